@@ -1,16 +1,30 @@
-from flask import Flask
-from flask_swagger_ui import get_swaggerui_blueprint
-from flask_cors import CORS
-
-from .data_set import DataSet
-
 import os
+from typing import Optional
 
 FILE_NAME = "pm25_data_final.parquet"
+YEARS_DIR = "pm25_by_year"
+
+
+def create_app(config: Optional[dict] = None):
+    # imported here so that importing a module of the package, e.g.
+    # app.partitions from data/create_dataset.py, does not need the web stack
+    from flask import Flask
+    from flask_swagger_ui import get_swaggerui_blueprint
+    from flask_cors import CORS
 
+    from .admission import admit
+    from .changes import CHANGE_LOG_ROWS
+    from .data_set import TILE_SIZE, TILE_ZOOM, DataSet
+    from .json_provider import OrjsonProvider
+    from .metrics import instrument
+    from .response_cache import ResponseCache
+    from .years import YearlyData
 
-def create_app():
     app = Flask(__name__)
+    app.json = OrjsonProvider(app)
+    # e.g. AIR_QUALITY_WAL_DIR=/var/lib/air-quality sets WAL_DIR
+    app.config.from_prefixed_env(prefix="AIR_QUALITY")
+    app.config.update(config or {})
     # NOTE this is only enabled globally for dev purposes
     CORS(app)
 
@@ -28,7 +42,49 @@ def create_app():
     app.register_blueprint(swaggerui_blueprint, url_prefix=SWAGGER_URL)
 
     file_path = os.path.join(app.root_path, "./", FILE_NAME)
-    data_set = DataSet(file_path)
+    load_options = {
+        "load": app.config.get("LOAD_MODE", "eager"),
+        "dtypes": app.config.get("STORAGE_DTYPES", "native"),
+        "tile_zoom": app.config.get("TILE_ZOOM", TILE_ZOOM),
+        "tile_size": app.config.get("TILE_SIZE", TILE_SIZE),
+        "change_log_rows": app.config.get("CHANGE_LOG_ROWS", CHANGE_LOG_ROWS),
+    }
+    if app.config.get("WAL_DIR") and app.config.get("SHARED_WORKERS"):
+        # worker processes share the columns and one writer, see app/cluster.py
+        from .cluster import SharedDataSet
+
+        data_set = app.cluster = SharedDataSet(
+            file_path,
+            app.config["WAL_DIR"],
+            compact_interval=app.config.get("COMPACT_INTERVAL", 60.0),
+            compact_min_records=app.config.get("COMPACT_MIN_RECORDS", 1000),
+            **dict(load_options, load="mmap"),
+        )
+    elif app.config.get("WAL_DIR"):
+        # writes are logged and survive restarts, see app/wal.py
+        from .wal import open_durable
+
+        data_set, app.mutation_log, app.compactor = open_durable(
+            file_path,
+            app.config["WAL_DIR"],
+            compact_interval=app.config.get("COMPACT_INTERVAL", 60.0),
+            compact_min_records=app.config.get("COMPACT_MIN_RECORDS", 1000),
+            **load_options,
+        )
+    else:
+        data_set = DataSet(file_path, **load_options)
     app.data_set = data_set
+    # past years are read-only and only loaded when asked for, see app/years.py
+    app.years = YearlyData(
+        app.config.get("YEARS_DIR", os.path.join(app.root_path, YEARS_DIR)),
+        memory_budget=app.config.get("YEAR_CACHE_BYTES", 1 << 30),
+        **load_options,
+    )
+    app.response_cache = ResponseCache(
+        max_entries=app.config.get("RESPONSE_CACHE_ENTRIES", 1024),
+        max_bytes=app.config.get("RESPONSE_CACHE_BYTES", 64 << 20),
+    )
+    instrument(app)
+    admit(app)
 
     return app
@@ -0,0 +1,183 @@
+import math
+import threading
+import time
+from typing import Callable, Optional, Union
+
+from flask import Flask, current_app, g, jsonify, request
+from werkzeug.exceptions import HTTPException
+from werkzeug.wrappers import Request
+
+from .metrics import ADMISSION_WAIT_SECONDS, ADMISSIONS, REGISTRY, Gauge
+
+# cost classes of routes, see cost()
+CHEAP = "cheap"
+QUERY = "query"
+BULK = "bulk"
+# clients waiting for changes, cheap to answer but held open for long
+CHANGES = "changes"
+COSTS = (CHEAP, QUERY, BULK, CHANGES)
+
+# requests of a class served at once, None for no limit, and how many more may wait
+LIMITS = {CHEAP: None, QUERY: 16, BULK: 2, CHANGES: 64}
+QUEUES = {CHEAP: 0, QUERY: 16, BULK: 4, CHANGES: 0}
+# seconds a request may wait for a slot before it is turned away
+ADMISSION_WAIT = 0.5
+# bounds of the Retry-After estimate, in seconds
+MIN_RETRY_AFTER = 1
+MAX_RETRY_AFTER = 60
+# weight of the latest hold time in the running mean
+HOLD_SMOOTHING = 0.2
+
+
+class Gate:
+    """
+    At most limit requests of one cost class at once. Up to queue more wait
+    for a slot, for at most wait seconds, and the rest are turned away at
+    once, so a burst of expensive requests queues briefly instead of
+    piling up behind each other.
+    """
+
+    def __init__(self, cost: str, limit: Optional[int], queue: int, wait: float):
+        self.cost = cost
+        self.limit = limit if limit is not None and limit > 0 else None
+        self.queue = max(queue, 0)
+        self.wait = wait
+        self.active = 0
+        self.waiting = 0
+        # running mean of the seconds a slot is held, for Retry-After
+        self.mean_hold = 0.0
+        self._free = threading.Condition()
+
+    def acquire(self) -> bool:
+        """Take a slot, False when none came free in time."""
+        with self._free:
+            if self.limit is None or (self.active < self.limit and not self.waiting):
+                self.active += 1
+                return True
+            if self.waiting >= self.queue:
+                return False
+            self.waiting += 1
+            try:
+                admitted = self._free.wait_for(
+                    lambda: self.active < self.limit, self.wait
+                )
+            finally:
+                self.waiting -= 1
+            if admitted:
+                self.active += 1
+            return admitted
+
+    def release(self, held: float) -> None:
+        """Give back a slot held for held seconds."""
+        with self._free:
+            self.active -= 1
+            self.mean_hold += HOLD_SMOOTHING * (held - self.mean_hold)
+            self._free.notify()
+
+    def retry_after(self) -> int:
+        """Seconds until the requests holding and waiting for slots are likely done."""
+        with self._free:
+            if self.limit is None:
+                return MIN_RETRY_AFTER
+            expected = self.mean_hold * (self.waiting + self.active) / self.limit
+        return min(max(math.ceil(expected), MIN_RETRY_AFTER), MAX_RETRY_AFTER)
+
+
+def cost(of: Union[str, Callable[[], str]]):
+    """
+    Mark a view with its cost class, or a function of the Request that
+    picks one. Views without one are CHEAP.
+    """
+
+    def mark(view):
+        view.admission_cost = of
+        return view
+
+    return mark
+
+
+def _cost(app: Flask, endpoint: Optional[str], req: Request) -> str:
+    of = getattr(app.view_functions.get(endpoint), "admission_cost", CHEAP)
+    return of(req) if callable(of) else of
+
+
+def cost_of(app: Flask, environ: dict) -> str:
+    """The cost class of the request in a WSGI environ, before app handles it."""
+    try:
+        endpoint, _ = app.url_map.bind_to_environ(environ).match()
+    except HTTPException:
+        return CHEAP
+    return _cost(app, endpoint, Request(environ))
+
+
+def admit(app: Flask) -> None:
+    """
+    Hold every request of app to the limits of its cost class, see Gate.
+    Requests that are not admitted get 503 with a Retry-After header.
+    Streamed responses hold their slot until the body is closed, the others
+    give it back once the view returns. Each class is set up from
+    ADMISSION_<CLASS>_LIMIT and ADMISSION_<CLASS>_QUEUE, and ADMISSION_WAIT
+    for all of them. ADMISSION = False admits every request.
+    """
+    if not app.config.get("ADMISSION", True):
+        return
+    wait = app.config.get("ADMISSION_WAIT", ADMISSION_WAIT)
+    app.admission = {
+        name: Gate(
+            name,
+            app.config.get(f"ADMISSION_{name.upper()}_LIMIT", LIMITS[name]),
+            app.config.get(f"ADMISSION_{name.upper()}_QUEUE", QUEUES[name]),
+            wait,
+        )
+        for name in COSTS
+    }
+    for name in COSTS:
+        for state in ("active", "waiting"):
+            REGISTRY.register(
+                Gauge(
+                    f"air_quality_admission_{name}_{state}",
+                    f"Requests of cost class {name} {state}.",
+                    lambda name=name, state=state: getattr(app.admission[name], state),
+                )
+            )
+
+    @app.before_request
+    def take_slot():
+        gate = current_app.admission[_cost(current_app, request.endpoint, request)]
+        start = time.perf_counter()
+        if not gate.acquire():
+            ADMISSIONS.inc(cost=gate.cost, outcome="rejected")
+            response = jsonify(
+                {"error": "Server busy with requests like this one, retry later."}
+            )
+            response.status_code = 503
+            response.headers["Retry-After"] = str(gate.retry_after())
+            return response
+        admitted = time.perf_counter()
+        ADMISSIONS.inc(cost=gate.cost, outcome="admitted")
+        ADMISSION_WAIT_SECONDS.observe(admitted - start, cost=gate.cost)
+        released = []
+
+        def release():
+            if not released:
+                released.append(True)
+                gate.release(time.perf_counter() - admitted)
+
+        g.admission_release = release
+
+    @app.after_request
+    def hand_slot_to_response(response):
+        # a buffered body is already rendered, a streamed one is rendered as
+        # it is sent, and only the server closes it once it is
+        if response.is_streamed:
+            release = g.pop("admission_release", None)
+            if release is not None:
+                response.call_on_close(release)
+        return response
+
+    @app.teardown_request
+    def free_slot(error=None):
+        # the response was buffered, or the view raised and there is none
+        release = g.pop("admission_release", None)
+        if release is not None:
+            release()
@@ -0,0 +1,147 @@
+import heapq
+import math
+
+import numpy as np
+
+
+class RunningStats:
+    """
+    Count, sum, min and max of a column, kept up to date as values are added
+    and removed so reading them never scans the column.
+
+    Values are held as a multiset. The values it starts with are a sorted
+    array of distinct values with an array of occurrences, which is cheap to
+    build and small even for millions of rows; the lowest and highest slots
+    still in use are tracked as pointers. Values first seen later go to a
+    dict (value -> occurrences) with a min-heap and a max-heap. Entries that
+    have left the multiset are skipped lazily when they reach the top, so
+    removing the current extreme is cheap. NaN is ignored, matching pandas.
+    """
+
+    def __init__(self, values: np.ndarray):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        self._base, counts = np.unique(values, return_counts=True)
+        self._base_counts = counts.astype(np.int64)
+        self._low = 0
+        self._high = len(self._base) - 1
+        self._counts = {}
+        self.count = len(values)
+        self._sum = math.fsum(values.tolist())
+        self._compensation = 0.0
+        self._rebuild_heaps()
+
+    def _rebuild_heaps(self) -> None:
+        distinct = sorted(self._counts)
+        self._min_heap = distinct
+        self._max_heap = [-value for value in reversed(distinct)]
+
+    def _base_slot(self, value: float) -> int:
+        """Slot of value among the initial values, -1 if it is not one."""
+        slot = int(np.searchsorted(self._base, value))
+        if slot < len(self._base) and self._base[slot] == value:
+            return slot
+        return -1
+
+    def _accumulate(self, value: float) -> None:
+        # Neumaier summation so long add/remove sequences do not drift
+        total = self._sum + value
+        if abs(self._sum) >= abs(value):
+            self._compensation += (self._sum - total) + value
+        else:
+            self._compensation += (value - total) + self._sum
+        self._sum = total
+
+    def _add_extra(self, value: float, occurrences: int) -> None:
+        if value not in self._counts:
+            self._counts[value] = 0
+            heapq.heappush(self._min_heap, value)
+            heapq.heappush(self._max_heap, -value)
+        self._counts[value] += occurrences
+
+    def add(self, value: float) -> None:
+        value = float(value)
+        if math.isnan(value):
+            return
+        slot = self._base_slot(value)
+        if slot >= 0:
+            self._base_counts[slot] += 1
+            self._low = min(self._low, slot)
+            self._high = max(self._high, slot)
+        else:
+            self._add_extra(value, 1)
+            if len(self._min_heap) > 2 * len(self._counts) + 64:
+                self._rebuild_heaps()
+        self.count += 1
+        self._accumulate(value)
+
+    def add_many(self, values: np.ndarray) -> None:
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        distinct, counts = np.unique(values, return_counts=True)
+        slots = np.minimum(
+            np.searchsorted(self._base, distinct), max(len(self._base) - 1, 0)
+        )
+        in_base = (
+            self._base[slots] == distinct
+            if len(self._base)
+            else np.zeros(len(distinct), dtype=bool)
+        )
+        if in_base.any():
+            np.add.at(self._base_counts, slots[in_base], counts[in_base])
+            self._low = min(self._low, int(slots[in_base][0]))
+            self._high = max(self._high, int(slots[in_base][-1]))
+        for value, occurrences in zip(
+            distinct[~in_base].tolist(), counts[~in_base].tolist()
+        ):
+            self._add_extra(value, occurrences)
+        if len(self._min_heap) > 2 * len(self._counts) + 64:
+            self._rebuild_heaps()
+        self.count += len(values)
+        self._accumulate(math.fsum(values.tolist()))
+
+    def remove(self, value: float) -> None:
+        value = float(value)
+        if math.isnan(value):
+            return
+        slot = self._base_slot(value)
+        if slot >= 0 and self._base_counts[slot]:
+            self._base_counts[slot] -= 1
+        else:
+            occurrences = self._counts[value]
+            if occurrences == 1:
+                del self._counts[value]
+            else:
+                self._counts[value] = occurrences - 1
+        self.count -= 1
+        self._accumulate(-value)
+
+    @property
+    def total(self) -> float:
+        return self._sum + self._compensation if self.count else 0.0
+
+    @property
+    def min(self) -> float:
+        if not self.count:
+            return math.nan
+        while self._low <= self._high and not self._base_counts[self._low]:
+            self._low += 1
+        while self._min_heap and self._min_heap[0] not in self._counts:
+            heapq.heappop(self._min_heap)
+        candidates = [float(self._base[self._low])] if self._low <= self._high else []
+        return min(candidates + self._min_heap[:1])
+
+    @property
+    def max(self) -> float:
+        if not self.count:
+            return math.nan
+        while self._high >= self._low and not self._base_counts[self._high]:
+            self._high -= 1
+        while self._max_heap and -self._max_heap[0] not in self._counts:
+            heapq.heappop(self._max_heap)
+        candidates = [float(self._base[self._high])] if self._high >= self._low else []
+        return max(candidates + [-value for value in self._max_heap[:1]])
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else math.nan
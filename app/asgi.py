@@ -0,0 +1,239 @@
+import asyncio
+import io
+import json
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+from flask import Flask
+
+from . import create_app
+from .admission import CHANGES, LIMITS, cost_of
+
+HANDLER_WORKERS = 8
+STREAM_WORKERS = 4
+# threads of requests waiting for changes, also how many may wait at once
+WAIT_WORKERS = LIMITS[CHANGES]
+
+_DONE = object()
+
+
+def _environ(scope: dict, body: bytes) -> dict:
+    """The WSGI environ of an ASGI http scope."""
+    server = scope.get("server") or ("localhost", 80)
+    client = scope.get("client") or ("", 0)
+    environ = {
+        "REQUEST_METHOD": scope["method"],
+        # WSGI carries the raw path as latin-1, ASGI has it decoded
+        "SCRIPT_NAME": scope.get("root_path", "").encode("utf-8").decode("latin-1"),
+        "PATH_INFO": scope["path"].encode("utf-8").decode("latin-1"),
+        "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+        "SERVER_NAME": server[0],
+        "SERVER_PORT": str(server[1]),
+        "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+        "REMOTE_ADDR": client[0],
+        "CONTENT_LENGTH": str(len(body)),
+        "wsgi.version": (1, 0),
+        "wsgi.url_scheme": scope.get("scheme", "http"),
+        "wsgi.input": io.BytesIO(body),
+        "wsgi.errors": sys.stderr,
+        "wsgi.multithread": True,
+        "wsgi.multiprocess": False,
+        "wsgi.run_once": False,
+    }
+    for name, value in scope.get("headers", []):
+        name = name.decode("latin-1")
+        value = value.decode("latin-1")
+        if name == "content-length":
+            continue
+        if name == "content-type":
+            environ["CONTENT_TYPE"] = value
+            continue
+        key = "HTTP_" + name.upper().replace("-", "_")
+        environ[key] = f"{environ[key]},{value}" if key in environ else value
+    return environ
+
+
+class AsgiApp:
+    """
+    ASGI front of the Flask app, serving the same routes (main_bp) over the
+    same DataSet from an event loop.
+
+    Request bodies are read and responses written asynchronously, so a slow
+    client only holds a coroutine. The blueprint's handlers run on a bounded
+    pool of handler threads. Streamed bodies (full downloads) are then
+    rendered a chunk at a time on a separate, smaller pool, and each chunk is
+    sent before the next is rendered. Thousands of slow downloads therefore
+    queue for stream threads and never take the threads answering lookups.
+
+    Requests of the CHANGES cost class, long-polls and event streams of
+    /data/changes, spend most of their time blocked waiting for a write.
+    They run start to finish on a third pool with a thread for each, so
+    they never hold a handler or stream thread. Beyond wait_workers of them
+    at once the rest are turned away with 503.
+    """
+
+    def __init__(
+        self,
+        app: Flask,
+        workers: int = HANDLER_WORKERS,
+        stream_workers: int = STREAM_WORKERS,
+        wait_workers: int = WAIT_WORKERS,
+    ):
+        self.app = app
+        self._handlers = ThreadPoolExecutor(workers, thread_name_prefix="handler")
+        self._streams = ThreadPoolExecutor(stream_workers, thread_name_prefix="stream")
+        self._waiters = ThreadPoolExecutor(wait_workers, thread_name_prefix="waiter")
+        self.max_waiting = wait_workers
+        # requests on the waiter pool, only touched from the event loop
+        self.waiting = 0
+
+    async def __call__(self, scope: dict, receive, send) -> None:
+        if scope["type"] == "http":
+            await self._http(scope, receive, send)
+        elif scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+        else:
+            raise ValueError(f"Unsupported ASGI scope type {scope['type']!r}")
+
+    async def _lifespan(self, receive, send) -> None:
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await asyncio.get_running_loop().run_in_executor(None, self.close)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    def close(self) -> None:
+        """Finish running work, then stop compaction and flush the log."""
+        self._handlers.shutdown()
+        self._streams.shutdown()
+        self._waiters.shutdown()
+        if getattr(self.app, "compactor", None) is not None:
+            self.app.compactor.stop()
+        if getattr(self.app, "mutation_log", None) is not None:
+            self.app.mutation_log.close()
+        if getattr(self.app, "cluster", None) is not None:
+            self.app.cluster.close()
+
+    @staticmethod
+    async def _read_body(receive) -> Optional[bytes]:
+        """The whole request body, None if the client went away first."""
+        chunks = []
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return None
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body", False):
+                return b"".join(chunks)
+
+    def _handle(self, environ: dict) -> tuple:
+        """
+        Run the Flask app on a handler thread.
+
+        :return: Tuple of (status, headers, body chunks read so far, the
+            body iterable still to read or None when it was read whole).
+        """
+        started = {}
+
+        def start_response(status, headers, exc_info=None):
+            started["status"] = int(status.split(" ", 1)[0])
+            started["headers"] = headers
+            return lambda data: None
+
+        body = self.app.wsgi_app(environ, start_response)
+        status, headers = started["status"], started["headers"]
+        sized = any(name.lower() == "content-length" for name, _ in headers)
+        if sized or status in (204, 304) or environ["REQUEST_METHOD"] == "HEAD":
+            # a buffered response, reading it is only copying bytes
+            try:
+                return status, headers, list(body), None
+            finally:
+                getattr(body, "close", lambda: None)()
+        return status, headers, [], body
+
+    async def _http(self, scope: dict, receive, send) -> None:
+        body = await self._read_body(receive)
+        if body is None:
+            return
+        environ = _environ(scope, body)
+        if cost_of(self.app, environ) != CHANGES:
+            await self._respond(environ, send, self._handlers, self._streams)
+        elif self.waiting >= self.max_waiting:
+            await self._busy(send)
+        else:
+            self.waiting += 1
+            try:
+                await self._respond(environ, send, self._waiters, self._waiters)
+            finally:
+                self.waiting -= 1
+
+    @staticmethod
+    async def _busy(send) -> None:
+        """503 for a request waiting for changes when too many already are."""
+        body = json.dumps(
+            {"error": "Too many clients waiting for changes, retry later."}
+        ).encode("utf-8")
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 503,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode("latin-1")),
+                    (b"retry-after", b"1"),
+                ],
+            }
+        )
+        await send({"type": "http.response.body", "body": body, "more_body": False})
+
+    async def _respond(self, environ: dict, send, handlers, streams) -> None:
+        """Run the app on the handlers pool, render a streamed body on streams."""
+        loop = asyncio.get_running_loop()
+        status, headers, chunks, rest = await loop.run_in_executor(
+            handlers, self._handle, environ
+        )
+        await send(
+            {
+                "type": "http.response.start",
+                "status": status,
+                "headers": [
+                    (name.lower().encode("latin-1"), value.encode("latin-1"))
+                    for name, value in headers
+                ],
+            }
+        )
+        for chunk in chunks:
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        if rest is not None:
+            chunks = iter(rest)
+            try:
+                while True:
+                    chunk = await loop.run_in_executor(streams, next, chunks, _DONE)
+                    if chunk is _DONE:
+                        break
+                    await send(
+                        {"type": "http.response.body", "body": chunk, "more_body": True}
+                    )
+            finally:
+                close = getattr(rest, "close", None)
+                if close is not None:
+                    await loop.run_in_executor(streams, close)
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+
+def create_asgi_app(config: Optional[dict] = None) -> AsgiApp:
+    """
+    The app for an ASGI server, e.g. uvicorn asgi:app. ASGI_WORKERS,
+    ASGI_STREAM_WORKERS and ASGI_WAIT_WORKERS size the three thread pools.
+    """
+    app = create_app(config)
+    return AsgiApp(
+        app,
+        workers=app.config.get("ASGI_WORKERS", HANDLER_WORKERS),
+        stream_workers=app.config.get("ASGI_STREAM_WORKERS", STREAM_WORKERS),
+        wait_workers=app.config.get("ASGI_WAIT_WORKERS", WAIT_WORKERS),
+    )
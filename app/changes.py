@@ -0,0 +1,115 @@
+import bisect
+import threading
+
+# rows of changes held, the oldest whole versions are dropped beyond it
+CHANGE_LOG_ROWS = 100000
+
+INSERT = "insert"
+UPDATE = "update"
+DELETE = "delete"
+# change of a row for each logged mutation
+OPS = {"add": INSERT, "update": UPDATE, "delete": DELETE}
+
+
+class ChangesGoneError(LookupError):
+    """Some changes after the requested version are no longer in the change log."""
+
+
+def _rows(record: dict) -> int:
+    return len(record["lat"]) if record["op"] == "add_many" else 1
+
+
+def _expand(version: int, record: dict) -> list:
+    """The row changes of one logged mutation, see app.wal for the records."""
+    op = record["op"]
+    if op == "add_many":
+        return [
+            {
+                "seq": version,
+                "op": INSERT,
+                "id": record["first_id"] + i,
+                "lat": lat,
+                "lon": lon,
+                "GWRPM25": gwrpm25,
+            }
+            for i, (lat, lon, gwrpm25) in enumerate(
+                zip(record["lat"], record["lon"], record["gwrpm25"])
+            )
+        ]
+    change = {"seq": version, "op": OPS[op], "id": record["id"]}
+    if op != "delete":
+        change.update(lat=record["lat"], lon=record["lon"], GWRPM25=record["gwrpm25"])
+    return [change]
+
+
+class ChangeLog:
+    """
+    The mutations of the most recent versions of a DataSet, held in memory
+    as the records it journals, so clients can catch up on changes instead
+    of downloading every row again.
+
+    At most max_rows changed rows are held. Once there are more, the oldest
+    versions are dropped, and asking for changes after a version some of
+    whose successors were dropped raises ChangesGoneError: the client has to
+    download the rows again. So does asking after a version the log has not
+    reached, as after a restart without a mutation log.
+    """
+
+    def __init__(self, version: int = 0, max_rows: int = CHANGE_LOG_ROWS):
+        self.max_rows = max_rows
+        self._changed = threading.Condition()
+        self.reset(version)
+
+    def reset(self, version: int) -> None:
+        """Forget every change, carry on from version."""
+        with self._changed:
+            self._versions = []
+            self._records = []
+            self._start = 0
+            self._rows = 0
+            # changes up to this version are not held
+            self._floor = version
+            self.latest = version
+            self._changed.notify_all()
+
+    def append(self, version: int, record: dict) -> None:
+        """Hold the mutation that made version, versions must increase."""
+        with self._changed:
+            self._versions.append(version)
+            self._records.append(record)
+            self._rows += _rows(record)
+            self.latest = version
+            while self._rows > self.max_rows and len(self._versions) - self._start > 1:
+                self._rows -= _rows(self._records[self._start])
+                self._floor = self._versions[self._start]
+                self._records[self._start] = None
+                self._start += 1
+            if self._start > len(self._versions) // 2:
+                del self._versions[: self._start]
+                del self._records[: self._start]
+                self._start = 0
+            self._changed.notify_all()
+
+    def since(self, version: int, limit: int) -> tuple:
+        """
+        Row changes after version, oldest first, whole versions at a time
+        until there are at least limit rows.
+
+        :return: Tuple of (changes, version to ask from next, latest version).
+        """
+        with self._changed:
+            if not self._floor <= version <= self.latest:
+                raise ChangesGoneError(version)
+            at = bisect.bisect_right(self._versions, version, lo=self._start)
+            changes = []
+            upto = version
+            while at < len(self._versions) and len(changes) < limit:
+                upto = self._versions[at]
+                changes.extend(_expand(upto, self._records[at]))
+                at += 1
+            return changes, upto, self.latest
+
+    def wait(self, version: int, timeout: float) -> bool:
+        """Block until there is a version after version, False on timeout."""
+        with self._changed:
+            return self._changed.wait_for(lambda: self.latest > version, timeout)
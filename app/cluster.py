@@ -0,0 +1,287 @@
+import fcntl
+import os
+import threading
+import time
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+
+from .data_set import DataSet
+from .logger import setup_logger
+from .wal import LogGapError, LogTail, SharedLsn, load_latest, start_durable
+
+import logging
+
+WRITER_LOCK = "writer.lock"
+WRITER_SOCKET = "writer.sock"
+WRITER_KEY = "writer.key"
+MUTATIONS = (
+    "add_data_entry",
+    "add_data_entries",
+    "update_data_entry",
+    "delete_data_entry",
+)
+# how long a worker looks for a writer, or waits to see its own write
+WRITER_TIMEOUT = 10.0
+RETRY_DELAY = 0.05
+
+logger = setup_logger(name="cluster", log_file="cluster.txt", level=logging.INFO)
+
+
+class SharedDataSet:
+    """
+    One worker process's view of a DataSet shared by every worker started
+    over the same log directory, see app/wal.py.
+
+    Every worker maps the same Arrow copy of the base columns, and the
+    structures built over them, copy-on-write (load="mmap"), so their pages
+    are held once by the page cache. The first worker to take the
+    directory's lock is the single writer: it journals mutations like
+    open_durable and answers the other workers' mutations over a Unix
+    socket. The other workers follow the log once its shared durable lsn
+    moves past their version, so a write becomes visible to them on their
+    next access, and a worker's own write is visible to it as soon as the
+    call returns. If the writer dies, the next worker to write takes the
+    lock over.
+
+    Everything but the mutations is read from the worker's DataSet.
+    """
+
+    def __init__(
+        self,
+        base_path: str,
+        directory: str,
+        compact_interval: float = 60.0,
+        compact_min_records: int = 1000,
+        **load_options,
+    ):
+        os.makedirs(directory, exist_ok=True)
+        self.base_path = base_path
+        self.directory = directory
+        self.compact_interval = compact_interval
+        self.compact_min_records = compact_min_records
+        self.load_options = load_options
+        self.address = os.path.join(directory, WRITER_SOCKET)
+        # guards the role and following the log
+        self._lock = threading.Lock()
+        self._lock_file = open(os.path.join(directory, WRITER_LOCK), "a")
+        self._local = threading.local()
+        self.log = self.compactor = self._listener = None
+        self.data_set = load_latest(base_path, directory, **load_options)
+        self._tail = LogTail(directory, after=self.data_set.version)
+        # followers only read the log once this is past their version
+        self._durable_lsn = SharedLsn(directory)
+        with self._lock:
+            self._promote()
+
+    @property
+    def is_writer(self) -> bool:
+        return self.log is not None
+
+    def __getattr__(self, name: str):
+        # only called for what SharedDataSet does not define itself
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.catch_up(), name)
+
+    def catch_up(self) -> DataSet:
+        """Apply the writes logged since the last call, return the DataSet."""
+        data_set = self.data_set
+        if self.is_writer or self._durable_lsn.value <= data_set.version:
+            return data_set
+        with self._lock:
+            if not self.is_writer:
+                self._follow()
+            return self.data_set
+
+    def _follow(self) -> None:
+        """Replay new log records, call with the lock held."""
+        try:
+            self.data_set.replay(self._tail.read())
+        except LogGapError:
+            logger.warning("Fell behind log compaction, reloading the snapshot")
+            self._tail.close()
+            self.data_set = load_latest(
+                self.base_path, self.directory, **self.load_options
+            )
+            self._tail = LogTail(self.directory, after=self.data_set.version)
+            self.data_set.replay(self._tail.read())
+
+    def _promote(self) -> bool:
+        """Become the writer if no process is, call with the lock held."""
+        if self.is_writer:
+            return True
+        try:
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        self._follow()
+        self._tail.close()
+        self.log, self.compactor = start_durable(
+            self.data_set,
+            self.directory,
+            self.compact_interval,
+            self.compact_min_records,
+        )
+        self._key = key = os.urandom(32)
+        key_path = os.path.join(self.directory, WRITER_KEY)
+        descriptor = os.open(key_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(descriptor, "wb") as key_file:
+            key_file.write(key)
+        if os.path.exists(self.address):
+            # left behind by a writer that died
+            os.remove(self.address)
+        self._listener = Listener(self.address, family="AF_UNIX", authkey=key)
+        self._connections = set()
+        threading.Thread(target=self._serve, name="cluster-writer", daemon=True).start()
+        logger.info(
+            f"Process {os.getpid()} is the writer at version {self.data_set.version}"
+        )
+        return True
+
+    def _serve(self) -> None:
+        listener = self._listener
+        while True:
+            try:
+                connection = listener.accept()
+            except (OSError, EOFError, AuthenticationError):
+                if self._listener is not listener:
+                    return
+                continue
+            if self._listener is not listener:
+                connection.close()
+                return
+            self._connections.add(connection)
+            threading.Thread(
+                target=self._answer, args=(connection,), daemon=True
+            ).start()
+
+    def _answer(self, connection) -> None:
+        """Apply the mutations one worker sends until it hangs up."""
+        try:
+            while True:
+                name, args, kwargs = connection.recv()
+                try:
+                    if name not in MUTATIONS:
+                        raise ValueError(f"Unknown mutation {name!r}")
+                    result = getattr(self.data_set, name)(*args, **kwargs)
+                except (LookupError, ValueError, OSError) as e:
+                    connection.send(("error", e, None))
+                else:
+                    connection.send(("ok", result, self.data_set.version))
+        except (EOFError, OSError):
+            pass
+        finally:
+            self._connections.discard(connection)
+            connection.close()
+
+    def _connection(self):
+        """This thread's connection to the writer."""
+        connection = getattr(self._local, "connection", None)
+        # a request always gets its answer, anything readable now is EOF
+        if connection is not None and connection.poll():
+            self._disconnect()
+            connection = None
+        if connection is None:
+            with open(os.path.join(self.directory, WRITER_KEY), "rb") as key_file:
+                key = key_file.read()
+            connection = Client(self.address, family="AF_UNIX", authkey=key)
+            self._local.connection = connection
+        return connection
+
+    def _disconnect(self) -> None:
+        connection = getattr(self._local, "connection", None)
+        self._local.connection = None
+        if connection is not None:
+            connection.close()
+
+    def _mutate(self, name: str, *args, **kwargs):
+        """
+        Apply a mutation on the writer and wait to see it here.
+
+        Raises OSError when no writer answers in time, or when the writer
+        went away after the mutation was sent so it may or may not apply.
+        """
+        deadline = time.monotonic() + WRITER_TIMEOUT
+        while True:
+            with self._lock:
+                writer = self.is_writer or self._promote()
+            if writer:
+                return getattr(self.data_set, name)(*args, **kwargs)
+            try:
+                connection = self._connection()
+                connection.send((name, args, kwargs))
+            except (OSError, EOFError, AuthenticationError) as e:
+                self._disconnect()
+                if time.monotonic() > deadline:
+                    raise OSError(f"No writer to apply {name}") from e
+                time.sleep(RETRY_DELAY)
+                continue
+            try:
+                status, result, version = connection.recv()
+            except (OSError, EOFError) as e:
+                self._disconnect()
+                raise OSError(f"Writer went away during {name}") from e
+            if status == "error":
+                raise result
+            self._wait_for(version, deadline)
+            return result
+
+    def _wait_for(self, version: int, deadline: float) -> None:
+        """Follow the log until it reaches version, the writer logs first."""
+        while self.catch_up().version < version:
+            if time.monotonic() > deadline:
+                raise OSError(f"Version {version} did not reach the log")
+            time.sleep(RETRY_DELAY / 10)
+
+    def wait_for_changes(self, since: int, timeout: float) -> bool:
+        """
+        Block until a version after since, see DataSet.wait_for_changes.
+        Followers only see writes by following the log, so they poll it.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            data_set = self.catch_up()
+            remaining = deadline - time.monotonic()
+            if self.is_writer:
+                return data_set.wait_for_changes(since, max(remaining, 0.0))
+            if data_set.version > since:
+                return True
+            if remaining <= 0:
+                return False
+            time.sleep(min(RETRY_DELAY, remaining))
+
+    def add_data_entry(self, lat: float, lon: float, gwrpm25: float) -> int:
+        return self._mutate("add_data_entry", lat=lat, lon=lon, gwrpm25=gwrpm25)
+
+    def add_data_entries(self, lat, lon, gwrpm25) -> tuple:
+        return self._mutate("add_data_entries", lat=lat, lon=lon, gwrpm25=gwrpm25)
+
+    def update_data_entry(self, id: int, lat: float, lon: float, gwrpm25: float):
+        self._mutate("update_data_entry", id=id, lat=lat, lon=lon, gwrpm25=gwrpm25)
+
+    def delete_data_entry(self, id: int) -> None:
+        self._mutate("delete_data_entry", id=id)
+
+    def close(self) -> None:
+        """Stop writing or following and let another process take over."""
+        with self._lock:
+            if self._lock_file.closed:
+                return
+            if self.is_writer:
+                listener, self._listener = self._listener, None
+                # wakes the accept() so the serving thread sees it is closed
+                try:
+                    Client(self.address, family="AF_UNIX", authkey=self._key).close()
+                except (OSError, EOFError, AuthenticationError):
+                    pass
+                listener.close()
+                for connection in list(self._connections):
+                    connection.close()
+                self.compactor.stop()
+                self.log.close()
+                self.log = self.compactor = None
+            self._tail.close()
+            self._durable_lsn.close()
+            self._disconnect()
+            fcntl.flock(self._lock_file, fcntl.LOCK_UN)
+            self._lock_file.close()
@@ -1,44 +1,775 @@
 import pandas as pd
 import numpy as np
 
+from .aggregates import RunningStats
+from .changes import CHANGE_LOG_ROWS, ChangeLog
+from .distribution import QUANTILES, QuantileSketch
+from .formats import JSON, NDJSON, encode, frame_columns, iter_encode
+from .mapped import load_mapped, map_built
+from .metrics import OPERATION_SECONDS, timed_iter
+from .raster import RasterGrid, RasterIndex
+from .region_stats import RegionStats, points_in_polygon
+from .sampling import BILINEAR, GridSampler
+from .spatial_index import GridIndex, haversine_km
+from .storage import COLUMNS, RASTER, ColumnStore, StoreSnapshot
+from .tiles import TilePyramid
+
+import collections
 import os
+import threading
+from typing import Iterable, Iterator, Optional
+
+CHUNK_SIZE = 10000
+TILE_ZOOM = 10
+TILE_SIZE = 16
+# orders of filter_data and within_data results
+BY_ID = "id"
+BY_DISTANCE = "distance"
+ORDERS = (BY_ID, BY_DISTANCE)
+
+
+def _array_bytes(value) -> int:
+    """Bytes of the numpy arrays in value and in the lists and dicts it holds."""
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, dict):
+        value = list(value.values())
+    if isinstance(value, (list, tuple)):
+        return sum(_array_bytes(item) for item in value)
+    return 0
+
+
+class EntryNotFoundError(LookupError):
+    """No live entry has the requested id."""
+
+
+class Snapshot:
+    """
+    Rows, index, stats, value sketch, tiles, region tables and sampling grid
+    of the DataSet at one version.
+    """
+
+    def __init__(
+        self,
+        version: int,
+        rows: StoreSnapshot,
+        index: GridIndex,
+        stats: dict,
+        tiles: TilePyramid,
+        regions: RegionStats,
+        sampler: GridSampler,
+        sketch: QuantileSketch,
+    ):
+        self.version = version
+        self.rows = rows
+        self.index = index
+        self.stats = stats
+        self.sketch = sketch
+        self.tiles = tiles
+        self.regions = regions
+        self.sampler = sampler
 
 
 class DataSet:
-    def __init__(self, file_path: str):
-        self.df = pd.read_parquet(file_path)
+    """
+    Readers work on the latest published Snapshot and never take a lock.
+    Writers are serialized by a lock, apply a mutation (including any check
+    that the entry exists) as one step and then publish a new Snapshot with a
+    single attribute assignment. With a log attached, a Snapshot is only
+    published once the log holds its mutation, see _commit.
+    """
+
+    @OPERATION_SECONDS.time(operation="load")
+    def __init__(
+        self,
+        file_path: str,
+        load: str = "eager",
+        dtypes: str = "native",
+        tile_zoom: int = TILE_ZOOM,
+        tile_size: int = TILE_SIZE,
+        change_log_rows: int = CHANGE_LOG_ROWS,
+    ):
+        """
+        :param load: "eager" reads the whole Parquet file into memory, "mmap"
+            memory-maps an Arrow copy of it, and the index, tiles and other
+            structures built over it, instead, see app.mapped.
+        :param dtypes: How values are stored, see storage.STORAGE_DTYPES, or
+            "raster" to keep coordinates as cells of the data's grid.
+        :param tile_zoom: Deepest zoom of the tile pyramid, see app.tiles.
+        :param tile_size: Bins along each side of a tile.
+        :param change_log_rows: Changed rows held for changes(), see app.changes.
+        """
+        if load == "mmap" and dtypes == RASTER:
+            raise ValueError("Raster storage needs the eager load mode")
+        built = None
+        if load == "mmap":
+            store = load_mapped(file_path, dtypes)
+            built = map_built(
+                file_path,
+                dtypes,
+                f"{tile_zoom}-{tile_size}",
+                lambda: self._build(store, tile_zoom, tile_size),
+            )
+        elif load == "eager":
+            store = ColumnStore(pd.read_parquet(file_path), dtypes)
+        else:
+            raise ValueError(f"Unknown load mode {load!r}")
+        self._attach(
+            store,
+            built,
+            tile_zoom=tile_zoom,
+            tile_size=tile_size,
+            change_log_rows=change_log_rows,
+        )
+
+    @property
+    def df(self) -> pd.DataFrame:
+        """Read-only DataFrame view of the live rows, indexed by id."""
+        rows = self.snapshot().rows
+        return rows.frame(rows.live_slots())
+
+    @df.setter
+    def df(self, df: pd.DataFrame) -> None:
+        self._attach(ColumnStore(df))
+
+    @staticmethod
+    def _build(store: ColumnStore, tile_zoom: int, tile_size: int) -> dict:
+        """The index, aggregates, tiles and grids over the live rows of store."""
+        slots = store.live_slots()
+        points = (
+            store.ids(slots),
+            store.column("lat", slots),
+            store.column("lon", slots),
+        )
+        if store.grid is not None:
+            spatial_index = RasterIndex(store.grid, *points)
+        else:
+            spatial_index = GridIndex(*points)
+        values = store.column("GWRPM25", slots)
+        grid = store.grid
+        if grid is None:
+            try:
+                grid = RasterGrid.detect(points[1], points[2])
+            except ValueError:
+                grid = None
+        return {
+            "spatial_index": spatial_index,
+            "aggregates": RunningStats(values),
+            "sketch": QuantileSketch(values),
+            "tiles": TilePyramid(
+                points[1], points[2], values, max_zoom=tile_zoom, size=tile_size
+            ),
+            "region_stats": RegionStats(points[1], points[2], values, grid=grid),
+            "sampler": GridSampler(points[1], points[2], values, grid=grid),
+        }
+
+    def _attach(
+        self,
+        store: ColumnStore,
+        built: Optional[dict] = None,
+        tile_zoom: int = TILE_ZOOM,
+        tile_size: int = TILE_SIZE,
+        change_log_rows: int = CHANGE_LOG_ROWS,
+    ) -> None:
+        """Serve store, with built from _build, or built here when None."""
+        self._write_lock = threading.Lock()
+        self.version = 0
+        self.log = None
+        # (Snapshot, record) of logged mutations not yet durable, oldest first
+        self._unsynced = collections.deque()
+        self._sync_lock = threading.Lock()
+        self.change_log = ChangeLog(self.version, max_rows=change_log_rows)
+        self.store = store
+        if built is None:
+            built = self._build(store, tile_zoom, tile_size)
+        self.spatial_index = built["spatial_index"]
+        self.aggregates = built["aggregates"]
+        self.sketch = built["sketch"]
+        self.tiles = built["tiles"]
+        self.region_stats = built["region_stats"]
+        self.sampler = built["sampler"]
+        self._publish()
+
+    def snapshot(self) -> Snapshot:
+        return self._snapshot
+
+    @property
+    def nbytes(self) -> int:
+        """Estimated bytes of the rows and the structures built over them."""
+        built = (
+            self.spatial_index,
+            self.tiles,
+            self.region_stats,
+            self.sampler,
+            self.sketch,
+        )
+        return self.store.nbytes + sum(_array_bytes(vars(part)) for part in built)
+
+    def _publish(self) -> None:
+        """Publish the writer's state to readers, call with the lock held."""
+        self._snapshot = self._freeze()
+
+    def _freeze(self) -> Snapshot:
+        """The writer's state as a new Snapshot, call with the lock held."""
+        if self.spatial_index.needs_rebuild():
+            slots = self.store.live_slots()
+            self.spatial_index.rebuild(
+                self.store.ids(slots),
+                self.store.column("lat", slots),
+                self.store.column("lon", slots),
+            )
+        for built in (self.region_stats, self.sampler):
+            if built.needs_rebuild():
+                slots = self.store.live_slots()
+                built.rebuild(
+                    *(
+                        self.store.column(name, slots)
+                        for name in ("lat", "lon", "GWRPM25")
+                    )
+                )
+        if self.tiles.needs_compact():
+            self.tiles.compact()
+        return Snapshot(
+            version=self.version,
+            rows=self.store.snapshot(),
+            index=self.spatial_index.view(),
+            stats={
+                "count": int(self.aggregates.count),
+                "average": float(self.aggregates.mean),
+                "min": float(self.aggregates.min),
+                "max": float(self.aggregates.max),
+            },
+            tiles=self.tiles.view(),
+            regions=self.region_stats.view(),
+            sampler=self.sampler.view(),
+            sketch=self.sketch.view(),
+        )
+
+    @staticmethod
+    def _to_records(df: pd.DataFrame, fmt: str = JSON):
+        """Rows of a DataFrame indexed by id in a format of app.formats."""
+        with OPERATION_SECONDS.time(operation="serialize"):
+            return encode(frame_columns(df), fmt)
 
     def get_full_data(self) -> str:
-        df_with_id = self.df.reset_index().rename(columns={"index": "id"})
-        return df_with_id.to_json(orient="records")
+        return "".join(self.iter_full_data())
+
+    @staticmethod
+    def _slots_after(
+        rows: StoreSnapshot, after_id: Optional[int], limit: Optional[int]
+    ):
+        """Keyset slice of live slots with id above after_id, at most limit."""
+        start = rows.slot_after(after_id)
+        if limit is None:
+            return rows.live_slots(start), False
+        slots = rows.live_slots(start, limit + 1)
+        return slots[:limit], len(slots) > limit
+
+    @staticmethod
+    def _iter_columns(rows: StoreSnapshot, slots: np.ndarray, chunk_size: int):
+        """Columns of the rows at slots a chunk at a time, at least one chunk."""
+        for start in range(0, max(len(slots), 1), chunk_size):
+            yield rows.columns(slots[start : start + chunk_size])
+
+    def iter_full_data(
+        self,
+        after_id: Optional[int] = None,
+        limit: Optional[int] = None,
+        chunk_size: int = CHUNK_SIZE,
+        fmt: str = JSON,
+    ) -> Iterator:
+        """Yield the records in a format of app.formats a chunk of rows at a time."""
+        return self.iter_page(after_id, limit, chunk_size, fmt)[0]
+
+    def iter_page(
+        self,
+        after_id: Optional[int],
+        limit: Optional[int],
+        chunk_size: int = CHUNK_SIZE,
+        fmt: str = JSON,
+    ) -> tuple:
+        """
+        One page of records for keyset pagination, streamed a chunk of rows
+        at a time.
+
+        :return: Tuple of (iterator of the records in a format of
+            app.formats, id to pass as after_id for the next page or None on
+            the last page).
+        """
+        rows = self.snapshot().rows
+        slots, has_more = self._slots_after(rows, after_id, limit)
+        next_after_id = int(rows.ids(slots[-1:])[0]) if has_more else None
+        pieces = iter_encode(
+            self._iter_columns(rows, slots, chunk_size), len(slots), fmt
+        )
+        return timed_iter(pieces, "serialize"), next_after_id
+
+    def iter_ndjson(
+        self,
+        after_id: Optional[int] = None,
+        limit: Optional[int] = None,
+        chunk_size: int = CHUNK_SIZE,
+    ) -> Iterator[str]:
+        """Yield newline delimited JSON records a chunk of rows at a time."""
+        return self.iter_full_data(after_id, limit, chunk_size, fmt=NDJSON)
+
+    def get_page(self, after_id: Optional[int], limit: int, fmt: str = JSON) -> tuple:
+        """
+        One page of records for keyset pagination.
+
+        :return: Tuple of (the records in a format of app.formats, id to pass
+            as after_id for the next page or None on the last page).
+        """
+        rows = self.snapshot().rows
+        slots, has_more = self._slots_after(rows, after_id, limit)
+        columns = rows.columns(slots)
+        next_after_id = int(columns["id"][-1]) if has_more else None
+        with OPERATION_SECONDS.time(operation="serialize"):
+            return encode(columns, fmt), next_after_id
 
     def get_datum_by_id(self, id: int) -> {}:
-        return self.df.loc[id] if id in self.df.index else None
+        rows = self.snapshot().rows
+        slot = rows.slot_of(id)
+        return None if slot is None else rows.frame([slot]).iloc[0]
+
+    def get_data_by_ids(
+        self, ids: Iterable[int], fields: Optional[list] = None, fmt: str = JSON
+    ) -> tuple:
+        """
+        The rows of many ids found with one index lookup, in id order.
 
-    def add_data_entry(self, lat: float, lon: float, gwrpm25: float) -> None:
-        self.df.loc[len(self.df)] = {"lat": lat, "lon": lon, "GWRPM25": gwrpm25}
-        return len(self.df)
+        :param fields: Columns to send besides id, all of COLUMNS when None.
+        :return: Tuple of (the records in a format of app.formats, sorted
+            array of the requested ids without a live row).
+        """
+        unknown = set(fields or ()) - set(COLUMNS)
+        if unknown:
+            raise ValueError(f"Unknown fields {sorted(unknown)}")
+        rows = self.snapshot().rows
+        ids = np.unique(np.asarray(ids, dtype=np.int64))
+        slots = rows.slots_of(ids)
+        found = rows.ids(slots)
+        columns = {"id": found}
+        for name in COLUMNS if fields is None else fields:
+            columns[name] = rows.column(name, slots)
+        missing = np.setdiff1d(ids, found, assume_unique=True)
+        with OPERATION_SECONDS.time(operation="serialize"):
+            return encode(columns, fmt), missing
 
+    def _current(self, id: int) -> pd.Series:
+        """The writer's current row for id, call with the lock held."""
+        slot = self.store.slot_of(id)
+        if slot is None:
+            raise EntryNotFoundError(id)
+        return self.store.frame([slot]).iloc[0]
+
+    def _remember(self, id: int) -> None:
+        """Add a stored row to the index, aggregates, tiles, regions and sampler."""
+        datum = self._current(id)
+        self.spatial_index.add(id, datum["lat"], datum["lon"])
+        self.aggregates.add(datum["GWRPM25"])
+        self.sketch.add(datum["GWRPM25"])
+        self.tiles.add(datum["lat"], datum["lon"], datum["GWRPM25"])
+        self.region_stats.add(datum["lat"], datum["lon"], datum["GWRPM25"])
+        self.sampler.add(datum["lat"], datum["lon"], datum["GWRPM25"])
+
+    def _forget(self, datum: pd.Series) -> None:
+        """Take a row that was just changed or deleted out of the derived tables."""
+        self.tiles.remove(datum["lat"], datum["lon"], datum["GWRPM25"], self._values_in)
+        self.region_stats.remove(datum["lat"], datum["lon"], datum["GWRPM25"])
+        self.sampler.remove(datum["lat"], datum["lon"], datum["GWRPM25"])
+
+    def _values_in(
+        self, min_lat: float, min_lon: float, max_lat: float, max_lon: float
+    ) -> tuple:
+        """The writer's rows that may be in a box, call with the lock held."""
+        ids = self.spatial_index.query_bbox(min_lat, min_lon, max_lat, max_lon)
+        slots = self.store.slots_of(ids)
+        return tuple(
+            self.store.column(name, slots) for name in ("lat", "lon", "GWRPM25")
+        )
+
+    @OPERATION_SECONDS.time(operation="mutate")
+    def add_data_entry(self, lat: float, lon: float, gwrpm25: float) -> int:
+        with self._write_lock:
+            self._check_log()
+            id = self.store.append(lat=lat, lon=lon, gwrpm25=gwrpm25)
+            self._remember(id)
+            version = self._commit(
+                {"op": "add", "id": id, "lat": lat, "lon": lon, "gwrpm25": gwrpm25}
+            )
+        self._sync(version)
+        return id
+
+    @OPERATION_SECONDS.time(operation="mutate")
+    def add_data_entries(
+        self, lat: np.ndarray, lon: np.ndarray, gwrpm25: np.ndarray
+    ) -> tuple:
+        """
+        Append a batch of validated rows in one operation.
+
+        :return: Tuple of (first id, last id) allocated, ids are contiguous.
+        """
+        with self._write_lock:
+            self._check_log()
+            first_id = self.store.append_many(lat=lat, lon=lon, gwrpm25=gwrpm25)
+            slots = self.store.slots_of(np.arange(first_id, first_id + len(lat)))
+            lats = self.store.column("lat", slots)
+            lons = self.store.column("lon", slots)
+            values = self.store.column("GWRPM25", slots)
+            self.spatial_index.add_many(self.store.ids(slots), lats, lons)
+            self.aggregates.add_many(values)
+            self.sketch.add_many(values)
+            self.tiles.add_many(lats, lons, values)
+            self.region_stats.add_many(lats, lons, values)
+            self.sampler.add_many(lats, lons, values)
+            version = self._commit(
+                {
+                    "op": "add_many",
+                    "first_id": first_id,
+                    "lat": np.asarray(lat).tolist(),
+                    "lon": np.asarray(lon).tolist(),
+                    "gwrpm25": np.asarray(gwrpm25).tolist(),
+                }
+            )
+        self._sync(version)
+        return first_id, first_id + len(lat) - 1
+
+    @OPERATION_SECONDS.time(operation="mutate")
     def update_data_entry(
         self, id: int, lat: float, lon: float, gwrpm25: float
     ) -> None:
-        self.df.loc[id] = {"lat": lat, "lon": lon, "GWRPM25": gwrpm25}
+        """Update an entry, raises EntryNotFoundError if it does not exist."""
+        with self._write_lock:
+            self._check_log()
+            previous = self._current(id)
+            self.store.update(id, lat=lat, lon=lon, gwrpm25=gwrpm25)
+            self.aggregates.remove(previous["GWRPM25"])
+            self.sketch.remove(previous["GWRPM25"])
+            self._forget(previous)
+            # the index keeps the old cell too, readers check coordinates
+            self._remember(id)
+            version = self._commit(
+                {"op": "update", "id": id, "lat": lat, "lon": lon, "gwrpm25": gwrpm25}
+            )
+        self._sync(version)
 
+    @OPERATION_SECONDS.time(operation="mutate")
     def delete_data_entry(self, id: int) -> None:
-        self.df = self.df.drop(id)
+        """Delete an entry, raises EntryNotFoundError if it does not exist."""
+        with self._write_lock:
+            self._check_log()
+            previous = self._current(id)
+            self.aggregates.remove(previous["GWRPM25"])
+            self.sketch.remove(previous["GWRPM25"])
+            self.store.delete(id)
+            self._forget(previous)
+            version = self._commit({"op": "delete", "id": id})
+        self._sync(version)
+
+    def attach_log(self, log) -> None:
+        """Journal every later mutation to log, see app.wal.MutationLog."""
+        with self._write_lock:
+            self.log = log
+
+    def _check_log(self) -> None:
+        """
+        Refuse a mutation before it is made when the log cannot take it, so
+        nothing is applied that would have to be undone. Call with the lock held.
+        """
+        if self.log is not None:
+            self.log.check()
+
+    def _commit(self, record: dict) -> int:
+        """
+        Hand a mutation to the log and freeze it, call with the lock held.
+
+        Without a log the mutation is published at once. With one it waits
+        in _unsynced until _sync sees the log hold it, so readers and the
+        change log never see a write that a restart could lose.
+        """
+        self.version += 1
+        if self.log is None:
+            # before publishing, so no reader sees a version changes() lacks
+            self.change_log.append(self.version, record)
+            self._publish()
+        else:
+            self.log.append(dict(record, lsn=self.version))
+            self._unsynced.append((self._freeze(), record))
+        return self.version
+
+    def _sync(self, version: int) -> None:
+        """
+        Block until the mutation at version is durable, outside the lock,
+        then publish it and whatever was made durable with it. Raises
+        OSError when the log could not write it.
+        """
+        if self.log is None:
+            return
+        self.log.wait(version)
+        with self._sync_lock:
+            while self._unsynced:
+                snapshot, record = self._unsynced[0]
+                if snapshot.version > self.log.durable_lsn:
+                    break
+                self.change_log.append(snapshot.version, record)
+                self._snapshot = snapshot
+                self._unsynced.popleft()
+
+    def roll_log(self) -> tuple:
+        """
+        Send later mutations to a new log segment, see app.wal.MutationLog.roll.
+
+        :return: Tuple of (path of the new segment, Snapshot holding every
+            record in the older segments, durable or not).
+        """
+        with self._write_lock:
+            path = self.log.roll()
+            return path, self._unsynced[-1][0] if self._unsynced else self._snapshot
+
+    def resume(self, version: int, next_id: Optional[int] = None) -> None:
+        """Carry on from a saved version, keeping ids deleted before the save."""
+        with self._write_lock:
+            self.version = version
+            if next_id is not None:
+                self.store.next_id = max(self.store.next_id, next_id)
+            self.change_log.reset(version)
+            self._publish()
+
+    def replay(self, records: Iterable[dict]) -> None:
+        """Re-apply logged mutations in order, before a log is attached."""
+        for record in records:
+            op = record["op"]
+            if op in ("add", "add_many"):
+                first_id = record["id"] if op == "add" else record["first_id"]
+                if first_id < self.store.next_id:
+                    raise ValueError(f"Log entry {record['lsn']} reuses id {first_id}")
+                self.store.next_id = first_id
+            self.version = record["lsn"] - 1
+            if op == "add":
+                self.add_data_entry(record["lat"], record["lon"], record["gwrpm25"])
+            elif op == "add_many":
+                self.add_data_entries(
+                    np.asarray(record["lat"], dtype=np.float64),
+                    np.asarray(record["lon"], dtype=np.float64),
+                    np.asarray(record["gwrpm25"], dtype=np.float64),
+                )
+            elif op == "update":
+                self.update_data_entry(
+                    record["id"], record["lat"], record["lon"], record["gwrpm25"]
+                )
+            elif op == "delete":
+                self.delete_data_entry(record["id"])
+            else:
+                raise ValueError(f"Unknown log entry {record}")
 
-    def filter_data(self, lat: float, lon: float) -> str:
-        filtered_df = self.df[
-            np.isclose(self.df["lat"], lat, atol=1e-9)
-            & np.isclose(self.df["lon"], lon, atol=1e-9)
-        ]
-        df_with_id = filtered_df.reset_index().rename(columns={"index": "id"})
-        return df_with_id.to_json(orient="records")
+    def changes(self, since: int, limit: int = CHUNK_SIZE) -> tuple:
+        """
+        Inserts, updates and deletes after version since, see
+        ChangeLog.since. Raises ChangesGoneError when the client has to
+        download the rows again.
+        """
+        return self.change_log.since(since, limit)
+
+    def wait_for_changes(self, since: int, timeout: float) -> bool:
+        """Block until a mutation after version since, False on timeout."""
+        return self.change_log.wait(since, timeout)
+
+    @staticmethod
+    def _candidates(snapshot: Snapshot, ids: np.ndarray) -> pd.DataFrame:
+        return snapshot.rows.frame(snapshot.rows.slots_of(ids))
+
+    @staticmethod
+    def _by_distance(df: pd.DataFrame, lat: float, lon: float, order: str):
+        """Rows with their great-circle distance in km, sorted by order."""
+        distances = haversine_km(
+            lat,
+            lon,
+            df["lat"].to_numpy(dtype=np.float64),
+            df["lon"].to_numpy(dtype=np.float64),
+        )
+        df = df.assign(distance_km=distances)
+        if order == BY_DISTANCE:
+            return df.iloc[np.argsort(distances, kind="stable")]
+        return df.sort_index()
+
+    def filter_data(
+        self,
+        lat: float,
+        lon: float,
+        fmt: str = JSON,
+        tolerance: float = 1e-9,
+        order: str = BY_ID,
+    ):
+        """
+        Rows within tolerance degrees of lat and of lon, in id order or by
+        distance, which then comes back as distance_km.
+        """
+        if order not in ORDERS:
+            raise ValueError(f"Unknown order {order!r}")
+        snapshot = self.snapshot()
+        with OPERATION_SECONDS.time(operation="filter"):
+            # narrow storage dtypes move coordinates by up to this much
+            atol = max(tolerance, snapshot.rows.coordinate_tolerance)
+            candidates = self._candidates(
+                snapshot, snapshot.index.query_point(lat, lon, atol=atol)
+            )
+            filtered_df = candidates[
+                np.isclose(candidates["lat"], lat, atol=atol)
+                & np.isclose(candidates["lon"], lon, atol=atol)
+            ]
+            if order == BY_DISTANCE:
+                filtered_df = self._by_distance(filtered_df, lat, lon, order)
+        return self._to_records(filtered_df, fmt)
+
+    def within_data(
+        self,
+        lat: float,
+        lon: float,
+        radius_km: float,
+        fmt: str = JSON,
+        order: str = BY_DISTANCE,
+    ):
+        """
+        Rows within radius_km of (lat, lon) by great-circle distance, with
+        that distance. Distances are only worked out for the rows in the
+        index cells around the circle.
+        """
+        if order not in ORDERS:
+            raise ValueError(f"Unknown order {order!r}")
+        snapshot = self.snapshot()
+        with OPERATION_SECONDS.time(operation="filter"):
+            candidates = self._candidates(
+                snapshot,
+                np.unique(snapshot.index.query_radius(lat, lon, radius_km)),
+            )
+            within = self._by_distance(candidates, lat, lon, order)
+            within = within[within["distance_km"].to_numpy() <= radius_km]
+        return self._to_records(within, fmt)
+
+    def bbox_data(
+        self,
+        min_lat: float,
+        min_lon: float,
+        max_lat: float,
+        max_lon: float,
+        fmt: str = JSON,
+    ):
+        """Rows inside the box, a min_lon above max_lon wraps the antimeridian."""
+        snapshot = self.snapshot()
+        with OPERATION_SECONDS.time(operation="filter"):
+            in_box = self._in_box(snapshot, min_lat, min_lon, max_lat, max_lon)
+        return self._to_records(in_box, fmt)
+
+    def _in_box(
+        self,
+        snapshot: Snapshot,
+        min_lat: float,
+        min_lon: float,
+        max_lat: float,
+        max_lon: float,
+    ) -> pd.DataFrame:
+        candidates = self._candidates(
+            snapshot, snapshot.index.query_bbox(min_lat, min_lon, max_lat, max_lon)
+        )
+        in_lat = candidates["lat"].between(min_lat, max_lat)
+        if min_lon <= max_lon:
+            in_lon = candidates["lon"].between(min_lon, max_lon)
+        else:
+            in_lon = (candidates["lon"] >= min_lon) | (candidates["lon"] <= max_lon)
+        return candidates[in_lat & in_lon]
+
+    def nearest_data(self, lat: float, lon: float, k: int, fmt: str = JSON):
+        """The k rows closest to (lat, lon), with their great-circle distance."""
+        snapshot = self.snapshot()
+
+        def locate(ids: np.ndarray) -> tuple:
+            candidates = self._candidates(snapshot, ids)
+            return (
+                candidates.index.to_numpy(),
+                candidates["lat"].to_numpy(dtype=np.float64),
+                candidates["lon"].to_numpy(dtype=np.float64),
+            )
+
+        with OPERATION_SECONDS.time(operation="filter"):
+            ids, distances = snapshot.index.nearest(lat, lon, k, locate)
+            nearest_df = self._candidates(snapshot, ids).loc[ids]
+        return self._to_records(nearest_df.assign(distance_km=distances), fmt)
 
     def get_stats(self) -> {}:
+        return dict(self.snapshot().stats)
+
+    def bbox_stats(
+        self, min_lat: float, min_lon: float, max_lat: float, max_lon: float
+    ) -> dict:
+        """Count, sum and average PM2.5 inside a box, see RegionStats.bbox."""
+        return self.snapshot().regions.bbox(min_lat, min_lon, max_lat, max_lon)
+
+    def polygon_stats(self, lats: np.ndarray, lons: np.ndarray) -> dict:
+        """Count, sum and average PM2.5 inside a polygon, see RegionStats.polygon."""
+        return self.snapshot().regions.polygon(lats, lons)
+
+    def distribution(
+        self,
+        quantiles: Iterable[float] = QUANTILES,
+        bins: int = 10,
+        value_range: Optional[tuple] = None,
+        bbox: Optional[tuple] = None,
+        polygon: Optional[tuple] = None,
+    ) -> dict:
+        """
+        Approximate quantiles and a histogram of PM2.5, see QuantileSketch
+        for the error bounds. The whole dataset is answered from the sketch
+        kept up to date by the mutations. For a bbox (min_lat, min_lon,
+        max_lat, max_lon) or polygon (lats, lons) a sketch is built from the
+        rows inside, found through the spatial index as bbox_data does.
+        """
+        snapshot = self.snapshot()
+        sketch = snapshot.sketch
+        if bbox is not None or polygon is not None:
+            with OPERATION_SECONDS.time(operation="filter"):
+                if polygon is not None:
+                    lats, lons = (
+                        np.asarray(part, dtype=np.float64) for part in polygon
+                    )
+                    rows = self._in_box(
+                        snapshot, lats.min(), lons.min(), lats.max(), lons.max()
+                    )
+                    points = (
+                        rows["lat"].to_numpy(dtype=np.float64),
+                        rows["lon"].to_numpy(dtype=np.float64),
+                    )
+                    # in chunks, the test holds a row per point and edge
+                    inside = [
+                        points_in_polygon(
+                            points[0][start : start + CHUNK_SIZE],
+                            points[1][start : start + CHUNK_SIZE],
+                            lats,
+                            lons,
+                        )
+                        for start in range(0, len(rows), CHUNK_SIZE)
+                    ]
+                    rows = rows[np.concatenate(inside or [np.empty(0, dtype=bool)])]
+                else:
+                    rows = self._in_box(snapshot, *bbox)
+                sketch = QuantileSketch(rows["GWRPM25"].to_numpy(dtype=np.float64))
+        quantiles = list(quantiles)
+        values = sketch.quantiles(quantiles)
         return {
-            "count": int(self.df["GWRPM25"].count()),
-            "average": float(self.df["GWRPM25"].mean()),
-            "min": float(self.df["GWRPM25"].min()),
-            "max": float(self.df["GWRPM25"].max()),
+            "count": sketch.count,
+            "accuracy": sketch.accuracy,
+            "quantiles": {
+                f"p{q * 100:g}": None if np.isnan(value) else value
+                for q, value in zip(quantiles, values)
+            },
+            "histogram": sketch.histogram(bins, value_range),
         }
+
+    def sample(self, lats, lons, method: str = BILINEAR) -> np.ndarray:
+        """PM2.5 interpolated at many coordinates, see GridSampler.sample."""
+        with OPERATION_SECONDS.time(operation="sample"):
+            return self.snapshot().sampler.sample(lats, lons, method)
+
+    def get_tile(self, z: int, x: int, y: int) -> Optional[dict]:
+        """Aggregated bins of map tile z/x/y, None outside the pyramid."""
+        return self.snapshot().tiles.tile(z, x, y)
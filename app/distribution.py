@@ -0,0 +1,124 @@
+import copy
+import math
+from typing import Optional
+
+import numpy as np
+
+# relative error of quantiles and histogram placement, see QuantileSketch
+ACCURACY = 0.01
+# magnitudes below count as zero, above as MAX_MAGNITUDE
+MIN_MAGNITUDE = 1e-6
+MAX_MAGNITUDE = 1e6
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+class QuantileSketch:
+    """
+    Approximate quantiles and histograms of a column, from counts of its
+    values in logarithmic buckets (the DDSketch scheme).
+
+    With gamma = (1 + accuracy) / (1 - accuracy), bucket k holds the
+    magnitudes in (gamma ** (k - 1), gamma ** k] and stands for the value
+    2 * gamma ** k / (gamma + 1), which is within accuracy of every value in
+    the bucket relative to that value. So a quantile reported for rank r is
+    within accuracy * |x| of the value x of rank r, and a value can only be
+    counted in the neighbouring histogram bin when it lies within accuracy
+    of the edge between them. This holds for magnitudes between
+    MIN_MAGNITUDE and MAX_MAGNITUDE, smaller ones count as zero and larger
+    ones as MAX_MAGNITUDE.
+
+    Buckets are slots of one count array ordered by value: negative
+    buckets, zero, then positive ones. Adding and removing values only
+    changes counts, so removal is exact, and two sketches of the same
+    accuracy merge by adding counts. The counts are replaced rather than
+    changed in place, so a view() stays valid while the writer carries on.
+    """
+
+    def __init__(self, values=(), accuracy: float = ACCURACY):
+        if not 0 < accuracy < 1:
+            raise ValueError(f"Sketch accuracy out of range: {accuracy}")
+        self.accuracy = accuracy
+        self._log_gamma = math.log((1 + accuracy) / (1 - accuracy))
+        self._min_key = self._key(MIN_MAGNITUDE)
+        size = self._key(MAX_MAGNITUDE) - self._min_key + 1
+        self._zero = size
+        keys = np.arange(self._min_key, self._min_key + size)
+        magnitudes = 2 * np.exp(keys * self._log_gamma) / (np.exp(self._log_gamma) + 1)
+        # value each slot stands for, in slot order
+        self._values = np.concatenate([-magnitudes[::-1], [0.0], magnitudes])
+        self.counts = np.zeros(2 * size + 1, dtype=np.int64)
+        self.add_many(values)
+
+    def _key(self, magnitude):
+        return int(math.ceil(math.log(magnitude) / self._log_gamma))
+
+    def slots(self, values) -> np.ndarray:
+        """Slot of each value, NaN left out."""
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        magnitudes = np.clip(np.abs(values), MIN_MAGNITUDE, MAX_MAGNITUDE)
+        keys = np.ceil(np.log(magnitudes) / self._log_gamma).astype(np.int64)
+        # float rounding can put the bounds one key out
+        offsets = np.clip(keys - self._min_key, 0, self._zero - 1)
+        slots = np.where(values > 0, self._zero + 1 + offsets, self._zero - 1 - offsets)
+        return np.where(np.abs(values) < MIN_MAGNITUDE, self._zero, slots)
+
+    def add_many(self, values, weight: int = 1) -> None:
+        """Count values, or take them back out with weight -1."""
+        slots = self.slots(values)
+        if len(slots):
+            self.counts = self.counts + weight * np.bincount(
+                slots, minlength=len(self.counts)
+            )
+
+    def add(self, value: float) -> None:
+        self.add_many([value])
+
+    def remove(self, value: float) -> None:
+        self.add_many([value], weight=-1)
+
+    def merge(self, other: "QuantileSketch") -> "QuantileSketch":
+        """A new sketch of the values of both, which must share an accuracy."""
+        if other.accuracy != self.accuracy:
+            raise ValueError("Only sketches of the same accuracy merge")
+        merged = copy.copy(self)
+        merged.counts = self.counts + other.counts
+        return merged
+
+    def view(self) -> "QuantileSketch":
+        """A frozen copy for readers, see the class docstring."""
+        return copy.copy(self)
+
+    @property
+    def count(self) -> int:
+        return int(self.counts.sum())
+
+    def quantiles(self, qs) -> list:
+        """Values of rank floor(q * (count - 1)) for each q, NaN when empty."""
+        count = self.count
+        if not count:
+            return [math.nan] * len(qs)
+        cumulative = np.cumsum(self.counts)
+        ranks = np.floor(np.asarray(qs, dtype=np.float64) * (count - 1))
+        slots = np.searchsorted(cumulative, ranks, side="right")
+        return self._values[slots].tolist()
+
+    def histogram(self, bins: int = 10, value_range: Optional[tuple] = None) -> dict:
+        """
+        Counts in bins equal width bins over value_range, by default from
+        the lowest to the highest value held. Values outside the range are
+        left out, the last bin includes its upper edge.
+        """
+        used = np.flatnonzero(self.counts)
+        if value_range is None:
+            if len(used):
+                value_range = (self._values[used[0]], self._values[used[-1]])
+            else:
+                value_range = (0.0, 1.0)
+        counts, edges = np.histogram(
+            self._values[used],
+            bins=bins,
+            range=value_range,
+            weights=self.counts[used],
+        )
+        return {"edges": edges.tolist(), "counts": counts.astype(np.int64).tolist()}
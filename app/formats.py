@@ -0,0 +1,136 @@
+from typing import Iterable, Iterator
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+
+JSON = "application/json"
+NDJSON = "application/x-ndjson"
+ARROW = "application/vnd.apache.arrow.stream"
+MSGPACK = "application/msgpack"
+CSV = "text/csv"
+
+# formats a list of rows can be sent in, the first is the default
+ROW_FORMATS = (JSON, ARROW, MSGPACK, CSV)
+# other names clients send for the same formats
+ALIASES = {"application/x-msgpack": MSGPACK}
+
+# formats encoded to bytes rather than str
+BYTES = (ARROW, MSGPACK, CSV)
+
+# end of an Arrow IPC stream
+_ARROW_EOS = b"\xff\xff\xff\xff\x00\x00\x00\x00"
+
+
+def _length(columns: dict) -> int:
+    return len(next(iter(columns.values())))
+
+
+def _msgpack_header(count: int) -> bytes:
+    if count < 16:
+        return bytes([0x90 | count])
+    if count < 1 << 16:
+        return b"\xdc" + count.to_bytes(2, "big")
+    return b"\xdd" + count.to_bytes(4, "big")
+
+
+def _msgpack_records(columns: dict) -> bytes:
+    """
+    Rows as MessagePack maps of column name to value, packed a column at a
+    time into big-endian structs like app.tiles.pack_tile.
+    """
+    fields = [("map", "u1")]
+    tags = {}
+    for i, (name, values) in enumerate(columns.items()):
+        key = name.encode("utf-8")
+        if np.issubdtype(values.dtype, np.integer):
+            tag, dtype = 0xD3, ">i8"
+        elif values.dtype == np.float32:
+            tag, dtype = 0xCA, ">f4"
+        else:
+            tag, dtype = 0xCB, ">f8"
+        fields += [
+            (f"key{i}", f"S{len(key) + 1}"),
+            (f"tag{i}", "u1"),
+            (f"value{i}", dtype),
+        ]
+        tags[i] = (bytes([0xA0 | len(key)]) + key, tag)
+    records = np.empty(_length(columns), dtype=np.dtype(fields))
+    records["map"] = 0x80 | len(columns)
+    for i, values in enumerate(columns.values()):
+        records[f"key{i}"], records[f"tag{i}"] = tags[i]
+        records[f"value{i}"] = values
+    return records.tobytes()
+
+
+def _arrow_batch(columns: dict, nan_as_null: bool = False) -> pa.RecordBatch:
+    # numeric numpy arrays are wrapped, not copied
+    return pa.RecordBatch.from_arrays(
+        [pa.array(values, from_pandas=nan_as_null) for values in columns.values()],
+        names=list(columns),
+    )
+
+
+def _csv_rows(columns: dict) -> bytes:
+    """Rows as CSV lines without a header, NaN left empty."""
+    sink = pa.BufferOutputStream()
+    pa_csv.write_csv(
+        _arrow_batch(columns, nan_as_null=True),
+        sink,
+        pa_csv.WriteOptions(include_header=False, quoting_style="none"),
+    )
+    return sink.getvalue().to_pybytes()
+
+
+def iter_encode(batches: Iterable[dict], count: int, fmt: str) -> Iterator:
+    """
+    Encode rows given as batches of columns (dicts of name to numpy array,
+    in output order) as one document of fmt, a piece per batch.
+
+    :param count: Total rows over all batches, MessagePack needs it first.
+    """
+    if fmt == JSON:
+        yield "["
+        first = True
+        for columns in batches:
+            if _length(columns):
+                records = pd.DataFrame(columns).to_json(orient="records")[1:-1]
+                yield records if first else "," + records
+                first = False
+        yield "]"
+    elif fmt == NDJSON:
+        for columns in batches:
+            if _length(columns):
+                yield pd.DataFrame(columns).to_json(orient="records", lines=True)
+    elif fmt == CSV:
+        for i, columns in enumerate(batches):
+            if i == 0:
+                yield (",".join(columns) + "\n").encode("utf-8")
+            yield _csv_rows(columns)
+    elif fmt == MSGPACK:
+        yield _msgpack_header(count)
+        for columns in batches:
+            yield _msgpack_records(columns)
+    elif fmt == ARROW:
+        for i, columns in enumerate(batches):
+            batch = _arrow_batch(columns)
+            if i == 0:
+                yield batch.schema.serialize().to_pybytes()
+            yield batch.serialize().to_pybytes()
+        yield _ARROW_EOS
+    else:
+        raise ValueError(f"Unknown format {fmt!r}")
+
+
+def encode(columns: dict, fmt: str):
+    """Rows given as columns as one document of fmt, str for JSON."""
+    pieces = list(iter_encode([columns], _length(columns), fmt))
+    return b"".join(pieces) if fmt in BYTES else "".join(pieces)
+
+
+def frame_columns(df: pd.DataFrame) -> dict:
+    """Columns of a DataFrame indexed by id, id first."""
+    columns = {"id": df.index.to_numpy(dtype=np.int64)}
+    columns.update((name, df[name].to_numpy()) for name in df.columns)
+    return columns
@@ -0,0 +1,154 @@
+import io
+import json
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+FIELDS = ("lat", "lon", "gwrpm25")
+MAX_REPORTED_ERRORS = 1000
+
+JSON = "application/json"
+NDJSON = "application/x-ndjson"
+ARROW_STREAM = "application/vnd.apache.arrow.stream"
+ARROW_FILE = "application/vnd.apache.arrow.file"
+PARQUET = "application/vnd.apache.parquet"
+
+
+class BatchFormatError(ValueError):
+    """The request body could not be read as a batch at all."""
+
+
+def parse_batch(body: bytes, content_type: str) -> tuple:
+    """
+    Read a batch body into a DataFrame with one row per submitted entry.
+
+    :return: Tuple of (DataFrame, {row number: error}) for rows that could not
+        even be parsed, those come back as empty rows.
+    """
+    try:
+        if content_type == NDJSON:
+            return _parse_ndjson(body)
+        if content_type == ARROW_STREAM:
+            return pa.ipc.open_stream(body).read_all().to_pandas(), {}
+        if content_type == ARROW_FILE:
+            return pa.ipc.open_file(pa.BufferReader(body)).read_all().to_pandas(), {}
+        if content_type == PARQUET:
+            return pq.read_table(io.BytesIO(body)).to_pandas(), {}
+        rows = json.loads(body)
+    except (pa.ArrowInvalid, UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise BatchFormatError(str(e))
+    if not isinstance(rows, list):
+        raise BatchFormatError("Expected a JSON array of entries.")
+    return _from_records(rows, {})
+
+
+def parse_points(body: bytes, content_type: str) -> tuple:
+    """
+    Read a body of coordinates: a JSON array of [lat, lon] pairs, or a
+    batch of entries with lat and lon fields in any format of parse_batch.
+
+    :return: Tuple of (lats, lons) float64 arrays, BatchFormatError when a
+        point is missing or not a finite number.
+    """
+    points = None
+    if content_type not in (NDJSON, ARROW_STREAM, ARROW_FILE, PARQUET):
+        try:
+            rows = json.loads(body)
+        except (UnicodeDecodeError, json.JSONDecodeError) as e:
+            raise BatchFormatError(str(e))
+        if isinstance(rows, list) and rows and isinstance(rows[0], list):
+            try:
+                points = np.array(rows, dtype=np.float64)
+            except (TypeError, ValueError):
+                raise BatchFormatError("Points must be [lat, lon] pairs of numbers.")
+            if points.ndim != 2 or points.shape[1] != 2:
+                raise BatchFormatError("Points must be [lat, lon] pairs of numbers.")
+        elif isinstance(rows, list):
+            df, errors = _from_records(rows, {})
+        else:
+            raise BatchFormatError("Expected a JSON array of points.")
+    else:
+        df, errors = parse_batch(body, content_type)
+    if points is None:
+        if errors:
+            raise BatchFormatError(f"Point {min(errors)}: {errors[min(errors)]}")
+        df = df.rename(columns=str.lower)
+        points = np.column_stack(
+            [
+                (
+                    pd.to_numeric(df[name], errors="coerce").to_numpy(
+                        dtype=np.float64, na_value=np.nan
+                    )
+                    if name in df
+                    else np.full(len(df), np.nan)
+                )
+                for name in ("lat", "lon")
+            ]
+        ).reshape(-1, 2)
+    bad = np.flatnonzero(~np.isfinite(points).all(axis=1))
+    if len(bad):
+        raise BatchFormatError(f"Point {bad[0]} needs a finite lat and lon.")
+    return points[:, 0], points[:, 1]
+
+
+def _parse_ndjson(body: bytes) -> tuple:
+    rows = []
+    errors = {}
+    for line in body.decode("utf-8").splitlines():
+        if not line.strip():
+            continue
+        try:
+            rows.append(json.loads(line))
+        except json.JSONDecodeError:
+            errors[len(rows)] = "Malformed JSON."
+            rows.append({})
+    return _from_records(rows, errors)
+
+
+def _from_records(rows: list, errors: dict) -> tuple:
+    for i, row in enumerate(rows):
+        if not isinstance(row, dict):
+            errors[i] = "Entry must be an object."
+    records = [row if isinstance(row, dict) else {} for row in rows]
+    return pd.DataFrame(records, index=range(len(records))), errors
+
+
+def validate_batch(df: pd.DataFrame, parse_errors: dict) -> tuple:
+    """
+    Check whole columns at once for required, finite numeric fields.
+
+    :return: Tuple of (float64 column dict for the valid rows, row numbers of
+        the valid rows, list of {"row", "error"} dicts for the rejected ones).
+    """
+    df = df.rename(columns=str.lower)
+    size = len(df)
+    columns = {}
+    bad = {}
+    for field in FIELDS:
+        if field in df:
+            values = pd.to_numeric(df[field], errors="coerce").to_numpy(
+                dtype=np.float64, na_value=np.nan
+            )
+        else:
+            values = np.full(size, np.nan)
+        columns[field] = values
+        bad[field] = ~np.isfinite(values)
+
+    invalid = np.logical_or.reduce([bad[field] for field in FIELDS])
+    if parse_errors:
+        invalid[list(parse_errors)] = True
+    rows = np.flatnonzero(~invalid)
+
+    errors = []
+    for row in np.flatnonzero(invalid)[:MAX_REPORTED_ERRORS].tolist():
+        if row in parse_errors:
+            message = parse_errors[row]
+        else:
+            fields = ", ".join(field for field in FIELDS if bad[field][row])
+            message = f"{fields} must be present and finite numbers."
+        errors.append({"row": row, "error": message})
+
+    valid = {field: values[rows] for field, values in columns.items()}
+    return valid, rows, errors
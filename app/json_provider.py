@@ -0,0 +1,17 @@
+import orjson
+from flask.json.provider import DefaultJSONProvider
+
+
+class OrjsonProvider(DefaultJSONProvider):
+    """
+    Flask's JSON provider with orjson writing jsonify responses, keys still
+    sorted. NaN is written as null rather than the invalid NaN.
+    """
+
+    option = orjson.OPT_SORT_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+    def dumps(self, obj, **kwargs) -> str:
+        if "indent" in kwargs:
+            # debug mode pretty printing, not worth a second code path
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=self.option).decode()
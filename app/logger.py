@@ -1,13 +1,24 @@
+import atexit
 import logging
 import os
+import queue
+from logging.handlers import QueueHandler, QueueListener
 
 LOG_DIRECTORY = "logs"
 
+# one listener thread per logger, writing its records to file and stderr
+_listeners = {}
+
 
 def setup_logger(name: str, log_file: str, level=logging.INFO) -> logging.Logger:
     """
     Setup a logger with a given name and log file.
 
+    Records only go onto a queue on the calling thread. A listener thread
+    formats them and writes them to the file and to stderr, so disk I/O
+    never holds up a request. Calling it again for the same name returns
+    the logger as it is, without adding handlers twice.
+
     :param name: The name of the logger (can be module name).
     :param log_file: The log file where logs will be written.
     :param level: Logging level (default: logging.INFO).
@@ -15,16 +26,14 @@ def setup_logger(name: str, log_file: str, level=logging.INFO) -> logging.Logger
     """
     logger = logging.getLogger(name)
     logger.setLevel(level)
+    if name in _listeners:
+        return logger
 
     if not os.path.exists(LOG_DIRECTORY):
         os.makedirs(LOG_DIRECTORY)
 
     log_file_path = os.path.join(LOG_DIRECTORY, log_file)
 
-    logger = logging.getLogger(name)
-
-    logger.setLevel(level)
-
     file_handler = logging.FileHandler(log_file_path)
     stream_handler = logging.StreamHandler()
 
@@ -34,7 +43,18 @@ def setup_logger(name: str, log_file: str, level=logging.INFO) -> logging.Logger
     file_handler.setFormatter(formatter)
     stream_handler.setFormatter(formatter)
 
-    logger.addHandler(file_handler)
-    logger.addHandler(stream_handler)
+    records = queue.SimpleQueue()
+    listener = QueueListener(records, file_handler, stream_handler)
+    listener.start()
+    _listeners[name] = listener
+    logger.addHandler(QueueHandler(records))
 
     return logger
+
+
+@atexit.register
+def _flush() -> None:
+    """Write out queued records before the interpreter exits."""
+    for listener in _listeners.values():
+        listener.stop()
+    _listeners.clear()
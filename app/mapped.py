@@ -0,0 +1,250 @@
+import fcntl
+import hashlib
+import json
+import mmap
+import os
+import pickle
+import struct
+from contextlib import contextmanager
+from typing import Callable, Iterator, Optional
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from .storage import CHUNK_ROWS, COLUMNS, ColumnStore, codecs_for, encode
+
+INDEX_COLUMN = "__index_level_0__"
+# start of a file written by save_built, then where its pickle starts and the
+# lengths of the pickle and of the header after it
+BUILT_MAGIC = b"AQBUILT1"
+BUILT_PREFIX = struct.Struct("<8sQQQ")
+
+
+def cache_path(parquet_path: str, dtypes: str, cache_dir: Optional[str] = None) -> str:
+    """Where the Arrow copy of parquet_path stored as dtypes lives."""
+    root, _ = os.path.splitext(os.path.basename(parquet_path))
+    directory = cache_dir or os.path.dirname(os.path.abspath(parquet_path))
+    return os.path.join(directory, f"{root}.{dtypes}.arrow")
+
+
+def _stamp(path: str) -> bytes:
+    stat = os.stat(path)
+    return f"{stat.st_size}:{stat.st_mtime_ns}".encode("utf-8")
+
+
+def _is_fresh(arrow_path: str, parquet_path: str) -> bool:
+    if not os.path.exists(arrow_path):
+        return False
+    try:
+        with pa.memory_map(arrow_path) as source:
+            metadata = pa.ipc.open_file(source).schema.metadata or {}
+    except pa.ArrowInvalid:
+        return False
+    return metadata.get(b"source") == _stamp(parquet_path)
+
+
+@contextmanager
+def _building(arrow_path: str):
+    """Hold a lock that lets one process at a time build arrow_path."""
+    with open(arrow_path + ".lock", "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _rebatched(parquet: pq.ParquetFile, columns: list) -> Iterator[pa.Table]:
+    """Tables of exactly CHUNK_ROWS rows, the last one may be shorter."""
+    pending = []
+    rows = 0
+    for batch in parquet.iter_batches(batch_size=CHUNK_ROWS, columns=columns):
+        pending.append(batch)
+        rows += batch.num_rows
+        while rows >= CHUNK_ROWS:
+            table = pa.Table.from_batches(pending)
+            yield table.slice(0, CHUNK_ROWS)
+            rest = table.slice(CHUNK_ROWS)
+            pending = rest.to_batches()
+            rows = rest.num_rows
+    if rows:
+        yield pa.Table.from_batches(pending)
+
+
+def build_cache(parquet_path: str, arrow_path: str, dtypes: str) -> None:
+    """
+    Write parquet_path as an uncompressed Arrow IPC file that can be mapped
+    straight into a ColumnStore: one record batch per storage chunk, values
+    already encoded for dtypes and an explicit ascending "id" column.
+
+    Reads and writes a chunk at a time, so never holds the whole table.
+    """
+    codecs = codecs_for(dtypes)
+    parquet = pq.ParquetFile(parquet_path)
+    source_schema = parquet.schema_arrow
+    has_index = INDEX_COLUMN in source_schema.names
+    fields = [pa.field("id", pa.int64())]
+    for name in COLUMNS:
+        if name in codecs:
+            fields.append(pa.field(name, pa.from_numpy_dtype(codecs[name][0])))
+        else:
+            fields.append(pa.field(name, source_schema.field(name).type))
+    schema = pa.schema(fields, metadata={b"source": _stamp(parquet_path)})
+    columns = list(COLUMNS) + ([INDEX_COLUMN] if has_index else [])
+
+    temp_path = arrow_path + ".tmp"
+    next_id = 0
+    with pa.OSFile(temp_path, "wb") as sink:
+        with pa.ipc.new_file(sink, schema) as writer:
+            for table in _rebatched(parquet, columns):
+                if has_index:
+                    ids = table.column(INDEX_COLUMN).to_numpy().astype(np.int64)
+                else:
+                    ids = np.arange(next_id, next_id + table.num_rows, dtype=np.int64)
+                if ids[0] < next_id or np.any(np.diff(ids) <= 0):
+                    raise ValueError(f"{parquet_path} ids are not ascending")
+                next_id = int(ids[-1]) + 1
+                arrays = [pa.array(ids)]
+                for field in fields[1:]:
+                    values = table.column(field.name).to_numpy()
+                    arrays.append(
+                        pa.array(encode(codecs, field.name, values), type=field.type)
+                    )
+                writer.write_batch(pa.record_batch(arrays, schema=schema))
+    os.replace(temp_path, arrow_path)
+
+
+def load_mapped(
+    parquet_path: str, dtypes: str = "native", cache_dir: Optional[str] = None
+) -> ColumnStore:
+    """
+    A ColumnStore over a memory-mapped Arrow copy of parquet_path, building
+    the copy first if it is missing or older than the Parquet file.
+
+    Nothing is read up front, pages are faulted in from the page cache as
+    rows are touched and chunks are only copied into memory when written.
+    Processes mapping the same copy share its pages, and only one of them
+    builds it when several start at once.
+    """
+    arrow_path = cache_path(parquet_path, dtypes, cache_dir)
+    if not _is_fresh(arrow_path, parquet_path):
+        with _building(arrow_path):
+            if not _is_fresh(arrow_path, parquet_path):
+                build_cache(parquet_path, arrow_path, dtypes)
+    reader = pa.ipc.open_file(pa.memory_map(arrow_path))
+    chunks = {name: [] for name in ("id",) + COLUMNS}
+    for i in range(reader.num_record_batches):
+        batch = reader.get_batch(i)
+        for name in chunks:
+            values = batch.column(batch.schema.get_field_index(name))
+            chunks[name].append(values.to_numpy(zero_copy_only=True))
+    return ColumnStore.from_chunks(chunks, dtypes)
+
+
+def _code_stamp() -> bytes:
+    """Changes with the app's code, so structures pickled by other code are rebuilt."""
+    digest = hashlib.blake2b(digest_size=8)
+    package = os.path.dirname(os.path.abspath(__file__))
+    for name in sorted(os.listdir(package)):
+        if name.endswith(".py"):
+            digest.update(name.encode("utf-8") + _stamp(os.path.join(package, name)))
+    return digest.hexdigest().encode("utf-8")
+
+
+def built_path(
+    parquet_path: str, dtypes: str, key: str, cache_dir: Optional[str] = None
+) -> str:
+    """Where the structures built over the Arrow copy of parquet_path live."""
+    arrow_path = cache_path(parquet_path, dtypes, cache_dir)
+    return f"{os.path.splitext(arrow_path)[0]}.{key}.built"
+
+
+def _aligned(offset: int) -> int:
+    return -(-offset // mmap.PAGESIZE) * mmap.PAGESIZE
+
+
+def save_built(built: dict, path: str, source: bytes) -> None:
+    """
+    Write built, a dict of objects holding numpy arrays, so load_built can
+    map it. The arrays are written out of band (pickle protocol 5), each
+    from a page boundary, followed by the pickle of the rest and a header.
+    """
+    buffers = []
+    pickled = pickle.dumps(built, protocol=5, buffer_callback=buffers.append)
+    raws = [buffer.raw() for buffer in buffers]
+    offsets = []
+    offset = _aligned(BUILT_PREFIX.size)
+    for raw in raws:
+        offsets.append(offset)
+        offset = _aligned(offset + raw.nbytes)
+    header = json.dumps(
+        {
+            "source": source.decode("utf-8"),
+            "buffers": [[at, raw.nbytes] for at, raw in zip(offsets, raws)],
+        }
+    ).encode("utf-8")
+    temp_path = path + ".tmp"
+    with open(temp_path, "wb") as out:
+        out.write(BUILT_PREFIX.pack(BUILT_MAGIC, offset, len(pickled), len(header)))
+        for at, raw in zip(offsets, raws):
+            out.seek(at)
+            out.write(raw)
+        out.seek(offset)
+        out.write(pickled)
+        out.write(header)
+    os.replace(temp_path, path)
+
+
+def load_built(path: str, source: bytes) -> Optional[dict]:
+    """
+    The structures save_built wrote to path, None when there are none or
+    they were built from another source.
+
+    The arrays are mapped copy-on-write: processes loading the same file
+    share its pages through the page cache, and a process writing to an
+    array only copies the pages it writes.
+    """
+    try:
+        with open(path, "rb") as file:
+            magic, offset, pickled_length, header_length = BUILT_PREFIX.unpack(
+                file.read(BUILT_PREFIX.size)
+            )
+            if magic != BUILT_MAGIC:
+                return None
+            file.seek(offset)
+            pickled = file.read(pickled_length)
+            header = json.loads(file.read(header_length))
+            if header["source"].encode("utf-8") != source:
+                return None
+            mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_COPY)
+    except (OSError, ValueError, struct.error):
+        return None
+    view = memoryview(mapped)
+    buffers = [view[at : at + size] for at, size in header["buffers"]]
+    return pickle.loads(pickled, buffers=buffers)
+
+
+def map_built(
+    parquet_path: str,
+    dtypes: str,
+    key: str,
+    build: Callable[[], dict],
+    cache_dir: Optional[str] = None,
+) -> dict:
+    """
+    The structures build() makes over the ColumnStore of load_mapped,
+    built by the first process to ask and mapped by every other one, see
+    load_built. key tells apart structures built with other options.
+    """
+    path = built_path(parquet_path, dtypes, key, cache_dir)
+    source = _stamp(parquet_path) + b":" + _code_stamp()
+    built = load_built(path, source)
+    if built is not None:
+        return built
+    with _building(path):
+        built = load_built(path, source)
+        if built is None:
+            save_built(build(), path, source)
+            built = load_built(path, source)
+    return built
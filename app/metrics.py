@@ -0,0 +1,312 @@
+import bisect
+import logging
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Iterable, Iterator, Optional
+
+from flask import Flask, g, request
+
+from .logger import setup_logger
+
+# seconds, from sub-millisecond lookups to full downloads
+LATENCY_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+)
+# bytes
+SIZE_BUCKETS = (100, 1000, 10_000, 100_000, 1_000_000, 10_000_000, 100_000_000)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+logger = setup_logger(name="metrics", log_file="metrics.txt", level=logging.INFO)
+
+
+def _number(value: float) -> str:
+    if math.isnan(value):
+        return "NaN"
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+def _labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Counter:
+    """A monotonic count per combination of label values."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Iterable[str] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = tuple(labels[name] for name in self.label_names)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def samples(self) -> Iterator[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            yield f"{self.name}{_labels(self.label_names, key)} {_number(value)}"
+
+
+class Histogram:
+    """Counts of observations per bucket, with their sum and count."""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labels: Iterable[str] = (),
+        buckets: Iterable[float] = LATENCY_BUCKETS,
+    ):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        # label values -> [count per bucket and +Inf, sum]
+        self._values = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = tuple(labels[name] for name in self.label_names)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            counts[0][index] += 1
+            counts[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the seconds the with block takes."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self) -> Iterator[str]:
+        with self._lock:
+            values = sorted((key, (list(c), s)) for key, (c, s) in self._values.items())
+        for key, (counts, total) in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                le = f'le="{_number(bound)}"'
+                yield f"{self.name}_bucket{_labels(self.label_names, key, le)} {cumulative}"
+            labels = _labels(self.label_names, key)
+            yield f"{self.name}_sum{labels} {_number(total)}"
+            yield f"{self.name}_count{labels} {cumulative}"
+
+
+class Gauge:
+    """
+    A value read when the metrics are rendered, kind "counter" for totals
+    kept elsewhere.
+    """
+
+    def __init__(
+        self, name: str, help: str, read: Callable[[], float], kind: str = "gauge"
+    ):
+        self.name = name
+        self.help = help
+        self.read = read
+        self.kind = kind
+
+    def samples(self) -> Iterator[str]:
+        try:
+            value = self.read()
+        except Exception:
+            # one broken gauge should not take the rest of /metrics down
+            logger.exception(f"Error reading gauge {self.name}")
+            return
+        if value is not None:
+            yield f"{self.name} {_number(value)}"
+
+
+class Registry:
+    """Metrics by name, rendered in the Prometheus text format."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics = {}
+
+    def register(self, metric):
+        """Add a metric, replacing any earlier one of the same name."""
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def get(self, name: str):
+        with self._lock:
+            return self._metrics.get(name)
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {_escape(metric.help)}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUESTS = REGISTRY.register(
+    Counter(
+        "air_quality_http_requests_total",
+        "Requests answered, by route and status.",
+        ("method", "route", "status"),
+    )
+)
+REQUEST_SECONDS = REGISTRY.register(
+    Histogram(
+        "air_quality_http_request_duration_seconds",
+        "Time to the response, streamed bodies not included.",
+        ("method", "route"),
+    )
+)
+RESPONSE_BYTES = REGISTRY.register(
+    Histogram(
+        "air_quality_http_response_size_bytes",
+        "Response body sizes, streamed bodies counted as they are sent.",
+        ("method", "route"),
+        buckets=SIZE_BUCKETS,
+    )
+)
+OPERATION_SECONDS = REGISTRY.register(
+    Histogram(
+        "air_quality_dataset_operation_seconds",
+        "Time DataSet spends loading, filtering, sampling, serializing and mutating.",
+        ("operation",),
+    )
+)
+ADMISSIONS = REGISTRY.register(
+    Counter(
+        "air_quality_admission_requests_total",
+        "Requests admitted or turned away with 503, by cost class.",
+        ("cost", "outcome"),
+    )
+)
+ADMISSION_WAIT_SECONDS = REGISTRY.register(
+    Histogram(
+        "air_quality_admission_wait_seconds",
+        "Time admitted requests waited for a slot, by cost class.",
+        ("cost",),
+    )
+)
+
+
+def timed_iter(pieces: Iterable, operation: str) -> Iterator:
+    """Yield pieces, observing the time spent producing them once exhausted."""
+    spent = 0.0
+    iterator = iter(pieces)
+    while True:
+        start = time.perf_counter()
+        try:
+            piece = next(iterator)
+        except StopIteration:
+            OPERATION_SECONDS.observe(
+                spent + time.perf_counter() - start, operation=operation
+            )
+            return
+        spent += time.perf_counter() - start
+        yield piece
+
+
+def _counted(body: Iterable, observe: Callable[[int], None]) -> Iterator:
+    size = 0
+    try:
+        for chunk in body:
+            ascii = isinstance(chunk, bytes) or chunk.isascii()
+            size += len(chunk) if ascii else len(chunk.encode("utf-8"))
+            yield chunk
+    finally:
+        observe(size)
+        close = getattr(body, "close", None)
+        if close is not None:
+            close()
+
+
+def _route() -> str:
+    rule: Optional[object] = request.url_rule
+    # unmatched paths share one label so they cannot blow up the series
+    return rule.rule if rule is not None else "<unmatched>"
+
+
+def instrument(app: Flask) -> None:
+    """
+    Count and time every request of app, see REQUESTS, and report its
+    dataset and response cache. The gauges read the app last instrumented.
+    """
+    REGISTRY.register(
+        Gauge(
+            "air_quality_dataset_rows",
+            "Live rows in the current dataset.",
+            lambda: len(app.data_set.snapshot().rows),
+        )
+    )
+    for name in ("hits", "misses"):
+        REGISTRY.register(
+            Gauge(
+                f"air_quality_response_cache_{name}_total",
+                f"Response cache {name}.",
+                lambda name=name: getattr(app.response_cache, name),
+                kind="counter",
+            )
+        )
+
+    @app.before_request
+    def start_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def observe(response):
+        start = g.pop("metrics_start", None)
+        if start is None:
+            return response
+        labels = {"method": request.method, "route": _route()}
+        REQUEST_SECONDS.observe(time.perf_counter() - start, **labels)
+        REQUESTS.inc(status=str(response.status_code), **labels)
+        if response.is_streamed:
+            response.response = _counted(
+                response.response,
+                lambda size: RESPONSE_BYTES.observe(size, **labels),
+            )
+        else:
+            RESPONSE_BYTES.observe(response.content_length or 0, **labels)
+        return response
@@ -0,0 +1,35 @@
+"""
+Layout of the year-partitioned Parquet dataset, shared by the app and
+data/create_dataset.py. It needs only numpy, so the converter can use it
+without the app's web dependencies.
+"""
+
+import os
+import re
+
+import numpy as np
+
+# one directory per year, as written by data/create_dataset.py
+YEAR_DIRECTORY = re.compile(r"^year=(\d{4})$")
+PART_FILE = "part-0.parquet"
+ROW_GROUP_ROWS = 65536
+# rows are sorted by cells of this many degrees, so a row group covers a patch
+SORT_CELL = 1.0
+
+
+def spatial_order(lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+    """
+    Row order by SORT_CELL degree cell, then by lat and lon. Row groups of
+    rows in this order each cover a small patch, so their lat/lon statistics
+    let a point lookup skip the rest of the file.
+    """
+    return np.lexsort(
+        (lons, lats, np.floor(lons / SORT_CELL), np.floor(lats / SORT_CELL))
+    )
+
+
+def partition_path(root: str, year: int) -> str:
+    """Path of a year's Parquet file under root, its directory created."""
+    directory = os.path.join(root, f"year={year}")
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, PART_FILE)
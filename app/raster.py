@@ -0,0 +1,309 @@
+import copy
+import math
+
+import numpy as np
+
+from .spatial_index import (
+    GridIndex,
+    haversine_km,
+    min_distance_beyond_km,
+    radius_bbox,
+)
+
+# coordinates this fraction of a cell from a cell centre are on the grid
+SNAP_FRACTION = 1e-3
+MAX_DENSE_MEMBER = np.iinfo(np.int32).max
+
+
+def _nice(value: float, tolerance: float) -> float:
+    """The shortest decimal within tolerance of value, undoing float32 noise."""
+    for decimals in range(10):
+        rounded = round(value, decimals)
+        if abs(rounded - value) <= tolerance:
+            return rounded
+    return value
+
+
+def _decimals(*values: float):
+    """Decimal places that write all values exactly, None if too many."""
+    for decimals in range(10):
+        if all(round(value, decimals) == value for value in values):
+            return decimals
+    return None
+
+
+def _axis(values, name: str) -> tuple:
+    """(first cell centre, spacing, cell count) of one axis of a grid."""
+    values = np.asarray(values, dtype=np.float64)
+    values, counts = np.unique(values[np.isfinite(values)], return_counts=True)
+    if len(values) < 2:
+        raise ValueError(f"Not enough distinct {name} values to find a grid")
+    # values shared by several points are on the grid, stray ones would
+    # make gaps smaller than a cell
+    repeated = counts > 1
+    anchors = values
+    if repeated.sum() >= 2 and 2 * counts[repeated].sum() >= counts.sum():
+        anchors = values[repeated]
+    gaps = np.diff(anchors)
+    # the smallest gap is one cell, larger ones skip empty cells, and
+    # near-duplicates left by float32 rounding are no gap at all
+    step = float(gaps[gaps > gaps.max() * SNAP_FRACTION].min())
+    span = float(anchors[-1] - anchors[0])
+    steps = max(1, round(span / step))
+    step = span / steps
+    tolerance = step * SNAP_FRACTION
+    origin = _nice(float(anchors[0]), tolerance)
+    step = _nice(step, tolerance / steps)
+    # stretch the axis over every value on the same lattice
+    cells = np.rint((values - origin) / step)
+    on_lattice = np.abs(values - (origin + cells * step)) <= tolerance
+    first, last = int(cells[on_lattice].min()), int(cells[on_lattice].max())
+    return _nice(origin + first * step, tolerance), step, last - first + 1
+
+
+class RasterGrid:
+    """
+    A regular lat/lon grid: the centre of its first cell, the spacing
+    between cell centres and the number of cells along each axis.
+
+    Coordinates within tolerance of a cell centre are on the grid and map to
+    (row, col) by arithmetic alone.
+    """
+
+    def __init__(
+        self,
+        lat0: float,
+        lon0: float,
+        dlat: float,
+        dlon: float,
+        n_lat: int,
+        n_lon: int,
+    ):
+        self.lat0 = lat0
+        self.lon0 = lon0
+        self.dlat = dlat
+        self.dlon = dlon
+        self.n_lat = n_lat
+        self.n_lon = n_lon
+        self.tolerance = min(dlat, dlon) * SNAP_FRACTION
+        self.decimals = _decimals(lat0, lon0, dlat, dlon)
+
+    @classmethod
+    def detect(cls, lats, lons) -> "RasterGrid":
+        """The grid most of the points lie on, ValueError if there is none."""
+        lat0, dlat, n_lat = _axis(lats, "lat")
+        lon0, dlon, n_lon = _axis(lons, "lon")
+        grid = cls(lat0, lon0, dlat, dlon, n_lat, n_lon)
+        _, _, on_grid = grid.locate(lats, lons)
+        if on_grid.mean() < 0.5:
+            raise ValueError("Coordinates do not lie on a regular grid")
+        return grid
+
+    def _centres(self, origin: float, step: float, cells) -> np.ndarray:
+        values = origin + np.asarray(cells, dtype=np.float64) * step
+        if self.decimals is not None:
+            # 0.005 + 3 * 0.01 should read 0.035, not 0.035000000000000003
+            values = np.round(values, self.decimals)
+        return values
+
+    def lats(self, rows) -> np.ndarray:
+        return self._centres(self.lat0, self.dlat, rows)
+
+    def lons(self, cols) -> np.ndarray:
+        return self._centres(self.lon0, self.dlon, cols)
+
+    def locate(self, lats, lons) -> tuple:
+        """
+        :return: Tuple of (rows, cols, on grid mask), rows and cols are -1
+            for points off the grid.
+        """
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        with np.errstate(invalid="ignore"):
+            rows = np.rint((lats - self.lat0) / self.dlat)
+            cols = np.rint((lons - self.lon0) / self.dlon)
+            on_grid = (
+                (np.abs(lats - self.lats(np.nan_to_num(rows))) <= self.tolerance)
+                & (np.abs(lons - self.lons(np.nan_to_num(cols))) <= self.tolerance)
+                & (rows >= 0)
+                & (rows < self.n_lat)
+                & (cols >= 0)
+                & (cols < self.n_lon)
+            )
+        rows = np.where(on_grid, np.nan_to_num(rows), -1).astype(np.int64)
+        cols = np.where(on_grid, np.nan_to_num(cols), -1).astype(np.int64)
+        return rows, cols, on_grid
+
+    def row_range(self, min_lat: float, max_lat: float) -> tuple:
+        """First and last row with a centre inside [min_lat, max_lat]."""
+        first = max(0, math.ceil((min_lat - self.lat0) / self.dlat - SNAP_FRACTION))
+        last = min(
+            self.n_lat - 1,
+            math.floor((max_lat - self.lat0) / self.dlat + SNAP_FRACTION),
+        )
+        return first, last
+
+    def col_range(self, min_lon: float, max_lon: float) -> tuple:
+        """First and last col with a centre inside [min_lon, max_lon]."""
+        first = max(0, math.ceil((min_lon - self.lon0) / self.dlon - SNAP_FRACTION))
+        last = min(
+            self.n_lon - 1,
+            math.floor((max_lon - self.lon0) / self.dlon + SNAP_FRACTION),
+        )
+        return first, last
+
+
+class RasterIndex:
+    """
+    Spatial index over a RasterGrid, a drop-in for GridIndex.
+
+    A dense (n_lat, n_lon) array holds a member for each grid cell, so
+    finding the members at a point or in a box is slicing. Members off the
+    grid, extra members sharing a cell and ids too large for the array go to
+    a sparse GridIndex overlay.
+
+    As with GridIndex, nothing is removed between rebuilds and queries only
+    return candidates for the caller to check. An addition may fill an empty
+    cell that existing views share, which only adds a candidate those views'
+    callers will not find in their rows.
+    """
+
+    def __init__(
+        self, grid: RasterGrid, members: np.ndarray, lats: np.ndarray, lons: np.ndarray
+    ):
+        self.grid = grid
+        self.rebuild(members, lats, lons)
+
+    def __len__(self) -> int:
+        return self._dense_count + len(self.overlay)
+
+    def rebuild(self, members: np.ndarray, lats: np.ndarray, lons: np.ndarray):
+        """Replace the whole index with the given members."""
+        self.cells = np.full((self.grid.n_lat, self.grid.n_lon), -1, dtype=np.int32)
+        self._dense_count = 0
+        self.overlay = GridIndex(np.empty(0, dtype=np.int64), np.empty(0), np.empty(0))
+        rest = self._fill(members, lats, lons)
+        self.overlay.rebuild(
+            np.asarray(members)[rest], np.asarray(lats)[rest], np.asarray(lons)[rest]
+        )
+
+    def _fill(self, members, lats, lons) -> np.ndarray:
+        """Put members into empty cells, return the mask of those that did not fit."""
+        members = np.asarray(members, dtype=np.int64)
+        rows, cols, on_grid = self.grid.locate(lats, lons)
+        fits = np.flatnonzero(on_grid & (members <= MAX_DENSE_MEMBER))
+        flat = rows[fits] * self.grid.n_lon + cols[fits]
+        empty = self.cells.ravel()[flat] < 0
+        fits, flat = fits[empty], flat[empty]
+        # only the first of several members for one cell goes in the array
+        flat, first = np.unique(flat, return_index=True)
+        placed = fits[first]
+        self.cells.ravel()[flat] = members[placed]
+        self._dense_count += len(placed)
+        rest = np.ones(len(members), dtype=bool)
+        rest[placed] = False
+        return rest
+
+    def needs_rebuild(self) -> bool:
+        return self.overlay.needs_rebuild()
+
+    def view(self) -> "RasterIndex":
+        """A frozen copy for readers, see the class docstring for the cells."""
+        view = copy.copy(self)
+        view.overlay = self.overlay.view()
+        return view
+
+    def add(self, member: int, lat: float, lon: float) -> None:
+        self.add_many(np.array([member]), np.array([lat]), np.array([lon]))
+
+    def add_many(self, members: np.ndarray, lats: np.ndarray, lons: np.ndarray):
+        rest = self._fill(members, lats, lons)
+        if rest.any():
+            self.overlay.add_many(
+                np.asarray(members)[rest],
+                np.asarray(lats)[rest],
+                np.asarray(lons)[rest],
+            )
+
+    def _dense_box(self, min_lat, min_lon, max_lat, max_lon) -> np.ndarray:
+        first_row, last_row = self.grid.row_range(min_lat, max_lat)
+        if min_lon <= max_lon:
+            col_ranges = [self.grid.col_range(min_lon, max_lon)]
+        else:
+            col_ranges = [
+                self.grid.col_range(min_lon, 180.0),
+                self.grid.col_range(-180.0, max_lon),
+            ]
+        parts = []
+        for first_col, last_col in col_ranges:
+            if first_row <= last_row and first_col <= last_col:
+                box = self.cells[first_row : last_row + 1, first_col : last_col + 1]
+                parts.append(box[box >= 0].astype(np.int64))
+        return np.concatenate(parts) if parts else np.empty(0, dtype=np.int64)
+
+    def query_point(self, lat: float, lon: float, atol: float = 1e-9) -> np.ndarray:
+        """Candidates within the square lat/lon +- atol."""
+        return np.concatenate(
+            [
+                self._dense_box(lat - atol, lon - atol, lat + atol, lon + atol),
+                self.overlay.query_point(lat, lon, atol),
+            ]
+        )
+
+    def query_bbox(
+        self, min_lat: float, min_lon: float, max_lat: float, max_lon: float
+    ) -> np.ndarray:
+        """
+        Candidates for a box, a min_lon greater than max_lon wraps
+        across the antimeridian.
+        """
+        return np.concatenate(
+            [
+                self._dense_box(min_lat, min_lon, max_lat, max_lon),
+                self.overlay.query_bbox(min_lat, min_lon, max_lat, max_lon),
+            ]
+        )
+
+    def query_radius(self, lat: float, lon: float, radius_km: float) -> np.ndarray:
+        """Candidates in the box around a great circle, see radius_bbox."""
+        return self.query_bbox(*radius_bbox(lat, lon, radius_km))
+
+    def nearest(self, lat: float, lon: float, k: int, locate) -> tuple:
+        """
+        The k members closest to (lat, lon) by great-circle distance, found
+        by searching boxes centred on the point that double in size.
+
+        :param locate: Callable mapping candidate members to
+            (members, lats, lons) for the ones that are still valid.
+        :return: Tuple of (members, distances in km) sorted by distance.
+        """
+        radius = 1
+        while True:
+            lat_reach = radius * self.grid.dlat
+            lon_reach = radius * self.grid.dlon
+            covers_lons = lon_reach >= 180.0
+            if covers_lons:
+                min_lon, max_lon = -180.0, 180.0
+            else:
+                min_lon = (lon - lon_reach + 180.0) % 360.0 - 180.0
+                max_lon = (lon + lon_reach + 180.0) % 360.0 - 180.0
+            candidates = self.query_bbox(
+                max(-90.0, lat - lat_reach),
+                min_lon,
+                min(90.0, lat + lat_reach),
+                max_lon,
+            )
+            members, lats, lons = locate(np.unique(candidates))
+            distances = haversine_km(lat, lon, lats, lons)
+            bound = min_distance_beyond_km(
+                lat,
+                lat_reach,
+                lon_reach,
+                covers_lats=lat - lat_reach <= -90.0 and lat + lat_reach >= 90.0,
+                covers_lons=covers_lons,
+            )
+            if len(distances) >= k or bound == math.inf:
+                order = np.argsort(distances, kind="stable")[:k]
+                if bound == math.inf or distances[order[-1]] <= bound:
+                    return members[order], distances[order]
+            radius = radius * 2 + 1
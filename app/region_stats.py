@@ -0,0 +1,366 @@
+import copy
+from typing import Optional
+
+import numpy as np
+
+from .raster import RasterGrid
+
+# larger grids are tabulated per block of cells, see RegionStats
+MAX_CELLS = 1 << 22
+# sides of the blocks tried for larger grids
+BLOCK_SIDES = (4, 8, 16, 32, 64)
+# extra points kept before a rebuild, the count grows with the data up to
+# MAX_REBUILD, so checking them stays cheap however large the data
+MIN_REBUILD = 4096
+MAX_REBUILD = 1 << 16
+
+# the three parts of a range of cells split at block edges
+BEFORE, WHOLE, AFTER = range(3)
+
+
+def _crossings(lats, poly_lats, poly_lons) -> tuple:
+    """
+    For each of lats and each polygon edge, whether the edge crosses that
+    latitude and the longitude where it does.
+    """
+    lats = np.asarray(lats, dtype=np.float64)[:, None]
+    a_lat, a_lon = poly_lats, poly_lons
+    b_lat, b_lon = np.roll(poly_lats, 1), np.roll(poly_lons, 1)
+    crosses = (a_lat > lats) != (b_lat > lats)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        at = a_lon + (lats - a_lat) * (b_lon - a_lon) / (b_lat - a_lat)
+    return crosses, at
+
+
+def points_in_polygon(lats, lons, poly_lats, poly_lons) -> np.ndarray:
+    """
+    Even-odd rule: a point is inside when an odd number of edges cross its
+    latitude east of it, so west and south edges are in, east and north out.
+    """
+    crosses, at = _crossings(lats, poly_lats, poly_lons)
+    east = crosses & (at > np.asarray(lons, dtype=np.float64)[:, None])
+    return east.sum(axis=1) % 2 == 1
+
+
+class RegionStats:
+    """
+    Count and sum of PM2.5 over any lat/lon box or polygon, from summed-area
+    tables (2-D prefix sums) of the points on the data's regular grid.
+
+    A point on the grid counts as its cell centre, so a region holds a cell
+    exactly when it holds the centre, and a box is four table lookups
+    whatever its size. A polygon is split into the rows of cells it covers,
+    rows covering the same columns are merged into boxes.
+
+    Grids of more than MAX_CELLS cells are too large for one table. They
+    are cut into square blocks: one table over the blocks' totals answers
+    the whole blocks inside a box, and a table per block holding points
+    answers the blocks cut by the box's edges. The side of the blocks is
+    the one of BLOCK_SIDES with the smallest tables, so empty parts of the
+    grid cost little. A box then takes a lookup per block along its edges
+    instead of a scan of every point.
+
+    Points off the grid and every change since the tables were built are
+    kept as a list of weighted extra points (+1 added, -1 removed) checked
+    exactly, until there are enough of them to rebuild.
+
+    As with GridIndex the extras are append-only, so a view() taken at any
+    point stays valid while the writer keeps adding.
+    """
+
+    def __init__(
+        self,
+        lats: np.ndarray,
+        lons: np.ndarray,
+        values: np.ndarray,
+        grid: Optional[RasterGrid] = None,
+    ):
+        if grid is None:
+            try:
+                grid = RasterGrid.detect(lats, lons)
+            except ValueError:
+                grid = None
+        self.grid = grid
+        self.rebuild(lats, lons, values)
+
+    def rebuild(self, lats: np.ndarray, lons: np.ndarray, values: np.ndarray):
+        """Replace the tables and extras with the given points."""
+        lats, lons, values, rows, cols, on_grid = self._points(lats, lons, values)
+        if self.grid is not None:
+            n_lat, n_lon = self.grid.n_lat, self.grid.n_lon
+            self._lat_centres = self.grid.lats(np.arange(n_lat))
+            self._lon_centres = self.grid.lons(np.arange(n_lon))
+            self._tabulate(rows[on_grid], cols[on_grid], values[on_grid])
+        self._extra = {name: np.empty(0) for name in ("lat", "lon", "weight", "value")}
+        self._extra_len = 0
+        self._append(lats[~on_grid], lons[~on_grid], values[~on_grid], 1.0)
+        self._rebuild_at = self._extra_len + min(
+            max(MIN_REBUILD, len(values) // 8), MAX_REBUILD
+        )
+
+    def _block_side(self, rows: np.ndarray, cols: np.ndarray) -> int:
+        """1 for grids of up to MAX_CELLS, else the side with the smallest tables."""
+        n_lat, n_lon = self.grid.n_lat, self.grid.n_lon
+        if n_lat * n_lon <= MAX_CELLS:
+            return 1
+
+        def size(side: int) -> int:
+            n_cols = -(-n_lon // side)
+            used = len(np.unique(rows // side * n_cols + cols // side))
+            return (-(-n_lat // side) + 1) * (n_cols + 1) + used * (side + 1) ** 2
+
+        return min(BLOCK_SIDES, key=size)
+
+    def _tabulate(self, rows: np.ndarray, cols: np.ndarray, values: np.ndarray):
+        """Summed-area tables of the blocks, and of each block holding points."""
+        side = self._block = self._block_side(rows, cols)
+        shape = (-(-self.grid.n_lat // side), -(-self.grid.n_lon // side))
+        blocks = rows // side * shape[1] + cols // side
+        tables = []
+        for weights in (None, values):
+            totals = np.bincount(blocks, weights=weights, minlength=shape[0] * shape[1])
+            table = np.zeros((shape[0] + 1, shape[1] + 1))
+            table[1:, 1:] = totals.reshape(shape).cumsum(0).cumsum(1)
+            tables.append(table)
+        self._count_table = tables[0].astype(np.int64)
+        self._sum_table = tables[1]
+        if side == 1:
+            return
+        used, slots = np.unique(blocks, return_inverse=True)
+        self._slots = np.full(shape, -1, dtype=np.int32)
+        self._slots.flat[used] = np.arange(len(used), dtype=np.int32)
+        cells = (slots * side + rows % side) * side + cols % side
+        tables = []
+        for weights in (None, values):
+            counts = np.bincount(cells, weights=weights, minlength=len(used) * side**2)
+            table = np.zeros((len(used), side + 1, side + 1))
+            table[:, 1:, 1:] = counts.reshape(-1, side, side).cumsum(1).cumsum(2)
+            tables.append(table)
+        self._block_counts = tables[0].astype(np.int32)
+        self._block_sums = tables[1]
+
+    def _points(self, lats, lons, values) -> tuple:
+        """Points without NaN values, on-grid ones moved to their cell centre."""
+        values = np.asarray(values, dtype=np.float64)
+        keep = ~np.isnan(values)
+        lats = np.asarray(lats, dtype=np.float64)[keep]
+        lons = np.asarray(lons, dtype=np.float64)[keep]
+        values = values[keep]
+        if self.grid is None:
+            on_grid = np.zeros(len(values), dtype=bool)
+            return lats, lons, values, None, None, on_grid
+        rows, cols, on_grid = self.grid.locate(lats, lons)
+        lats = np.where(on_grid, self.grid.lats(rows), lats)
+        lons = np.where(on_grid, self.grid.lons(cols), lons)
+        return lats, lons, values, rows, cols, on_grid
+
+    def _append(self, lats, lons, values, weight: float) -> None:
+        start, end = self._extra_len, self._extra_len + len(values)
+        if end > len(self._extra["lat"]):
+            capacity = max(end, 2 * len(self._extra["lat"]), 64)
+            for name, column in self._extra.items():
+                grown = np.empty(capacity)
+                grown[:start] = column[:start]
+                self._extra[name] = grown
+        self._extra["lat"][start:end] = lats
+        self._extra["lon"][start:end] = lons
+        self._extra["weight"][start:end] = weight
+        self._extra["value"][start:end] = values
+        self._extra_len = end
+
+    def add_many(self, lats: np.ndarray, lons: np.ndarray, values: np.ndarray):
+        lats, lons, values, *_ = self._points(lats, lons, values)
+        self._append(lats, lons, values, 1.0)
+
+    def add(self, lat: float, lon: float, value: float) -> None:
+        self.add_many(np.array([lat]), np.array([lon]), np.array([value]))
+
+    def remove(self, lat: float, lon: float, value: float) -> None:
+        lats, lons, values, *_ = self._points([lat], [lon], [value])
+        self._append(lats, lons, values, -1.0)
+
+    def needs_rebuild(self) -> bool:
+        return self._extra_len > self._rebuild_at
+
+    def view(self) -> "RegionStats":
+        """A frozen copy for readers, see the class docstring."""
+        view = copy.copy(self)
+        view._extra = dict(self._extra)
+        return view
+
+    def _split(self, start: np.ndarray, stop: np.ndarray) -> dict:
+        """
+        Half-open ranges of cells split at block edges into the cells
+        BEFORE the first whole block, the WHOLE blocks and the cells AFTER
+        them, each as (first block, end block, first cell, end cell within
+        the blocks).
+        """
+        side = self._block
+        first, end = -(-start // side), stop // side
+        # a range within one block has no whole block, only cells before
+        inside = first > end
+        first = np.where(inside, stop // side + 1, first)
+        end = np.where(inside, first, end)
+        before = np.where(inside, stop, first * side)
+        after = np.maximum(end * side, before)
+        return {
+            BEFORE: (
+                start // side,
+                np.where(before > start, start // side + 1, start // side),
+                start % side,
+                before - start // side * side,
+            ),
+            WHOLE: (first, end, np.zeros_like(start), np.full_like(start, side)),
+            AFTER: (
+                end,
+                np.where(stop > after, end + 1, end),
+                np.zeros_like(start),
+                stop - end * side,
+            ),
+        }
+
+    def _boxes(self, rows: np.ndarray, cols: np.ndarray) -> tuple:
+        """Count and sum over cell boxes, rows and cols are (n, 2) half-open."""
+        parts = self._split(*rows.T), self._split(*cols.T)
+        r0, r1 = parts[0][WHOLE][:2]
+        c0, c1 = parts[1][WHOLE][:2]
+        r1, c1 = np.maximum(r0, r1), np.maximum(c0, c1)
+        results = []
+        for table in (self._count_table, self._sum_table):
+            results.append(
+                (table[r1, c1] - table[r0, c1] - table[r1, c0] + table[r0, c0]).sum()
+            )
+        count, total = int(results[0]), float(results[1])
+        if self._block == 1:
+            return count, total
+        pieces = [
+            parts[0][row] + parts[1][col]
+            for row in (BEFORE, WHOLE, AFTER)
+            for col in (BEFORE, WHOLE, AFTER)
+            if (row, col) != (WHOLE, WHOLE)
+        ]
+        pieces = [np.concatenate(column) for column in zip(*pieces)]
+        extra_count, extra_total = self._blocks(*pieces)
+        return count + extra_count, total + extra_total
+
+    def _blocks(self, rb0, rb1, rl0, rl1, cb0, cb1, cl0, cl1) -> tuple:
+        """
+        Count and sum of the cells rl0:rl1, cl0:cl1 within each block of the
+        block ranges rb0:rb1, cb0:cb1, from the tables of the blocks.
+        """
+        n_rows = np.maximum(rb1 - rb0, 0)
+        n_cols = np.maximum(cb1 - cb0, 0)
+        sizes = n_rows * n_cols
+        piece = np.repeat(np.arange(len(sizes)), sizes)
+        at = np.arange(len(piece)) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+        block_rows = rb0[piece] + at // n_cols[piece]
+        block_cols = cb0[piece] + at % n_cols[piece]
+        slots = self._slots[block_rows, block_cols]
+        held = slots >= 0
+        slots, piece = slots[held], piece[held]
+        r0, r1 = rl0[piece], rl1[piece]
+        c0, c1 = cl0[piece], cl1[piece]
+        results = []
+        for table in (self._block_counts, self._block_sums):
+            results.append(
+                (
+                    table[slots, r1, c1]
+                    - table[slots, r0, c1]
+                    - table[slots, r1, c0]
+                    + table[slots, r0, c0]
+                ).sum()
+            )
+        return int(results[0]), float(results[1])
+
+    def _extras(self, inside) -> tuple:
+        """Count and sum of the extra points selected by inside(lats, lons)."""
+        extra = {
+            name: column[: self._extra_len] for name, column in self._extra.items()
+        }
+        mask = inside(extra["lat"], extra["lon"])
+        weights = extra["weight"][mask]
+        return int(weights.sum()), float((weights * extra["value"][mask]).sum())
+
+    @staticmethod
+    def _result(count: int, total: float) -> dict:
+        if count <= 0:
+            return {"count": 0, "sum": 0.0, "average": None}
+        return {"count": count, "sum": total, "average": total / count}
+
+    def bbox(
+        self, min_lat: float, min_lon: float, max_lat: float, max_lon: float
+    ) -> dict:
+        """
+        Count, sum and average of the points in a box, edges included. A
+        min_lon greater than max_lon wraps across the antimeridian.
+        """
+        lon_ranges = (
+            [(min_lon, max_lon)]
+            if min_lon <= max_lon
+            else [(min_lon, 180.0), (-180.0, max_lon)]
+        )
+        count, total = 0, 0.0
+        if self.grid is not None:
+            rows = (
+                np.searchsorted(self._lat_centres, min_lat, "left"),
+                np.searchsorted(self._lat_centres, max_lat, "right"),
+            )
+            cols = [
+                (
+                    np.searchsorted(self._lon_centres, low, "left"),
+                    np.searchsorted(self._lon_centres, high, "right"),
+                )
+                for low, high in lon_ranges
+            ]
+            if rows[0] < rows[1]:
+                count, total = self._boxes(
+                    np.array([rows] * len(cols)), np.array(cols).reshape(-1, 2)
+                )
+
+        def inside(lats, lons):
+            in_lon = np.zeros(len(lons), dtype=bool)
+            for low, high in lon_ranges:
+                in_lon |= (lons >= low) & (lons <= high)
+            return (lats >= min_lat) & (lats <= max_lat) & in_lon
+
+        extra_count, extra_total = self._extras(inside)
+        return self._result(count + extra_count, total + extra_total)
+
+    def polygon(self, lats, lons) -> dict:
+        """
+        Count, sum and average of the points in a polygon given by its
+        vertices, by the even-odd rule of points_in_polygon. Longitudes are
+        taken as they are, a polygon cannot cross the antimeridian.
+        """
+        poly_lats = np.asarray(lats, dtype=np.float64)
+        poly_lons = np.asarray(lons, dtype=np.float64)
+        count, total = 0, 0.0
+        if self.grid is not None:
+            rows = np.arange(
+                np.searchsorted(self._lat_centres, poly_lats.min(), "left"),
+                np.searchsorted(self._lat_centres, poly_lats.max(), "right"),
+            )
+            crosses, at = _crossings(self._lat_centres[rows], poly_lats, poly_lons)
+            box_rows, box_cols = [], []
+            previous = None
+            for row, row_crosses, row_at in zip(rows.tolist(), crosses, at):
+                # cells between each pair of crossings, west edge in
+                edges = np.sort(row_at[row_crosses])
+                spans = np.searchsorted(self._lon_centres, edges, "left").reshape(-1, 2)
+                spans = spans[spans[:, 0] < spans[:, 1]]
+                if not len(spans):
+                    pass
+                elif previous is not None and np.array_equal(spans, previous):
+                    for box in box_rows[-len(spans) :]:
+                        box[1] = row + 1
+                else:
+                    box_rows.extend([row, row + 1] for _ in spans)
+                    box_cols.extend(spans.tolist())
+                previous = spans
+            if box_rows:
+                count, total = self._boxes(np.array(box_rows), np.array(box_cols))
+
+        extra_count, extra_total = self._extras(
+            lambda lats, lons: points_in_polygon(lats, lons, poly_lats, poly_lons)
+        )
+        return self._result(count + extra_count, total + extra_total)
@@ -0,0 +1,59 @@
+import threading
+from collections import OrderedDict
+from typing import Hashable, Optional
+
+
+class ResponseCache:
+    """
+    Bounded LRU of rendered responses for one dataset version at a time.
+
+    Entries are looked up by (version, key). Versions only go up, so once a
+    newer version is seen every older entry is unreachable and the whole
+    cache is dropped rather than left to age out. Both the number of entries
+    and their total size are capped, a value bigger than the whole size cap
+    is not stored at all.
+    """
+
+    def __init__(self, max_entries: int = 1024, max_bytes: int = 64 << 20):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._version = None
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _advance(self, version: int) -> bool:
+        """Move on to version, False if it is older than the current one."""
+        if self._version is None or version > self._version:
+            self._entries.clear()
+            self.size = 0
+            self._version = version
+        return version == self._version
+
+    def get(self, version: int, key: Hashable) -> Optional[object]:
+        with self._lock:
+            if self._advance(version) and key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key][0]
+            self.misses += 1
+            return None
+
+    def put(self, version: int, key: Hashable, value: object, size: int) -> None:
+        with self._lock:
+            if not self._advance(version) or size > self.max_bytes:
+                return
+            if key in self._entries:
+                self.size -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self.size += size
+            while self._entries and (
+                len(self._entries) > self.max_entries or self.size > self.max_bytes
+            ):
+                _, (_, evicted) = self._entries.popitem(last=False)
+                self.size -= evicted
@@ -1,21 +1,276 @@
 from flask import Blueprint, current_app, jsonify, request, make_response
-from flask.wrappers import Response
+from flask.wrappers import Request, Response
 
+from .admission import BULK, CHANGES, CHEAP, QUERY, cost
+from .changes import ChangesGoneError
+from .data_set import BY_DISTANCE, BY_ID, ORDERS, EntryNotFoundError
+from .distribution import QUANTILES
+from .formats import ALIASES, JSON, NDJSON, ROW_FORMATS, encode
+from .ingest import BatchFormatError, parse_batch, parse_points, validate_batch
 from .logger import setup_logger
+from .metrics import CONTENT_TYPE, REGISTRY
+from .sampling import BILINEAR, METHODS
+from .storage import COLUMNS
+from .tiles import pack_tile
+from .years import YearNotAvailableError
 
+import hashlib
 import logging
+import math
 import os
+import time
+
+import orjson
+from typing import Callable, Optional
 
 main_bp = Blueprint("main", __name__)
 logger = setup_logger(name="routes", log_file="routes.txt", level=logging.DEBUG)
 
+MAX_NEAREST = 1000
+DEFAULT_PAGE_LIMIT = 1000
+MAX_PAGE_LIMIT = 100000
+MAX_IDS = 100000
+# ids are stored as int64
+MIN_ID, MAX_ID = -(1 << 63), (1 << 63) - 1
+MAX_SAMPLE_POINTS = 10_000_000
+# degrees, wider searches are better asked as a bbox or a radius
+MAX_TOLERANCE = 1.0
+MAX_BINS = 1000
+# longest long-poll of /data/changes, and how long one event stream lasts
+MAX_CHANGES_WAIT = 30.0
+CHANGES_STREAM_SECONDS = 60.0
+KEEPALIVE_SECONDS = 15.0
+EVENT_STREAM = "text/event-stream"
+MAX_QUANTILES = 100
+
+TILE_BINARY = "application/octet-stream"
+
+
+def _etag(version: int) -> str:
+    """ETag of the current request's response at a dataset version."""
+    digest = hashlib.blake2b(digest_size=8)
+    for part in (request.path, request.query_string, request.headers.get("Accept")):
+        digest.update(repr(part).encode("utf-8"))
+    return f"{version}-{digest.hexdigest()}"
+
+
+def _cached_read(build: Callable[[], Response]) -> Response:
+    """
+    Answer a read from the response cache, or with 304 Not Modified when the
+    client already holds it, and only call build() to render it otherwise.
+
+    Responses are keyed on the dataset version read before rendering, so a
+    write landing mid-render can only label newer rows with an older,
+    already unreachable version, never the other way round. Streamed
+    responses get an ETag but are not stored, errors get neither.
+    """
+    version = current_app.data_set.snapshot().version
+    etag = _etag(version)
+    if request.if_none_match.contains(etag):
+        response = Response(status=304)
+    else:
+        cache = current_app.response_cache
+        cached = cache.get(version, etag)
+        if cached is not None:
+            body, status, headers = cached
+            response = Response(body, status=status, headers=headers)
+        else:
+            response = build()
+            if response.status_code != 200:
+                return response
+            if not response.is_streamed:
+                body = response.get_data()
+                headers = list(response.headers)
+                cache.put(version, etag, (body, 200, headers), len(body))
+    response.set_etag(etag)
+    # where to ask /data/changes from to keep this response up to date
+    response.headers["X-Data-Version"] = str(version)
+    response.headers["Cache-Control"] = "no-cache"
+    response.vary.add("Accept")
+    return response
+
+
+def _floats(name: str) -> list:
+    """Comma separated query parameter as finite floats, ValueError otherwise."""
+    values = [float(value) for value in request.args[name].split(",")]
+    if not all(math.isfinite(value) for value in values):
+        raise ValueError(f"{name} must be finite numbers")
+    return values
+
+
+def _check_coordinates(lats: tuple, lons: tuple) -> None:
+    """ValueError unless every lat is within [-90, 90] and lon within [-180, 180]."""
+    if not all(-90 <= lat <= 90 for lat in lats) or not all(
+        -180 <= lon <= 180 for lon in lons
+    ):
+        # NaN fails every comparison and infinities are out of range
+        raise ValueError(f"Coordinates out of range: {lats}, {lons}")
+
+
+def _optional_int(name: str):
+    """Query parameter as int, None when absent, ValueError when malformed."""
+    value = request.args.get(name)
+    return None if value is None else int(value)
+
+
+def _row_format(*extra: str) -> str:
+    """
+    The format of app.formats to send rows in, picked from the Accept
+    header among ROW_FORMATS and extra, JSON when nothing matches.
+    """
+    offered = ROW_FORMATS + extra + tuple(ALIASES)
+    best = request.accept_mimetypes.best_match(offered, default=JSON)
+    return ALIASES.get(best, best)
+
+
+def _rows_response(body, fmt: str) -> Response:
+    return Response(body, status=200, mimetype=fmt)
+
+
+def _read_data_set():
+    """
+    The DataSet a read is answered from: the past year given by the year
+    query parameter, the current data otherwise. Raises ValueError for a
+    malformed year and YearNotAvailableError for a missing one.
+    """
+    year = _optional_int("year")
+    if year is None:
+        return current_app.data_set
+    return current_app.years.get(year)
+
+
+def _write_failed(error: OSError) -> Response:
+    """503 for a write the mutation log, or the cluster's writer, could not take."""
+    logger.error(f"Write not made durable: {error}")
+    response = jsonify({"error": "The write could not be saved, retry later."})
+    response.status_code = 503
+    response.headers["Retry-After"] = "1"
+    return response
+
+
+def _year_not_available(year: YearNotAvailableError) -> Response:
+    return jsonify({"error": f"Year {year} is not available."}), 404
+
+
+def _fields(values) -> Optional[list]:
+    """
+    Columns to send besides id, from a list or a comma separated string,
+    None for all. ValueError for names not in COLUMNS.
+    """
+    if values is None:
+        return None
+    if isinstance(values, str):
+        values = values.split(",") if values else []
+    if not isinstance(values, list) or not set(values) <= set(COLUMNS):
+        raise ValueError(f"fields must be among {', '.join(COLUMNS)}")
+    return values
+
+
+def _checked_ids(ids: list) -> list:
+    if not 1 <= len(ids) <= MAX_IDS:
+        raise ValueError(f"between 1 and {MAX_IDS} ids are needed, not {len(ids)}")
+    if not all(MIN_ID <= id <= MAX_ID for id in ids):
+        raise ValueError(f"ids must be between {MIN_ID} and {MAX_ID}")
+    return ids
+
+
+def _ids_response(data_set, ids: list, fields: Optional[list]) -> Response:
+    """
+    Rows of many ids, JSON as {"data": rows, "not_found": ids}. Other
+    formats hold just the rows and list the ids not found in X-Not-Found.
+    """
+    fmt = _row_format()
+    body, missing = data_set.get_data_by_ids(ids, fields, fmt)
+    not_found = ",".join(str(id) for id in missing.tolist())
+    if fmt == JSON:
+        return _rows_response(f'{{"data":{body},"not_found":[{not_found}]}}', fmt)
+    response = _rows_response(body, fmt)
+    response.headers["X-Not-Found"] = not_found
+    return response
+
+
+_IDS_ERROR = (
+    f"Invalid input, ids must be 1 to {MAX_IDS} integers and fields among "
+    f"{', '.join(COLUMNS)}."
+)
+
+
+def _get_data_by_ids() -> Response:
+    """GET /data?ids=1,2,3, see post_data_lookup."""
+    try:
+        ids = _checked_ids([int(id) for id in request.args["ids"].split(",")])
+        fields = _fields(request.args.get("fields"))
+        data_set = _read_data_set()
+        return _cached_read(lambda: _ids_response(data_set, ids, fields))
+    except YearNotAvailableError as e:
+        return _year_not_available(e)
+    except ValueError:
+        return jsonify({"error": _IDS_ERROR}), 400
+    except AttributeError as e:
+        logger.error(f"Error for get data by ids: {e}")
+        return Response("Internal error", status=500)
+
+
+def _data_cost(req: Request) -> str:
+    """Without ids or a limit GET /data sends every row."""
+    return BULK if "ids" not in req.args and "limit" not in req.args else QUERY
+
 
 @main_bp.route("/data", methods=["GET"])
+@cost(_data_cost)
 def get_data() -> Response:
-    """Retrieve all available data."""
+    """
+    Retrieve all available data, streamed in chunks.
+
+    Pass after_id and/or limit for keyset pagination, the next page is linked
+    in the Link header. Send Accept: application/x-ndjson to stream one record
+    per line instead of a JSON array, or another of app.formats.ROW_FORMATS.
+    Pass ids (and optionally fields) for just those rows instead.
+    """
+    if "ids" in request.args:
+        return _get_data_by_ids()
     try:
-        result = current_app.data_set.get_full_data()
-        return Response(result, status=200)
+        after_id = _optional_int("after_id")
+        limit = _optional_int("limit")
+        if limit is not None and not 1 <= limit <= MAX_PAGE_LIMIT:
+            raise ValueError(f"limit out of range: {limit}")
+        data_set = _read_data_set()
+
+        def build() -> Response:
+            fmt = _row_format(NDJSON)
+            if fmt == NDJSON:
+                # without a limit the stream runs to the last row
+                page_limit = limit
+                result, next_after_id = data_set.iter_page(
+                    after_id=after_id, limit=limit, fmt=NDJSON
+                )
+            elif after_id is None and limit is None:
+                result = data_set.iter_full_data(fmt=fmt)
+                return Response(result, status=200, mimetype=fmt)
+            else:
+                page_limit = limit or DEFAULT_PAGE_LIMIT
+                result, next_after_id = data_set.get_page(
+                    after_id=after_id, limit=page_limit, fmt=fmt
+                )
+            response = Response(result, status=200, mimetype=fmt)
+            if next_after_id is not None:
+                response.headers["Link"] = (
+                    f'</data?after_id={next_after_id}&limit={page_limit}>; rel="next"'
+                )
+            return response
+
+        return _cached_read(build)
+    except YearNotAvailableError as e:
+        return _year_not_available(e)
+    except ValueError:
+        return (
+            jsonify(
+                {
+                    "error": f"Invalid input, after_id must be an integer and limit between 1 and {MAX_PAGE_LIMIT}."
+                }
+            ),
+            400,
+        )
     except AttributeError as e:
         logger.error(f"Error for get data: {e}")
         return Response("Internal error", status=500)
@@ -23,13 +278,32 @@ def get_data() -> Response:
 
 @main_bp.route("/data/<int:id>", methods=["GET"])
 def get_datum_by_id(id: int) -> Response:
-    """Fetch a specific datum by its ID."""
+    """Fetch a specific datum by its ID, only the given fields if any."""
     try:
-        datum = current_app.data_set.get_datum_by_id(id)
-        if datum is not None:
-            return jsonify(datum.to_dict()), 200
-        else:
-            return Response("Item not found", status=404)
+        fields = _fields(request.args.get("fields"))
+        data_set = _read_data_set()
+
+        def build() -> Response:
+            datum = data_set.get_datum_by_id(id)
+            if datum is not None:
+                if fields is not None:
+                    datum = datum[fields]
+                return jsonify(datum.to_dict())
+            else:
+                return Response("Item not found", status=404)
+
+        return _cached_read(build)
+    except YearNotAvailableError as e:
+        return _year_not_available(e)
+    except ValueError:
+        return (
+            jsonify(
+                {
+                    "error": f"Invalid input, year must be an integer and fields among {', '.join(COLUMNS)}."
+                }
+            ),
+            400,
+        )
     except AttributeError as e:
         logger.error(f"Error for get datum by id: {e}")
         return Response("Internal error", status=500)
@@ -56,18 +330,220 @@ def post_data() -> Response:
             ),
             400,
         )
+    except OSError as e:
+        return _write_failed(e)
     except AttributeError as e:
         logger.error(f"Error for post data: {e}")
         return Response("Internal error", status=500)
 
 
+@main_bp.route("/data/batch", methods=["POST"])
+@cost(BULK)
+def post_data_batch() -> Response:
+    """
+    Add many data entries at once from a JSON array, NDJSON, Arrow or Parquet
+    body. Valid rows are appended together, invalid rows are reported by
+    position without rejecting the rest.
+    """
+    try:
+        frame, parse_errors = parse_batch(request.get_data(), request.mimetype)
+        columns, rows, errors = validate_batch(frame, parse_errors)
+        rejected = len(frame) - len(rows)
+        if not len(rows):
+            return jsonify({"inserted": 0, "rejected": rejected, "errors": errors}), 400
+
+        first_id, last_id = current_app.data_set.add_data_entries(
+            lat=columns["lat"], lon=columns["lon"], gwrpm25=columns["gwrpm25"]
+        )
+        return (
+            jsonify(
+                {
+                    "inserted": len(rows),
+                    "rejected": rejected,
+                    "first_id": first_id,
+                    "last_id": last_id,
+                    "errors": errors,
+                }
+            ),
+            201,
+        )
+    except BatchFormatError as e:
+        return jsonify({"error": f"Invalid batch body: {e}"}), 400
+    except ValueError as e:
+        # values the configured storage dtypes cannot hold
+        return jsonify({"error": str(e)}), 400
+    except OSError as e:
+        return _write_failed(e)
+    except AttributeError as e:
+        logger.error(f"Error for post data batch: {e}")
+        return Response("Internal error", status=500)
+
+
+@main_bp.route("/data/lookup", methods=["POST"])
+@cost(BULK)
+def post_data_lookup() -> Response:
+    """
+    Fetch the rows of a list of ids too long for GET /data?ids=, sent as
+    {"ids": [1, 2, 3], "fields": ["GWRPM25"]}. Ids without a live row are
+    listed as not found in the same response.
+    """
+    try:
+        data = request.get_json()
+        ids = data["ids"]
+        if not isinstance(ids, list) or not all(
+            isinstance(id, int) and not isinstance(id, bool) for id in ids
+        ):
+            raise ValueError("ids must be integers")
+        fields = _fields(data.get("fields"))
+        return _ids_response(_read_data_set(), _checked_ids(ids), fields)
+    except YearNotAvailableError as e:
+        return _year_not_available(e)
+    except (KeyError, TypeError, ValueError):
+        return jsonify({"error": _IDS_ERROR}), 400
+    except AttributeError as e:
+        logger.error(f"Error for post data lookup: {e}")
+        return Response("Internal error", status=500)
+
+
+@main_bp.route("/data/sample", methods=["POST"])
+@cost(BULK)
+def post_data_sample() -> Response:
+    """
+    PM2.5 interpolated at many coordinates from the data's grid, given as a
+    JSON array of [lat, lon] pairs or entries with lat and lon in any format
+    /data/batch reads. Pass method=nearest for the value of the cell each
+    point falls in instead of bilinear interpolation. Rows come back in the
+    order sent, GWRPM25 is null where there is no value.
+    """
+    try:
+        method = request.args.get("method", BILINEAR)
+        if method not in METHODS:
+            return (
+                jsonify({"error": f"method must be one of {', '.join(METHODS)}."}),
+                400,
+            )
+        lats, lons = parse_points(request.get_data(), request.mimetype)
+        if len(lats) > MAX_SAMPLE_POINTS:
+            return (
+                jsonify({"error": f"At most {MAX_SAMPLE_POINTS} points per request."}),
+                400,
+            )
+        data_set = _read_data_set()
+        values = data_set.sample(lats, lons, method)
+        fmt = _row_format()
+        columns = {"lat": lats, "lon": lons, "GWRPM25": values}
+        return _rows_response(encode(columns, fmt), fmt)
+    except YearNotAvailableError as e:
+        return _year_not_available(e)
+    except BatchFormatError as e:
+        return jsonify({"error": f"Invalid points: {e}"}), 400
+    except ValueError as e:
+        # a malformed year, or data that is not on a regular grid
+        return jsonify({"error": str(e)}), 400
+    except AttributeError as e:
+        logger.error(f"Error for post data sample: {e}")
+        return Response("Internal error", status=500)
+
+
+def _changes_gone(since: int, latest: int) -> Response:
+    return (
+        jsonify(
+            {
+                "error": f"Changes since version {since} are no longer held, download the data again.",
+                "resync": True,
+                "latest": latest,
+            }
+        ),
+        410,
+    )
+
+
+def _change_events(data_set, since: int, limit: int):
+    """
+    Server-sent events of the changes after since, for CHANGES_STREAM_SECONDS
+    after which an EventSource reconnects with Last-Event-ID.
+    """
+    deadline = time.monotonic() + CHANGES_STREAM_SECONDS
+    # tells EventSource how soon to reconnect, in milliseconds
+    yield "retry: 1000\n\n"
+    while True:
+        try:
+            changes, since, latest = data_set.changes(since, limit)
+        except ChangesGoneError:
+            body = {"resync": True, "latest": data_set.version}
+            yield f"event: resync\ndata: {orjson.dumps(body).decode()}\n\n"
+            return
+        if changes:
+            body = orjson.dumps({"changes": changes, "next": since, "latest": latest})
+            yield f"id: {since}\nevent: changes\ndata: {body.decode()}\n\n"
+            continue
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        if not data_set.wait_for_changes(since, min(remaining, KEEPALIVE_SECONDS)):
+            # a comment, keeps proxies from closing an idle stream
+            yield ": keepalive\n\n"
+
+
+def _changes_cost(req: Request) -> str:
+    """Long-polls and event streams hold their request open, the rest answer at once."""
+    waits = req.args.get("wait", "0") not in ("", "0")
+    streams = req.accept_mimetypes.best_match([JSON, EVENT_STREAM]) == EVENT_STREAM
+    return CHANGES if waits or streams else CHEAP
+
+
+@main_bp.route("/data/changes", methods=["GET"])
+@cost(_changes_cost)
+def get_changes() -> Response:
+    """
+    Inserts, updates and deletes after version since, oldest first, with
+    the version to ask from next. Start from the X-Data-Version header of a
+    /data download. Answers 410 Gone when the changes are no longer held
+    and the client has to download the data again. wait=seconds waits up to
+    that long for a change when there is none yet. Accept:
+    text/event-stream streams the changes as server-sent events instead.
+    """
+    try:
+        since = request.args.get("since", request.headers.get("Last-Event-ID"))
+        since = int(since)
+        limit = int(request.args.get("limit", DEFAULT_PAGE_LIMIT))
+        wait = float(request.args.get("wait", 0))
+        if since < 0 or not 1 <= limit <= MAX_PAGE_LIMIT:
+            raise ValueError(f"since or limit out of range: {since}, {limit}")
+        if not 0 <= wait <= MAX_CHANGES_WAIT:
+            raise ValueError(f"wait out of range: {wait}")
+        data_set = current_app.data_set
+        if request.accept_mimetypes.best_match([JSON, EVENT_STREAM]) == EVENT_STREAM:
+            data_set.changes(since, 1)
+            return Response(
+                _change_events(data_set, since, limit),
+                mimetype=EVENT_STREAM,
+                headers={"Cache-Control": "no-cache"},
+            )
+        changes, upto, latest = data_set.changes(since, limit)
+        if not changes and wait and data_set.wait_for_changes(since, wait):
+            changes, upto, latest = data_set.changes(since, limit)
+        return jsonify({"changes": changes, "next": upto, "latest": latest})
+    except ChangesGoneError:
+        return _changes_gone(since, current_app.data_set.version)
+    except (TypeError, ValueError):
+        return (
+            jsonify(
+                {
+                    "error": f"Invalid input, since is a required version of 0 or more, limit an integer between 1 and {MAX_PAGE_LIMIT} and wait seconds up to {MAX_CHANGES_WAIT}."
+                }
+            ),
+            400,
+        )
+    except AttributeError as e:
+        logger.error(f"Error for get changes: {e}")
+        return Response("Internal error", status=500)
+
+
 @main_bp.route("/data/<int:id>", methods=["PUT"])
 def put_datum_by_id(id: int) -> Response:
     """Update an existing data entry."""
     try:
-        if current_app.data_set.get_datum_by_id(id) is None:
-            return jsonify({"error": f"Entry with ID {id} not found."}), 404
-
         data = request.get_json()
         lat = float(data["lat"])
         lon = float(data["lon"])
@@ -83,6 +559,8 @@ def put_datum_by_id(id: int) -> Response:
             ),
             200,
         )
+    except EntryNotFoundError:
+        return jsonify({"error": f"Entry with ID {id} not found."}), 404
     except (KeyError, TypeError, ValueError):
         return (
             jsonify(
@@ -92,6 +570,8 @@ def put_datum_by_id(id: int) -> Response:
             ),
             400,
         )
+    except OSError as e:
+        return _write_failed(e)
     except AttributeError as e:
         logger.error(f"Error for put datum by id: {e}")
         return Response("Internal error", status=500)
@@ -101,9 +581,6 @@ def put_datum_by_id(id: int) -> Response:
 def delete_datum_by_id(id: int) -> Response:
     """Delete a data entry."""
     try:
-        if current_app.data_set.get_datum_by_id(id) is None:
-            return jsonify({"error": f"Entry with ID {id} not found."}), 404
-
         current_app.data_set.delete_data_entry(id=id)
 
         return (
@@ -115,6 +592,8 @@ def delete_datum_by_id(id: int) -> Response:
             ),
             200,
         )
+    except EntryNotFoundError:
+        return jsonify({"error": f"Entry with ID {id} not found."}), 404
     except (KeyError, TypeError, ValueError):
         return (
             jsonify(
@@ -124,35 +603,363 @@ def delete_datum_by_id(id: int) -> Response:
             ),
             400,
         )
+    except OSError as e:
+        return _write_failed(e)
     except AttributeError as e:
         logger.error(f"Error for delete data entry by id: {e}")
         return Response("Internal error", status=500)
 
 
+def _order(default: str) -> str:
+    order = request.args.get("sort", default)
+    if order not in ORDERS:
+        raise ValueError(f"Invalid sort: {order}")
+    return order
+
+
 @main_bp.route("/data/filter/<string:lat>/<string:long>", methods=["GET"])
+@cost(QUERY)
 def get_filtered_data(lat: str, long: str) -> Response:
-    """Filter the dataset based on latitude and longitude up to 1e-9 floating point precision."""
+    """
+    Filter the dataset based on latitude and longitude up to 1e-9 floating
+    point precision, or up to tolerance degrees. sort=distance orders the
+    matches by distance from the point and adds it as distance_km.
+    """
     try:
         # convert to float as negative not handled natively
         lat = float(lat)
         long = float(long)
+        _check_coordinates((lat,), (long,))
+        tolerance = float(request.args.get("tolerance", 1e-9))
+        if not 0 <= tolerance <= MAX_TOLERANCE:
+            raise ValueError(f"tolerance out of range: {tolerance}")
+        order = _order(BY_ID)
+        data_set = _read_data_set()
+        fmt = _row_format()
 
-        result = current_app.data_set.filter_data(lat=lat, lon=long)
-
-        return Response(result, status=200)
+        return _cached_read(
+            lambda: _rows_response(
+                data_set.filter_data(
+                    lat=lat, lon=long, fmt=fmt, tolerance=tolerance, order=order
+                ),
+                fmt,
+            )
+        )
+    except YearNotAvailableError as e:
+        return _year_not_available(e)
     except ValueError:
-        return jsonify({"error": "Invalid latitude or longitude format."}), 400
+        return (
+            jsonify(
+                {
+                    "error": f"Invalid input, latitude and longitude must be floats within [-90, 90] and [-180, 180], tolerance between 0 and {MAX_TOLERANCE} degrees and sort one of {', '.join(ORDERS)}."
+                }
+            ),
+            400,
+        )
     except AttributeError as e:
         logger.error(f"Error for filter data: {e}")
         return Response("Internal error", status=500)
 
 
+def _region() -> tuple:
+    """
+    (bbox, polygon) of the bbox=min_lat,min_lon,max_lat,max_lon or
+    polygon=lat,lon,lat,lon,... query parameter, None for the one not given.
+    """
+    if "bbox" in request.args:
+        box = _floats("bbox")
+        if len(box) != 4 or box[0] > box[2]:
+            raise ValueError(f"Invalid bbox: {box}")
+        return box, None
+    if "polygon" in request.args:
+        vertices = _floats("polygon")
+        if len(vertices) < 6 or len(vertices) % 2:
+            raise ValueError("A polygon needs at least 3 lat,lon vertices")
+        return None, (vertices[0::2], vertices[1::2])
+    return None, None
+
+
 @main_bp.route("/data/stats", methods=["GET"])
+@cost(QUERY)
 def get_stats() -> Response:
-    """Provide basic statistics (count, average PM2.5, min, max) across the dataset"""
+    """
+    Provide basic statistics (count, average PM2.5, min, max) across the dataset.
+
+    Pass bbox=min_lat,min_lon,max_lat,max_lon or polygon=lat,lon,lat,lon,...
+    for the count, sum and average PM2.5 of the entries inside that region.
+    """
     try:
-        results = current_app.data_set.get_stats()
-        return jsonify(results), 200
+        data_set = _read_data_set()
+        box, polygon = _region()
+        if box is not None:
+            build = lambda: jsonify(data_set.bbox_stats(*box))
+        elif polygon is not None:
+            build = lambda: jsonify(data_set.polygon_stats(*polygon))
+        else:
+            build = lambda: jsonify(data_set.get_stats())
+        return _cached_read(build)
+    except YearNotAvailableError as e:
+        return _year_not_available(e)
+    except ValueError:
+        return (
+            jsonify(
+                {
+                    "error": "Invalid input, bbox must be min_lat,min_lon,max_lat,max_lon and polygon at least 3 lat,lon pairs, all finite floats."
+                }
+            ),
+            400,
+        )
     except AttributeError as e:
         logger.error(f"Error for get stats: {e}")
         return Response("Internal error", status=500)
+
+
+@main_bp.route("/data/stats/distribution", methods=["GET"])
+@cost(QUERY)
+def get_distribution() -> Response:
+    """
+    Approximate PM2.5 quantiles (quantiles=0.5,0.9,0.99) and a histogram of
+    bins equal width bins over range=low,high (default the lowest to the
+    highest value), each value within 1% of the true one, see
+    app/distribution.py. Pass bbox or polygon as for /data/stats to describe
+    the entries inside a region.
+    """
+    try:
+        data_set = _read_data_set()
+        box, polygon = _region()
+        quantiles = _floats("quantiles") if "quantiles" in request.args else QUANTILES
+        if not 1 <= len(quantiles) <= MAX_QUANTILES or not all(
+            0 <= q <= 1 for q in quantiles
+        ):
+            raise ValueError(f"Invalid quantiles: {quantiles}")
+        bins = int(request.args.get("bins", 10))
+        if not 1 <= bins <= MAX_BINS:
+            raise ValueError(f"bins out of range: {bins}")
+        value_range = None
+        if "range" in request.args:
+            value_range = _floats("range")
+            if len(value_range) != 2 or value_range[0] >= value_range[1]:
+                raise ValueError(f"Invalid range: {value_range}")
+
+        return _cached_read(
+            lambda: jsonify(
+                data_set.distribution(
+                    quantiles=quantiles,
+                    bins=bins,
+                    value_range=value_range,
+                    bbox=box,
+                    polygon=polygon,
+                )
+            )
+        )
+    except YearNotAvailableError as e:
+        return _year_not_available(e)
+    except ValueError:
+        return (
+            jsonify(
+                {
+                    "error": f"Invalid input, quantiles must be between 0 and 1, bins an integer between 1 and {MAX_BINS}, range low,high with low below high, and bbox or polygon as for /data/stats."
+                }
+            ),
+            400,
+        )
+    except AttributeError as e:
+        logger.error(f"Error for distribution: {e}")
+        return Response("Internal error", status=500)
+
+
+@main_bp.route("/data/bbox", methods=["GET"])
+@cost(QUERY)
+def get_bbox_data() -> Response:
+    """Return entries inside a latitude/longitude bounding box."""
+    try:
+        min_lat = float(request.args["min_lat"])
+        min_lon = float(request.args["min_lon"])
+        max_lat = float(request.args["max_lat"])
+        max_lon = float(request.args["max_lon"])
+        _check_coordinates((min_lat, max_lat), (min_lon, max_lon))
+        if min_lat > max_lat:
+            raise ValueError("min_lat above max_lat")
+        data_set = _read_data_set()
+        fmt = _row_format()
+
+        return _cached_read(
+            lambda: _rows_response(
+                data_set.bbox_data(
+                    min_lat=min_lat,
+                    min_lon=min_lon,
+                    max_lat=max_lat,
+                    max_lon=max_lon,
+                    fmt=fmt,
+                ),
+                fmt,
+            )
+        )
+    except YearNotAvailableError as e:
+        return _year_not_available(e)
+    except (KeyError, ValueError):
+        return (
+            jsonify(
+                {
+                    "error": "Invalid input, min_lat, min_lon, max_lat and max_lon are required floats with min_lat <= max_lat, lat within [-90, 90] and lon within [-180, 180]."
+                }
+            ),
+            400,
+        )
+    except AttributeError as e:
+        logger.error(f"Error for bbox data: {e}")
+        return Response("Internal error", status=500)
+
+
+@main_bp.route("/data/nearest", methods=["GET"])
+@cost(QUERY)
+def get_nearest_data() -> Response:
+    """Return the k entries closest to a point, ordered by distance."""
+    try:
+        lat = float(request.args["lat"])
+        lon = float(request.args["lon"])
+        k = int(request.args.get("k", 1))
+        _check_coordinates((lat,), (lon,))
+        if not 1 <= k <= MAX_NEAREST:
+            raise ValueError(f"k out of range: {k}")
+        data_set = _read_data_set()
+        fmt = _row_format()
+
+        return _cached_read(
+            lambda: _rows_response(
+                data_set.nearest_data(lat=lat, lon=lon, k=k, fmt=fmt), fmt
+            )
+        )
+    except YearNotAvailableError as e:
+        return _year_not_available(e)
+    except (KeyError, ValueError):
+        return (
+            jsonify(
+                {
+                    "error": f"Invalid input, lat within [-90, 90] and lon within [-180, 180] are required floats and k an integer between 1 and {MAX_NEAREST}."
+                }
+            ),
+            400,
+        )
+    except AttributeError as e:
+        logger.error(f"Error for nearest data: {e}")
+        return Response("Internal error", status=500)
+
+
+@main_bp.route("/data/within", methods=["GET"])
+@cost(QUERY)
+def get_within_data() -> Response:
+    """
+    Return the entries within radius_km of a point by great-circle distance,
+    closest first or with sort=id in id order, with their distance_km.
+    """
+    try:
+        lat = float(request.args["lat"])
+        lon = float(request.args["lon"])
+        radius_km = float(request.args["radius_km"])
+        _check_coordinates((lat,), (lon,))
+        if not math.isfinite(radius_km) or radius_km <= 0:
+            raise ValueError(f"Invalid point or radius: {lat}, {lon}, {radius_km}")
+        order = _order(BY_DISTANCE)
+        data_set = _read_data_set()
+        fmt = _row_format()
+
+        return _cached_read(
+            lambda: _rows_response(
+                data_set.within_data(
+                    lat=lat, lon=lon, radius_km=radius_km, fmt=fmt, order=order
+                ),
+                fmt,
+            )
+        )
+    except YearNotAvailableError as e:
+        return _year_not_available(e)
+    except (KeyError, ValueError):
+        return (
+            jsonify(
+                {
+                    "error": f"Invalid input, lat within [-90, 90], lon within [-180, 180] and radius_km are required finite floats, radius_km above 0, and sort one of {', '.join(ORDERS)}."
+                }
+            ),
+            400,
+        )
+    except AttributeError as e:
+        logger.error(f"Error for within data: {e}")
+        return Response("Internal error", status=500)
+
+
+@main_bp.route("/data/timeseries/<string:lat>/<string:lon>", methods=["GET"])
+@cost(QUERY)
+def get_timeseries(lat: str, lon: str) -> Response:
+    """
+    PM2.5 at one grid point in every past year, oldest first. Only the
+    Parquet row groups that can hold the point are read.
+    """
+    try:
+        lat = float(lat)
+        lon = float(lon)
+        _check_coordinates((lat,), (lon,))
+
+        fmt = _row_format()
+
+        def build() -> Response:
+            rows = current_app.years.timeseries(lat, lon)
+            columns = {name: rows[name].to_numpy() for name in rows.columns}
+            return _rows_response(encode(columns, fmt), fmt)
+
+        return _cached_read(build)
+    except ValueError:
+        return (
+            jsonify(
+                {
+                    "error": "Invalid input, latitude and longitude must be floats within [-90, 90] and [-180, 180]."
+                }
+            ),
+            400,
+        )
+    except AttributeError as e:
+        logger.error(f"Error for timeseries: {e}")
+        return Response("Internal error", status=500)
+
+
+@main_bp.route("/tiles/<int:z>/<int:x>/<int:y>", methods=["GET"])
+def get_tile(z: int, x: int, y: int) -> Response:
+    """
+    Count, mean, min and max PM2.5 of the bins of a Web Mercator map tile.
+    Send Accept: application/octet-stream for packed binary bins instead of
+    JSON, see app.tiles.TILE_RECORD.
+    """
+    try:
+
+        def build() -> Response:
+            tile = current_app.data_set.get_tile(z, x, y)
+            if tile is None:
+                return Response("Tile not found", status=404)
+            if request.accept_mimetypes.best_match([JSON, TILE_BINARY]) == TILE_BINARY:
+                response = Response(pack_tile(tile), status=200, mimetype=TILE_BINARY)
+                response.headers["X-Tile-Size"] = str(tile["size"])
+                return response
+            return jsonify(
+                {
+                    name: value.tolist() if hasattr(value, "tolist") else value
+                    for name, value in tile.items()
+                }
+            )
+
+        return _cached_read(build)
+    except AttributeError as e:
+        logger.error(f"Error for get tile: {e}")
+        return Response("Internal error", status=500)
+
+
+@main_bp.route("/metrics", methods=["GET"])
+def get_metrics() -> Response:
+    """
+    Request counts, latency and size histograms per route and DataSet
+    operation timings in the Prometheus text format.
+    """
+    try:
+        return Response(REGISTRY.render(), status=200, content_type=CONTENT_TYPE)
+    except AttributeError as e:
+        logger.error(f"Error for metrics: {e}")
+        return Response("Internal error", status=500)
@@ -0,0 +1,210 @@
+import copy
+from typing import Optional
+
+import numpy as np
+
+from .raster import SNAP_FRACTION, RasterGrid
+
+NEAREST = "nearest"
+BILINEAR = "bilinear"
+METHODS = (NEAREST, BILINEAR)
+
+# grid cells are stored in square blocks of 1 << BLOCK_SHIFT per side, and
+# only blocks holding a point are allocated, so sea and gaps cost nothing
+BLOCK_SHIFT = 6
+BLOCK = 1 << BLOCK_SHIFT
+# changed cells kept aside before a rebuild, also the smallest count that grows it
+MIN_REBUILD = 4096
+
+
+class GridSampler:
+    """
+    PM2.5 at arbitrary coordinates, read off the data's regular grid.
+
+    Each cell holds the mean of the points on it. Blocks of cells are looked
+    up through a small block index, so a whole batch of coordinates is
+    sampled with a few array gathers. Points off the grid are not sampled.
+
+    Changes since the last rebuild are kept aside as (cell, sum, count)
+    deltas, as RegionStats does, and added to the cells they touch when
+    sampling. Views share the blocks, which only a rebuild replaces.
+    """
+
+    def __init__(
+        self,
+        lats: np.ndarray,
+        lons: np.ndarray,
+        values: np.ndarray,
+        grid: Optional[RasterGrid] = None,
+    ):
+        if grid is None:
+            try:
+                grid = RasterGrid.detect(lats, lons)
+            except ValueError:
+                grid = None
+        self.grid = grid
+        self.rebuild(lats, lons, values)
+
+    def _cells(self, lats, lons, values) -> tuple:
+        """Flat cells and values of the points on the grid with a value."""
+        values = np.asarray(values, dtype=np.float64)
+        rows, cols, on_grid = self.grid.locate(lats, lons)
+        keep = on_grid & ~np.isnan(values)
+        return rows[keep] * self.grid.n_lon + cols[keep], values[keep]
+
+    def rebuild(self, lats: np.ndarray, lons: np.ndarray, values: np.ndarray):
+        """Replace the blocks and deltas with the given points."""
+        self._deltas = {name: np.empty(0) for name in ("cell", "sum", "count")}
+        self._deltas_len = 0
+        self._merged = None
+        self._rebuild_at = max(MIN_REBUILD, len(values) // 8)
+        if self.grid is None:
+            return
+        cells, values = self._cells(lats, lons, values)
+        rows, cols = np.divmod(cells, self.grid.n_lon)
+        index_shape = (
+            (self.grid.n_lat + BLOCK - 1) >> BLOCK_SHIFT,
+            (self.grid.n_lon + BLOCK - 1) >> BLOCK_SHIFT,
+        )
+        blocks = (rows >> BLOCK_SHIFT) * index_shape[1] + (cols >> BLOCK_SHIFT)
+        used, slots = np.unique(blocks, return_inverse=True)
+        self._index = np.full(index_shape, -1, dtype=np.int32)
+        self._index.flat[used] = np.arange(len(used), dtype=np.int32)
+        within = slots * BLOCK * BLOCK + (rows % BLOCK) * BLOCK + cols % BLOCK
+        size = max(len(used), 1) * BLOCK * BLOCK
+        counts = np.bincount(within, minlength=size)
+        sums = np.bincount(within, weights=values, minlength=size)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            means = sums / counts
+        self._means = means.reshape(-1, BLOCK, BLOCK)
+        self._counts = counts.astype(np.int32).reshape(-1, BLOCK, BLOCK)
+
+    def _append(self, cells, sums, counts) -> None:
+        start, end = self._deltas_len, self._deltas_len + len(cells)
+        if end > len(self._deltas["cell"]):
+            capacity = max(end, 2 * len(self._deltas["cell"]), 64)
+            for name, column in self._deltas.items():
+                grown = np.empty(capacity)
+                grown[:start] = column[:start]
+                self._deltas[name] = grown
+        self._deltas["cell"][start:end] = cells
+        self._deltas["sum"][start:end] = sums
+        self._deltas["count"][start:end] = counts
+        self._deltas_len = end
+
+    def add_many(self, lats: np.ndarray, lons: np.ndarray, values: np.ndarray):
+        if self.grid is not None:
+            cells, values = self._cells(lats, lons, values)
+            self._append(cells, values, 1.0)
+
+    def add(self, lat: float, lon: float, value: float) -> None:
+        self.add_many(np.array([lat]), np.array([lon]), np.array([value]))
+
+    def remove(self, lat: float, lon: float, value: float) -> None:
+        if self.grid is not None:
+            cells, values = self._cells([lat], [lon], [value])
+            self._append(cells, -values, -1.0)
+
+    def needs_rebuild(self) -> bool:
+        return self._deltas_len > self._rebuild_at
+
+    def view(self) -> "GridSampler":
+        """A frozen copy for readers, see the class docstring."""
+        view = copy.copy(self)
+        view._deltas = dict(self._deltas)
+        view._merged = None
+        return view
+
+    def _merged_deltas(self) -> tuple:
+        """Sorted changed cells with their summed deltas, built once per view."""
+        if self._merged is None:
+            n = self._deltas_len
+            cells, inverse = np.unique(
+                self._deltas["cell"][:n].astype(np.int64), return_inverse=True
+            )
+            self._merged = (
+                cells,
+                np.bincount(inverse, weights=self._deltas["sum"][:n]),
+                np.bincount(inverse, weights=self._deltas["count"][:n]),
+            )
+        return self._merged
+
+    def cell_values(self, rows: np.ndarray, cols: np.ndarray) -> np.ndarray:
+        """Mean PM2.5 of cells, NaN for cells without points or off the grid."""
+        n_lat, n_lon = self.grid.n_lat, self.grid.n_lon
+        on_grid = (rows >= 0) & (rows < n_lat) & (cols >= 0) & (cols < n_lon)
+        rows = np.where(on_grid, rows, 0)
+        cols = np.where(on_grid, cols, 0)
+        slots = self._index[rows >> BLOCK_SHIFT, cols >> BLOCK_SHIFT]
+        stored = on_grid & (slots >= 0)
+        within = (np.where(stored, slots, 0), rows % BLOCK, cols % BLOCK)
+        means = np.where(stored, self._means[within], np.nan)
+        if not self._deltas_len:
+            return means
+
+        changed, sums, counts = self._merged_deltas()
+        cells = rows * n_lon + cols
+        at = np.searchsorted(changed, cells).clip(max=len(changed) - 1)
+        hit = on_grid & (changed[at] == cells)
+        if hit.any():
+            at = at[hit]
+            base_counts = np.where(stored, self._counts[within], 0)[hit]
+            base_sums = np.where(base_counts > 0, means[hit] * base_counts, 0.0)
+            total = base_counts + counts[at]
+            with np.errstate(invalid="ignore", divide="ignore"):
+                means[hit] = np.where(
+                    total > 0.5, (base_sums + sums[at]) / total, np.nan
+                )
+        return means
+
+    def _positions(self, lats, lons) -> tuple:
+        """Fractional rows and cols, snapped to whole ones next to a centre."""
+        grid = self.grid
+        positions = []
+        for values, origin, step in (
+            (lats, grid.lat0, grid.dlat),
+            (lons, grid.lon0, grid.dlon),
+        ):
+            position = (np.asarray(values, dtype=np.float64) - origin) / step
+            nearest = np.rint(position)
+            snap = np.abs(position - nearest) <= SNAP_FRACTION
+            positions.append(np.where(snap, nearest, position))
+        return positions
+
+    def sample(self, lats, lons, method: str = BILINEAR) -> np.ndarray:
+        """
+        PM2.5 at each coordinate, NaN where there is none.
+
+        NEAREST takes the cell the coordinate falls in. BILINEAR weighs the
+        four cell centres around it by distance, leaving out cells without
+        a value and rescaling the other weights to sum to one.
+
+        Raises ValueError for an unknown method or data off any regular grid.
+        """
+        if method not in METHODS:
+            raise ValueError(f"Unknown sampling method {method!r}")
+        if self.grid is None:
+            raise ValueError("The data does not lie on a regular grid")
+        rows, cols = self._positions(lats, lons)
+        if method == NEAREST:
+            return self.cell_values(
+                np.rint(rows).astype(np.int64), np.rint(cols).astype(np.int64)
+            )
+
+        row0, col0 = np.floor(rows), np.floor(cols)
+        below, left = rows - row0, cols - col0
+        row0, col0 = row0.astype(np.int64), col0.astype(np.int64)
+        total = np.zeros(len(rows))
+        weights = np.zeros(len(rows))
+        for row_step, col_step, weight in (
+            (0, 0, (1 - below) * (1 - left)),
+            (0, 1, (1 - below) * left),
+            (1, 0, below * (1 - left)),
+            (1, 1, below * left),
+        ):
+            values = self.cell_values(row0 + row_step, col0 + col_step)
+            weight = np.where(np.isnan(values), 0.0, weight)
+            total += weight * np.nan_to_num(values)
+            weights += weight
+        with np.errstate(invalid="ignore", divide="ignore"):
+            return np.where(weights > 0, total / weights, np.nan)
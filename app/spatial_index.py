@@ -0,0 +1,258 @@
+import copy
+import math
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def haversine_km(lat: float, lon: float, lats: np.ndarray, lons: np.ndarray):
+    """Great-circle distance in km from one point to arrays of points."""
+    lat_r = np.radians(lat)
+    lats_r = np.radians(lats)
+    dlat = lats_r - lat_r
+    dlon = np.radians(lons) - np.radians(lon)
+    a = (
+        np.sin(dlat / 2.0) ** 2
+        + np.cos(lat_r) * np.cos(lats_r) * np.sin(dlon / 2.0) ** 2
+    )
+    return 2.0 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def min_distance_beyond_km(
+    lat: float,
+    lat_reach: float,
+    lon_reach: float,
+    covers_lats: bool,
+    covers_lons: bool,
+) -> float:
+    """
+    Lower bound on the distance from a point at lat to any point more than
+    lat_reach degrees away in latitude or lon_reach degrees in longitude.
+    Directions a search already covered completely are left out.
+    """
+    if covers_lats and covers_lons:
+        return math.inf
+    bounds = []
+    if not covers_lats:
+        bounds.append(math.radians(lat_reach))
+    if not covers_lons:
+        # closest approach to any meridian at least lon_reach away
+        bounds.append(
+            math.asin(
+                min(1.0, abs(math.cos(math.radians(lat))))
+                * math.sin(min(math.radians(lon_reach), math.pi / 2))
+            )
+        )
+    return EARTH_RADIUS_KM * min(bounds)
+
+
+def radius_bbox(lat: float, lon: float, radius_km: float) -> tuple:
+    """
+    Smallest lat/lon box holding every point within radius_km of (lat, lon),
+    as (min_lat, min_lon, max_lat, max_lon). min_lon is above max_lon when
+    the box wraps across the antimeridian, and spans every longitude when
+    the circle holds a pole.
+    """
+    reach = radius_km / EARTH_RADIUS_KM
+    lat_reach = math.degrees(reach)
+    min_lat, max_lat = max(-90.0, lat - lat_reach), min(90.0, lat + lat_reach)
+    if min_lat <= -90.0 or max_lat >= 90.0:
+        return min_lat, -180.0, max_lat, 180.0
+    # widest longitude offset on the circle, reached away from its centre lat
+    lon_reach = math.degrees(
+        math.asin(min(1.0, math.sin(reach) / math.cos(math.radians(lat))))
+    )
+    return (
+        min_lat,
+        (lon - lon_reach + 180.0) % 360.0 - 180.0,
+        max_lat,
+        (lon + lon_reach + 180.0) % 360.0 - 180.0,
+    )
+
+
+class GridIndex:
+    """
+    Bucket members (row ids) into fixed size lat/lon cells.
+
+    The bulk of the index is a sorted array of cell keys with offsets into a
+    member array, so lookups are a binary search. Later additions go to an
+    append-only overlay that is merged in by rebuilding once it grows.
+
+    Nothing is ever removed between rebuilds, so a member that moved or was
+    deleted can still come back as a candidate: queries return candidates
+    only, callers check them against the rows they are reading. That way a
+    view() taken at any point stays valid for that point while the writer
+    keeps adding.
+    """
+
+    def __init__(
+        self,
+        members: np.ndarray,
+        lats: np.ndarray,
+        lons: np.ndarray,
+        cell_size: float = 0.1,
+    ):
+        self.cell_size = cell_size
+        self.n_rows = int(round(180.0 / cell_size))
+        self.n_cols = int(round(360.0 / cell_size))
+        self.rebuild(members, lats, lons)
+
+    def __len__(self) -> int:
+        return len(self._members) + self._extra_len
+
+    def rebuild(self, members: np.ndarray, lats: np.ndarray, lons: np.ndarray):
+        """Replace the whole index with the given members."""
+        keys = self.cell_keys(lats, lons)
+        order = np.argsort(keys, kind="stable")
+        sorted_keys = keys[order]
+        # fresh arrays rather than in-place changes, views keep the old ones
+        self._members = np.asarray(members, dtype=np.int64)[order]
+        # already sorted, so find where each key starts without sorting again
+        starts = np.flatnonzero(np.diff(sorted_keys, prepend=-1))
+        self._keys = sorted_keys[starts]
+        self._offsets = np.append(starts, len(sorted_keys)).astype(np.int64)
+        self._extra_keys = np.empty(1024, dtype=np.int64)
+        self._extra_members = np.empty(1024, dtype=np.int64)
+        self._extra_len = 0
+
+    def needs_rebuild(self) -> bool:
+        return self._extra_len > max(4096, len(self._members) // 8)
+
+    def view(self) -> "GridIndex":
+        """A frozen copy for readers, later additions are invisible to it."""
+        return copy.copy(self)
+
+    def cell_rows(self, lats) -> np.ndarray:
+        rows = np.floor((np.nan_to_num(lats) + 90.0) / self.cell_size)
+        return np.clip(rows, 0, self.n_rows - 1).astype(np.int64)
+
+    def cell_cols(self, lons) -> np.ndarray:
+        cols = np.floor((np.nan_to_num(lons) + 180.0) / self.cell_size)
+        return np.mod(cols, self.n_cols).astype(np.int64)
+
+    def cell_keys(self, lats, lons) -> np.ndarray:
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        return self.cell_rows(lats) * self.n_cols + self.cell_cols(lons)
+
+    def add(self, member: int, lat: float, lon: float) -> None:
+        self.add_many(np.array([member]), np.array([lat]), np.array([lon]))
+
+    def add_many(self, members: np.ndarray, lats: np.ndarray, lons: np.ndarray):
+        count = len(members)
+        size = self._extra_len + count
+        if size > len(self._extra_keys):
+            capacity = max(size, 2 * len(self._extra_keys))
+            self._extra_keys = self._grown(self._extra_keys, capacity)
+            self._extra_members = self._grown(self._extra_members, capacity)
+        # written past _extra_len, so invisible to existing views
+        self._extra_keys[self._extra_len : size] = self.cell_keys(lats, lons)
+        self._extra_members[self._extra_len : size] = members
+        self._extra_len = size
+
+    def _grown(self, values: np.ndarray, capacity: int) -> np.ndarray:
+        grown = np.empty(capacity, dtype=values.dtype)
+        grown[: self._extra_len] = values[: self._extra_len]
+        return grown
+
+    def _key_ranges(self, rows: np.ndarray, col_ranges: list) -> np.ndarray:
+        if not len(rows):
+            return np.empty(0, dtype=np.int64)
+        parts = []
+        for first_col, last_col in col_ranges:
+            lo = np.searchsorted(self._keys, rows * self.n_cols + first_col, "left")
+            hi = np.searchsorted(self._keys, rows * self.n_cols + last_col, "right")
+            for start, stop in zip(self._offsets[lo], self._offsets[hi]):
+                if stop > start:
+                    parts.append(self._members[start:stop])
+        if self._extra_len:
+            extra_rows, extra_cols = np.divmod(
+                self._extra_keys[: self._extra_len], self.n_cols
+            )
+            in_cols = np.zeros(self._extra_len, dtype=bool)
+            for first_col, last_col in col_ranges:
+                in_cols |= (extra_cols >= first_col) & (extra_cols <= last_col)
+            in_rows = (extra_rows >= rows[0]) & (extra_rows <= rows[-1])
+            parts.append(self._extra_members[: self._extra_len][in_rows & in_cols])
+        return np.concatenate(parts) if parts else np.empty(0, dtype=np.int64)
+
+    def _col_ranges(self, first_col: int, last_col: int, span: int) -> list:
+        if span >= self.n_cols:
+            return [(0, self.n_cols - 1)]
+        if first_col <= last_col:
+            return [(first_col, last_col)]
+        return [(first_col, self.n_cols - 1), (0, last_col)]
+
+    def query_point(self, lat: float, lon: float, atol: float = 1e-9) -> np.ndarray:
+        """Candidates in every cell touched by the square lat/lon +- atol."""
+        rows = self.cell_rows(np.array([lat - atol, lat + atol]))
+        cols = self.cell_cols(np.array([lon - atol, lon + atol]))
+        span = int(np.ceil(2 * atol / self.cell_size)) + 1
+        return self._key_ranges(
+            np.arange(rows[0], rows[1] + 1),
+            self._col_ranges(int(cols[0]), int(cols[1]), span),
+        )
+
+    def query_bbox(
+        self, min_lat: float, min_lon: float, max_lat: float, max_lon: float
+    ) -> np.ndarray:
+        """
+        Candidates for a box, a min_lon greater than max_lon wraps
+        across the antimeridian.
+        """
+        rows = self.cell_rows(np.array([min_lat, max_lat]))
+        cols = self.cell_cols(np.array([min_lon, max_lon]))
+        if min_lon <= max_lon:
+            span = int(np.ceil((max_lon - min_lon) / self.cell_size)) + 1
+        else:
+            span = int(np.ceil((max_lon - min_lon + 360.0) / self.cell_size)) + 1
+        return self._key_ranges(
+            np.arange(rows[0], rows[1] + 1),
+            self._col_ranges(int(cols[0]), int(cols[1]), span),
+        )
+
+    def query_radius(self, lat: float, lon: float, radius_km: float) -> np.ndarray:
+        """Candidates in the cells of the box around a great circle, see radius_bbox."""
+        return self.query_bbox(*radius_bbox(lat, lon, radius_km))
+
+    def _query_ring(self, lat: float, lon: float, radius: int) -> np.ndarray:
+        row = int(self.cell_rows(np.array([lat]))[0])
+        col = int(self.cell_cols(np.array([lon]))[0])
+        rows = np.arange(max(row - radius, 0), min(row + radius, self.n_rows - 1) + 1)
+        first_col = (col - radius) % self.n_cols
+        last_col = (col + radius) % self.n_cols
+        return self._key_ranges(
+            rows, self._col_ranges(first_col, last_col, 2 * radius + 1)
+        )
+
+    def _searched_km(self, lat: float, radius: int) -> float:
+        """Lower bound on the distance to any point outside the searched cells."""
+        row = int(self.cell_rows(np.array([lat]))[0])
+        reach = radius * self.cell_size
+        return min_distance_beyond_km(
+            lat,
+            reach,
+            reach,
+            covers_lats=row - radius <= 0 and row + radius >= self.n_rows - 1,
+            covers_lons=2 * radius + 1 >= self.n_cols,
+        )
+
+    def nearest(self, lat: float, lon: float, k: int, locate) -> tuple:
+        """
+        The k members closest to (lat, lon) by great-circle distance.
+
+        :param locate: Callable mapping candidate members to
+            (members, lats, lons) for the ones that are still valid.
+        :return: Tuple of (members, distances in km) sorted by distance.
+        """
+        radius = 0
+        while True:
+            members, lats, lons = locate(self._query_ring(lat, lon, radius))
+            distances = haversine_km(lat, lon, lats, lons)
+            bound = self._searched_km(lat, radius)
+            if len(distances) >= k or bound == math.inf:
+                order = np.argsort(distances, kind="stable")[:k]
+                if bound == math.inf or distances[order[-1]] <= bound:
+                    return members[order], distances[order]
+            radius = radius * 2 + 1
@@ -0,0 +1,439 @@
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from .raster import RasterGrid
+
+COLUMNS = ("lat", "lon", "GWRPM25")
+CHUNK_SHIFT = 16
+CHUNK_ROWS = 1 << CHUNK_SHIFT
+
+# lat/lon as cells of a detected grid, see app.raster and ColumnStore
+RASTER = "raster"
+
+# column -> (stored dtype, scale), a scale stores round(value * scale)
+STORAGE_DTYPES = {
+    "native": {},
+    "float32": {name: (np.float32, None) for name in COLUMNS},
+    "quantized": {
+        "lat": (np.int32, 1e6),
+        "lon": (np.int32, 1e6),
+        "GWRPM25": (np.int32, 1e3),
+    },
+}
+
+_ALL_ALIVE = np.ones(CHUNK_ROWS, dtype=bool)
+_ALL_ALIVE.flags.writeable = False
+
+
+def codecs_for(dtypes: str) -> dict:
+    if dtypes not in STORAGE_DTYPES:
+        raise ValueError(f"Unknown storage dtypes {dtypes!r}")
+    return STORAGE_DTYPES[dtypes]
+
+
+def encode(codecs: dict, name: str, values) -> np.ndarray:
+    """Values of a column as stored, ValueError if they do not fit."""
+    if name not in codecs:
+        return np.asarray(values)
+    dtype, scale = codecs[name]
+    if scale is None:
+        return np.asarray(values, dtype=dtype)
+    scaled = np.round(np.asarray(values, dtype=np.float64) * scale)
+    info = np.iinfo(dtype)
+    # NaN fails both comparisons too
+    if not np.all((scaled >= info.min) & (scaled <= info.max)):
+        raise ValueError(f"{name} values out of range for quantized storage")
+    return scaled.astype(dtype)
+
+
+class _ChunkedRows:
+    """
+    Read side of the row storage.
+
+    Every column ("id", "alive" and the COLUMNS) is split into chunks of
+    CHUNK_ROWS slots. Rows are kept in slots ordered by id, so ids are found
+    by binary search over the first id of each chunk and then within it.
+    """
+
+    def __len__(self) -> int:
+        return self.size - self.dead
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes held by the chunks, mapped ones included."""
+        held = sum(chunk.nbytes for chunks in self._chunks.values() for chunk in chunks)
+        return held + sum(values.nbytes for values in self._off_grid.values())
+
+    def _chunk_len(self, chunk: int) -> int:
+        return min(CHUNK_ROWS, self.size - chunk * CHUNK_ROWS)
+
+    def _slice(self, name: str, start: int, stop: int) -> np.ndarray:
+        """Column values for the contiguous slots start to stop."""
+        chunks = self._chunks[name]
+        pieces = []
+        while start < stop:
+            chunk, offset = divmod(start, CHUNK_ROWS)
+            end = min(CHUNK_ROWS, offset + stop - start)
+            pieces.append(chunks[chunk][offset:end])
+            start += end - offset
+        if len(pieces) == 1:
+            return pieces[0]
+        if not pieces:
+            return np.empty(0, dtype=self._dtypes[name])
+        return np.concatenate(pieces)
+
+    def _gather(self, name: str, slots) -> np.ndarray:
+        slots = np.asarray(slots, dtype=np.int64)
+        if len(slots) > 1 and slots[-1] - slots[0] == len(slots) - 1:
+            if (np.diff(slots) == 1).all():
+                # a run of slots, e.g. a page without deletes, is a slice
+                values = self._slice(name, int(slots[0]), int(slots[-1]) + 1)
+                if values.base is not None:
+                    values = values.view()
+                    values.flags.writeable = False
+                return values
+        chunks = self._chunks[name]
+        which = slots >> CHUNK_SHIFT
+        offsets = slots & (CHUNK_ROWS - 1)
+        if len(slots) and which[0] == which[-1] and (which == which[0]).all():
+            return chunks[which[0]][offsets]
+        values = np.empty(len(slots), dtype=self._dtypes[name])
+        steps = np.diff(which)
+        if len(slots) and (steps >= 0).all():
+            # sorted slots, the usual case, split at chunk changes
+            bounds = np.concatenate(([0], np.flatnonzero(steps) + 1, [len(slots)]))
+            for start, stop in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+                values[start:stop] = chunks[which[start]][offsets[start:stop]]
+            return values
+        for chunk in np.unique(which):
+            mask = which == chunk
+            values[mask] = chunks[chunk][offsets[mask]]
+        return values
+
+    def _chunk_ids(self, chunk: int) -> np.ndarray:
+        return self._chunks["id"][chunk][: self._chunk_len(chunk)]
+
+    def slot_of(self, id: int) -> Optional[int]:
+        chunk = int(np.searchsorted(self._first_ids, id, side="right")) - 1
+        if chunk < 0:
+            return None
+        ids = self._chunk_ids(chunk)
+        offset = int(np.searchsorted(ids, id))
+        if offset < len(ids) and ids[offset] == id:
+            if self._chunks["alive"][chunk][offset]:
+                return chunk * CHUNK_ROWS + offset
+        return None
+
+    def slots_of(self, ids) -> np.ndarray:
+        """Slots of the live rows among ids, in id order."""
+        ids = np.unique(np.asarray(ids, dtype=np.int64))
+        chunks = np.searchsorted(self._first_ids, ids, side="right") - 1
+        found = []
+        for chunk in np.unique(chunks[chunks >= 0]):
+            wanted = ids[chunks == chunk]
+            chunk_ids = self._chunk_ids(chunk)
+            offsets = np.searchsorted(chunk_ids, wanted)
+            inside = offsets < len(chunk_ids)
+            offsets, wanted = offsets[inside], wanted[inside]
+            offsets = offsets[chunk_ids[offsets] == wanted]
+            offsets = offsets[self._chunks["alive"][chunk][offsets]]
+            found.append(chunk * CHUNK_ROWS + offsets)
+        return np.concatenate(found) if found else np.empty(0, dtype=np.int64)
+
+    def slot_after(self, id: Optional[int]) -> int:
+        """First slot holding an id above the given one."""
+        if id is None:
+            return 0
+        chunk = int(np.searchsorted(self._first_ids, id, side="right")) - 1
+        if chunk < 0:
+            return 0
+        offset = int(np.searchsorted(self._chunk_ids(chunk), id, side="right"))
+        return chunk * CHUNK_ROWS + offset
+
+    def live_slots(self, start: int = 0, limit: Optional[int] = None) -> np.ndarray:
+        """Live slots from start onward, scanning only as far as limit needs."""
+        if limit is None:
+            return start + np.flatnonzero(self._slice("alive", start, self.size))
+        found = []
+        count = 0
+        window = max(1024, 2 * limit)
+        while start < self.size and count < limit:
+            stop = min(start + window, self.size)
+            slots = start + np.flatnonzero(self._slice("alive", start, stop))
+            found.append(slots[: limit - count])
+            count += len(found[-1])
+            start = stop
+        return np.concatenate(found) if found else np.empty(0, dtype=np.int64)
+
+    def ids(self, slots) -> np.ndarray:
+        return self._gather("id", slots)
+
+    def column(self, name: str, slots) -> np.ndarray:
+        values = self._gather(name, slots)
+        if self.grid is not None and name in ("lat", "lon"):
+            return self._decode_grid(name, values)
+        codec = self._codecs.get(name)
+        if codec is None or codec[1] is None:
+            return values
+        return values / codec[1]
+
+    def _decode_grid(self, name: str, codes: np.ndarray) -> np.ndarray:
+        values = self.grid.lats(codes) if name == "lat" else self.grid.lons(codes)
+        off_grid = codes < 0
+        if off_grid.any():
+            values[off_grid] = self._off_grid[name][-1 - codes[off_grid]]
+        return values
+
+    @property
+    def coordinate_tolerance(self) -> float:
+        """Largest change storing a lat or lon can make to it."""
+        if self.grid is not None:
+            return self.grid.tolerance
+        tolerance = 0.0
+        for name in ("lat", "lon"):
+            dtype, scale = self._codecs.get(name, (self._dtypes[name], None))
+            if scale is not None:
+                tolerance = max(tolerance, 0.5 / scale)
+            elif np.dtype(dtype).itemsize < 8:
+                tolerance = max(tolerance, float(np.spacing(dtype(180.0))) / 2)
+        return tolerance
+
+    def columns(self, slots) -> dict:
+        """
+        Ids and COLUMNS of the rows at the given slots. A run of slots inside
+        one chunk is returned as read-only views of it, without copying.
+        """
+        columns = {"id": self.ids(slots)}
+        columns.update((name, self.column(name, slots)) for name in COLUMNS)
+        return columns
+
+    def frame(self, slots) -> pd.DataFrame:
+        """Rows at the given slots as a DataFrame indexed by id."""
+        return pd.DataFrame(
+            {name: self.column(name, slots) for name in COLUMNS},
+            index=pd.Index(self.ids(slots)),
+        )
+
+
+class StoreSnapshot(_ChunkedRows):
+    """
+    Immutable view of the store as of one write.
+
+    The writer never changes a slot a snapshot can see, so readers use it
+    without locking for as long as they like.
+    """
+
+    def __init__(self, store: "ColumnStore"):
+        self._chunks = {name: tuple(chunks) for name, chunks in store._chunks.items()}
+        self._dtypes = store._dtypes
+        self._codecs = store._codecs
+        self.grid = store.grid
+        # written past the snapshot's codes only, like the chunks
+        self._off_grid = dict(store._off_grid)
+        self._first_ids = store._first_ids
+        self.size = store.size
+        self.dead = store.dead
+        self.next_id = store.next_id
+
+
+class ColumnStore(_ChunkedRows):
+    """
+    Columnar row storage written by a single writer at a time.
+
+    Columns grow a preallocated chunk at a time, so appending a row is
+    amortized O(1) and never copies existing rows. Ids come from a monotonic
+    counter and are never reused. Deleting a row only clears its alive flag,
+    dead slots are squeezed out once they make up half the store.
+
+    A chunk handed out in a snapshot is copied before any of its visible slots
+    change. Appends only write past every snapshot's size, so need no copy.
+
+    Values can be stored narrower than they are read, see STORAGE_DTYPES:
+    column() always returns them decoded.
+
+    With dtypes RASTER, lat and lon are stored as the int32 row and col of a
+    RasterGrid detected from the data. Points off the grid are kept exactly
+    in an append-only overlay and get the code -1 - their overlay position.
+    """
+
+    def __init__(self, df: pd.DataFrame, dtypes: str = "native"):
+        df = df.sort_index()
+        self.grid = None
+        self._codecs = {}
+        self._off_grid = {"lat": np.empty(0), "lon": np.empty(0)}
+        self._off_grid_len = 0
+        if dtypes == RASTER:
+            self.grid = RasterGrid.detect(df["lat"], df["lon"])
+        else:
+            self._codecs = codecs_for(dtypes)
+        columns = {"id": df.index.to_numpy(dtype=np.int64)}
+        columns["alive"] = np.ones(len(df), dtype=bool)
+        columns["lat"], columns["lon"] = self._encode_points(
+            df["lat"].to_numpy(), df["lon"].to_numpy()
+        )
+        columns["GWRPM25"] = encode(self._codecs, "GWRPM25", df["GWRPM25"].to_numpy())
+        self._dtypes = {name: values.dtype for name, values in columns.items()}
+        self.next_id = int(columns["id"][-1]) + 1 if len(df) else 0
+        self._fill(columns)
+
+    @classmethod
+    def from_chunks(cls, chunks: dict, dtypes: str = "native") -> "ColumnStore":
+        """
+        Wrap existing "id" and COLUMNS chunks, e.g. read-only memory-mapped
+        arrays, without copying them. Every chunk but the last must hold
+        CHUNK_ROWS rows, values must already be encoded for dtypes and ids
+        ascending. A chunk is only copied once a write touches it.
+        """
+        store = cls.__new__(cls)
+        store._codecs = codecs_for(dtypes)
+        store.grid = None
+        store._off_grid = {"lat": np.empty(0), "lon": np.empty(0)}
+        store._off_grid_len = 0
+        store._dtypes = {"id": np.dtype(np.int64), "alive": np.dtype(bool)}
+        for name in COLUMNS:
+            if name in store._codecs:
+                store._dtypes[name] = np.dtype(store._codecs[name][0])
+            elif chunks[name]:
+                store._dtypes[name] = chunks[name][0].dtype
+            else:
+                store._dtypes[name] = np.dtype(np.float64)
+        store._chunks = {name: list(chunks[name]) for name in ("id",) + COLUMNS}
+        store._chunks["alive"] = [_ALL_ALIVE[: len(ids)] for ids in chunks["id"]]
+        store.size = sum(len(ids) for ids in chunks["id"])
+        store.dead = 0
+        store._owned = set()
+        store.next_id = int(chunks["id"][-1][-1]) + 1 if store.size else 0
+        store._update_first_ids()
+        return store
+
+    def _fill(self, columns: dict) -> None:
+        size = len(columns["id"])
+        self._chunks = {name: [] for name in columns}
+        for start in range(0, size, CHUNK_ROWS):
+            for name, values in columns.items():
+                chunk = np.zeros(CHUNK_ROWS, dtype=self._dtypes[name])
+                piece = values[start : start + CHUNK_ROWS]
+                chunk[: len(piece)] = piece
+                self._chunks[name].append(chunk)
+        self.size = size
+        self.dead = 0
+        self._owned = set()
+        self._update_first_ids()
+
+    def _update_first_ids(self) -> None:
+        self._first_ids = np.array(
+            [chunk[0] for chunk in self._chunks["id"]], dtype=np.int64
+        )
+
+    @property
+    def capacity(self) -> int:
+        return len(self._chunks["id"]) * CHUNK_ROWS
+
+    def snapshot(self) -> StoreSnapshot:
+        """Freeze the current rows, later writes copy any chunk they touch."""
+        self._owned.clear()
+        return StoreSnapshot(self)
+
+    def _writable(self, name: str, chunk: int) -> np.ndarray:
+        if (name, chunk) not in self._owned:
+            self._chunks[name][chunk] = self._chunks[name][chunk].copy()
+            self._owned.add((name, chunk))
+        return self._chunks[name][chunk]
+
+    def _appendable(self, name: str, chunk: int) -> np.ndarray:
+        """The chunk at full length and writable, for slots past self.size."""
+        values = self._chunks[name][chunk]
+        if len(values) < CHUNK_ROWS or not values.flags.writeable:
+            grown = np.zeros(CHUNK_ROWS, dtype=self._dtypes[name])
+            grown[: len(values)] = values
+            self._chunks[name][chunk] = values = grown
+            self._owned.add((name, chunk))
+        return values
+
+    def _encode_points(self, lat, lon) -> tuple:
+        """Stored lat and lon columns for the given points."""
+        if self.grid is None:
+            return encode(self._codecs, "lat", lat), encode(self._codecs, "lon", lon)
+        rows, cols, on_grid = self.grid.locate(lat, lon)
+        off = np.flatnonzero(~on_grid)
+        if len(off):
+            start = self._off_grid_len
+            end = start + len(off)
+            if end > len(self._off_grid["lat"]):
+                capacity = max(end, 2 * len(self._off_grid["lat"]), 64)
+                for name, values in self._off_grid.items():
+                    # a new array, snapshots keep reading the old one
+                    grown = np.empty(capacity)
+                    grown[:start] = values[:start]
+                    self._off_grid[name] = grown
+            self._off_grid["lat"][start:end] = np.asarray(lat, dtype=np.float64)[off]
+            self._off_grid["lon"][start:end] = np.asarray(lon, dtype=np.float64)[off]
+            self._off_grid_len = end
+            rows[off] = cols[off] = -1 - np.arange(start, end)
+        return rows.astype(np.int32), cols.astype(np.int32)
+
+    def compact(self) -> None:
+        """Squeeze dead slots out into fresh chunks."""
+        live = self.live_slots()
+        self._fill({name: self._gather(name, live) for name in self._chunks})
+
+    def append(self, lat: float, lon: float, gwrpm25: float) -> int:
+        """Store a new row and return the id allocated to it."""
+        return self.append_many(
+            lat=np.array([lat]), lon=np.array([lon]), gwrpm25=np.array([gwrpm25])
+        )
+
+    def append_many(self, lat: np.ndarray, lon: np.ndarray, gwrpm25: np.ndarray) -> int:
+        """Store a batch of rows in one go and return the first id allocated."""
+        count = len(lat)
+        first_id = self.next_id
+        had_chunks = len(self._chunks["id"])
+        while self.capacity < self.size + count:
+            for name, chunks in self._chunks.items():
+                chunks.append(np.zeros(CHUNK_ROWS, dtype=self._dtypes[name]))
+        gwrpm25 = encode(self._codecs, "GWRPM25", gwrpm25)
+        lat, lon = self._encode_points(lat, lon)
+        columns = {
+            "id": np.arange(first_id, first_id + count, dtype=np.int64),
+            "alive": np.ones(count, dtype=bool),
+            "lat": lat,
+            "lon": lon,
+            "GWRPM25": gwrpm25,
+        }
+        done = 0
+        while done < count:
+            chunk, offset = divmod(self.size + done, CHUNK_ROWS)
+            step = min(CHUNK_ROWS - offset, count - done)
+            for name, values in columns.items():
+                # slots at or past self.size are invisible to every snapshot
+                target = self._appendable(name, chunk)
+                target[offset : offset + step] = values[done : done + step]
+            done += step
+        self.size += count
+        self.next_id += count
+        if len(self._chunks["id"]) != had_chunks:
+            self._update_first_ids()
+        return first_id
+
+    def update(self, id: int, lat: float, lon: float, gwrpm25: float) -> None:
+        slot = self.slot_of(id)
+        if slot is None:
+            raise KeyError(id)
+        gwrpm25 = encode(self._codecs, "GWRPM25", [gwrpm25])[0]
+        lat, lon = self._encode_points([lat], [lon])
+        values = {"lat": lat[0], "lon": lon[0], "GWRPM25": gwrpm25}
+        chunk, offset = divmod(slot, CHUNK_ROWS)
+        for name, value in values.items():
+            self._writable(name, chunk)[offset] = value
+
+    def delete(self, id: int) -> None:
+        slot = self.slot_of(id)
+        if slot is None:
+            raise KeyError(id)
+        chunk, offset = divmod(slot, CHUNK_ROWS)
+        self._writable("alive", chunk)[offset] = False
+        self.dead += 1
+        if self.dead > max(1024, self.size // 2):
+            self.compact()
@@ -0,0 +1,382 @@
+import copy
+import math
+from typing import Callable, Optional
+
+import numpy as np
+
+# latitudes Web Mercator tiles cover, points further north or south are left out
+MAX_LAT = math.degrees(math.atan(math.sinh(math.pi)))
+# changed bins kept aside before compacting, also the smallest base that grows it
+MIN_COMPACT = 4096
+
+# one non-empty bin of a binary tile, see pack_tile
+TILE_RECORD = np.dtype(
+    [
+        ("index", "<u2"),
+        ("count", "<u4"),
+        ("mean", "<f4"),
+        ("min", "<f4"),
+        ("max", "<f4"),
+    ]
+)
+
+COUNT, TOTAL, MIN, MAX = range(4)
+
+
+def _group(keys: np.ndarray, stats: np.ndarray) -> tuple:
+    """Combine the (count, total, min, max) rows of equal keys, sorted by key."""
+    order = np.argsort(keys, kind="stable")
+    keys, stats = keys[order], stats[order]
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]]) if len(keys) else []
+    grouped = np.empty((len(starts), 4))
+    if len(starts):
+        grouped[:, COUNT] = np.add.reduceat(stats[:, COUNT], starts)
+        grouped[:, TOTAL] = np.add.reduceat(stats[:, TOTAL], starts)
+        grouped[:, MIN] = np.minimum.reduceat(stats[:, MIN], starts)
+        grouped[:, MAX] = np.maximum.reduceat(stats[:, MAX], starts)
+    return keys[starts], grouped
+
+
+def _combine(current: Optional[tuple], stats: np.ndarray) -> tuple:
+    if current is None or current[COUNT] == 0:
+        return tuple(stats)
+    return (
+        current[COUNT] + stats[COUNT],
+        current[TOTAL] + stats[TOTAL],
+        min(current[MIN], stats[MIN]),
+        max(current[MAX], stats[MAX]),
+    )
+
+
+class _Overlay:
+    """
+    Changed bins of one zoom level, tile -> {local index: stats}, as a
+    stack of frozen layers under the one the writer fills.
+
+    freeze() puts the writer's layer on the stack and merges the top layers
+    while the lower one is no more than twice the size of the one above,
+    like a binary counter. Frozen layers are never changed, so a view only
+    copies the list of O(log changes) layers, and each change is copied
+    O(log changes) times until compact() folds the overlay away.
+    """
+
+    def __init__(self, layers: tuple = ()):
+        # (bins, {tile: {local: stats}}), oldest first
+        self._layers = list(layers)
+        self._top = {}
+        self._top_bins = 0
+        self.bins = sum(bins for bins, _ in self._layers)
+
+    def __bool__(self) -> bool:
+        return self.bins > 0
+
+    def get(self, tile: int, local: int) -> Optional[tuple]:
+        bins = self._top.get(tile)
+        if bins is not None and local in bins:
+            return bins[local]
+        for _, layer in reversed(self._layers):
+            bins = layer.get(tile)
+            if bins is not None and local in bins:
+                return bins[local]
+        return None
+
+    def set(self, tile: int, local: int, stats: tuple) -> None:
+        bins = self._top.setdefault(tile, {})
+        if local not in bins:
+            self._top_bins += 1
+            self.bins += 1
+        bins[local] = stats
+
+    def tile(self, tile: int) -> dict:
+        """The changed bins of one tile, local index -> stats."""
+        bins = {}
+        for _, layer in self._layers:
+            bins.update(layer.get(tile, {}))
+        bins.update(self._top.get(tile, {}))
+        return bins
+
+    def items(self):
+        """(tile, local, stats) of every changed bin, latest stats only."""
+        merged = self._merge(self._layers + [(self._top_bins, self._top)])
+        for tile, bins in merged[1].items():
+            for local, stats in bins.items():
+                yield tile, local, stats
+
+    @staticmethod
+    def _merge(layers: list) -> tuple:
+        merged = {}
+        for _, layer in layers:
+            for tile, bins in layer.items():
+                merged.setdefault(tile, {}).update(bins)
+        return sum(len(bins) for bins in merged.values()), merged
+
+    def freeze(self) -> "_Overlay":
+        """A copy that no later change shows in, see the class docstring."""
+        if self._top_bins:
+            self._layers.append((self._top_bins, self._top))
+            self._top, self._top_bins = {}, 0
+            while (
+                len(self._layers) > 1 and self._layers[-2][0] <= 2 * self._layers[-1][0]
+            ):
+                self._layers[-2:] = [self._merge(self._layers[-2:])]
+            self.bins = sum(bins for bins, _ in self._layers)
+        return _Overlay(tuple(self._layers))
+
+
+def pack_tile(tile: dict) -> bytes:
+    """A tile's bins as packed little-endian TILE_RECORD structs."""
+    records = np.empty(len(tile["index"]), dtype=TILE_RECORD)
+    for name in TILE_RECORD.names:
+        records[name] = tile[name]
+    return records.tobytes()
+
+
+class TilePyramid:
+    """
+    Count, mean, min and max of PM2.5 over Web Mercator map tiles (the
+    z/x/y scheme of web maps) at every zoom from 0 to max_zoom. Each tile is
+    split into size x size bins, bin index = row * size + col from the
+    tile's north-west corner.
+
+    Each zoom level holds its non-empty bins as a sorted array of keys with
+    an array of (count, total, min, max), so memory grows with the number of
+    occupied bins rather than the area. Changes go to an overlay of replaced
+    bins per level that compact() folds back in. A view() shares the arrays
+    and the overlay's frozen layers, so it stays valid while the writer
+    carries on and costs little however many bins changed, see _Overlay.
+
+    Removing a value that was a bin's min or max rescans the bin: the rows
+    of the finest bin are fetched with values_in, coarser bins are combined
+    from the four bins below them.
+    """
+
+    def __init__(
+        self,
+        lats: np.ndarray,
+        lons: np.ndarray,
+        values: np.ndarray,
+        max_zoom: int = 10,
+        size: int = 16,
+    ):
+        if not 0 <= max_zoom <= 24:
+            raise ValueError(f"Tile zoom out of range: {max_zoom}")
+        if not 1 <= size <= 256:
+            raise ValueError(f"Tile size out of range: {size}")
+        self.max_zoom = max_zoom
+        self.size = size
+        self.rebuild(lats, lons, values)
+
+    def rebuild(self, lats: np.ndarray, lons: np.ndarray, values: np.ndarray):
+        """Replace the whole pyramid with the given points."""
+        keys, stats = self._finest(lats, lons, values)
+        self._keys = [None] * (self.max_zoom + 1)
+        self._stats = [None] * (self.max_zoom + 1)
+        self._changed = [_Overlay() for _ in range(self.max_zoom + 1)]
+        for z in range(self.max_zoom, -1, -1):
+            keys, stats = _group(keys, stats)
+            self._keys[z], self._stats[z] = keys, stats
+            if z:
+                rows, cols = self._cells(z, keys)
+                keys = self._key(z - 1, rows >> 1, cols >> 1)
+
+    def _bins(self, lats, lons) -> tuple:
+        """(rows, cols, inside mask) of points in the bins at max_zoom."""
+        lats = np.asarray(lats, dtype=np.float64)
+        lons = np.asarray(lons, dtype=np.float64)
+        n = self.size << self.max_zoom
+        with np.errstate(invalid="ignore"):
+            inside = (np.abs(lats) <= MAX_LAT) & (np.abs(lons) <= 180.0)
+        lat_r = np.radians(np.where(inside, lats, 0.0))
+        y = (1.0 - np.arcsinh(np.tan(lat_r)) / math.pi) / 2.0
+        x = (np.where(inside, lons, 0.0) + 180.0) / 360.0
+        rows = np.clip(np.floor(y * n), 0, n - 1).astype(np.int64)
+        cols = np.clip(np.floor(x * n), 0, n - 1).astype(np.int64)
+        return rows, cols, inside
+
+    def _finest(self, lats, lons, values) -> tuple:
+        values = np.asarray(values, dtype=np.float64)
+        rows, cols, inside = self._bins(lats, lons)
+        keep = inside & ~np.isnan(values)
+        values = values[keep]
+        stats = np.column_stack([np.ones(len(values)), values, values, values])
+        return self._key(self.max_zoom, rows[keep], cols[keep]), stats
+
+    def _key(self, z: int, rows, cols):
+        """Keys sorting bins tile by tile, so a tile's bins are contiguous."""
+        tile = (rows // self.size << z) + cols // self.size
+        return tile * self.size**2 + rows % self.size * self.size + cols % self.size
+
+    def _cells(self, z: int, keys) -> tuple:
+        tile, local = np.divmod(keys, self.size**2)
+        tile_y, tile_x = np.divmod(tile, 1 << z)
+        row, col = np.divmod(local, self.size)
+        return tile_y * self.size + row, tile_x * self.size + col
+
+    def _box(self, row: int, col: int) -> tuple:
+        """(min_lat, min_lon, max_lat, max_lon) of a bin at max_zoom."""
+        n = self.size << self.max_zoom
+
+        def lat(edge: int) -> float:
+            return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * edge / n))))
+
+        return (
+            lat(row + 1),
+            col / n * 360.0 - 180.0,
+            lat(row),
+            (col + 1) / n * 360.0 - 180.0,
+        )
+
+    def _get(self, z: int, key: int) -> Optional[tuple]:
+        changed = self._changed[z].get(*divmod(key, self.size**2))
+        if changed is not None:
+            return changed
+        keys = self._keys[z]
+        i = int(np.searchsorted(keys, key))
+        if i < len(keys) and keys[i] == key:
+            return tuple(self._stats[z][i])
+        return None
+
+    def _set(self, z: int, key: int, stats: tuple) -> None:
+        self._changed[z].set(*divmod(key, self.size**2), stats)
+
+    def add(self, lat: float, lon: float, value: float) -> None:
+        self.add_many(np.array([lat]), np.array([lon]), np.array([value]))
+
+    def add_many(self, lats: np.ndarray, lons: np.ndarray, values: np.ndarray):
+        keys, stats = self._finest(lats, lons, values)
+        for z in range(self.max_zoom, -1, -1):
+            keys, stats = _group(keys, stats)
+            if len(keys) > MIN_COMPACT:
+                # big batches merge straight into the arrays
+                self._compact_level(z)
+                self._keys[z], self._stats[z] = _group(
+                    np.concatenate([self._keys[z], keys]),
+                    np.concatenate([self._stats[z], stats]),
+                )
+            else:
+                for key, row in zip(keys.tolist(), stats):
+                    self._set(z, key, _combine(self._get(z, key), row))
+            if z:
+                rows, cols = self._cells(z, keys)
+                keys = self._key(z - 1, rows >> 1, cols >> 1)
+
+    def remove(self, lat: float, lon: float, value: float, values_in: Callable) -> None:
+        """
+        Take a point back out of the pyramid.
+
+        :param values_in: Callable mapping (min_lat, min_lon, max_lat,
+            max_lon) to (lats, lons, values) of at least the rows now in
+            that box, used to find a new min or max.
+        """
+        rows, cols, inside = self._bins([lat], [lon])
+        if not inside[0] or math.isnan(value):
+            return
+        row, col = int(rows[0]), int(cols[0])
+        for z in range(self.max_zoom, -1, -1):
+            shift = self.max_zoom - z
+            key = int(self._key(z, row >> shift, col >> shift))
+            current = self._get(z, key)
+            if current is None:
+                return
+            count, total, low, high = current
+            count -= 1
+            total -= value
+            if count <= 0:
+                low = high = math.nan
+            elif value <= low or value >= high:
+                if z == self.max_zoom:
+                    low, high = self._rescan(row, col, values_in)
+                else:
+                    low, high = self._from_children(z, row >> shift, col >> shift)
+            self._set(z, key, (count, total, low, high))
+
+    def _rescan(self, row: int, col: int, values_in: Callable) -> tuple:
+        lats, lons, values = values_in(*self._box(row, col))
+        rows, cols, inside = self._bins(lats, lons)
+        values = np.asarray(values, dtype=np.float64)
+        values = values[inside & (rows == row) & (cols == col) & ~np.isnan(values)]
+        if not len(values):
+            return math.nan, math.nan
+        return float(values.min()), float(values.max())
+
+    def _from_children(self, z: int, row: int, col: int) -> tuple:
+        children = [
+            self._get(z + 1, int(self._key(z + 1, 2 * row + i, 2 * col + j)))
+            for i in (0, 1)
+            for j in (0, 1)
+        ]
+        children = [child for child in children if child and child[COUNT] > 0]
+        if not children:
+            return math.nan, math.nan
+        return min(c[MIN] for c in children), max(c[MAX] for c in children)
+
+    def needs_compact(self) -> bool:
+        changed = sum(level.bins for level in self._changed)
+        base = sum(len(keys) for keys in self._keys)
+        return changed > max(MIN_COMPACT, base // 8)
+
+    def compact(self) -> None:
+        """Fold the changed bins into the arrays, views keep the old ones."""
+        for z in range(self.max_zoom + 1):
+            self._compact_level(z)
+
+    def _compact_level(self, z: int) -> None:
+        if not self._changed[z]:
+            return
+        area = self.size**2
+        changed = list(self._changed[z].items())
+        keys = np.array(
+            [tile * area + local for tile, local, _ in changed], dtype=np.int64
+        )
+        stats = np.array([stats for _, _, stats in changed], dtype=np.float64).reshape(
+            -1, 4
+        )
+        kept = ~np.isin(self._keys[z], keys)
+        keys, stats = _group(
+            np.concatenate([self._keys[z][kept], keys]),
+            np.concatenate([self._stats[z][kept], stats]),
+        )
+        nonempty = stats[:, COUNT] > 0
+        self._keys[z], self._stats[z] = keys[nonempty], stats[nonempty]
+        self._changed[z] = _Overlay()
+
+    def view(self) -> "TilePyramid":
+        """A frozen copy for readers, see the class docstring."""
+        view = copy.copy(self)
+        view._keys = list(self._keys)
+        view._stats = list(self._stats)
+        view._changed = [level.freeze() for level in self._changed]
+        return view
+
+    def tile(self, z: int, x: int, y: int) -> Optional[dict]:
+        """
+        The non-empty bins of a tile as arrays, None if the tile is outside
+        the pyramid.
+        """
+        if not (0 <= z <= self.max_zoom and 0 <= x < 1 << z and 0 <= y < 1 << z):
+            return None
+        area = self.size**2
+        tile = (y << z) + x
+        keys = self._keys[z]
+        start, stop = np.searchsorted(keys, [tile * area, (tile + 1) * area])
+        bins = dict(
+            zip((keys[start:stop] - tile * area).tolist(), self._stats[z][start:stop])
+        )
+        bins.update(self._changed[z].tile(tile))
+        index = np.array(
+            sorted(local for local, stats in bins.items() if stats[COUNT] > 0),
+            dtype=np.int64,
+        )
+        stats = np.array([bins[local] for local in index.tolist()]).reshape(-1, 4)
+        count = stats[:, COUNT].astype(np.int64)
+        return {
+            "z": z,
+            "x": x,
+            "y": y,
+            "size": self.size,
+            "index": index,
+            "count": count,
+            "mean": stats[:, TOTAL] / np.maximum(count, 1),
+            "min": stats[:, MIN],
+            "max": stats[:, MAX],
+        }
@@ -0,0 +1,540 @@
+import json
+import mmap
+import os
+import struct
+import threading
+from typing import Iterator
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from .data_set import DataSet, Snapshot
+from .logger import setup_logger
+
+import logging
+
+SNAPSHOT_FILE = "snapshot.parquet"
+SEGMENT_PREFIX = "mutations-"
+SEGMENT_SUFFIX = ".log"
+# holds the lsn of the last record on disk, see SharedLsn
+LSN_FILE = "durable.lsn"
+STATE_KEY = b"air_quality"
+ROW_GROUP_ROWS = 1 << 16
+# seconds between attempts to write records the log failed to write
+RETRY_SECONDS = 1.0
+
+logger = setup_logger(name="wal", log_file="wal.txt", level=logging.INFO)
+
+
+def _plain(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Cannot log {type(value).__name__}")
+
+
+def _segments(directory: str) -> list:
+    names = [
+        name
+        for name in os.listdir(directory)
+        if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX)
+    ]
+    return [os.path.join(directory, name) for name in sorted(names)]
+
+
+def _first_lsn(path: str) -> int:
+    """The first lsn the segment at path may hold."""
+    return int(os.path.basename(path)[len(SEGMENT_PREFIX) : -len(SEGMENT_SUFFIX)])
+
+
+class LogGapError(LookupError):
+    """Records a reader still needs were compacted out of the log."""
+
+
+class LogWriteError(OSError):
+    """The log is closed, or could not write and fsync a record."""
+
+
+def _fsync_directory(directory: str) -> None:
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class SharedLsn:
+    """
+    The lsn of the last record of a log directory that is on disk, in a
+    small file every process maps. The writer stores it after each fsync,
+    so readers can tell whether there is anything new to read without
+    listing or reading the segments.
+    """
+
+    FORMAT = struct.Struct("<q")
+
+    def __init__(self, directory: str):
+        path = os.path.join(directory, LSN_FILE)
+        descriptor = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            if os.fstat(descriptor).st_size < self.FORMAT.size:
+                os.ftruncate(descriptor, self.FORMAT.size)
+            self._map = mmap.mmap(descriptor, self.FORMAT.size)
+        finally:
+            os.close(descriptor)
+
+    @property
+    def value(self) -> int:
+        return self.FORMAT.unpack_from(self._map)[0]
+
+    @value.setter
+    def value(self, lsn: int) -> None:
+        self.FORMAT.pack_into(self._map, 0, lsn)
+
+    def close(self) -> None:
+        self._map.close()
+
+
+class MutationLog:
+    """
+    Append-only log of DataSet mutations, one JSON record per line.
+
+    Records carry the DataSet version they produced (their lsn). Writers call
+    append() under the DataSet lock, which only queues the line, and wait()
+    after releasing it. A single flusher thread writes whatever has queued up
+    and fsyncs once for all of it, so concurrent writers share an fsync
+    (group commit) instead of paying for one each.
+
+    When a write fails, the part written is cut off the segment, the
+    waiting writers get LogWriteError and check() refuses new mutations.
+    The flusher keeps the records and tries again every RETRY_SECONDS until
+    the write goes through, so the log never skips a record.
+
+    The log is split into segments named after the first lsn they may hold,
+    roll() starts a new one so older ones can be dropped once a snapshot
+    covers them.
+    """
+
+    def __init__(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self._cond = threading.Condition()
+        self._io_lock = threading.Lock()
+        self._pending = []
+        self._appended_lsn = 0
+        self.durable_lsn = 0
+        self._file = None
+        self._path = None
+        # bytes of the segment holding only complete, fsynced records
+        self._size = 0
+        self._segment_start = None
+        self._error = None
+        self._closed = False
+        self._flusher = None
+        self._shared_lsn = None
+
+    def segments(self) -> list:
+        return _segments(self.directory)
+
+    def _segment_path(self, first_lsn: int) -> str:
+        name = f"{SEGMENT_PREFIX}{first_lsn:020d}{SEGMENT_SUFFIX}"
+        return os.path.join(self.directory, name)
+
+    def records(self, after: int = 0) -> Iterator[dict]:
+        """
+        Logged records with an lsn above after, oldest first.
+
+        A crash mid-write can leave the last line of the log incomplete, that
+        line is cut off the file. A complete line that is not valid JSON
+        means the log is damaged and raises ValueError.
+        """
+        for path in self.segments():
+            with open(path, "rb+") as segment:
+                good = 0
+                for line in segment:
+                    if not line.endswith(b"\n"):
+                        logger.warning(f"Dropping torn record at end of {path}")
+                        segment.truncate(good)
+                        break
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        raise ValueError(f"Corrupt record in {path} at byte {good}")
+                    good += len(line)
+                    if record["lsn"] > after:
+                        yield record
+
+    def open(self, lsn: int) -> None:
+        """Start accepting records after lsn, the last one already applied."""
+        self._appended_lsn = self.durable_lsn = lsn
+        self._shared_lsn = SharedLsn(self.directory)
+        self._shared_lsn.value = lsn
+        self._start_segment(lsn + 1)
+        self._flusher = threading.Thread(
+            target=self._flush_loop, name="wal-flusher", daemon=True
+        )
+        self._flusher.start()
+
+    def _start_segment(self, first_lsn: int) -> str:
+        path = self._segment_path(first_lsn)
+        self._file = open(path, "ab")
+        self._path = path
+        self._size = self._file.tell()
+        self._segment_start = first_lsn
+        _fsync_directory(self.directory)
+        return path
+
+    def check(self) -> None:
+        """Raise LogWriteError when the log is closed or failing to write."""
+        with self._cond:
+            if self._closed:
+                raise LogWriteError("Mutation log is closed")
+            if self._error is not None:
+                raise LogWriteError(f"Mutation log write failed: {self._error}")
+
+    def append(self, record: dict) -> None:
+        line = json.dumps(record, default=_plain).encode("utf-8") + b"\n"
+        with self._cond:
+            if self._closed:
+                raise LogWriteError("Mutation log is closed")
+            self._pending.append(line)
+            self._appended_lsn = record["lsn"]
+            self._cond.notify_all()
+
+    def wait(self, lsn: int) -> None:
+        """Block until the record at lsn is on disk, LogWriteError if it failed."""
+        with self._cond:
+            while self.durable_lsn < lsn and self._error is None:
+                self._cond.wait()
+            if self.durable_lsn < lsn:
+                raise LogWriteError(f"Mutation log write failed: {self._error}")
+
+    def _write(self, data: bytes) -> None:
+        """Append data to the segment and fsync it, call with the io lock held."""
+        try:
+            if self._file is None:
+                self._reopen()
+            self._file.write(data)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+        except OSError:
+            file, self._file = self._file, None
+            if file is not None:
+                try:
+                    file.close()
+                except OSError:
+                    pass
+            raise
+        self._size += len(data)
+
+    def _reopen(self) -> None:
+        """Open the segment again after a failed write, cutting off what it left."""
+        self._file = open(self._path, "ab")
+        self._file.truncate(self._size)
+
+    def _flush_loop(self) -> None:
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                if not self._pending:
+                    return
+                batch = list(self._pending)
+                lsn = self._appended_lsn
+            try:
+                with self._io_lock:
+                    self._write(b"".join(batch))
+            except OSError as e:
+                logger.error(f"Error writing mutation log, retrying: {e}")
+                with self._cond:
+                    self._error = e
+                    self._cond.notify_all()
+                    if self._cond.wait_for(lambda: self._closed, RETRY_SECONDS):
+                        return
+                continue
+            # before the writers waiting for it are told, see SharedLsn
+            self._shared_lsn.value = lsn
+            with self._cond:
+                del self._pending[: len(batch)]
+                self.durable_lsn = lsn
+                self._error = None
+                self._cond.notify_all()
+
+    def roll(self) -> str:
+        """
+        Send later records to a new segment.
+
+        :return: Path of the segment now being written, every older segment
+            only holds records appended before the call.
+        """
+        with self._io_lock:
+            with self._cond:
+                first_lsn = self._appended_lsn + 1
+            if first_lsn == self._segment_start:
+                return self._segment_path(first_lsn)
+            if self._file is None:
+                # the flusher still has to write older records to this segment
+                raise LogWriteError("Mutation log is failing to write")
+            old = self._file
+            path = self._start_segment(first_lsn)
+            old.close()
+            return path
+
+    def discard_before(self, path: str) -> None:
+        """Delete the segments older than path."""
+        for segment in self.segments():
+            if segment >= path:
+                break
+            os.remove(segment)
+        _fsync_directory(self.directory)
+
+    def close(self) -> None:
+        """Flush what is queued and stop the flusher."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._flusher is not None:
+            self._flusher.join()
+        if self._file is not None:
+            self._file.close()
+        if self._shared_lsn is not None:
+            self._shared_lsn.close()
+
+
+class LogTail:
+    """
+    Follows the records another process appends to a MutationLog directory,
+    reading only what was added since the last call.
+
+    Unlike MutationLog.records it never truncates: an incomplete last line
+    is the writer's record in flight and is read on a later call.
+    """
+
+    def __init__(self, directory: str, after: int):
+        """:param after: lsn of the last record already applied."""
+        self.directory = directory
+        self.lsn = after
+        self._file = None
+        self._path = None
+
+    def read(self) -> list:
+        """
+        Complete records after the last one read, oldest first.
+
+        Raises LogGapError when a record after it is no longer in the log,
+        the reader then has to start over from the snapshot.
+        """
+        records = []
+        while True:
+            # listed before reading, so a later segment means this one is done
+            segments = _segments(self.directory)
+            if self._file is None:
+                path = self._segment_holding(segments, self.lsn + 1)
+                if path is None:
+                    return records
+                self._open(path)
+            records += self._read_lines()
+            later = [path for path in segments if path > self._path]
+            if not later:
+                return records
+            if _first_lsn(later[0]) > self.lsn + 1:
+                # compaction deleted the segments in between
+                raise LogGapError(self.lsn + 1)
+            self._open(later[0])
+
+    def _segment_holding(self, segments: list, lsn: int):
+        if not segments:
+            return None
+        if _first_lsn(segments[0]) > lsn:
+            raise LogGapError(lsn)
+        return [path for path in segments if _first_lsn(path) <= lsn][-1]
+
+    def _open(self, path: str) -> None:
+        self.close()
+        self._file = open(path, "rb")
+        self._path = path
+
+    def _read_lines(self) -> list:
+        records = []
+        while True:
+            start = self._file.tell()
+            line = self._file.readline()
+            if not line.endswith(b"\n"):
+                self._file.seek(start)
+                return records
+            record = json.loads(line)
+            if record["lsn"] <= self.lsn:
+                continue
+            if record["lsn"] != self.lsn + 1:
+                raise LogGapError(self.lsn + 1)
+            self.lsn = record["lsn"]
+            records.append(record)
+
+    def close(self) -> None:
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def read_state(path: str) -> tuple:
+    """
+    Version and next id saved in a snapshot written by write_snapshot.
+
+    :return: Tuple of (version, next id), (0, None) for any other file.
+    """
+    metadata = pq.read_schema(path).metadata or {}
+    if STATE_KEY not in metadata:
+        return 0, None
+    state = json.loads(metadata[STATE_KEY])
+    return state["version"], state["next_id"]
+
+
+def write_snapshot(snapshot: Snapshot, path: str) -> None:
+    """
+    Atomically replace path with the live rows of snapshot, a row group at a
+    time so the whole table is never held in memory at once.
+    """
+    rows = snapshot.rows
+    slots = rows.live_slots()
+    state = json.dumps({"version": snapshot.version, "next_id": rows.next_id})
+    temp_path = path + ".tmp"
+    table = pa.Table.from_pandas(rows.frame(slots[:ROW_GROUP_ROWS]))
+    schema = table.schema.with_metadata(
+        {**(table.schema.metadata or {}), STATE_KEY: state.encode("utf-8")}
+    )
+    with pq.ParquetWriter(temp_path, schema) as writer:
+        writer.write_table(table)
+        for start in range(ROW_GROUP_ROWS, len(slots), ROW_GROUP_ROWS):
+            frame = rows.frame(slots[start : start + ROW_GROUP_ROWS])
+            writer.write_table(pa.Table.from_pandas(frame, schema=schema))
+    with open(temp_path, "rb") as written:
+        os.fsync(written.fileno())
+    os.replace(temp_path, path)
+    _fsync_directory(os.path.dirname(os.path.abspath(path)))
+
+
+class Compactor:
+    """
+    Background thread that folds the log into a new Parquet snapshot once
+    enough mutations have piled up, which bounds replay time on restart.
+
+    The log is rolled as the snapshot is taken, under the DataSet lock, so
+    the snapshot holds every record in the older segments and they can then
+    be deleted. Records in the new segment that the snapshot already holds
+    are skipped on replay.
+    """
+
+    def __init__(
+        self,
+        data_set: DataSet,
+        log: MutationLog,
+        path: str,
+        interval: float = 60.0,
+        min_records: int = 1000,
+        compacted_version: int = 0,
+    ):
+        self.data_set = data_set
+        self.log = log
+        self.path = path
+        self.interval = interval
+        self.min_records = min_records
+        self.compacted_version = compacted_version
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self) -> "Compactor":
+        self._thread = threading.Thread(
+            target=self._run, name="wal-compactor", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            pending = self.data_set.snapshot().version - self.compacted_version
+            if pending >= self.min_records:
+                try:
+                    self.compact()
+                except (OSError, pa.ArrowException) as e:
+                    logger.error(f"Error compacting mutation log: {e}")
+
+    def compact(self) -> None:
+        segment, snapshot = self.data_set.roll_log()
+        write_snapshot(snapshot, self.path)
+        self.log.discard_before(segment)
+        self.compacted_version = snapshot.version
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+
+def load_latest(base_path: str, directory: str, **load_options) -> DataSet:
+    """
+    The newest snapshot in directory, or the base file if there is none yet,
+    at the version it was saved at and without the log replayed.
+    """
+    snapshot_path = os.path.join(directory, SNAPSHOT_FILE)
+    while True:
+        path = snapshot_path if os.path.exists(snapshot_path) else base_path
+        state = read_state(path)
+        data_set = DataSet(path, **load_options)
+        # another process may have compacted while it loaded
+        if read_state(path) == state:
+            break
+    data_set.resume(*state)
+    return data_set
+
+
+def start_durable(
+    data_set: DataSet,
+    directory: str,
+    compact_interval: float = 60.0,
+    compact_min_records: int = 1000,
+) -> tuple:
+    """
+    Replay the log in directory on top of data_set and start logging and
+    compaction, data_set must hold the newest snapshot or later records.
+
+    :return: Tuple of (MutationLog, Compactor).
+    """
+    snapshot_path = os.path.join(directory, SNAPSHOT_FILE)
+    compacted_version = (
+        read_state(snapshot_path)[0] if os.path.exists(snapshot_path) else 0
+    )
+    log = MutationLog(directory)
+    data_set.replay(log.records(after=data_set.version))
+    log.open(data_set.version)
+    data_set.attach_log(log)
+
+    compactor = Compactor(
+        data_set,
+        log,
+        snapshot_path,
+        interval=compact_interval,
+        min_records=compact_min_records,
+        compacted_version=compacted_version,
+    ).start()
+    return log, compactor
+
+
+def open_durable(
+    base_path: str,
+    directory: str,
+    compact_interval: float = 60.0,
+    compact_min_records: int = 1000,
+    **load_options,
+) -> tuple:
+    """
+    Load the newest snapshot in directory (or the base file if there is none
+    yet), replay the log on top of it and start logging and compaction.
+
+    :param load_options: Passed on to DataSet, e.g. load="mmap".
+    :return: Tuple of (DataSet, MutationLog, Compactor).
+    """
+    data_set = load_latest(base_path, directory, **load_options)
+    log, compactor = start_durable(
+        data_set, directory, compact_interval, compact_min_records
+    )
+    return data_set, log, compactor
@@ -0,0 +1,155 @@
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+from .data_set import DataSet
+from .partitions import (
+    PART_FILE,
+    ROW_GROUP_ROWS,
+    YEAR_DIRECTORY,
+    partition_path,
+    spatial_order,
+)
+
+# float32 coordinates in the source files are this close to the grid
+TIMESERIES_ATOL = 1e-5
+
+
+def write_year(df: pd.DataFrame, year: int, root: str) -> str:
+    """Write one year's lat, lon and GWRPM25 rows under root/year=YYYY."""
+    order = spatial_order(df["lat"].to_numpy(), df["lon"].to_numpy())
+    path = partition_path(root, year)
+    temp_path = path + ".tmp"
+    df.iloc[order][["lat", "lon", "GWRPM25"]].to_parquet(
+        temp_path, index=False, row_group_size=ROW_GROUP_ROWS
+    )
+    os.replace(temp_path, path)
+    return path
+
+
+class YearNotAvailableError(LookupError):
+    """No partition holds the requested year."""
+
+
+class YearlyData:
+    """
+    Read-only PM2.5 of every year in a year-partitioned Parquet dataset,
+    see write_year.
+
+    A year is read into a DataSet the first time it is asked for and then
+    kept in an LRU cache. The least recently used years are dropped once the
+    cached years' estimated size is over memory_budget bytes, but the year
+    just read is always kept. Time series read only the row groups whose
+    statistics can hold the point, without loading any year.
+    """
+
+    def __init__(self, root: str, memory_budget: int = 1 << 30, **load_options):
+        """
+        :param load_options: Passed on to DataSet, e.g. dtypes="float32".
+        """
+        self.root = root
+        self.memory_budget = memory_budget
+        self._load_options = load_options
+        self._lock = threading.Lock()
+        self._loading = {}
+        self._cache = OrderedDict()
+        self._extents = {}
+        self.size = 0
+        self.paths = {}
+        if os.path.isdir(root):
+            for name in os.listdir(root):
+                match = YEAR_DIRECTORY.match(name)
+                path = os.path.join(root, name, PART_FILE)
+                if match and os.path.exists(path):
+                    self.paths[int(match.group(1))] = path
+        self.years = sorted(self.paths)
+
+    def cached_years(self) -> list:
+        with self._lock:
+            return list(self._cache)
+
+    def get(self, year: int) -> DataSet:
+        """The DataSet of a year, raises YearNotAvailableError if there is none."""
+        if year not in self.paths:
+            raise YearNotAvailableError(year)
+        path = self.paths[year]
+        with self._lock:
+            if year in self._cache:
+                self._cache.move_to_end(year)
+                return self._cache[year][0]
+            loading = self._loading.setdefault(year, threading.Lock())
+        # other years stay available while this one loads
+        with loading:
+            with self._lock:
+                if year in self._cache:
+                    self._cache.move_to_end(year)
+                    return self._cache[year][0]
+            data_set = DataSet(path, **self._load_options)
+            with self._lock:
+                self._cache[year] = (data_set, data_set.nbytes)
+                self.size += data_set.nbytes
+                while self.size > self.memory_budget and len(self._cache) > 1:
+                    _, (_, evicted) = self._cache.popitem(last=False)
+                    self.size -= evicted
+                self._loading.pop(year, None)
+        return data_set
+
+    def _row_group_extents(self, year: int) -> tuple:
+        """
+        :return: Tuple of (the year's Parquet metadata, array of (min_lat,
+            max_lat, min_lon, max_lon) of each row group).
+        """
+        with self._lock:
+            if year in self._extents:
+                return self._extents[year]
+        metadata = pq.read_metadata(self.paths[year])
+        names = [metadata.schema.column(i).name for i in range(metadata.num_columns)]
+        extents = np.empty((metadata.num_row_groups, 4))
+        for group in range(metadata.num_row_groups):
+            row_group = metadata.row_group(group)
+            for offset, name in enumerate(("lat", "lon")):
+                stats = row_group.column(names.index(name)).statistics
+                if stats is not None and stats.has_min_max:
+                    low, high = stats.min, stats.max
+                else:
+                    low, high = -np.inf, np.inf
+                extents[group, 2 * offset : 2 * offset + 2] = (low, high)
+        with self._lock:
+            self._extents[year] = (metadata, extents)
+        return metadata, extents
+
+    def timeseries(self, lat: float, lon: float, atol: float = TIMESERIES_ATOL):
+        """
+        Rows within atol of (lat, lon) in every year, oldest year first.
+
+        :return: DataFrame with year, lat, lon and GWRPM25 columns.
+        """
+        frames = []
+        for year in self.years:
+            metadata, extents = self._row_group_extents(year)
+            groups = np.flatnonzero(
+                (extents[:, 0] <= lat + atol)
+                & (extents[:, 1] >= lat - atol)
+                & (extents[:, 2] <= lon + atol)
+                & (extents[:, 3] >= lon - atol)
+            )
+            if not len(groups):
+                continue
+            rows = (
+                pq.ParquetFile(self.paths[year], metadata=metadata)
+                .read_row_groups(groups.tolist(), columns=["lat", "lon", "GWRPM25"])
+                .to_pandas()
+            )
+            rows = rows[
+                np.isclose(rows["lat"], lat, rtol=0, atol=atol)
+                & np.isclose(rows["lon"], lon, rtol=0, atol=atol)
+            ]
+            frames.append(rows.assign(year=year))
+        columns = ["year", "lat", "lon", "GWRPM25"]
+        if not frames:
+            return pd.DataFrame(columns=columns)
+        return pd.concat(frames, ignore_index=True)[columns]
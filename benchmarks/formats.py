@@ -0,0 +1,128 @@
+"""
+Payload size and encode time of the row formats a client can ask for.
+
+The full dataset is encoded the way GET /data streams it, chunk by chunk,
+in each format of app.formats. The client's decode time is shown too,
+with the usual library for each format. A last row encodes the rows as
+dicts with orjson for reference, which is slower than pandas' encoder for
+records because every row becomes Python objects first.
+
+    python benchmarks/formats.py
+    python benchmarks/formats.py --rows 5000000 --repeat 3
+"""
+
+import argparse
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import orjson
+import pandas as pd
+import pyarrow as pa
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from app.data_set import DataSet  # noqa: E402
+from app.formats import ARROW, BYTES, CSV, JSON, MSGPACK, NDJSON  # noqa: E402
+
+
+def decoders() -> dict:
+    decode = {
+        JSON: json.loads,
+        NDJSON: lambda body: [json.loads(line) for line in body.splitlines()],
+        CSV: lambda body: pd.read_csv(io.BytesIO(body)),
+        ARROW: lambda body: pa.ipc.open_stream(body).read_all(),
+    }
+    try:
+        import msgpack
+
+        decode[MSGPACK] = msgpack.unpackb
+    except ImportError:
+        pass
+    return decode
+
+
+def best_of(repeat: int, function) -> tuple:
+    """Fastest of repeat calls in seconds, with the last result."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - start)
+    return min(times), result
+
+
+def synthetic(rows: int, directory: str) -> str:
+    path = os.path.join(directory, "synthetic.parquet")
+    rng = np.random.default_rng(0)
+    pd.DataFrame(
+        {
+            "lat": np.round(rng.uniform(-60.0, 80.0, rows), 2),
+            "lon": np.round(rng.uniform(-180.0, 180.0, rows), 2),
+            "GWRPM25": rng.gamma(2.0, 5.0, rows).astype(np.float32),
+        }
+    ).to_parquet(path, index=False)
+    return path
+
+
+def run(path: str, repeat: int) -> None:
+    data_set = DataSet(path)
+    rows = len(data_set.store)
+    print(f"{path}: {rows} rows, best of {repeat}")
+    print(
+        f"{'format':<38}{'MB':>9}{'bytes/row':>11}{'encode s':>10}"
+        f"{'rows/s':>13}{'decode s':>10}"
+    )
+    decode = decoders()
+
+    def report(name, seconds, body, decode_s):
+        size = len(body)
+        decoded = "n/a" if decode_s is None else f"{decode_s:.3f}"
+        print(
+            f"{name:<38}{size / 1e6:>9.2f}{size / max(rows, 1):>11.1f}"
+            f"{seconds:>10.3f}{rows / seconds:>13,.0f}{decoded:>10}"
+        )
+
+    for fmt in (JSON, NDJSON, CSV, MSGPACK, ARROW):
+        joiner = b"" if fmt in BYTES else ""
+        seconds, body = best_of(
+            repeat, lambda: joiner.join(data_set.iter_full_data(fmt=fmt))
+        )
+        decode_s = None
+        if fmt in decode:
+            decode_s, _ = best_of(repeat, lambda: decode[fmt](body))
+        report(fmt, seconds, body, decode_s)
+
+    rows_df = data_set.df.reset_index().rename(columns={"index": "id"})
+    seconds, body = best_of(
+        repeat, lambda: orjson.dumps(rows_df.to_dict(orient="records"))
+    )
+    report("orjson of row dicts (reference)", seconds, body, None)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--rows", type=int, help="benchmark a synthetic file of this many rows"
+    )
+    parser.add_argument(
+        "--file",
+        default=os.path.join(ROOT, "app", "pm25_data_final.parquet"),
+        help="Parquet file to load (default: the app's data)",
+    )
+    parser.add_argument("--repeat", type=int, default=5, help="runs per format")
+    args = parser.parse_args()
+    if args.rows:
+        with tempfile.TemporaryDirectory() as directory:
+            run(synthetic(args.rows, directory), args.repeat)
+    else:
+        run(args.file, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""
+Lookup throughput and latency of the WSGI and ASGI serving paths under slow readers.
+
+Each server runs in its own process on the app's data. While a crowd of
+slow clients stream GET /data and read it a little at a time, a few fast
+clients fetch random ids as quickly as they can. The fast clients' request
+rate and latency show how well each server keeps lookups moving.
+
+    python benchmarks/serving.py
+    python benchmarks/serving.py --slow 500 --fast 32 --seconds 20
+
+The WSGI path is Werkzeug's threaded server, as run.py starts it. The ASGI
+path is app.asgi under uvicorn, which must be installed.
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+HOST = "127.0.0.1"
+
+
+def serve(mode: str, port: int) -> None:
+    if mode == "wsgi":
+        from werkzeug.serving import run_simple
+
+        from app import create_app
+
+        run_simple(HOST, port, create_app(), threaded=True)
+    else:
+        import uvicorn
+
+        from app.asgi import create_asgi_app
+
+        uvicorn.run(create_asgi_app(), host=HOST, port=port, log_level="warning")
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind((HOST, 0))
+        return sock.getsockname()[1]
+
+
+async def wait_until_up(port: int, timeout: float = 120.0) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            _, writer = await asyncio.open_connection(HOST, port)
+            writer.close()
+            return
+        except OSError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.2)
+
+
+async def get(port: int, path: str) -> bytes:
+    reader, writer = await asyncio.open_connection(HOST, port)
+    writer.write(
+        f"GET {path} HTTP/1.1\r\nHost: {HOST}\r\nConnection: close\r\n\r\n".encode()
+    )
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    return response
+
+
+async def slow_reader(port: int, stop: asyncio.Event, delay: float, read: list):
+    """Stream the full dataset over and over, reading 16 KiB per delay."""
+    while not stop.is_set():
+        try:
+            reader, writer = await asyncio.open_connection(HOST, port)
+        except OSError:
+            await asyncio.sleep(delay)
+            continue
+        writer.write(
+            f"GET /data HTTP/1.1\r\nHost: {HOST}\r\nConnection: close\r\n\r\n".encode()
+        )
+        while not stop.is_set():
+            chunk = await reader.read(16384)
+            if not chunk:
+                break
+            read[0] += len(chunk)
+            await asyncio.sleep(delay)
+        writer.close()
+
+
+async def fast_client(port: int, stop: asyncio.Event, ids: int, latencies: list):
+    while not stop.is_set():
+        start = time.perf_counter()
+        response = await get(port, f"/data/{random.randrange(ids)}")
+        if b" 200 " in response.split(b"\r\n", 1)[0]:
+            latencies.append(time.perf_counter() - start)
+
+
+async def load(port: int, args) -> dict:
+    await wait_until_up(port)
+    stop = asyncio.Event()
+    read = [0]
+    latencies = []
+    slow = [
+        asyncio.ensure_future(slow_reader(port, stop, args.delay, read))
+        for _ in range(args.slow)
+    ]
+    # let the slow readers connect before timing lookups
+    await asyncio.sleep(1.0)
+    latencies.clear()
+    fast = [
+        asyncio.ensure_future(fast_client(port, stop, args.ids, latencies))
+        for _ in range(args.fast)
+    ]
+    await asyncio.sleep(args.seconds)
+    stop.set()
+    await asyncio.wait(fast, timeout=30)
+    for task in slow:
+        task.cancel()
+    await asyncio.gather(*slow, return_exceptions=True)
+    latencies.sort()
+
+    def percentile(p: float) -> float:
+        if not latencies:
+            return float("nan")
+        return latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1000
+
+    return {
+        "rps": len(latencies) / args.seconds,
+        "p50": percentile(0.50),
+        "p99": percentile(0.99),
+        "slow_mb_s": read[0] / args.seconds / 1e6,
+    }
+
+
+def run(args) -> None:
+    print(f"{args.slow} slow readers, {args.fast} fast clients, {args.seconds:.0f}s")
+    print(f"{'mode':<6}{'lookups/s':>11}{'p50 ms':>9}{'p99 ms':>9}{'slow MB/s':>11}")
+    for mode in args.modes:
+        if mode == "asgi":
+            try:
+                import uvicorn  # noqa: F401
+            except ImportError:
+                print(f"{mode:<6}  skipped, uvicorn is not installed")
+                continue
+        port = free_port()
+        server = subprocess.Popen(
+            [sys.executable, __file__, "--serve", mode, str(port)],
+            cwd=ROOT,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        try:
+            result = asyncio.run(load(port, args))
+        finally:
+            server.terminate()
+            server.wait()
+        print(
+            f"{mode:<6}{result['rps']:>11.1f}{result['p50']:>9.2f}"
+            f"{result['p99']:>9.2f}{result['slow_mb_s']:>11.2f}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--serve", nargs=2, help=argparse.SUPPRESS)
+    parser.add_argument("--slow", type=int, default=200, help="slow streaming clients")
+    parser.add_argument("--fast", type=int, default=16, help="fast lookup clients")
+    parser.add_argument("--seconds", type=float, default=10.0, help="time to measure")
+    parser.add_argument(
+        "--delay", type=float, default=0.05, help="slow readers' pause per 16 KiB"
+    )
+    parser.add_argument("--ids", type=int, default=11621, help="ids to look up")
+    parser.add_argument("--modes", nargs="+", default=["wsgi", "asgi"])
+    args = parser.parse_args()
+    if args.serve:
+        serve(args.serve[0], int(args.serve[1]))
+    else:
+        run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+"""
+Startup time and memory of the DataSet load modes.
+
+Each mode is loaded in a fresh interpreter, which reports the time to load,
+the time of a first lookup and its resident memory after loading. RSS is
+split into anonymous memory (the heap, private to the process) and file
+backed memory (mapped pages that live in the shared page cache).
+
+    python benchmarks/startup.py
+    python benchmarks/startup.py --rows 5000000
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+MODES = [
+    ("eager", "native"),
+    ("eager", "float32"),
+    ("eager", "quantized"),
+    ("mmap", "native"),
+    ("mmap", "float32"),
+    ("mmap", "quantized"),
+]
+
+
+def memory_kb() -> dict:
+    """Current RSS split from /proc (Linux), peak RSS from getrusage."""
+    usage = {"peak_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss}
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                key, _, value = line.partition(":")
+                if key in ("VmRSS", "RssAnon", "RssFile"):
+                    usage[key] = int(value.split()[0])
+    except FileNotFoundError:
+        pass
+    return usage
+
+
+def child(path: str, load: str, dtypes: str) -> None:
+    from app.data_set import DataSet
+
+    before = memory_kb()
+    start = time.perf_counter()
+    data_set = DataSet(path, load=load, dtypes=dtypes)
+    loaded = time.perf_counter()
+    data_set.get_datum_by_id(len(data_set.store) // 2)
+    first_lookup = time.perf_counter()
+    after = memory_kb()
+    print(
+        json.dumps(
+            {
+                "load_s": loaded - start,
+                "first_lookup_ms": (first_lookup - loaded) * 1000,
+                "before": before,
+                "after": after,
+            }
+        )
+    )
+
+
+def synthetic(rows: int, directory: str) -> str:
+    path = os.path.join(directory, "synthetic.parquet")
+    rng = np.random.default_rng(0)
+    pd.DataFrame(
+        {
+            "lat": np.round(rng.uniform(-60.0, 80.0, rows), 2),
+            "lon": np.round(rng.uniform(-180.0, 180.0, rows), 2),
+            "GWRPM25": rng.gamma(2.0, 5.0, rows).astype(np.float32),
+        }
+    ).to_parquet(path, index=False)
+    return path
+
+
+def run(path: str) -> None:
+    from app.mapped import build_cache, cache_path
+
+    print(f"{path}: {pd.read_parquet(path, columns=['lat']).shape[0]} rows")
+    header = f"{'mode':<18}{'load s':>9}{'lookup ms':>11}{'rss MB':>9}"
+    print(header + f"{'anon MB':>9}{'file MB':>9}{'peak MB':>9}{'cache s':>9}")
+    for load, dtypes in MODES:
+        cache_s = ""
+        if load == "mmap":
+            # the one-off conversion is reported separately from startup
+            start = time.perf_counter()
+            build_cache(path, cache_path(path, dtypes), dtypes)
+            cache_s = f"{time.perf_counter() - start:.2f}"
+        output = subprocess.run(
+            [sys.executable, __file__, "--child", path, load, dtypes],
+            check=True,
+            capture_output=True,
+            text=True,
+            cwd=ROOT,
+        ).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        before, after = result["before"], result["after"]
+
+        def grown(key: str) -> str:
+            if key not in after:
+                return "n/a"
+            return f"{(after[key] - before.get(key, 0)) / 1024:.1f}"
+
+        print(
+            f"{load + '/' + dtypes:<18}{result['load_s']:>9.3f}"
+            f"{result['first_lookup_ms']:>11.2f}{grown('VmRSS'):>9}"
+            f"{grown('RssAnon'):>9}{grown('RssFile'):>9}"
+            f"{after['peak_rss'] / 1024:>9.1f}{cache_s:>9}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--child", nargs=3, help=argparse.SUPPRESS)
+    parser.add_argument(
+        "--rows", type=int, help="benchmark a synthetic file of this many rows"
+    )
+    parser.add_argument(
+        "--file",
+        default=os.path.join(ROOT, "app", "pm25_data_final.parquet"),
+        help="Parquet file to load (default: the app's data)",
+    )
+    args = parser.parse_args()
+    if args.child:
+        child(*args.child)
+    elif args.rows:
+        with tempfile.TemporaryDirectory() as directory:
+            run(synthetic(args.rows, directory))
+    else:
+        run(args.file)
+
+
+if __name__ == "__main__":
+    main()
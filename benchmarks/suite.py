@@ -0,0 +1,319 @@
+"""
+Latency and peak memory of DataSet methods and routes across dataset sizes.
+
+Each size runs in a fresh interpreter on a synthetic grid like the app's
+data: a regular 0.01 degree lat/lon grid with 30% of cells missing, as over
+the sea. Every method is called until it has run for at least --min-time
+seconds (and at least 3 times) and its median, p95 and minimum latency are
+kept. Peak memory is the tracemalloc peak of one more call, so it counts
+Python and numpy allocations made by the call. Routes are timed through the
+Flask test client with the response cache off, so each request renders.
+
+Results are written as JSON with the commit and environment, compare two
+runs to spot regressions:
+
+    python benchmarks/suite.py
+    python benchmarks/suite.py --sizes 10000 100000 1000000 10000000
+    python benchmarks/suite.py --output before.json
+    python benchmarks/suite.py --compare before.json after.json
+"""
+
+import argparse
+import gc
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+STEP = 0.01
+# share of grid cells without a value
+MISSING = 0.3
+# larger sizes skip the full-dataset benchmarks unless --full is given
+FULL_DATA_ROWS = 1_000_000
+# coordinates per sampling call
+SAMPLE_POINTS = 100_000
+
+
+def grid_frame(rows: int, seed: int = 0) -> pd.DataFrame:
+    """
+    Synthetic PM2.5 on a regular STEP degree grid, rows cells with values
+    out of a near-square block, stored through float32 like the NetCDF data.
+    """
+    rng = np.random.default_rng(seed)
+    cells = int(np.ceil(rows / (1 - MISSING)))
+    n_lon = int(np.ceil(np.sqrt(cells)))
+    n_lat = int(np.ceil(cells / n_lon))
+    kept = np.sort(rng.choice(n_lat * n_lon, size=rows, replace=False))
+    row, col = np.divmod(kept, n_lon)
+    lat = (-40.0 + STEP / 2 + row * STEP).astype(np.float32)
+    lon = (-20.0 + STEP / 2 + col * STEP).astype(np.float32)
+    return pd.DataFrame(
+        {
+            "lat": lat.astype(np.float64),
+            "lon": lon.astype(np.float64),
+            "GWRPM25": rng.gamma(2.0, 5.0, rows).astype(np.float32),
+        }
+    )
+
+
+def measure(function, min_time: float, max_calls: int = 10000) -> dict:
+    """Latency statistics in milliseconds and tracemalloc peak in MiB."""
+    function()
+    samples = []
+    started = time.perf_counter()
+    while len(samples) < 3 or (
+        time.perf_counter() - started < min_time and len(samples) < max_calls
+    ):
+        start = time.perf_counter()
+        function()
+        samples.append((time.perf_counter() - start) * 1000)
+    gc.collect()
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    samples = np.array(samples)
+    return {
+        "calls": len(samples),
+        "median_ms": float(np.median(samples)),
+        "p95_ms": float(np.percentile(samples, 95)),
+        "min_ms": float(samples.min()),
+        "peak_mib": peak / (1 << 20),
+    }
+
+
+def cases(data_set, frame: pd.DataFrame, full: bool, rng) -> dict:
+    """Benchmark name -> function, each call working on fresh arguments."""
+    points = frame.sample(1000, replace=True, random_state=1)[["lat", "lon"]].to_numpy()
+    span_lat = frame["lat"].max() - frame["lat"].min()
+    span_lon = frame["lon"].max() - frame["lon"].min()
+    ids = iter(rng.permutation(len(frame)).tolist())
+    lat_range = frame["lat"].min(), frame["lat"].max()
+    lon_range = frame["lon"].min(), frame["lon"].max()
+
+    def sample_points():
+        return rng.uniform(*lat_range, SAMPLE_POINTS), rng.uniform(
+            *lon_range, SAMPLE_POINTS
+        )
+
+    def point():
+        return points[rng.integers(len(points))]
+
+    def bbox():
+        # about 1% of the area
+        lat, lon = point()
+        return lat, lon, lat + span_lat / 10, lon + span_lon / 10
+
+    functions = {
+        "get_datum_by_id": lambda: data_set.get_datum_by_id(
+            int(rng.integers(len(frame)))
+        ),
+        "filter_data": lambda: data_set.filter_data(*point()),
+        "bbox_data": lambda: data_set.bbox_data(*bbox()),
+        "nearest_data": lambda: data_set.nearest_data(*point(), k=10),
+        "within_data": lambda: data_set.within_data(*point(), radius_km=10),
+        "get_stats": data_set.get_stats,
+        "bbox_stats": lambda: data_set.bbox_stats(*bbox()),
+        "distribution": data_set.distribution,
+        "bbox_distribution": lambda: data_set.distribution(bbox=bbox()),
+        "sample_bilinear": lambda: data_set.sample(*sample_points()),
+        "add_data_entry": lambda: data_set.add_data_entry(*point(), 7.5),
+        "delete_data_entry": lambda: data_set.delete_data_entry(next(ids)),
+    }
+    if full:
+        functions["get_full_data"] = data_set.get_full_data
+    return functions
+
+
+def route_cases(client, data_set, frame: pd.DataFrame, full: bool, rng) -> dict:
+    points = frame.sample(1000, replace=True, random_state=2)[["lat", "lon"]].to_numpy()
+    rows = data_set.snapshot().rows
+    # the method benchmarks deleted some
+    ids = rows.ids(rows.live_slots())
+
+    def get(path_of):
+        def call():
+            lat, lon = points[rng.integers(len(points))]
+            response = client.get(path_of(lat, lon))
+            assert response.status_code == 200, response.status_code
+            response.get_data()
+
+        return call
+
+    routes = {
+        "GET /data/<id>": get(lambda lat, lon: f"/data/{ids[rng.integers(len(ids))]}"),
+        "GET /data/filter": get(lambda lat, lon: f"/data/filter/{lat}/{lon}"),
+        "GET /data/nearest": get(
+            lambda lat, lon: f"/data/nearest?lat={lat}&lon={lon}&k=10"
+        ),
+        "GET /data/within": get(
+            lambda lat, lon: f"/data/within?lat={lat}&lon={lon}&radius_km=10"
+        ),
+        "GET /data/stats": get(lambda lat, lon: "/data/stats"),
+        "GET /data/stats?bbox": get(
+            lambda lat, lon: f"/data/stats?bbox={lat},{lon},{lat + 1},{lon + 1}"
+        ),
+        "GET /data/stats/distribution": get(
+            lambda lat, lon: "/data/stats/distribution"
+        ),
+        "GET /data?limit=1000": get(lambda lat, lon: "/data?limit=1000"),
+    }
+
+    def post():
+        lat, lon = points[rng.integers(len(points))]
+        response = client.post("/data", json={"lat": lat, "lon": lon, "gwrpm25": 7.5})
+        assert response.status_code == 201, response.status_code
+
+    routes["POST /data"] = post
+    if full:
+        routes["GET /data"] = get(lambda lat, lon: "/data")
+    return routes
+
+
+def child(rows: int, min_time: float, full: bool) -> None:
+    from app import create_app
+    from app.data_set import DataSet
+
+    rng = np.random.default_rng(0)
+    frame = grid_frame(rows)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "grid.parquet")
+        frame.to_parquet(path, index=False)
+        start = time.perf_counter()
+        data_set = DataSet(path)
+        load_s = time.perf_counter() - start
+
+    full = full or rows <= FULL_DATA_ROWS
+    results = {"rows": rows, "load_s": load_s, "methods": {}, "routes": {}}
+    for name, function in cases(data_set, frame, full, rng).items():
+        results["methods"][name] = measure(function, min_time)
+        print(f"  {name}", file=sys.stderr)
+
+    # the client calls back to back, admission would only measure itself
+    app = create_app({"RESPONSE_CACHE_BYTES": 0, "ADMISSION": False})
+    app.data_set = data_set
+    client = app.test_client()
+    for name, function in route_cases(client, data_set, frame, full, rng).items():
+        results["routes"][name] = measure(function, min_time)
+        print(f"  {name}", file=sys.stderr)
+    print(json.dumps(results))
+
+
+def environment() -> dict:
+    def git(*args):
+        try:
+            return subprocess.run(
+                ["git", *args], cwd=ROOT, capture_output=True, text=True, check=True
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return None
+
+    return {
+        "commit": git("rev-parse", "HEAD"),
+        "dirty": bool(git("status", "--porcelain", "--untracked-files=no")),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "pandas": pd.__version__,
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+
+
+def run(args) -> None:
+    report = {"environment": environment(), "min_time": args.min_time, "sizes": []}
+    for rows in args.sizes:
+        print(f"{rows} rows", file=sys.stderr)
+        command = [sys.executable, __file__, "--child", str(rows)]
+        command += ["--min-time", str(args.min_time)] + (
+            ["--full"] if args.full else []
+        )
+        output = subprocess.run(
+            command, check=True, stdout=subprocess.PIPE, text=True, cwd=ROOT
+        ).stdout
+        report["sizes"].append(json.loads(output.strip().splitlines()[-1]))
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=2)
+    print_report(report)
+    print(f"written to {args.output}")
+
+
+def print_report(report: dict) -> None:
+    print(
+        f"{'rows':>10}  {'benchmark':<24}{'median ms':>11}{'p95 ms':>10}{'peak MiB':>10}"
+    )
+    for size in report["sizes"]:
+        print(f"{size['rows']:>10}  {'load':<24}{size['load_s'] * 1000:>11.1f}")
+        for group in ("methods", "routes"):
+            for name, result in size[group].items():
+                print(
+                    f"{size['rows']:>10}  {name:<24}{result['median_ms']:>11.3f}"
+                    f"{result['p95_ms']:>10.3f}{result['peak_mib']:>10.2f}"
+                )
+
+
+def compare(before_path: str, after_path: str, threshold: float) -> int:
+    """Print median latency and peak memory ratios, 1 if any is over threshold."""
+    with open(before_path) as file:
+        before = {size["rows"]: size for size in json.load(file)["sizes"]}
+    with open(after_path) as file:
+        after = {size["rows"]: size for size in json.load(file)["sizes"]}
+    print(f"{'rows':>10}  {'benchmark':<24}{'time x':>8}{'memory x':>10}")
+    regressed = False
+    for rows in sorted(before.keys() & after.keys()):
+        for group in ("methods", "routes"):
+            old, new = before[rows][group], after[rows][group]
+            for name in sorted(old.keys() & new.keys()):
+                time_ratio = new[name]["median_ms"] / max(old[name]["median_ms"], 1e-9)
+                memory_ratio = (new[name]["peak_mib"] + 1) / (old[name]["peak_mib"] + 1)
+                flag = ""
+                if time_ratio > threshold or memory_ratio > threshold:
+                    flag, regressed = "  regression", True
+                print(
+                    f"{rows:>10}  {name:<24}{time_ratio:>8.2f}{memory_ratio:>10.2f}{flag}"
+                )
+    return 1 if regressed else 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--child", type=int, help=argparse.SUPPRESS)
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000]
+    )
+    parser.add_argument(
+        "--min-time", type=float, default=0.5, help="seconds to time each benchmark"
+    )
+    parser.add_argument(
+        "--full",
+        action="store_true",
+        help=f"time full-dataset reads above {FULL_DATA_ROWS} rows too",
+    )
+    parser.add_argument("--output", default="benchmark-results.json")
+    parser.add_argument(
+        "--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="compare two results"
+    )
+    parser.add_argument(
+        "--threshold", type=float, default=1.25, help="ratio --compare flags"
+    )
+    args = parser.parse_args()
+    if args.child:
+        child(args.child, args.min_time, args.full)
+    elif args.compare:
+        sys.exit(compare(*args.compare, args.threshold))
+    else:
+        run(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,43 +1,176 @@
+"""
+Convert the NetCDF PM2.5 grids to Parquet for the app.
+
+The grid is cut into bands of latitude, one SORT_CELL degree row of cells
+each. Worker processes read a band, drop its NaN cells and sort it by
+spatial key, and the bands are written in order through one Parquet writer.
+Bands come in ascending cell order, so the file is sorted by the same key
+as app.years.write_year. Only a few bands are in flight at a time, so
+memory is bounded by the band size and the number of workers, not the size
+of the grid.
+
+The layout of the files comes from app/partitions.py, which needs only
+numpy, so this script runs with just requirements-data.txt installed.
+Paths are relative to the repository root:
+
+    python data/create_dataset.py
+    python data/create_dataset.py --workers 8
+    python data/create_dataset.py --years ./data/yearly
+"""
+
+import argparse
+import glob
+import os
+import re
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
 import xarray as xr
-import pandas as pd
 import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.partitions import (  # noqa: E402
+    ROW_GROUP_ROWS,
+    SORT_CELL,
+    partition_path,
+    spatial_order,
+)
 
 file_name = "./data/sdei-global-annual-gwr-pm2-5-modis-misr-seawifs-viirs-aod-v5-gl-04-2000-netcdf/sdei-global-annual-gwr-pm2-5-modis-misr-seawifs-viirs-aod-v5-gl-04-2000-netcdf.nc"
+output_file = "./app/pm25_data_final.parquet"
+
+# the year in the name of each yearly NetCDF file, e.g. ...-gl-04-2000-netcdf.nc
+YEAR_IN_NAME = re.compile(r"-(\d{4})-netcdf\.nc$")
+# bands read ahead of the writer, per worker
+BANDS_IN_FLIGHT = 2
+
+
+def lat_bands(lats: np.ndarray) -> list:
+    """
+    Index ranges (start, stop) of the grid's latitudes, one per SORT_CELL
+    degree row of cells, in ascending cell order.
+    """
+    cells = np.floor(np.asarray(lats, dtype=np.float64) / SORT_CELL)
+    starts = np.r_[0, np.flatnonzero(np.diff(cells)) + 1]
+    stops = np.r_[starts[1:], len(cells)]
+    bands = list(zip(starts.tolist(), stops.tolist()))
+    return sorted(bands, key=lambda band: cells[band[0]])
+
+
+def read_band(path: str, start: int, stop: int) -> tuple:
+    """
+    The non-NaN cells of latitudes start to stop, sorted by spatial key.
+
+    :return: Tuple of (Arrow table of lat, lon and GWRPM25, number of cells
+        read including NaN).
+    """
+    with xr.open_dataset(path) as dataset:
+        pm25 = dataset["GWRPM25"].isel(lat=slice(start, stop))
+        values = pm25.transpose("lat", "lon").values
+        lats = pm25["lat"].values
+        lons = pm25["lon"].values
+    rows, cols = np.nonzero(~np.isnan(values))
+    lat, lon, value = lats[rows], lons[cols], values[rows, cols]
+    order = spatial_order(lat, lon)
+    table = pa.table({"lat": lat[order], "lon": lon[order], "GWRPM25": value[order]})
+    return table, values.size
+
+
+def convert(path: str, output: str, workers: Optional[int] = None) -> int:
+    """
+    Write the non-NaN cells of one NetCDF file to output, see the module
+    docstring. Prints progress and throughput as it goes.
+
+    :return: Number of rows written.
+    """
+    workers = workers or os.cpu_count() or 1
+    with xr.open_dataset(path) as dataset:
+        bands = lat_bands(dataset["lat"].values)
+    print(f"{path}: {len(bands)} bands on {workers} workers")
 
+    temp_path = output + ".tmp"
+    writer = None
+    rows = cells = done = 0
+    started = time.perf_counter()
 
-def create_dataset():
-    dataset = xr.open_dataset(file_name, chunks={"latitude": 100, "longitude": 1})
+    def write(future) -> None:
+        nonlocal writer, rows, cells, done
+        table, band_cells = future.result()
+        if writer is None:
+            writer = pq.ParquetWriter(temp_path, table.schema)
+        writer.write_table(table, row_group_size=ROW_GROUP_ROWS)
+        rows += table.num_rows
+        cells += band_cells
+        done += 1
+        elapsed = time.perf_counter() - started
+        print(
+            f"band {done}/{len(bands)}: {rows} rows, "
+            f"{cells / elapsed:,.0f} cells/s, {rows / elapsed:,.0f} rows/s"
+        )
 
-    pm25 = dataset["GWRPM25"]
+    try:
+        with ProcessPoolExecutor(workers) as pool:
+            pending = deque()
+            for start, stop in bands:
+                pending.append(pool.submit(read_band, path, start, stop))
+                if len(pending) >= BANDS_IN_FLIGHT * workers:
+                    write(pending.popleft())
+            while pending:
+                write(pending.popleft())
+    finally:
+        if writer is not None:
+            writer.close()
+    if writer is None:
+        raise ValueError(f"{path} has no latitudes")
+    os.replace(temp_path, output)
 
-    data_chunks = []
+    elapsed = time.perf_counter() - started
+    print(f"NaN count: {cells - rows}, Total count: {cells}")
+    print(f"final df length: {rows}, {elapsed:.1f}s, {rows / elapsed:,.0f} rows/s")
+    return rows
 
-    nan_count = pm25.isnull().sum().values
-    total_count = pm25.size
 
-    print(pm25.min().values, pm25.max().values, pm25.mean().values)
-    print(f"NaN count: {nan_count}, Total count: {total_count}")
+def create_dataset(workers: Optional[int] = None):
+    convert(file_name, output_file, workers)
 
-    lat_chunks = list(pm25.chunks[0])
-    lon_chunks = list(pm25.chunks[1])
 
-    for i in range(len(lat_chunks)):
-        chunk = (lat_chunks[i], lon_chunks[i])
-        print(f"chunk count: {i + 1}")
-        print(f"chunk shape: {chunk[0], chunk[1]}")
-        pm25_chunk = pm25.isel(lat=slice(chunk[0]), lon=slice(chunk[1]))
-        nan_mask = np.isnan(pm25_chunk)
-        computed_mask = nan_mask.compute()
-        valid_data_chunk = pm25_chunk.where(~computed_mask, drop=False)
-        df_chunk = valid_data_chunk.to_dataframe().reset_index()
-        data_chunks.append(df_chunk)
+def year_files(source_dir: str) -> dict:
+    """The yearly NetCDF files under source_dir, by year."""
+    files = {}
+    for path in glob.glob(os.path.join(source_dir, "**", "*.nc"), recursive=True):
+        match = YEAR_IN_NAME.search(os.path.basename(path))
+        if match:
+            files[int(match.group(1))] = path
+    return files
 
-    final_df = pd.concat(data_chunks, ignore_index=True)
-    final_df = final_df[final_df["GWRPM25"].notna()]
 
-    print(f"final df length: {len(final_df)}")
-    final_df.to_parquet("./app/pm25_data_final.parquet", index=False)
+def create_partitioned_dataset(
+    source_dir: str, output_dir: str, workers: Optional[int] = None
+):
+    """Write every yearly file under source_dir as output_dir/year=YYYY."""
+    for year, path in sorted(year_files(source_dir).items()):
+        convert(path, partition_path(output_dir, year), workers)
 
 
 if __name__ == "__main__":
-    create_dataset()
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--years",
+        metavar="SOURCE_DIR",
+        help="write every yearly NetCDF file under SOURCE_DIR, one partition per year",
+    )
+    parser.add_argument("--output", default="./app/pm25_by_year")
+    parser.add_argument(
+        "--workers", type=int, default=None, help="processes, default one per core"
+    )
+    args = parser.parse_args()
+    if args.years:
+        create_partitioned_dataset(args.years, args.output, args.workers)
+    else:
+        create_dataset(args.workers)
@@ -0,0 +1,188 @@
+import asyncio
+import json
+import time
+
+import pandas as pd
+import pytest
+
+from app.asgi import HANDLER_WORKERS, AsgiApp, create_asgi_app
+from app.data_set import DataSet
+
+
+@pytest.fixture
+def asgi_app():
+    data = pd.DataFrame(
+        {
+            "lat": [44.355000, -44.2222],
+            "lon": [176.255005, -176.2222],
+            "GWRPM25": [6.2, 5.2],
+        }
+    )
+    app = create_asgi_app()
+    app.app.data_set = DataSet.__new__(DataSet)
+    app.app.data_set.df = data
+    yield app
+    app.close()
+
+
+async def call_async(
+    app: AsgiApp, method: str, path: str, body: bytes = b"", headers=()
+):
+    """Run one request through the ASGI app, return (status, headers, body)."""
+    path, _, query = path.partition("?")
+    scope = {
+        "type": "http",
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "root_path": "",
+        "query_string": query.encode(),
+        "headers": [(k.lower().encode(), v.encode()) for k, v in headers],
+        "server": ("testserver", 80),
+        "client": ("127.0.0.1", 1234),
+    }
+    requests = [{"type": "http.request", "body": body, "more_body": False}]
+    sent = []
+
+    async def receive():
+        return requests.pop(0)
+
+    async def send(message):
+        sent.append(message)
+
+    await app(scope, receive, send)
+    start = sent[0]
+    assert sent[-1]["more_body"] is False
+    return (
+        start["status"],
+        {k.decode(): v.decode() for k, v in start["headers"]},
+        b"".join(message.get("body", b"") for message in sent[1:]),
+    )
+
+
+def call(app: AsgiApp, method: str, path: str, body: bytes = b"", headers=()):
+    return asyncio.run(call_async(app, method, path, body, headers))
+
+
+class TestAsgi:
+    def test_get_stats(self, asgi_app):
+        status, headers, body = call(asgi_app, "GET", "/data/stats")
+
+        assert status == 200
+        assert headers["content-type"] == "application/json"
+        assert json.loads(body)["count"] == 2
+
+    def test_streamed_download(self, asgi_app):
+        status, headers, body = call(asgi_app, "GET", "/data")
+
+        assert status == 200
+        assert "content-length" not in headers
+        assert [row["id"] for row in json.loads(body)] == [0, 1]
+
+    def test_query_string_and_headers(self, asgi_app):
+        status, headers, body = call(
+            asgi_app, "GET", "/data?limit=1", headers=[("Accept", "application/json")]
+        )
+
+        assert status == 200
+        assert headers["link"] == '</data?after_id=0&limit=1>; rel="next"'
+        assert len(json.loads(body)) == 1
+
+    def test_post_body(self, asgi_app):
+        status, _, body = call(
+            asgi_app,
+            "POST",
+            "/data",
+            body=json.dumps({"lat": 1.0, "lon": 2.0, "gwrpm25": 3.0}).encode(),
+            headers=[("Content-Type", "application/json")],
+        )
+
+        assert status == 201
+        assert body == b"success new entry id: 2"
+        assert call(asgi_app, "GET", "/data/2")[0] == 200
+
+    def test_not_modified_has_no_body(self, asgi_app):
+        etag = call(asgi_app, "GET", "/data/stats")[1]["etag"]
+
+        status, _, body = call(
+            asgi_app, "GET", "/data/stats", headers=[("If-None-Match", etag)]
+        )
+
+        assert status == 304
+        assert body == b""
+
+    def test_lifespan(self, asgi_app):
+        messages = [{"type": "lifespan.startup"}, {"type": "lifespan.shutdown"}]
+        sent = []
+
+        async def receive():
+            return messages.pop(0)
+
+        async def send(message):
+            sent.append(message)
+
+        asyncio.run(asgi_app({"type": "lifespan"}, receive, send))
+
+        assert [m["type"] for m in sent] == [
+            "lifespan.startup.complete",
+            "lifespan.shutdown.complete",
+        ]
+
+    def test_lookups_answer_while_clients_wait_for_changes(self, asgi_app):
+        version = asgi_app.app.data_set.version
+        new_entry = json.dumps({"lat": 1.0, "lon": 2.0, "gwrpm25": 3.0}).encode()
+
+        async def run():
+            # more long-polls than handler threads
+            polls = [
+                asyncio.ensure_future(
+                    call_async(
+                        asgi_app, "GET", f"/data/changes?since={version}&wait=10"
+                    )
+                )
+                for _ in range(HANDLER_WORKERS + 2)
+            ]
+            while asgi_app.waiting < len(polls):
+                await asyncio.sleep(0.01)
+            start = time.monotonic()
+            lookup = await call_async(asgi_app, "GET", "/data/1")
+            elapsed = time.monotonic() - start
+            still_waiting = not any(poll.done() for poll in polls)
+            await call_async(
+                asgi_app,
+                "POST",
+                "/data",
+                body=new_entry,
+                headers=[("Content-Type", "application/json")],
+            )
+            return lookup, elapsed, still_waiting, await asyncio.gather(*polls)
+
+        lookup, elapsed, still_waiting, polls = asyncio.run(run())
+
+        assert lookup[0] == 200
+        assert elapsed < 1.0
+        assert still_waiting
+        assert all(status == 200 for status, _, _ in polls)
+        assert all(len(json.loads(body)["changes"]) == 1 for _, _, body in polls)
+
+    def test_waiters_over_the_limit_are_turned_away(self, asgi_app):
+        waiters = AsgiApp(asgi_app.app, wait_workers=1)
+        version = asgi_app.app.data_set.version
+        path = f"/data/changes?since={version}&wait=0.5"
+
+        async def run():
+            first = asyncio.ensure_future(call_async(waiters, "GET", path))
+            while not waiters.waiting:
+                await asyncio.sleep(0.01)
+            second = await call_async(waiters, "GET", path)
+            return await first, second
+
+        try:
+            first, second = asyncio.run(run())
+        finally:
+            waiters.close()
+
+        assert first[0] == 200
+        assert second[0] == 503
+        assert second[1]["retry-after"] == "1"
@@ -1,11 +1,15 @@
 import json
+import threading
 
 import pytest
 import pandas as pd
+import pyarrow as pa
 from flask import current_app
 
 from app import create_app
+from app.admission import BULK, LIMITS
 from app.data_set import DataSet
+from app.years import write_year
 
 
 @pytest.fixture
@@ -55,6 +59,56 @@ class TestGetDataRoute:
 
             assert response.status_code == 500
 
+    def test_get_data_page(self, client, app, dataset):
+        with app.app_context():
+            current_app.data_set = dataset
+            response = client.get("/data?limit=1")
+
+            assert response.status_code == 200
+            assert (
+                response.data.decode("utf-8")
+                == '[{"id":0,"lat":44.355,"lon":176.255005,"GWRPM25":6.2}]'
+            )
+            assert response.headers["Link"] == '</data?after_id=0&limit=1>; rel="next"'
+
+            response = client.get("/data?after_id=0&limit=1")
+
+            assert (
+                response.data.decode("utf-8")
+                == '[{"id":1,"lat":-44.2222,"lon":-176.2222,"GWRPM25":5.2}]'
+            )
+            assert "Link" not in response.headers
+
+    def test_get_data_page_bad_limit(self, client, app, dataset):
+        with app.app_context():
+            current_app.data_set = dataset
+            response = client.get("/data?limit=0")
+
+            assert response.status_code == 400
+
+    def test_get_data_ndjson(self, client, app, dataset):
+        with app.app_context():
+            current_app.data_set = dataset
+            response = client.get("/data", headers={"Accept": "application/x-ndjson"})
+            rows = [json.loads(line) for line in response.data.splitlines()]
+
+            assert response.status_code == 200
+            assert response.mimetype == "application/x-ndjson"
+            assert [row["id"] for row in rows] == [0, 1]
+
+    def test_get_data_ndjson_page(self, client, app, dataset):
+        app.data_set = dataset
+        ndjson = {"Accept": "application/x-ndjson"}
+        response = client.get("/data?limit=1", headers=ndjson)
+
+        assert [json.loads(line)["id"] for line in response.data.splitlines()] == [0]
+        assert response.headers["Link"] == '</data?after_id=0&limit=1>; rel="next"'
+
+        response = client.get("/data?after_id=0&limit=1", headers=ndjson)
+
+        assert [json.loads(line)["id"] for line in response.data.splitlines()] == [1]
+        assert "Link" not in response.headers
+
 
 class TestGetDatumByIdRoute:
     def test_get_datum_by_id_success(self, client, app, dataset):
@@ -98,6 +152,18 @@ class TestPostData:
             )
             assert response.status_code == 201
 
+    def test_post_data_returns_new_id(self, client, app, dataset):
+        with app.app_context():
+            current_app.data_set = dataset
+            client.delete(f"/data/{0}")
+            data = {"lat": 40.7128, "lon": 74.0060, "gwrpm25": 12.5}
+            response = client.post(
+                "/data", data=json.dumps(data), content_type="application/json"
+            )
+            assert response.status_code == 201
+            assert response.data.decode("utf-8") == "success new entry id: 2"
+            assert current_app.data_set.get_datum_by_id(1)["GWRPM25"] == 5.2
+
     def test_post_data_fail(self, client, app, dataset):
         with app.app_context():
             current_app.data_set = None
@@ -107,6 +173,14 @@ class TestPostData:
             )
             assert response.status_code == 500
 
+    def test_post_data_log_failure(self, client, app, dataset, mocker):
+        app.data_set = dataset
+        mocker.patch.object(dataset, "add_data_entry", side_effect=OSError("disk full"))
+        response = client.post("/data", json={"lat": 1.0, "lon": 2.0, "gwrpm25": 3.0})
+
+        assert response.status_code == 503
+        assert response.headers["Retry-After"] == "1"
+
     def test_post_data_success_type_change(self, client, app, dataset):
         with app.app_context():
             current_app.data_set = dataset
@@ -139,6 +213,15 @@ class TestPutData:
             assert current_app.data_set.df.loc[0]["lon"] == 1.0
             assert current_app.data_set.df.loc[0]["GWRPM25"] == 1.0
 
+    def test_put_datum_by_id_not_found(self, client, app, dataset):
+        with app.app_context():
+            current_app.data_set = dataset
+            data = {"lat": 1.0, "lon": 1.0, "gwrpm25": 1.0}
+            response = client.put(
+                f"/data/{999}", data=json.dumps(data), content_type="application/json"
+            )
+            assert response.status_code == 404
+
     def test_put_datum_by_id_fail(self, client, app, dataset):
         with app.app_context():
             current_app.data_set = None
@@ -188,6 +271,14 @@ class TestDeleteData:
             assert response.status_code == 200
             assert 0 not in current_app.data_set.df.index
 
+    def test_delete_data_not_found(self, client, app, dataset):
+        with app.app_context():
+            current_app.data_set = dataset
+            client.delete(f"/data/{0}")
+            response = client.delete(f"/data/{0}")
+
+            assert response.status_code == 404
+
     def test_delete_data_fail(self, client, app, dataset):
         with app.app_context():
             current_app.data_set = None
@@ -235,6 +326,11 @@ class TestFilterData:
             response = client.get(f"/data/filter/hello/1.0")
             assert response.status_code == 400
 
+    @pytest.mark.parametrize("point", ["nan/1.0", "inf/1.0", "1.0/-inf", "91/1.0"])
+    def test_filter_data_out_of_range(self, client, app, dataset, point):
+        app.data_set = dataset
+        assert client.get(f"/data/filter/{point}").status_code == 400
+
     def test_filter_data_fail(self, client, app, dataset):
         with app.app_context():
             current_app.data_set = None
@@ -260,3 +356,875 @@ class TestGetStats:
             current_app.data_set = None
             response = client.get("/data/stats")
             assert response.status_code == 500
+
+    def test_get_stats_bbox(self, client, app, dataset):
+        with app.app_context():
+            current_app.data_set = dataset
+            response = client.get("/data/stats?bbox=-45,-177,-44,-176")
+            assert response.status_code == 200
+            assert json.loads(response.data.decode("utf-8")) == {
+                "average": 5.2,
+                "count": 1,
+                "sum": 5.2,
+            }
+
+    def test_get_stats_polygon(self, client, app, dataset):
+        with app.app_context():
+            current_app.data_set = dataset
+            client.delete("/data/1")
+            response = client.get("/data/stats?polygon=-45,-177,-44,-177,-44,-176")
+            assert response.status_code == 200
+            assert json.loads(response.data.decode("utf-8")) == {
+                "average": None,
+                "count": 0,
+                "sum": 0.0,
+            }
+
+    def test_get_stats_bad_region(self, client, app, dataset):
+        with app.app_context():
+            current_app.data_set = dataset
+            assert client.get("/data/stats?bbox=1,2,3").status_code == 400
+            assert client.get("/data/stats?bbox=3,2,1,4").status_code == 400
+            assert client.get("/data/stats?polygon=1,2,3,4").status_code == 400
+
+
+class TestBboxData:
+    def test_bbox_data_success(self, client, app, dataset):
+        with app.app_context():
+            current_app.data_set = dataset
+            response = client.get(
+                "/data/bbox?min_lat=40&min_lon=170&max_lat=50&max_lon=180"
+            )
+            assert response.status_code == 200
+            assert (
+                response.data.decode("utf-8")
+                == '[{"id":0,"lat":44.355,"lon":176.255005,"GWRPM25":6.2}]'
+            )
+
+    def test_bbox_data_missing_param(self, client, app, dataset):
+        with app.app_context():
+            current_app.data_set = dataset
+            response = client.get("/data/bbox?min_lat=40&min_lon=170&max_lat=50")
+            assert response.status_code == 400
+
+    def test_bbox_data_inverted_lat(self, client, app, dataset):
+        with app.app_context():
+            current_app.data_set = dataset
+            response = client.get(
+                "/data/bbox?min_lat=50&min_lon=170&max_lat=40&max_lon=180"
+            )
+            assert response.status_code == 400
+
+    @pytest.mark.parametrize(
+        "query",
+        [
+            "min_lat=-inf&min_lon=170&max_lat=50&max_lon=180",
+            "min_lat=40&min_lon=nan&max_lat=50&max_lon=180",
+            "min_lat=40&min_lon=170&max_lat=91&max_lon=180",
+            "min_lat=40&min_lon=170&max_lat=50&max_lon=181",
+        ],
+    )
+    def test_bbox_data_out_of_range(self, client, app, dataset, query):
+        app.data_set = dataset
+        assert client.get(f"/data/bbox?{query}").status_code == 400
+
+    def test_bbox_data_fail(self, client, app, dataset):
+        with app.app_context():
+            current_app.data_set = None
+            response = client.get(
+                "/data/bbox?min_lat=40&min_lon=170&max_lat=50&max_lon=180"
+            )
+            assert response.status_code == 500
+
+
+class TestNearestData:
+    def test_nearest_data_success(self, client, app, dataset):
+        with app.app_context():
+            current_app.data_set = dataset
+            response = client.get("/data/nearest?lat=-44&lon=-176&k=1")
+            data = json.loads(response.data.decode("utf-8"))
+
+            assert response.status_code == 200
+            assert len(data) == 1
+            assert data[0]["id"] == 1
+
+    def test_nearest_data_bad_k(self, client, app, dataset):
+        with app.app_context():
+            current_app.data_set = dataset
+            response = client.get("/data/nearest?lat=-44&lon=-176&k=0")
+            assert response.status_code == 400
+
+    @pytest.mark.parametrize(
+        "query", ["lat=nan&lon=0", "lat=0&lon=inf", "lat=-91&lon=0", "lat=0&lon=200"]
+    )
+    def test_nearest_data_out_of_range(self, client, app, dataset, query):
+        app.data_set = dataset
+        assert client.get(f"/data/nearest?{query}").status_code == 400
+
+    def test_nearest_data_fail(self, client, app, dataset):
+        with app.app_context():
+            current_app.data_set = None
+            response = client.get("/data/nearest?lat=-44&lon=-176")
+            assert response.status_code == 500
+
+
+class TestPostDataBatch:
+    def test_post_batch_json(self, client, app, dataset):
+        with app.app_context():
+            current_app.data_set = dataset
+            data = [
+                {"lat": 1.0, "lon": 2.0, "gwrpm25": 3.0},
+                {"lat": "bad", "lon": 2.0, "gwrpm25": 3.0},
+                {"lat": 4.0, "lon": 5.0, "gwrpm25": "6.5"},
+            ]
+            response = client.post(
+                "/data/batch", data=json.dumps(data), content_type="application/json"
+            )
+            body = json.loads(response.data.decode("utf-8"))
+
+            assert response.status_code == 201
+            assert body["inserted"] == 2
+            assert body["rejected"] == 1
+            assert (body["first_id"], body["last_id"]) == (2, 3)
+            assert body["errors"][0]["row"] == 1
+            assert current_app.data_set.get_datum_by_id(3)["GWRPM25"] == 6.5
+
+    def test_post_batch_ndjson(self, client, app, dataset):
+        with app.app_context():
+            current_app.data_set = dataset
+            data = '{"lat": 1.0, "lon": 2.0, "gwrpm25": 3.0}\n' * 3
+            response = client.post(
+                "/data/batch", data=data, content_type="application/x-ndjson"
+            )
+            body = json.loads(response.data.decode("utf-8"))
+
+            assert response.status_code == 201
+            assert body["inserted"] == 3
+
+    def test_post_batch_all_invalid(self, client, app, dataset):
+        with app.app_context():
+            current_app.data_set = dataset
+            response = client.post(
+                "/data/batch",
+                data=json.dumps([{"lat": 1.0}]),
+                content_type="application/json",
+            )
+
+            assert response.status_code == 400
+            assert json.loads(response.data.decode("utf-8"))["rejected"] == 1
+
+    def test_post_batch_malformed(self, client, app, dataset):
+        with app.app_context():
+            current_app.data_set = dataset
+            response = client.post(
+                "/data/batch", data="{not json", content_type="application/json"
+            )
+
+            assert response.status_code == 400
+
+    def test_post_batch_fail(self, client, app, dataset):
+        with app.app_context():
+            current_app.data_set = None
+            response = client.post(
+                "/data/batch",
+                data=json.dumps([{"lat": 1.0, "lon": 2.0, "gwrpm25": 3.0}]),
+                content_type="application/json",
+            )
+
+            assert response.status_code == 500
+
+
+class TestConditionalGet:
+    def test_etag_and_not_modified(self, client, app, dataset):
+        with app.app_context():
+            current_app.data_set = dataset
+            response = client.get("/data/stats")
+            etag = response.headers["ETag"]
+
+            repeat = client.get("/data/stats", headers={"If-None-Match": etag})
+
+            assert response.status_code == 200
+            assert repeat.status_code == 304
+            assert repeat.data == b""
+            assert repeat.headers["ETag"] == etag
+
+    def test_write_changes_etag(self, client, app, dataset):
+        with app.app_context():
+            current_app.data_set = dataset
+            etag = client.get("/data/filter/44.355/176.255005").headers["ETag"]
+            client.delete("/data/0")
+
+            response = client.get(
+                "/data/filter/44.355/176.255005", headers={"If-None-Match": etag}
+            )
+
+            assert response.status_code == 200
+            assert response.headers["ETag"] != etag
+            assert response.data.decode("utf-8") == "[]"
+
+    def test_repeated_reads_hit_cache(self, client, app, dataset, mocker):
+        with app.app_context():
+            current_app.data_set = dataset
+            spy = mocker.spy(dataset, "get_page")
+            first = client.get("/data?limit=1")
+
+            second = client.get("/data?limit=1")
+
+            assert spy.call_count == 1
+            assert second.data == first.data
+            assert second.headers["Link"] == first.headers["Link"]
+            assert current_app.response_cache.hits == 1
+
+    def test_etag_depends_on_representation(self, client, app, dataset):
+        with app.app_context():
+            current_app.data_set = dataset
+            json_etag = client.get("/data").headers["ETag"]
+
+            response = client.get(
+                "/data",
+                headers={"Accept": "application/x-ndjson", "If-None-Match": json_etag},
+            )
+
+            assert response.status_code == 200
+            assert response.mimetype == "application/x-ndjson"
+
+    def test_missing_entry_has_no_etag(self, client, app, dataset):
+        with app.app_context():
+            current_app.data_set = dataset
+            response = client.get("/data/99")
+
+            assert response.status_code == 404
+            assert "ETag" not in response.headers
+
+
+class TestTiles:
+    def test_tile_json(self, client, app, dataset):
+        with app.app_context():
+            current_app.data_set = dataset
+            response = client.get("/tiles/0/0/0")
+            data = json.loads(response.data.decode("utf-8"))
+
+            assert response.status_code == 200
+            assert data["count"] == [1, 1]
+            assert data["mean"] == [6.2, 5.2]
+            assert data["size"] == 16
+
+    def test_tile_binary(self, client, app, dataset):
+        with app.app_context():
+            current_app.data_set = dataset
+            response = client.get(
+                "/tiles/0/0/0", headers={"Accept": "application/octet-stream"}
+            )
+
+            assert response.status_code == 200
+            assert response.mimetype == "application/octet-stream"
+            assert len(response.data) == 2 * 18
+
+    def test_tile_follows_writes(self, client, app, dataset):
+        with app.app_context():
+            current_app.data_set = dataset
+            client.put(
+                "/data/0",
+                json={"lat": -44.2222, "lon": -176.2222, "gwrpm25": 1.2},
+            )
+            data = json.loads(client.get("/tiles/0/0/0").data.decode("utf-8"))
+
+            assert data["count"] == [2]
+            assert data["min"] == [1.2]
+            assert data["max"] == [5.2]
+
+    def test_tile_outside_pyramid(self, client, app, dataset):
+        with app.app_context():
+            current_app.data_set = dataset
+            assert client.get("/tiles/1/2/0").status_code == 404
+            assert client.get("/tiles/30/0/0").status_code == 404
+
+    def test_tile_fail(self, client, app, dataset):
+        with app.app_context():
+            current_app.data_set = None
+            response = client.get("/tiles/0/0/0")
+            assert response.status_code == 500
+
+
+class TestPastYears:
+    @pytest.fixture
+    def years_app(self, tmp_path):
+        for year, value in ((2001, 7.5), (2002, 8.5)):
+            write_year(
+                pd.DataFrame(
+                    {"lat": [44.355, -44.2222], "lon": [176.255, -176.2222]}
+                ).assign(GWRPM25=[value, value - 1]),
+                year,
+                str(tmp_path),
+            )
+        app = create_app({"YEARS_DIR": str(tmp_path)})
+        app.testing = True
+        return app
+
+    def test_timeseries(self, years_app):
+        response = years_app.test_client().get("/data/timeseries/-44.2222/-176.2222")
+        data = json.loads(response.data.decode("utf-8"))
+
+        assert response.status_code == 200
+        assert [row["year"] for row in data] == [2001, 2002]
+        assert [row["GWRPM25"] for row in data] == [6.5, 7.5]
+
+    @pytest.mark.parametrize("point", ["a/1", "nan/1", "1/inf", "-91/1", "1/181"])
+    def test_timeseries_invalid(self, years_app, point):
+        response = years_app.test_client().get(f"/data/timeseries/{point}")
+        assert response.status_code == 400
+
+    def test_year_param(self, years_app, dataset):
+        client = years_app.test_client()
+        with years_app.app_context():
+            current_app.data_set = dataset
+            stats = json.loads(client.get("/data/stats?year=2002").data)
+            current = json.loads(client.get("/data/stats").data)
+            nearest = json.loads(
+                client.get("/data/nearest?lat=44&lon=176&year=2001").data
+            )
+
+            assert stats["max"] == 8.5
+            assert current["max"] == 6.2
+            assert nearest[0]["GWRPM25"] == 7.5
+            assert years_app.years.cached_years() == [2002, 2001]
+
+    def test_year_not_available(self, years_app, dataset):
+        client = years_app.test_client()
+        with years_app.app_context():
+            current_app.data_set = dataset
+            assert client.get("/data?year=1999").status_code == 404
+            assert client.get("/data/0?year=1999").status_code == 404
+            assert client.get("/data/stats?year=2000").status_code == 404
+            assert client.get("/data/stats?year=x").status_code == 400
+
+
+class TestFormats:
+    def test_data_arrow(self, client, app, dataset):
+        with app.app_context():
+            current_app.data_set = dataset
+            response = client.get(
+                "/data", headers={"Accept": "application/vnd.apache.arrow.stream"}
+            )
+            table = pa.ipc.open_stream(response.data).read_all()
+
+            assert response.status_code == 200
+            assert response.mimetype == "application/vnd.apache.arrow.stream"
+            assert table.column_names == ["id", "lat", "lon", "GWRPM25"]
+            assert table.column("GWRPM25").to_pylist() == [6.2, 5.2]
+
+    def test_data_page_csv(self, client, app, dataset):
+        with app.app_context():
+            current_app.data_set = dataset
+            response = client.get("/data?limit=1", headers={"Accept": "text/csv"})
+
+            assert response.mimetype == "text/csv"
+            assert (
+                response.data.decode("utf-8")
+                == "id,lat,lon,GWRPM25\n0,44.355,176.255005,6.2\n"
+            )
+            assert "after_id=0" in response.headers["Link"]
+
+    def test_filter_msgpack(self, client, app, dataset):
+        with app.app_context():
+            current_app.data_set = dataset
+            response = client.get(
+                "/data/filter/-44.2222/-176.2222",
+                headers={"Accept": "application/x-msgpack"},
+            )
+
+            assert response.mimetype == "application/msgpack"
+            # a one element array of a four entry map, then "id": 1
+            assert response.data[:6] == b"\x91\x84\xa2id\xd3"
+            assert response.data[6:14] == (1).to_bytes(8, "big")
+
+    def test_nearest_arrow(self, client, app, dataset):
+        with app.app_context():
+            current_app.data_set = dataset
+            response = client.get(
+                "/data/nearest?lat=44&lon=176&k=2",
+                headers={"Accept": "application/vnd.apache.arrow.stream"},
+            )
+            table = pa.ipc.open_stream(response.data).read_all()
+
+            assert table.column("id").to_pylist() == [0, 1]
+            assert "distance_km" in table.column_names
+
+    def test_json_by_default(self, client, app, dataset):
+        with app.app_context():
+            current_app.data_set = dataset
+            response = client.get(
+                "/data/bbox?min_lat=0&min_lon=0&max_lat=50&max_lon=180"
+            )
+
+            assert response.mimetype == "application/json"
+            assert json.loads(response.data)[0]["id"] == 0
+
+    def test_formats_cached_apart(self, client, app, dataset):
+        with app.app_context():
+            current_app.data_set = dataset
+            csv = client.get("/data/stats", headers={"Accept": "text/csv"})
+            first = client.get("/data?limit=2", headers={"Accept": "text/csv"})
+            second = client.get("/data?limit=2")
+
+            assert csv.mimetype == "application/json"
+            assert first.data != second.data
+            assert first.headers["ETag"] != second.headers["ETag"]
+
+
+class TestMultiGet:
+    def test_get_ids(self, client, app, dataset):
+        app.data_set = dataset
+        response = client.get("/data?ids=1,5,0")
+
+        assert response.status_code == 200
+        assert json.loads(response.data) == {
+            "data": [
+                {"id": 0, "lat": 44.355, "lon": 176.255005, "GWRPM25": 6.2},
+                {"id": 1, "lat": -44.2222, "lon": -176.2222, "GWRPM25": 5.2},
+            ],
+            "not_found": [5],
+        }
+
+    def test_get_ids_with_fields(self, client, app, dataset):
+        app.data_set = dataset
+        response = client.get("/data?ids=1&fields=GWRPM25")
+
+        assert json.loads(response.data) == {
+            "data": [{"id": 1, "GWRPM25": 5.2}],
+            "not_found": [],
+        }
+
+    def test_get_ids_as_csv(self, client, app, dataset):
+        app.data_set = dataset
+        response = client.get(
+            "/data?ids=0,9&fields=lat", headers={"Accept": "text/csv"}
+        )
+
+        assert response.data == b"id,lat\n0,44.355\n"
+        assert response.headers["X-Not-Found"] == "9"
+
+    def test_post_lookup(self, client, app, dataset):
+        app.data_set = dataset
+        response = client.post(
+            "/data/lookup", json={"ids": list(range(3)), "fields": ["lat", "lon"]}
+        )
+
+        assert response.status_code == 200
+        assert json.loads(response.data) == {
+            "data": [
+                {"id": 0, "lat": 44.355, "lon": 176.255005},
+                {"id": 1, "lat": -44.2222, "lon": -176.2222},
+            ],
+            "not_found": [2],
+        }
+
+    @pytest.mark.parametrize(
+        "body",
+        [
+            {},
+            {"ids": []},
+            {"ids": ["1"]},
+            {"ids": [1.5]},
+            {"ids": [1], "fields": ["x"]},
+            {"ids": [1, 99999999999999999999]},
+            {"ids": [-(1 << 63) - 1]},
+        ],
+    )
+    def test_post_lookup_invalid(self, client, app, dataset, body):
+        app.data_set = dataset
+        # sent with json, orjson does not write ints outside 64 bits
+        response = client.post(
+            "/data/lookup", data=json.dumps(body), content_type="application/json"
+        )
+
+        assert response.status_code == 400
+
+    @pytest.mark.parametrize(
+        "query",
+        [
+            "ids=",
+            "ids=a",
+            "ids=1&fields=pm10",
+            "ids=1,99999999999999999999",
+            "ids=9223372036854775808",
+        ],
+    )
+    def test_get_ids_invalid(self, client, app, dataset, query):
+        app.data_set = dataset
+        assert client.get(f"/data?{query}").status_code == 400
+
+    def test_get_datum_fields(self, client, app, dataset):
+        app.data_set = dataset
+
+        assert client.get("/data/1?fields=GWRPM25").json == {"GWRPM25": 5.2}
+        assert client.get("/data/1?fields=pm10").status_code == 400
+
+
+class TestDistribution:
+    def test_distribution(self, client, app, dataset):
+        app.data_set = dataset
+        response = client.get("/data/stats/distribution?quantiles=0,0.5,1&bins=2")
+
+        assert response.status_code == 200
+        result = response.json
+        assert result["count"] == 2
+        assert result["accuracy"] == 0.01
+        assert result["quantiles"] == {
+            "p0": pytest.approx(5.2, rel=0.01),
+            "p50": pytest.approx(5.2, rel=0.01),
+            "p100": pytest.approx(6.2, rel=0.01),
+        }
+        assert result["histogram"]["counts"] == [1, 1]
+        assert len(result["histogram"]["edges"]) == 3
+
+    def test_region_and_range(self, client, app, dataset):
+        app.data_set = dataset
+        response = client.get(
+            "/data/stats/distribution?bbox=-45,-177,-44,-176&range=0,10&bins=5"
+        )
+
+        assert response.json["count"] == 1
+        assert response.json["histogram"] == {
+            "edges": [0.0, 2.0, 4.0, 6.0, 8.0, 10.0],
+            "counts": [0, 0, 1, 0, 0],
+        }
+
+    def test_empty_region(self, client, app, dataset):
+        app.data_set = dataset
+        response = client.get("/data/stats/distribution?polygon=0,0,1,0,1,1")
+
+        assert response.json["count"] == 0
+        assert response.json["quantiles"] == {"p50": None, "p90": None, "p99": None}
+
+    @pytest.mark.parametrize(
+        "query",
+        ["quantiles=1.5", "quantiles=", "bins=0", "bins=x", "range=3,1", "bbox=1,2"],
+    )
+    def test_invalid(self, client, app, dataset, query):
+        app.data_set = dataset
+        assert client.get(f"/data/stats/distribution?{query}").status_code == 400
+
+
+class TestChanges:
+    def test_changes(self, client, app, dataset):
+        app.data_set = dataset
+        since = int(client.get("/data?limit=1").headers["X-Data-Version"])
+        client.post("/data", json={"lat": 1.0, "lon": 2.0, "gwrpm25": 3.0})
+        client.put("/data/0", json={"lat": 1.0, "lon": 2.0, "gwrpm25": 4.0})
+        client.delete("/data/1")
+
+        response = client.get(f"/data/changes?since={since}")
+
+        assert response.status_code == 200
+        assert response.json == {
+            "changes": [
+                {
+                    "seq": 1,
+                    "op": "insert",
+                    "id": 2,
+                    "lat": 1.0,
+                    "lon": 2.0,
+                    "GWRPM25": 3.0,
+                },
+                {
+                    "seq": 2,
+                    "op": "update",
+                    "id": 0,
+                    "lat": 1.0,
+                    "lon": 2.0,
+                    "GWRPM25": 4.0,
+                },
+                {"seq": 3, "op": "delete", "id": 1},
+            ],
+            "next": 3,
+            "latest": 3,
+        }
+        assert client.get("/data/changes?since=1&limit=1").json["next"] == 2
+
+    def test_resync(self, client, app, dataset):
+        app.data_set = dataset
+        response = client.get("/data/changes?since=5")
+
+        assert response.status_code == 410
+        assert response.json["resync"] is True
+        assert response.json["latest"] == 0
+
+    def test_long_poll(self, client, app, dataset):
+        app.data_set = dataset
+        timer = threading.Timer(
+            0.05, dataset.add_data_entry, kwargs={"lat": 1, "lon": 2, "gwrpm25": 3}
+        )
+        timer.start()
+
+        response = client.get("/data/changes?since=0&wait=10")
+        timer.join()
+
+        assert [change["seq"] for change in response.json["changes"]] == [1]
+        assert client.get("/data/changes?since=1&wait=0.01").json["changes"] == []
+
+    def test_event_stream(self, client, app, dataset):
+        app.data_set = dataset
+        dataset.delete_data_entry(0)
+
+        response = client.get(
+            "/data/changes",
+            headers={"Accept": "text/event-stream", "Last-Event-ID": "0"},
+            buffered=False,
+        )
+        events = iter(response.response)
+        assert response.mimetype == "text/event-stream"
+        assert next(events).startswith(b"retry:")
+        event = next(events).decode()
+        response.close()
+
+        lines = event.splitlines()
+        assert lines[:2] == ["id: 1", "event: changes"]
+        assert json.loads(lines[2][len("data: ") :])["changes"] == [
+            {"seq": 1, "op": "delete", "id": 0}
+        ]
+
+    @pytest.mark.parametrize(
+        "query", ["", "since=-1", "since=a", "since=0&limit=0", "since=0&wait=60"]
+    )
+    def test_invalid(self, client, app, dataset, query):
+        app.data_set = dataset
+        assert client.get(f"/data/changes?{query}").status_code == 400
+
+
+class TestWithinData:
+    def test_within(self, client, app, dataset):
+        app.data_set = dataset
+        response = client.get("/data/within?lat=44.36&lon=176.26&radius_km=5")
+
+        assert response.status_code == 200
+        result = json.loads(response.data)
+        assert [row["id"] for row in result] == [0]
+        assert result[0]["distance_km"] == pytest.approx(0.69, abs=0.01)
+
+    def test_within_across_antimeridian(self, client, app, dataset):
+        app.data_set = dataset
+        response = client.get("/data/within?lat=-44.2&lon=179.0&radius_km=400&sort=id")
+
+        assert [row["id"] for row in json.loads(response.data)] == [1]
+
+    @pytest.mark.parametrize(
+        "query",
+        [
+            "lat=1&lon=1",
+            "lat=1&lon=1&radius_km=0",
+            "lat=1&lon=1&radius_km=inf",
+            "lat=a&lon=1&radius_km=1",
+            "lat=95&lon=1&radius_km=1",
+            "lat=1&lon=1&radius_km=1&sort=GWRPM25",
+        ],
+    )
+    def test_within_invalid(self, client, app, dataset, query):
+        app.data_set = dataset
+        assert client.get(f"/data/within?{query}").status_code == 400
+
+    def test_filter_tolerance(self, client, app, dataset):
+        app.data_set = dataset
+
+        assert client.get("/data/filter/44.356/176.256").json == []
+        response = client.get(
+            "/data/filter/44.356/176.256?tolerance=0.01&sort=distance"
+        )
+        assert [row["id"] for row in response.json] == [0]
+        assert "distance_km" in response.json[0]
+
+    @pytest.mark.parametrize("query", ["tolerance=-1", "tolerance=5", "sort=x"])
+    def test_filter_invalid(self, client, app, dataset, query):
+        app.data_set = dataset
+        assert client.get(f"/data/filter/1/1?{query}").status_code == 400
+
+
+@pytest.fixture
+def grid_dataset():
+    # 0.1 degree cells, lat 10.05..10.15 by lon 20.05..20.25
+    data = pd.DataFrame(
+        {
+            "lat": [10.05, 10.05, 10.05, 10.15, 10.15],
+            "lon": [20.05, 20.15, 20.25, 20.05, 20.15],
+            "GWRPM25": [1.0, 2.0, 3.0, 4.0, 5.0],
+        }
+    )
+    dataset = DataSet.__new__(DataSet)
+    dataset.df = data
+    return dataset
+
+
+class TestSample:
+    def test_pairs(self, client, app, grid_dataset):
+        app.data_set = grid_dataset
+        response = client.post(
+            "/data/sample", json=[[10.1, 20.1], [10.05, 20.2], [0, 0]]
+        )
+
+        assert response.status_code == 200
+        assert json.loads(response.data) == [
+            {"lat": 10.1, "lon": 20.1, "GWRPM25": pytest.approx(3.0)},
+            {"lat": 10.05, "lon": 20.2, "GWRPM25": pytest.approx(2.5)},
+            {"lat": 0.0, "lon": 0.0, "GWRPM25": None},
+        ]
+
+    def test_nearest_from_entries(self, client, app, grid_dataset):
+        app.data_set = grid_dataset
+        response = client.post(
+            "/data/sample?method=nearest", json=[{"lat": 10.14, "lon": 20.24}]
+        )
+
+        assert json.loads(response.data) == [
+            {"lat": 10.14, "lon": 20.24, "GWRPM25": None}
+        ]
+
+    def test_sees_writes(self, client, app, grid_dataset):
+        app.data_set = grid_dataset
+        client.post("/data", json={"lat": 10.15, "lon": 20.25, "gwrpm25": 6.0})
+        response = client.post("/data/sample?method=nearest", json=[[10.15, 20.25]])
+
+        assert json.loads(response.data)[0]["GWRPM25"] == pytest.approx(6.0)
+
+    def test_csv(self, client, app, grid_dataset):
+        app.data_set = grid_dataset
+        response = client.post(
+            "/data/sample?method=nearest",
+            json=[[10.05, 20.05]],
+            headers={"Accept": "text/csv"},
+        )
+
+        assert response.data == b"lat,lon,GWRPM25\n10.05,20.05,1\n"
+
+    @pytest.mark.parametrize(
+        "query, body",
+        [("", [[1]]), ("", {"lat": 1}), ("", [{"lon": 1}]), ("?method=cubic", [])],
+    )
+    def test_invalid(self, client, app, grid_dataset, query, body):
+        app.data_set = grid_dataset
+        assert client.post(f"/data/sample{query}", json=body).status_code == 400
+
+    def test_not_on_a_grid(self, client, app, dataset):
+        app.data_set = dataset
+        assert client.post("/data/sample", json=[[1, 2]]).status_code == 400
+
+
+def _metric(text: str, prefix: str) -> float:
+    """Value of the sample starting with prefix, 0 when there is none."""
+    for line in text.splitlines():
+        if line.startswith(prefix + " "):
+            return float(line.rsplit(" ", 1)[1])
+    return 0.0
+
+
+class TestMetrics:
+    def test_counts_requests_by_route_and_status(self, client, app, dataset):
+        app.data_set = dataset
+        requests = 'air_quality_http_requests_total{method="GET",route="/data/<int:id>"'
+        before = client.get("/metrics").get_data(as_text=True)
+        client.get("/data/0")
+        client.get("/data/99")
+        response = client.get("/metrics")
+        after = response.get_data(as_text=True)
+
+        assert response.status_code == 200
+        assert (
+            response.headers["Content-Type"]
+            == "text/plain; version=0.0.4; charset=utf-8"
+        )
+        for status in ("200", "404"):
+            prefix = f'{requests},status="{status}"}}'
+            assert _metric(after, prefix) == _metric(before, prefix) + 1
+        assert "air_quality_dataset_rows 2" in after
+
+    def test_counts_streamed_response_size(self, client, app, dataset):
+        app.data_set = dataset
+        sizes = (
+            "air_quality_http_response_size_bytes_sum" '{method="GET",route="/data"}'
+        )
+        before = _metric(client.get("/metrics").get_data(as_text=True), sizes)
+        body = client.get("/data").get_data()
+        after = _metric(client.get("/metrics").get_data(as_text=True), sizes)
+
+        assert after - before == len(body)
+
+    def test_times_dataset_operations(self, client, app, dataset):
+        app.data_set = dataset
+        filters = 'air_quality_dataset_operation_seconds_count{operation="filter"}'
+        before = _metric(client.get("/metrics").get_data(as_text=True), filters)
+        client.get("/data/filter/44.355/176.255005")
+        after = _metric(client.get("/metrics").get_data(as_text=True), filters)
+
+        assert after == before + 1
+
+
+class TestAdmission:
+    @pytest.fixture
+    def app(self, dataset):
+        app = create_app({"ADMISSION_BULK_LIMIT": 1, "ADMISSION_BULK_QUEUE": 0})
+        app.testing = True
+        app.data_set = dataset
+        return app
+
+    def test_sheds_bulk_downloads_over_the_limit(self, client, app):
+        download = client.get("/data")
+        busy = client.get("/data")
+
+        assert busy.status_code == 503
+        assert int(busy.headers["Retry-After"]) >= 1
+        assert "error" in busy.get_json()
+        # lookups and pages are other cost classes
+        assert client.get("/data/0").status_code == 200
+        assert client.get("/data?limit=1").status_code == 200
+        download.close()
+        assert client.get("/data", buffered=True).status_code == 200
+
+    def test_slot_held_until_the_stream_is_closed(self, client, app):
+        with client.get("/data") as download:
+            assert app.admission["bulk"].active == 1
+            download.get_data()
+        assert app.admission["bulk"].active == 0
+
+    def test_counts_admissions(self, client, app):
+        rejected = (
+            'air_quality_admission_requests_total{cost="bulk",outcome="rejected"}'
+        )
+        before = _metric(client.get("/metrics").get_data(as_text=True), rejected)
+        with client.get("/data"):
+            client.get("/data")
+            after = client.get("/metrics").get_data(as_text=True)
+
+        assert _metric(after, rejected) == before + 1
+        assert "air_quality_admission_bulk_active 1" in after
+        assert 'air_quality_admission_wait_seconds_count{cost="bulk"}' in after
+
+    def test_buffered_responses_free_their_slot(self, client, app):
+        # the test client never closes responses unless asked to
+        for _ in range(LIMITS[BULK] + 3):
+            response = client.post(
+                "/data/batch", json=[{"lat": 1.0, "lon": 2.0, "gwrpm25": 3.0}]
+            )
+            assert response.status_code == 201
+        assert app.admission["bulk"].active == 0
+
+    def test_waiting_for_changes_is_its_own_class(self, client, dataset):
+        app = create_app({"ADMISSION_CHANGES_LIMIT": 1})
+        app.data_set = dataset
+        client = app.test_client()
+        version = dataset.version
+
+        with client.get(
+            f"/data/changes?since={version}", headers={"Accept": "text/event-stream"}
+        ):
+            assert app.admission["changes"].active == 1
+            busy = client.get(f"/data/changes?since={version}&wait=0.1")
+            assert busy.status_code == 503
+            assert client.get(f"/data/changes?since={version}").status_code == 200
+
+    def test_can_be_turned_off(self, client, dataset):
+        app = create_app({"ADMISSION": False})
+        app.data_set = dataset
+        client = app.test_client()
+
+        with client.get("/data"), client.get("/data"):
+            assert client.get("/data", buffered=True).status_code == 200
+        assert not hasattr(app, "admission")
@@ -0,0 +1,81 @@
+import threading
+import time
+
+from app.admission import MAX_RETRY_AFTER, MIN_RETRY_AFTER, Gate
+
+
+class TestGate:
+    def test_admits_up_to_the_limit(self):
+        gate = Gate("bulk", limit=2, queue=0, wait=0.0)
+
+        assert gate.acquire()
+        assert gate.acquire()
+        assert not gate.acquire()
+        assert gate.active == 2
+
+    def test_release_frees_a_slot(self):
+        gate = Gate("bulk", limit=1, queue=0, wait=0.0)
+        gate.acquire()
+        gate.release(0.1)
+
+        assert gate.acquire()
+
+    def test_no_limit(self):
+        gate = Gate("cheap", limit=None, queue=0, wait=0.0)
+
+        assert all(gate.acquire() for _ in range(100))
+        assert gate.retry_after() == MIN_RETRY_AFTER
+
+    def test_waiter_gets_the_released_slot(self):
+        gate = Gate("bulk", limit=1, queue=1, wait=5.0)
+        gate.acquire()
+        admitted = []
+        waiter = threading.Thread(target=lambda: admitted.append(gate.acquire()))
+        waiter.start()
+        while not gate.waiting:
+            time.sleep(0.001)
+        gate.release(0.1)
+        waiter.join()
+
+        assert admitted == [True]
+        assert (gate.active, gate.waiting) == (1, 0)
+
+    def test_waiter_gives_up_after_wait(self):
+        gate = Gate("bulk", limit=1, queue=1, wait=0.05)
+        gate.acquire()
+        start = time.perf_counter()
+
+        assert not gate.acquire()
+        assert time.perf_counter() - start >= 0.05
+        assert gate.waiting == 0
+
+    def test_rejects_at_once_when_the_queue_is_full(self):
+        gate = Gate("bulk", limit=1, queue=1, wait=5.0)
+        gate.acquire()
+        waiter = threading.Thread(target=gate.acquire)
+        waiter.start()
+        while not gate.waiting:
+            time.sleep(0.001)
+        start = time.perf_counter()
+
+        assert not gate.acquire()
+        assert time.perf_counter() - start < 1.0
+        gate.release(0.1)
+        waiter.join()
+
+    def test_retry_after_follows_hold_times(self):
+        gate = Gate("bulk", limit=1, queue=0, wait=0.0)
+        for _ in range(50):
+            gate.acquire()
+            gate.release(10.0)
+        gate.acquire()
+
+        assert gate.retry_after() == 10
+
+    def test_retry_after_is_bounded(self):
+        gate = Gate("bulk", limit=1, queue=0, wait=0.0)
+        gate.acquire()
+        assert gate.retry_after() == MIN_RETRY_AFTER
+        gate.release(1e6)
+        gate.acquire()
+        assert gate.retry_after() == MAX_RETRY_AFTER
@@ -0,0 +1,68 @@
+import math
+
+import numpy as np
+import pytest
+
+from app.aggregates import RunningStats
+
+
+class TestRunningStats:
+    def test_initial_values(self):
+        stats = RunningStats(np.array([6.2, 5.2, np.nan, 7.0]))
+
+        assert stats.count == 3
+        assert stats.total == pytest.approx(18.4)
+        assert stats.min == 5.2
+        assert stats.max == 7.0
+
+    def test_remove_current_extremes(self):
+        stats = RunningStats(np.array([1.0, 2.0, 3.0, 3.0]))
+
+        stats.remove(1.0)
+        stats.remove(3.0)
+        assert stats.min == 2.0
+        assert stats.max == 3.0
+
+        stats.remove(3.0)
+        assert stats.max == 2.0
+
+    def test_empty(self):
+        stats = RunningStats(np.array([1.0]))
+        stats.remove(1.0)
+
+        assert stats.count == 0
+        assert math.isnan(stats.mean)
+        assert math.isnan(stats.min)
+        assert math.isnan(stats.max)
+
+    def test_random_mutations_match_recompute(self):
+        rng = np.random.default_rng(1)
+        values = list(np.round(rng.uniform(0, 50, 500), 1))
+        stats = RunningStats(np.array(values))
+
+        for _ in range(5000):
+            if values and rng.random() < 0.5:
+                stats.remove(values.pop(rng.integers(len(values))))
+            else:
+                value = float(np.round(rng.uniform(0, 50), 1))
+                values.append(value)
+                stats.add(value)
+
+            assert stats.count == len(values)
+            if values:
+                assert stats.mean == pytest.approx(np.mean(values), rel=1e-12)
+                assert stats.min == min(values)
+                assert stats.max == max(values)
+
+    def test_add_many_mixes_initial_and_new_values(self):
+        stats = RunningStats(np.array([2.0, 4.0]))
+        stats.remove(2.0)
+        stats.remove(4.0)
+
+        stats.add_many(np.array([4.0, 4.0, 9.0, 1.0, np.nan]))
+        stats.remove(1.0)
+
+        assert stats.count == 3
+        assert stats.min == 4.0
+        assert stats.max == 9.0
+        assert stats.total == pytest.approx(17.0)
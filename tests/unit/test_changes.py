@@ -0,0 +1,79 @@
+import threading
+
+import pytest
+
+from app.changes import ChangeLog, ChangesGoneError
+
+
+def add(id, value=1.0):
+    return {"op": "add", "id": id, "lat": 1.0, "lon": 2.0, "gwrpm25": value}
+
+
+class TestChangeLog:
+    def test_since(self):
+        log = ChangeLog()
+        log.append(1, add(0))
+        log.append(2, {"op": "delete", "id": 0})
+        log.append(
+            3,
+            {
+                "op": "add_many",
+                "first_id": 1,
+                "lat": [1.0, 3.0],
+                "lon": [2.0, 4.0],
+                "gwrpm25": [5.0, 6.0],
+            },
+        )
+
+        changes, upto, latest = log.since(1, 100)
+
+        assert (upto, latest) == (3, 3)
+        assert changes == [
+            {"seq": 2, "op": "delete", "id": 0},
+            {"seq": 3, "op": "insert", "id": 1, "lat": 1.0, "lon": 2.0, "GWRPM25": 5.0},
+            {"seq": 3, "op": "insert", "id": 2, "lat": 3.0, "lon": 4.0, "GWRPM25": 6.0},
+        ]
+        assert log.since(3, 100) == ([], 3, 3)
+
+    def test_limit_keeps_versions_whole(self):
+        log = ChangeLog()
+        for version in range(1, 6):
+            log.append(version, add(version))
+        log.append(6, {**add(1, 2.0), "op": "update"})
+
+        changes, upto, _ = log.since(0, 2)
+
+        assert [change["seq"] for change in changes] == [1, 2]
+        assert upto == 2
+        assert log.since(5, 1)[0][0]["op"] == "update"
+
+    def test_drops_oldest_versions(self):
+        log = ChangeLog(max_rows=3)
+        for version in range(1, 6):
+            log.append(version, add(version))
+
+        with pytest.raises(ChangesGoneError):
+            log.since(1, 10)
+        assert [change["id"] for change in log.since(2, 10)[0]] == [3, 4, 5]
+
+    def test_unknown_versions(self):
+        log = ChangeLog(version=10)
+        log.append(11, add(0))
+
+        with pytest.raises(ChangesGoneError):
+            log.since(9, 10)
+        with pytest.raises(ChangesGoneError):
+            log.since(12, 10)
+        log.reset(20)
+        with pytest.raises(ChangesGoneError):
+            log.since(11, 10)
+        assert log.since(20, 10) == ([], 20, 20)
+
+    def test_wait(self):
+        log = ChangeLog()
+
+        assert not log.wait(0, 0.01)
+        timer = threading.Timer(0.05, log.append, (1, add(0)))
+        timer.start()
+        assert log.wait(0, 5)
+        timer.join()
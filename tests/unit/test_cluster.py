@@ -0,0 +1,146 @@
+import multiprocessing
+import threading
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.cluster import SharedDataSet
+from app.data_set import EntryNotFoundError
+from app.wal import LogTail
+
+
+@pytest.fixture
+def base_path(tmp_path):
+    path = str(tmp_path / "base.parquet")
+    pd.DataFrame(
+        {
+            "lat": [-44.355000, -44.355000, -44.345001],
+            "lon": [-176.255005, -176.244995, -176.274994],
+            "GWRPM25": np.array([6.2, 5.2, 6.1], dtype=np.float32),
+        }
+    ).to_parquet(path)
+    return path
+
+
+@pytest.fixture
+def wal_dir(tmp_path):
+    return str(tmp_path / "wal")
+
+
+@pytest.fixture
+def workers(base_path, wal_dir):
+    """A writer and a follower, as two worker processes would have them."""
+    started = []
+
+    def start():
+        started.append(SharedDataSet(base_path, wal_dir, compact_interval=3600))
+        return started[-1]
+
+    yield start
+    for worker in reversed(started):
+        worker.close()
+
+
+def add_entries(base_path, wal_dir, count):
+    worker = SharedDataSet(base_path, wal_dir, compact_interval=3600)
+    for i in range(count):
+        worker.add_data_entry(lat=float(i), lon=0.0, gwrpm25=1.0)
+    worker.close()
+
+
+class TestSharedDataSet:
+    def test_first_worker_writes(self, workers):
+        writer, follower = workers(), workers()
+
+        assert writer.is_writer
+        assert not follower.is_writer
+
+    def test_writes_reach_every_worker(self, workers):
+        writer, follower = workers(), workers()
+
+        new_id = follower.add_data_entry(lat=1.0, lon=2.0, gwrpm25=3.0)
+        # visible to the worker that wrote it as soon as the call returns
+        assert follower.get_datum_by_id(new_id)["GWRPM25"] == 3.0
+        assert writer.get_datum_by_id(new_id)["GWRPM25"] == 3.0
+
+        writer.update_data_entry(0, lat=9.0, lon=9.0, gwrpm25=9.0)
+        assert follower.get_datum_by_id(0)["GWRPM25"] == 9.0
+
+        first_id, last_id = follower.add_data_entries(
+            np.array([4.0, 5.0]), np.array([4.0, 5.0]), np.array([4.0, 5.0])
+        )
+        follower.delete_data_entry(first_id)
+        pd.testing.assert_frame_equal(follower.df, writer.df)
+        assert follower.version == writer.version == 4
+
+    def test_followers_see_changes(self, workers):
+        writer, follower = workers(), workers()
+        timer = threading.Timer(0.05, writer.delete_data_entry, (1,))
+        timer.start()
+
+        assert follower.wait_for_changes(0, 10)
+        timer.join()
+        assert follower.changes(0) == ([{"seq": 1, "op": "delete", "id": 1}], 1, 1)
+        assert not follower.wait_for_changes(1, 0.01)
+
+    def test_followers_read_the_log_only_after_a_write(self, workers, monkeypatch):
+        writer, follower = workers(), workers()
+        reads = []
+        read = LogTail.read
+        monkeypatch.setattr(
+            LogTail, "read", lambda tail: reads.append(tail) or read(tail)
+        )
+
+        for _ in range(100):
+            follower.get_stats()
+        assert reads == []
+
+        writer.delete_data_entry(1)
+        assert follower.get_datum_by_id(1) is None
+        assert follower.get_datum_by_id(0) is not None
+        assert len(reads) == 1
+
+    def test_errors_come_back_to_the_caller(self, workers):
+        writer, follower = workers(), workers()
+
+        with pytest.raises(EntryNotFoundError):
+            follower.delete_data_entry(99)
+        assert writer.version == 0
+
+    def test_another_worker_takes_over_writing(self, workers):
+        writer, follower = workers(), workers()
+        follower.add_data_entry(lat=1.0, lon=2.0, gwrpm25=3.0)
+
+        writer.close()
+        new_id = follower.add_data_entry(lat=1.0, lon=2.0, gwrpm25=3.0)
+
+        assert follower.is_writer
+        assert new_id == 4
+        assert workers().version == follower.version == 2
+
+    def test_reloads_when_behind_compaction(self, workers):
+        writer, follower = workers(), workers()
+        writer.add_data_entry(lat=1.0, lon=2.0, gwrpm25=3.0)
+        writer.compactor.compact()
+        writer.delete_data_entry(0)
+
+        assert follower.get_datum_by_id(3)["GWRPM25"] == 3.0
+        assert follower.get_datum_by_id(0) is None
+        assert follower.version == 2
+
+    def test_worker_processes_share_one_writer(self, base_path, wal_dir, workers):
+        observer = workers()
+        context = multiprocessing.get_context("spawn")
+        processes = [
+            context.Process(target=add_entries, args=(base_path, wal_dir, 20))
+            for _ in range(3)
+        ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join(60)
+
+        assert [process.exitcode for process in processes] == [0, 0, 0]
+        assert observer.version == 60
+        assert observer.df.index.tolist() == list(range(63))
@@ -1,7 +1,13 @@
+import json
+import threading
+import time
+
 import pytest
+import numpy as np
 import pandas as pd
 
-from app.data_set import DataSet
+from app.data_set import DataSet, EntryNotFoundError
+from app.formats import NDJSON
 
 
 @pytest.fixture
@@ -44,6 +50,23 @@ class TestDataSet:
 
         assert result == None
 
+    def test_get_data_by_ids(self, mocker, mock_dataframe):
+        mocker.patch("pandas.read_parquet", return_value=mock_dataframe)
+        dataset = DataSet(file_path="mock_file_path.parquet")
+        dataset.delete_data_entry(0)
+
+        body, missing = dataset.get_data_by_ids([7, 1, 0, 1], fields=["GWRPM25"])
+
+        assert json.loads(body) == [{"id": 1, "GWRPM25": 5.2}]
+        assert missing.tolist() == [0, 7]
+
+    def test_get_data_by_ids_unknown_field(self, mocker, mock_dataframe):
+        mocker.patch("pandas.read_parquet", return_value=mock_dataframe)
+        dataset = DataSet(file_path="mock_file_path.parquet")
+
+        with pytest.raises(ValueError):
+            dataset.get_data_by_ids([0], fields=["pm10"])
+
     def test_add_data_entry(self, mocker, mock_dataframe):
         mocker.patch("pandas.read_parquet", return_value=mock_dataframe)
         dataset = DataSet(file_path="mock_file_path.parquet")
@@ -99,3 +122,302 @@ class TestDataSet:
             "min": float(5.2),
             "max": float(6.2),
         }
+
+    def test_filter_data_after_update(self, mocker, mock_dataframe):
+        mocker.patch("pandas.read_parquet", return_value=mock_dataframe)
+        dataset = DataSet(file_path="mock_file_path.parquet")
+
+        dataset.update_data_entry(id=0, lat=1.0, lon=1.0, gwrpm25=1.0)
+
+        assert dataset.filter_data(lat=-44.355000, lon=-176.255005) == "[]"
+        assert (
+            dataset.filter_data(lat=1.0, lon=1.0)
+            == '[{"id":0,"lat":1.0,"lon":1.0,"GWRPM25":1.0}]'
+        )
+
+    def test_filter_data_after_delete(self, mocker, mock_dataframe):
+        mocker.patch("pandas.read_parquet", return_value=mock_dataframe)
+        dataset = DataSet(file_path="mock_file_path.parquet")
+
+        dataset.delete_data_entry(id=0)
+
+        assert dataset.filter_data(lat=-44.355000, lon=-176.255005) == "[]"
+
+    def test_bbox_data(self, mocker, mock_dataframe):
+        mocker.patch("pandas.read_parquet", return_value=mock_dataframe)
+        dataset = DataSet(file_path="mock_file_path.parquet")
+
+        result = dataset.bbox_data(
+            min_lat=-45.0, min_lon=-176.25, max_lat=-44.0, max_lon=-176.0
+        )
+        assert result == '[{"id":1,"lat":-44.355,"lon":-176.244995,"GWRPM25":5.2}]'
+
+    def test_bbox_data_antimeridian(self, mocker, mock_dataframe):
+        mocker.patch("pandas.read_parquet", return_value=mock_dataframe)
+        dataset = DataSet(file_path="mock_file_path.parquet")
+
+        result = dataset.bbox_data(
+            min_lat=-45.0, min_lon=170.0, max_lat=-44.0, max_lon=-176.25
+        )
+        assert result == '[{"id":0,"lat":-44.355,"lon":-176.255005,"GWRPM25":6.2}]'
+
+    def test_nearest_data(self, mocker, mock_dataframe):
+        mocker.patch("pandas.read_parquet", return_value=mock_dataframe)
+        dataset = DataSet(file_path="mock_file_path.parquet")
+
+        result = json.loads(dataset.nearest_data(lat=-44.355, lon=-176.24, k=2))
+
+        assert [row["id"] for row in result] == [1, 0]
+        assert result[0]["distance_km"] < result[1]["distance_km"]
+
+    def test_filter_data_tolerance(self, mocker, mock_dataframe):
+        mocker.patch("pandas.read_parquet", return_value=mock_dataframe)
+        dataset = DataSet(file_path="mock_file_path.parquet")
+
+        assert dataset.filter_data(lat=-44.3551, lon=-176.249) == "[]"
+        result = json.loads(
+            dataset.filter_data(
+                lat=-44.3551, lon=-176.249, tolerance=0.01, order="distance"
+            )
+        )
+        assert [row["id"] for row in result] == [1, 0]
+        assert result[0]["distance_km"] < result[1]["distance_km"]
+
+    def test_within_data(self, mocker, mock_dataframe):
+        mocker.patch("pandas.read_parquet", return_value=mock_dataframe)
+        dataset = DataSet(file_path="mock_file_path.parquet")
+
+        result = json.loads(dataset.within_data(lat=-44.355, lon=-176.24, radius_km=1))
+        by_id = json.loads(
+            dataset.within_data(lat=-44.355, lon=-176.24, radius_km=2, order="id")
+        )
+
+        assert [row["id"] for row in result] == [1]
+        assert [row["id"] for row in by_id] == [0, 1]
+        assert by_id[0]["distance_km"] == pytest.approx(1.19, abs=0.01)
+        with pytest.raises(ValueError):
+            dataset.within_data(lat=0, lon=0, radius_km=1, order="pm25")
+
+    def test_distribution(self, mocker, mock_dataframe):
+        mocker.patch("pandas.read_parquet", return_value=mock_dataframe)
+        dataset = DataSet(file_path="mock_file_path.parquet")
+
+        dataset.add_data_entry(lat=10.0, lon=10.0, gwrpm25=20.0)
+        dataset.update_data_entry(id=0, lat=-44.355, lon=-176.255005, gwrpm25=7.0)
+        dataset.delete_data_entry(id=1)
+        result = dataset.distribution(quantiles=[0.0, 1.0], bins=2)
+        region = dataset.distribution(quantiles=[0.5], bbox=(-45, -177, -44, -176))
+        polygon = dataset.distribution(
+            quantiles=[0.5], polygon=([9, 11, 11, 9], [9, 9, 11, 11])
+        )
+
+        assert result["count"] == 2
+        assert result["quantiles"] == {
+            "p0": pytest.approx(7.0, rel=0.01),
+            "p100": pytest.approx(20.0, rel=0.01),
+        }
+        assert result["histogram"]["counts"] == [1, 1]
+        assert region["count"] == 1
+        assert region["quantiles"]["p50"] == pytest.approx(7.0, rel=0.01)
+        assert polygon["count"] == 1
+        assert polygon["quantiles"]["p50"] == pytest.approx(20.0, rel=0.01)
+
+    def test_get_full_data_chunked(self, mocker, mock_dataframe):
+        mocker.patch("pandas.read_parquet", return_value=mock_dataframe)
+        dataset = DataSet(file_path="mock_file_path.parquet")
+
+        chunks = list(dataset.iter_full_data(chunk_size=1))
+
+        assert len(chunks) == 4
+        assert "".join(chunks) == dataset.get_full_data()
+
+    def test_iter_ndjson(self, mocker, mock_dataframe):
+        mocker.patch("pandas.read_parquet", return_value=mock_dataframe)
+        dataset = DataSet(file_path="mock_file_path.parquet")
+
+        lines = "".join(dataset.iter_ndjson(after_id=0)).splitlines()
+
+        assert lines == ['{"id":1,"lat":-44.355,"lon":-176.244995,"GWRPM25":5.2}']
+
+    def test_get_page(self, mocker, mock_dataframe):
+        mocker.patch("pandas.read_parquet", return_value=mock_dataframe)
+        dataset = DataSet(file_path="mock_file_path.parquet")
+
+        first, next_after_id = dataset.get_page(after_id=None, limit=1)
+        second, last_after_id = dataset.get_page(after_id=next_after_id, limit=1)
+
+        assert first == '[{"id":0,"lat":-44.355,"lon":-176.255005,"GWRPM25":6.2}]'
+        assert next_after_id == 0
+        assert second == '[{"id":1,"lat":-44.355,"lon":-176.244995,"GWRPM25":5.2}]'
+        assert last_after_id is None
+
+    def test_iter_page(self, mocker, mock_dataframe):
+        mocker.patch("pandas.read_parquet", return_value=mock_dataframe)
+        dataset = DataSet(file_path="mock_file_path.parquet")
+
+        first, next_after_id = dataset.iter_page(after_id=None, limit=1, fmt=NDJSON)
+        second, last_after_id = dataset.iter_page(
+            after_id=next_after_id, limit=1, fmt=NDJSON
+        )
+
+        assert "".join(first).splitlines() == [
+            '{"id":0,"lat":-44.355,"lon":-176.255005,"GWRPM25":6.2}'
+        ]
+        assert next_after_id == 0
+        assert "".join(second).splitlines() == [
+            '{"id":1,"lat":-44.355,"lon":-176.244995,"GWRPM25":5.2}'
+        ]
+        assert last_after_id is None
+
+    def test_stats_match_recompute_after_mutations(self, mocker):
+        rng = np.random.default_rng(0)
+        mocker.patch(
+            "pandas.read_parquet",
+            return_value=pd.DataFrame(
+                {
+                    "lat": rng.uniform(-10, 10, 50),
+                    "lon": rng.uniform(-10, 10, 50),
+                    "GWRPM25": np.round(rng.uniform(0, 30, 50), 1),
+                }
+            ),
+        )
+        dataset = DataSet(file_path="mock_file_path.parquet")
+
+        for _ in range(300):
+            action = rng.integers(3)
+            ids = dataset.df.index
+            if action == 0 or len(ids) < 2:
+                dataset.add_data_entry(
+                    lat=1.0, lon=1.0, gwrpm25=float(rng.uniform(0, 30))
+                )
+            elif action == 1:
+                dataset.update_data_entry(
+                    id=int(rng.choice(ids)),
+                    lat=2.0,
+                    lon=2.0,
+                    gwrpm25=float(rng.uniform(0, 30)),
+                )
+            else:
+                dataset.delete_data_entry(id=int(rng.choice(ids)))
+
+            column = dataset.df["GWRPM25"]
+            stats = dataset.get_stats()
+            assert stats["count"] == column.count()
+            assert stats["average"] == pytest.approx(column.mean())
+            assert stats["min"] == column.min()
+            assert stats["max"] == column.max()
+
+    def test_add_after_delete_does_not_overwrite(self, mocker, mock_dataframe):
+        mocker.patch("pandas.read_parquet", return_value=mock_dataframe)
+        dataset = DataSet(file_path="mock_file_path.parquet")
+        dataset.delete_data_entry(id=0)
+
+        new_id = dataset.add_data_entry(lat=1.0, lon=1.0, gwrpm25=1.0)
+
+        assert new_id == 2
+        assert dataset.get_datum_by_id(1)["GWRPM25"] == 5.2
+        assert dataset.get_datum_by_id(2)["GWRPM25"] == 1.0
+
+    def test_add_data_entries(self, mocker, mock_dataframe):
+        mocker.patch("pandas.read_parquet", return_value=mock_dataframe)
+        dataset = DataSet(file_path="mock_file_path.parquet")
+
+        first_id, last_id = dataset.add_data_entries(
+            lat=np.array([1.0, 2.0]),
+            lon=np.array([1.0, 2.0]),
+            gwrpm25=np.array([10.0, 0.5]),
+        )
+
+        assert (first_id, last_id) == (2, 3)
+        assert dataset.get_datum_by_id(3)["lat"] == 2.0
+        assert dataset.filter_data(lat=1.0, lon=1.0) == (
+            '[{"id":2,"lat":1.0,"lon":1.0,"GWRPM25":10.0}]'
+        )
+        assert dataset.get_stats()["max"] == 10.0
+        assert dataset.get_stats()["min"] == 0.5
+        assert dataset.get_stats()["count"] == 4
+
+
+class TestDataSetConcurrency:
+    @pytest.fixture
+    def dataset(self):
+        values = np.arange(200, dtype=np.float64)
+        dataset = DataSet.__new__(DataSet)
+        dataset.df = pd.DataFrame({"lat": values, "lon": values, "GWRPM25": values})
+        return dataset
+
+    def test_concurrent_readers_and_writers(self, dataset):
+        stop = threading.Event()
+        errors = []
+
+        def writer(seed):
+            rng = np.random.default_rng(seed)
+            while not stop.is_set():
+                ids = dataset.df.index
+                value = float(rng.integers(1000))
+                action = rng.integers(3)
+                try:
+                    if action == 0:
+                        dataset.add_data_entry(lat=value, lon=value, gwrpm25=value)
+                    elif action == 1:
+                        dataset.update_data_entry(
+                            id=int(rng.choice(ids)), lat=value, lon=value, gwrpm25=value
+                        )
+                    elif len(ids) > 50:
+                        dataset.delete_data_entry(id=int(rng.choice(ids)))
+                except EntryNotFoundError:
+                    pass  # another writer got there first
+
+        def reader(seed):
+            rng = np.random.default_rng(seed)
+            try:
+                while not stop.is_set():
+                    snapshot = dataset.snapshot()
+                    rows = snapshot.rows.frame(snapshot.rows.live_slots())
+                    assert len(rows) == snapshot.stats["count"]
+                    assert rows["GWRPM25"].mean() == pytest.approx(
+                        snapshot.stats["average"]
+                    )
+                    assert (rows["lat"] == rows["lon"]).all()
+                    assert (rows["lat"] == rows["GWRPM25"]).all()
+
+                    records = json.loads(dataset.get_full_data())
+                    assert all(r["lat"] == r["lon"] == r["GWRPM25"] for r in records)
+
+                    value = float(rng.integers(1000))
+                    for record in json.loads(dataset.filter_data(lat=value, lon=value)):
+                        assert record["lat"] == record["lon"] == value
+            except AssertionError as e:
+                errors.append(e)
+                stop.set()
+
+        threads = [threading.Thread(target=writer, args=(i,)) for i in range(2)]
+        threads += [threading.Thread(target=reader, args=(i,)) for i in range(4)]
+        for thread in threads:
+            thread.start()
+        time.sleep(1.0)
+        stop.set()
+        for thread in threads:
+            thread.join()
+
+        assert errors == []
+        assert dataset.snapshot().version > 0
+
+    def test_concurrent_deletes_of_one_entry(self, dataset):
+        outcomes = []
+
+        def delete():
+            try:
+                dataset.delete_data_entry(id=5)
+                outcomes.append("deleted")
+            except EntryNotFoundError:
+                outcomes.append("not found")
+
+        threads = [threading.Thread(target=delete) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert sorted(outcomes) == ["deleted"] + ["not found"] * 7
+        assert dataset.get_stats()["count"] == 199
@@ -0,0 +1,84 @@
+import math
+
+import numpy as np
+import pytest
+
+from app.distribution import QuantileSketch
+
+
+@pytest.fixture
+def values():
+    rng = np.random.default_rng(0)
+    return np.r_[rng.gamma(2.0, 5.0, 20000), -rng.gamma(2.0, 1.0, 100), [0.0] * 10]
+
+
+def true_quantiles(values, qs):
+    ordered = np.sort(values)
+    return ordered[np.floor(np.asarray(qs) * (len(values) - 1)).astype(int)]
+
+
+class TestQuantileSketch:
+    def test_quantiles_within_accuracy(self, values):
+        sketch = QuantileSketch(values)
+        qs = [0.0, 0.001, 0.01, 0.25, 0.5, 0.9, 0.99, 1.0]
+
+        estimates = np.array(sketch.quantiles(qs))
+        expected = true_quantiles(values, qs)
+
+        assert sketch.count == len(values)
+        assert np.all(np.abs(estimates - expected) <= 0.01 * np.abs(expected) + 1e-12)
+
+    def test_remove_is_exact(self, values):
+        sketch = QuantileSketch(values)
+        for value in values[:5000]:
+            sketch.remove(value)
+
+        assert np.array_equal(sketch.counts, QuantileSketch(values[5000:]).counts)
+
+    def test_merge(self, values):
+        left, right = QuantileSketch(values[:7000]), QuantileSketch(values[7000:])
+
+        merged = left.merge(right)
+
+        assert np.array_equal(merged.counts, QuantileSketch(values).counts)
+        assert left.count == 7000
+        with pytest.raises(ValueError):
+            left.merge(QuantileSketch(accuracy=0.05))
+
+    def test_views_do_not_change(self, values):
+        sketch = QuantileSketch(values)
+        view = sketch.view()
+        sketch.add(1000.0)
+        sketch.remove(values[0])
+
+        assert view.count == len(values)
+        assert view.quantiles([1.0]) != sketch.quantiles([1.0])
+
+    def test_histogram(self):
+        sketch = QuantileSketch([1.0, 2.0, 2.0, 3.0, 10.0, np.nan])
+
+        histogram = sketch.histogram(3, (0.0, 6.0))
+
+        assert histogram["edges"] == [0.0, 2.0, 4.0, 6.0]
+        # values a bucket's width from an edge may land either side of it
+        assert sum(histogram["counts"]) == 4
+        assert histogram["counts"][2] == 0
+
+    def test_histogram_defaults_to_value_range(self):
+        histogram = QuantileSketch([5.0, 7.0, 9.0]).histogram(2)
+
+        assert histogram["edges"][0] == pytest.approx(5.0, rel=0.01)
+        assert histogram["edges"][-1] == pytest.approx(9.0, rel=0.01)
+        assert histogram["counts"] == [1, 2]
+
+    def test_empty(self):
+        sketch = QuantileSketch()
+
+        assert sketch.count == 0
+        assert all(math.isnan(q) for q in sketch.quantiles([0.5]))
+        assert sum(sketch.histogram(4)["counts"]) == 0
+
+    def test_tiny_and_huge_values(self):
+        sketch = QuantileSketch([1e-9, -1e-9, 1e9])
+
+        assert sketch.quantiles([0.0, 1.0]) == [0.0, pytest.approx(1e6, rel=0.01)]
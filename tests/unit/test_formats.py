@@ -0,0 +1,107 @@
+import io
+import json
+import struct
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pytest
+
+from app.formats import ARROW, BYTES, CSV, JSON, MSGPACK, NDJSON, encode, iter_encode
+
+
+def unpack(data: bytes) -> list:
+    """Decode the MessagePack subset app.formats writes."""
+    stream = io.BytesIO(data)
+
+    def read(fmt):
+        return struct.unpack(fmt, stream.read(struct.calcsize(fmt)))[0]
+
+    def value():
+        tag = read(">B")
+        if tag & 0xF0 == 0x90:
+            return [value() for _ in range(tag & 0x0F)]
+        if tag in (0xDC, 0xDD):
+            return [value() for _ in range(read(">H" if tag == 0xDC else ">I"))]
+        if tag & 0xF0 == 0x80:
+            return {value(): value() for _ in range(tag & 0x0F)}
+        if tag & 0xE0 == 0xA0:
+            return stream.read(tag & 0x1F).decode("utf-8")
+        return read({0xD3: ">q", 0xCA: ">f", 0xCB: ">d"}[tag])
+
+    result = value()
+    assert stream.read() == b""
+    return result
+
+
+@pytest.fixture
+def columns():
+    return {
+        "id": np.array([3, 7, 9]),
+        "lat": np.array([44.355, -44.2222, 0.5]),
+        "lon": np.array([176.255005, -176.2222, 1.25], dtype=np.float32),
+        "GWRPM25": np.array([6.2, np.nan, 5.2]),
+    }
+
+
+def batches(columns, size):
+    for start in range(0, 3, size):
+        yield {name: values[start : start + size] for name, values in columns.items()}
+
+
+class TestFormats:
+    def test_json(self, columns):
+        records = json.loads(encode(columns, JSON))
+
+        assert records[0]["id"] == 3
+        assert records[0]["lat"] == 44.355
+        assert records[0]["lon"] == pytest.approx(176.255005, abs=1e-5)
+        assert records[1]["GWRPM25"] is None
+
+    def test_streamed_matches_whole(self, columns):
+        for fmt in (JSON, NDJSON, CSV, MSGPACK):
+            pieces = list(iter_encode(batches(columns, 2), 3, fmt))
+            whole = encode(columns, fmt)
+
+            assert (b"" if fmt in BYTES else "").join(pieces) == whole
+
+    def test_msgpack(self, columns):
+        records = unpack(encode(columns, MSGPACK))
+
+        assert [record["id"] for record in records] == [3, 7, 9]
+        assert records[0]["lat"] == 44.355
+        assert records[0]["lon"] == pytest.approx(176.255005, abs=1e-5)
+        assert np.isnan(records[1]["GWRPM25"])
+
+    def test_msgpack_long_array(self):
+        columns = {"id": np.arange(70000)}
+
+        assert unpack(encode(columns, MSGPACK))[-1] == {"id": 69999}
+
+    def test_arrow(self, columns):
+        table = pa.ipc.open_stream(b"".join(iter_encode(batches(columns, 2), 3, ARROW)))
+        table = table.read_all()
+
+        assert table.num_rows == 3
+        assert table.schema.field("lon").type == pa.float32()
+        assert table.column("id").to_pylist() == [3, 7, 9]
+
+    def test_empty(self):
+        columns = {"id": np.empty(0, dtype=np.int64), "lat": np.empty(0)}
+
+        assert encode(columns, JSON) == "[]"
+        assert unpack(encode(columns, MSGPACK)) == []
+        assert pa.ipc.open_stream(encode(columns, ARROW)).read_all().num_rows == 0
+        assert encode(columns, CSV) == b"id,lat\n"
+
+    def test_csv(self, columns):
+        body = encode(columns, CSV)
+        frame = pd.read_csv(io.BytesIO(body))
+
+        assert body.splitlines()[:2] == [b"id,lat,lon,GWRPM25", b"3,44.355,176.255,6.2"]
+        assert frame["lat"].tolist() == [44.355, -44.2222, 0.5]
+        assert np.isnan(frame["GWRPM25"][1])
+
+    def test_unknown_format(self, columns):
+        with pytest.raises(ValueError):
+            encode(columns, "text/html")
@@ -0,0 +1,120 @@
+import io
+import json
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from app.ingest import (
+    ARROW_STREAM,
+    NDJSON,
+    PARQUET,
+    BatchFormatError,
+    parse_batch,
+    parse_points,
+    validate_batch,
+)
+
+
+@pytest.fixture
+def table():
+    return pa.table({"lat": [1.0, 2.0], "lon": [3.0, 4.0], "gwrpm25": [5.0, 6.0]})
+
+
+class TestParseBatch:
+    def test_json_array(self):
+        body = json.dumps([{"lat": 1, "lon": 2, "gwrpm25": 3}, 7]).encode()
+
+        frame, errors = parse_batch(body, "application/json")
+
+        assert len(frame) == 2
+        assert errors == {1: "Entry must be an object."}
+
+    def test_json_not_array(self):
+        with pytest.raises(BatchFormatError):
+            parse_batch(b'{"lat": 1}', "application/json")
+
+    def test_ndjson_malformed_line(self):
+        body = b'{"lat": 1, "lon": 2, "gwrpm25": 3}\n{oops\n\n{"lat": 4}\n'
+
+        frame, errors = parse_batch(body, NDJSON)
+
+        assert len(frame) == 3
+        assert errors == {1: "Malformed JSON."}
+
+    def test_arrow_stream(self, table):
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+
+        frame, errors = parse_batch(sink.getvalue().to_pybytes(), ARROW_STREAM)
+
+        assert frame["gwrpm25"].tolist() == [5.0, 6.0]
+        assert errors == {}
+
+    def test_parquet(self, table):
+        buffer = io.BytesIO()
+        pq.write_table(table, buffer)
+
+        frame, _ = parse_batch(buffer.getvalue(), PARQUET)
+
+        assert frame["lat"].tolist() == [1.0, 2.0]
+
+    def test_garbage_arrow(self):
+        with pytest.raises(BatchFormatError):
+            parse_batch(b"not arrow", ARROW_STREAM)
+
+
+class TestValidateBatch:
+    def test_reports_bad_rows(self):
+        frame = pd.DataFrame(
+            {
+                "lat": [1.0, "x", 3.0, None],
+                "lon": [1.0, 2.0, float("inf"), 4.0],
+                "GWRPM25": ["5.5", 6.0, 7.0, 8.0],
+            }
+        )
+
+        columns, rows, errors = validate_batch(frame, {})
+
+        assert rows.tolist() == [0]
+        assert columns["gwrpm25"].tolist() == [5.5]
+        assert errors == [
+            {"row": 1, "error": "lat must be present and finite numbers."},
+            {"row": 2, "error": "lon must be present and finite numbers."},
+            {"row": 3, "error": "lat must be present and finite numbers."},
+        ]
+
+    def test_missing_column(self):
+        frame = pd.DataFrame({"lat": [1.0], "lon": [1.0]})
+
+        _, rows, errors = validate_batch(frame, {})
+
+        assert len(rows) == 0
+        assert errors[0]["error"] == "gwrpm25 must be present and finite numbers."
+
+
+class TestParsePoints:
+    def test_pairs(self):
+        lats, lons = parse_points(b"[[1, 2], [3.5, -4]]", "application/json")
+
+        assert lats.tolist() == [1.0, 3.5]
+        assert lons.tolist() == [2.0, -4.0]
+
+    def test_entries(self, table):
+        sink = io.BytesIO()
+        pq.write_table(table, sink)
+
+        lats, lons = parse_points(sink.getvalue(), PARQUET)
+
+        assert lats.tolist() == [1.0, 2.0]
+        assert lons.tolist() == [3.0, 4.0]
+
+    @pytest.mark.parametrize(
+        "body",
+        [b"{}", b"[[1]]", b'[[1, "a"]]', b'[{"lat": 1}]', b"[[1, null]]", b"[["],
+    )
+    def test_invalid(self, body):
+        with pytest.raises(BatchFormatError):
+            parse_points(body, "application/json")
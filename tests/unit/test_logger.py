@@ -0,0 +1,17 @@
+from app import logger as logger_module
+
+
+class TestSetupLogger:
+    def test_adds_one_handler_however_often_called(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(logger_module, "LOG_DIRECTORY", str(tmp_path))
+        first = logger_module.setup_logger("test_logger", "test.txt")
+        second = logger_module.setup_logger("test_logger", "test.txt")
+
+        assert first is second
+        assert len(first.handlers) == 1
+
+        first.info("queued")
+        logger_module._listeners["test_logger"].stop()
+        del logger_module._listeners["test_logger"]
+        first.handlers.clear()
+        assert "queued" in (tmp_path / "test.txt").read_text()
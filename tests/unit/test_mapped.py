@@ -0,0 +1,90 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.data_set import DataSet
+from app.mapped import built_path, cache_path, load_mapped
+from app.storage import CHUNK_ROWS
+
+
+@pytest.fixture
+def parquet_path(tmp_path):
+    count = CHUNK_ROWS + 100
+    path = str(tmp_path / "data.parquet")
+    pd.DataFrame(
+        {
+            "lat": np.linspace(-60.0, 60.0, count),
+            "lon": np.linspace(-170.0, 170.0, count),
+            "GWRPM25": np.linspace(1.0, 50.0, count).astype(np.float32),
+        }
+    ).to_parquet(path, row_group_size=10000)
+    return path
+
+
+class TestLoadMapped:
+    def test_matches_eager_load(self, parquet_path):
+        eager = DataSet(parquet_path)
+
+        mapped = DataSet(parquet_path, load="mmap")
+
+        pd.testing.assert_frame_equal(mapped.df, eager.df)
+        assert mapped.get_stats() == eager.get_stats()
+        assert not mapped.store._chunks["lat"][0].flags.writeable
+
+    def test_writes_copy_mapped_chunks(self, parquet_path):
+        store = load_mapped(parquet_path)
+        snapshot = store.snapshot()
+
+        store.update(0, lat=1.0, lon=1.0, gwrpm25=1.0)
+        store.delete(1)
+        new_id = store.append(lat=2.0, lon=2.0, gwrpm25=2.0)
+
+        assert new_id == CHUNK_ROWS + 100
+        assert store.column("lat", [store.slot_of(0)])[0] == 1.0
+        assert store.column("lat", [store.slot_of(new_id)])[0] == 2.0
+        assert store.slot_of(1) is None
+        assert snapshot.column("lat", [0])[0] == -60.0
+        assert len(snapshot) == CHUNK_ROWS + 100
+
+    def test_cache_is_rebuilt_when_parquet_changes(self, parquet_path):
+        load_mapped(parquet_path, dtypes="float32")
+        pd.DataFrame(
+            {"lat": [1.0], "lon": [2.0], "GWRPM25": np.array([3.0], dtype=np.float32)}
+        ).to_parquet(parquet_path)
+
+        store = load_mapped(parquet_path, dtypes="float32")
+
+        assert cache_path(parquet_path, "float32").endswith("data.float32.arrow")
+        assert store.frame(store.live_slots()).values.tolist() == [[1.0, 2.0, 3.0]]
+
+    def test_keeps_ids_of_written_snapshots(self, tmp_path):
+        path = str(tmp_path / "snapshot.parquet")
+        pd.DataFrame(
+            {"lat": [1.0, 2.0], "lon": [1.0, 2.0], "GWRPM25": [1.0, 2.0]},
+            index=[3, 7],
+        ).to_parquet(path)
+
+        store = load_mapped(path, dtypes="quantized")
+
+        assert store.ids(store.live_slots()).tolist() == [3, 7]
+        assert store.next_id == 8
+        assert store.column("lat", [1])[0] == 2.0
+
+    def test_structures_are_built_once_and_mapped(self, parquet_path):
+        first = DataSet(parquet_path, load="mmap")
+        path = built_path(parquet_path, "native", "10-16")
+        with open(path, "rb") as built:
+            saved = built.read()
+
+        second = DataSet(parquet_path, load="mmap")
+        second.add_data_entry(lat=1.0, lon=2.0, gwrpm25=3.0)
+        second.delete_data_entry(0)
+        first.add_data_entry(lat=1.0, lon=2.0, gwrpm25=3.0)
+        first.delete_data_entry(0)
+
+        # arrays of the mapped structures view the file, not copies of it
+        assert not second.spatial_index._members.flags.owndata
+        assert second.nearest_data(1.0, 2.0, 3) == first.nearest_data(1.0, 2.0, 3)
+        assert second.get_stats() == first.get_stats()
+        with open(path, "rb") as built:
+            assert built.read() == saved
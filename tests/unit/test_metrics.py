@@ -0,0 +1,89 @@
+from app.metrics import Counter, Gauge, Histogram, Registry, timed_iter
+
+
+class TestCounter:
+    def test_counts_per_label_values(self):
+        counter = Counter("requests_total", "Requests.", ("route", "status"))
+        counter.inc(route="/data", status="200")
+        counter.inc(route="/data", status="200")
+        counter.inc(2, route="/data", status="404")
+
+        assert list(counter.samples()) == [
+            'requests_total{route="/data",status="200"} 2',
+            'requests_total{route="/data",status="404"} 2',
+        ]
+
+    def test_escapes_label_values(self):
+        counter = Counter("requests_total", "Requests.", ("route",))
+        counter.inc(route='a"b\\c\nd')
+
+        assert list(counter.samples()) == ['requests_total{route="a\\"b\\\\c\\nd"} 1']
+
+
+class TestHistogram:
+    def test_buckets_are_cumulative(self):
+        histogram = Histogram("latency_seconds", "Latency.", buckets=(0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 2.0):
+            histogram.observe(value)
+
+        assert list(histogram.samples()) == [
+            'latency_seconds_bucket{le="0.1"} 2',
+            'latency_seconds_bucket{le="1"} 3',
+            'latency_seconds_bucket{le="+Inf"} 4',
+            "latency_seconds_sum 2.65",
+            "latency_seconds_count 4",
+        ]
+
+    def test_time_observes_the_block(self):
+        histogram = Histogram("op_seconds", "Ops.", ("operation",))
+        with histogram.time(operation="filter"):
+            pass
+
+        assert 'op_seconds_count{operation="filter"} 1' in list(histogram.samples())
+
+    def test_timed_iter_observes_once_exhausted(self):
+        from app.metrics import OPERATION_SECONDS
+
+        def count():
+            return sum(
+                int(line.rsplit(" ", 1)[1])
+                for line in OPERATION_SECONDS.samples()
+                if line.startswith(
+                    'air_quality_dataset_operation_seconds_count{operation="test"'
+                )
+            )
+
+        pieces = timed_iter(iter(["a", "b"]), "test")
+        before = count()
+        assert next(pieces) == "a"
+        assert count() == before
+        assert list(pieces) == ["b"]
+        assert count() == before + 1
+
+
+class TestRegistry:
+    def test_render(self):
+        registry = Registry()
+        registry.register(Counter("hits_total", "Cache hits.")).inc()
+        registry.register(Gauge("rows", "Live rows.", lambda: 3))
+        registry.register(Gauge("broken", "Unreadable.", lambda: 1 / 0))
+
+        assert registry.render() == (
+            "# HELP hits_total Cache hits.\n"
+            "# TYPE hits_total counter\n"
+            "hits_total 1\n"
+            "# HELP rows Live rows.\n"
+            "# TYPE rows gauge\n"
+            "rows 3\n"
+            "# HELP broken Unreadable.\n"
+            "# TYPE broken gauge\n"
+        )
+
+    def test_broken_gauge_is_logged(self, caplog):
+        registry = Registry()
+        registry.register(Gauge("broken", "Unreadable.", lambda: 1 / 0))
+
+        registry.render()
+
+        assert "Error reading gauge broken" in caplog.text
+        assert "ZeroDivisionError" in caplog.text
@@ -0,0 +1,101 @@
+import numpy as np
+import pytest
+
+from app.raster import RasterGrid, RasterIndex
+from app.spatial_index import haversine_km
+
+
+@pytest.fixture
+def grid_points():
+    rows, cols = np.divmod(np.arange(600), 30)
+    lats = (-10.005 + rows * 0.01).astype(np.float32).astype(np.float64)
+    lons = (170.005 + cols * 0.01).astype(np.float32).astype(np.float64)
+    return np.arange(600), lats, lons
+
+
+def locator(ids, lats, lons):
+    def locate(members):
+        members = np.asarray(members, dtype=np.int64)
+        return members, lats[members], lons[members]
+
+    return locate
+
+
+class TestRasterGrid:
+    def test_detect_undoes_float32_noise(self, grid_points):
+        _, lats, lons = grid_points
+
+        grid = RasterGrid.detect(lats, lons)
+
+        assert (grid.lat0, grid.lon0, grid.dlat, grid.dlon) == (
+            -10.005,
+            170.005,
+            0.01,
+            0.01,
+        )
+        assert (grid.n_lat, grid.n_lon) == (20, 30)
+        assert grid.lats([3]).tolist() == [-9.975]
+
+    def test_locate(self, grid_points):
+        _, lats, lons = grid_points
+        grid = RasterGrid.detect(lats, lons)
+
+        rows, cols, on_grid = grid.locate(
+            [lats[31], -9.9712, 50.0, np.nan], [lons[31], 170.005, 170.005, 170.005]
+        )
+
+        assert on_grid.tolist() == [True, False, False, False]
+        assert (rows[0], cols[0]) == (1, 1)
+        assert rows[1:].tolist() == [-1, -1, -1]
+
+    def test_scattered_points_have_no_grid(self):
+        rng = np.random.default_rng(0)
+
+        with pytest.raises(ValueError):
+            RasterGrid.detect(rng.uniform(-60, 60, 500), rng.uniform(-180, 180, 500))
+
+
+class TestRasterIndex:
+    def test_query_point_and_bbox(self, grid_points):
+        ids, lats, lons = grid_points
+        index = RasterIndex(RasterGrid.detect(lats, lons), ids, lats, lons)
+
+        assert index.query_point(lats[42], lons[42]).tolist() == [42]
+        box = (-9.9, 170.05, -9.85, 170.1)
+        inside = (
+            (lats >= box[0]) & (lats <= box[2]) & (lons >= box[1]) & (lons <= box[3])
+        )
+        assert set(np.flatnonzero(inside)) == set(index.query_bbox(*box))
+
+    def test_duplicates_and_off_grid_go_to_overlay(self, grid_points):
+        ids, lats, lons = grid_points
+        index = RasterIndex(RasterGrid.detect(lats, lons), ids, lats, lons)
+
+        index.add_many(
+            np.array([600, 601]), np.array([lats[5], 0.0]), np.array([lons[5], 0.0])
+        )
+
+        assert len(index) == 602
+        assert len(index.overlay) == 2
+        assert sorted(index.query_point(lats[5], lons[5]).tolist()) == [5, 600]
+        assert index.query_point(0.0, 0.0).tolist() == [601]
+
+    def test_add_is_invisible_to_views_overlay(self, grid_points):
+        ids, lats, lons = grid_points
+        index = RasterIndex(RasterGrid.detect(lats, lons), ids, lats, lons)
+        view = index.view()
+
+        index.add(600, 0.0, 0.0)
+
+        assert index.query_point(0.0, 0.0).tolist() == [600]
+        assert len(view.query_point(0.0, 0.0)) == 0
+
+    def test_nearest_matches_brute_force(self, grid_points):
+        ids, lats, lons = grid_points
+        index = RasterIndex(RasterGrid.detect(lats, lons), ids, lats, lons)
+        locate = locator(ids, lats, lons)
+
+        for lat, lon, k in [(-9.9, 170.1, 5), (-30.0, -170.0, 3), (0.0, 0.0, 1)]:
+            members, distances = index.nearest(lat, lon, k, locate)
+            expected = np.sort(haversine_km(lat, lon, lats, lons))[:k]
+            assert np.allclose(distances, expected)
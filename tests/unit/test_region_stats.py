@@ -0,0 +1,141 @@
+import numpy as np
+import pytest
+
+from app import region_stats
+from app.region_stats import RegionStats, points_in_polygon
+
+
+@pytest.fixture
+def points():
+    rng = np.random.default_rng(0)
+    rows = rng.integers(0, 100, 5000)
+    cols = rng.integers(0, 150, 5000)
+    # a 0.01 degree grid stored as float32, plus a few points off it
+    lats = np.r_[-20.005 + rows * 0.01, rng.uniform(-20, -19, 100)]
+    lons = np.r_[100.005 + cols * 0.01, rng.uniform(100, 101.5, 100)]
+    values = rng.gamma(2.0, 3.0, len(lats))
+    return lats.astype(np.float32).astype(np.float64), lons, values
+
+
+def centred(stats, lats, lons):
+    """Coordinates as RegionStats sees them, on-grid points at the centre."""
+    rows, cols, on_grid = stats.grid.locate(lats, lons)
+    return (
+        np.where(on_grid, stats.grid.lats(rows), lats),
+        np.where(on_grid, stats.grid.lons(cols), lons),
+    )
+
+
+class TestRegionStats:
+    def test_bbox_matches_brute_force(self, points):
+        lats, lons, values = points
+        stats = RegionStats(lats, lons, values)
+        lats, lons = centred(stats, lats, lons)
+        rng = np.random.default_rng(1)
+
+        assert (stats.grid.n_lat, stats.grid.n_lon) == (100, 150)
+        for _ in range(50):
+            min_lat, max_lat = np.sort(rng.uniform(-20.1, -18.9, 2))
+            min_lon, max_lon = np.sort(rng.uniform(99.9, 101.6, 2))
+            inside = (
+                (lats >= min_lat)
+                & (lats <= max_lat)
+                & (lons >= min_lon)
+                & (lons <= max_lon)
+            )
+            result = stats.bbox(min_lat, min_lon, max_lat, max_lon)
+            assert result["count"] == inside.sum()
+            assert np.isclose(result["sum"], values[inside].sum())
+
+    def test_bbox_edges_are_inclusive(self, points):
+        stats = RegionStats(*points)
+
+        whole = stats.bbox(-20.005, 100.005, -19.015, 101.495)
+        inner = stats.bbox(-20.004, 100.006, -19.016, 101.494)
+
+        assert whole["count"] == 5000 + 100
+        assert inner["count"] < whole["count"]
+
+    def test_polygon_matches_brute_force(self, points):
+        lats, lons, values = points
+        stats = RegionStats(lats, lons, values)
+        lats, lons = centred(stats, lats, lons)
+        rng = np.random.default_rng(2)
+
+        for _ in range(50):
+            angles = np.sort(rng.uniform(0, 2 * np.pi, rng.integers(3, 9)))
+            radii = rng.uniform(0.05, 0.6, len(angles))
+            poly_lats = -19.5 + radii * np.sin(angles)
+            poly_lons = 100.75 + radii * np.cos(angles)
+            inside = points_in_polygon(lats, lons, poly_lats, poly_lons)
+            result = stats.polygon(poly_lats, poly_lons)
+            assert result["count"] == inside.sum()
+            assert np.isclose(result["sum"], values[inside].sum())
+
+    def test_changes_are_patched_and_views_frozen(self, points):
+        lats, lons, values = points
+        stats = RegionStats(lats, lons, values)
+        view = stats.view()
+        box = (-20.1, 99.9, -18.9, 101.6)
+        before = stats.bbox(*box)
+
+        stats.remove(lats[0], lons[0], values[0])
+        stats.add(-19.5, 100.5, 1000.0)
+
+        after = stats.bbox(*box)
+        assert after["count"] == before["count"]
+        assert np.isclose(after["sum"], before["sum"] - values[0] + 1000.0)
+        assert view.bbox(*box) == before
+
+    @pytest.mark.parametrize("max_cells", [1000, 4])
+    def test_large_grids_are_tabulated_per_block(self, points, max_cells, monkeypatch):
+        monkeypatch.setattr(region_stats, "MAX_CELLS", max_cells)
+        lats, lons, values = points
+        stats = RegionStats(lats, lons, values)
+        lats, lons = centred(stats, lats, lons)
+        rng = np.random.default_rng(3)
+
+        assert stats.grid is not None and stats._block > 1
+        assert stats._extra_len == 100
+        for _ in range(50):
+            min_lat, max_lat = np.sort(rng.uniform(-20.1, -18.9, 2))
+            min_lon, max_lon = np.sort(rng.uniform(99.9, 101.6, 2))
+            inside = (
+                (lats >= min_lat)
+                & (lats <= max_lat)
+                & (lons >= min_lon)
+                & (lons <= max_lon)
+            )
+            result = stats.bbox(min_lat, min_lon, max_lat, max_lon)
+            assert result["count"] == inside.sum()
+            assert np.isclose(result["sum"], values[inside].sum())
+        for _ in range(20):
+            angles = np.sort(rng.uniform(0, 2 * np.pi, rng.integers(3, 9)))
+            radii = rng.uniform(0.05, 0.6, len(angles))
+            poly_lats = -19.5 + radii * np.sin(angles)
+            poly_lons = 100.75 + radii * np.cos(angles)
+            inside = points_in_polygon(lats, lons, poly_lats, poly_lons)
+            result = stats.polygon(poly_lats, poly_lons)
+            assert result["count"] == inside.sum()
+            assert np.isclose(result["sum"], values[inside].sum())
+
+    def test_empty_region(self, points):
+        stats = RegionStats(*points)
+
+        assert stats.bbox(10.0, 10.0, 11.0, 11.0) == {
+            "count": 0,
+            "sum": 0.0,
+            "average": None,
+        }
+
+    def test_scattered_points_have_no_tables(self):
+        rng = np.random.default_rng(0)
+        lats, lons = rng.uniform(-60, 60, 500), rng.uniform(-180, 180, 500)
+        stats = RegionStats(lats, lons, np.ones(500))
+
+        result = stats.bbox(-10.0, 170.0, 10.0, -170.0)
+
+        assert stats.grid is None
+        assert result["count"] == np.sum(
+            (np.abs(lats) <= 10.0) & (np.abs(lons) >= 170.0)
+        )
@@ -0,0 +1,45 @@
+from app.response_cache import ResponseCache
+
+
+class TestResponseCache:
+    def test_get_put(self):
+        cache = ResponseCache()
+
+        assert cache.get(0, "a") is None
+        cache.put(0, "a", b"body", 4)
+
+        assert cache.get(0, "a") == b"body"
+        assert (cache.hits, cache.misses) == (1, 1)
+
+    def test_evicts_least_recently_used(self):
+        cache = ResponseCache(max_entries=2)
+        cache.put(0, "a", 1, 1)
+        cache.put(0, "b", 2, 1)
+        cache.get(0, "a")
+
+        cache.put(0, "c", 3, 1)
+
+        assert cache.get(0, "b") is None
+        assert cache.get(0, "a") == 1
+        assert cache.get(0, "c") == 3
+
+    def test_size_cap(self):
+        cache = ResponseCache(max_bytes=10)
+        cache.put(0, "a", "a", 6)
+        cache.put(0, "b", "b", 6)
+        cache.put(0, "huge", "huge", 11)
+
+        assert cache.get(0, "a") is None
+        assert cache.get(0, "b") == "b"
+        assert cache.get(0, "huge") is None
+        assert cache.size == 6
+
+    def test_newer_version_drops_older_entries(self):
+        cache = ResponseCache()
+        cache.put(0, "a", 1, 1)
+
+        assert cache.get(1, "a") is None
+        assert len(cache) == 0
+        # a render of an older version finishing late is not stored
+        cache.put(0, "a", 1, 1)
+        assert len(cache) == 0
@@ -0,0 +1,86 @@
+import numpy as np
+import pytest
+
+from app.raster import RasterGrid
+from app.sampling import BILINEAR, NEAREST, GridSampler
+
+
+@pytest.fixture
+def sampler():
+    # a 0.1 degree grid of 3 x 3 cells, value = 10 * row + col, (2, 2) empty
+    rows, cols = np.divmod(np.arange(8), 3)
+    lats = 10.05 + rows * 0.1
+    lons = 20.05 + cols * 0.1
+    return GridSampler(lats, lons, 10.0 * rows + cols)
+
+
+class TestGridSampler:
+    def test_exact_cells(self, sampler):
+        values = sampler.sample([10.05, 10.15, 10.25], [20.05, 20.25, 20.15], NEAREST)
+
+        assert values.tolist() == [0.0, 12.0, 21.0]
+
+    def test_bilinear_between_centres(self, sampler):
+        values = sampler.sample([10.1, 10.05, 10.1], [20.1, 20.1, 20.05], BILINEAR)
+
+        assert np.allclose(values, [5.5, 0.5, 5.0])
+
+    def test_bilinear_leaves_out_empty_cells(self, sampler):
+        # the (2, 2) corner has no value, the other three share its weight
+        value = sampler.sample([10.2], [20.2])[0]
+
+        assert np.isclose(value, (11 + 12 + 21) / 3)
+
+    def test_bilinear_matches_nearest_on_centres(self, sampler):
+        lats = np.array([10.05, 10.15, 10.25])
+        lons = np.array([20.25, 20.05, 20.15])
+
+        assert np.allclose(
+            sampler.sample(lats, lons, BILINEAR), sampler.sample(lats, lons, NEAREST)
+        )
+
+    def test_off_grid_is_nan(self, sampler):
+        values = sampler.sample([0.0, 10.25, 10.05], [0.0, 20.25, 25.0], NEAREST)
+
+        assert np.isnan(values).all()
+
+    def test_changes_show_in_new_views(self, sampler):
+        before = sampler.view()
+        sampler.add(10.25, 20.25, 30.0)
+        sampler.add(10.05, 20.05, 4.0)
+        sampler.remove(10.15, 20.15, 11.0)
+        after = sampler.view()
+
+        lats, lons = [10.25, 10.05, 10.15], [20.25, 20.05, 20.15]
+        assert np.allclose(
+            before.sample(lats, lons, NEAREST), [np.nan, 0.0, 11.0], equal_nan=True
+        )
+        assert np.allclose(
+            after.sample(lats, lons, NEAREST), [30.0, 2.0, np.nan], equal_nan=True
+        )
+
+    def test_rebuild_folds_in_changes(self, sampler):
+        sampler.add(10.25, 20.25, 30.0)
+        sampler.rebuild(np.array([10.25]), np.array([20.25]), np.array([30.0]))
+
+        assert sampler.sample([10.25], [20.25], NEAREST).tolist() == [30.0]
+        assert np.isnan(sampler.sample([10.05], [20.05], NEAREST)[0])
+
+    def test_blocks_only_where_points_are(self):
+        grid = RasterGrid(0.05, 0.05, 0.1, 0.1, 1000, 1000)
+        sampler = GridSampler(np.array([0.05]), np.array([99.95]), [1.0], grid)
+
+        assert sampler._means.shape[0] == 1
+        assert sampler.sample([0.05], [99.95], NEAREST).tolist() == [1.0]
+
+    def test_unknown_method(self, sampler):
+        with pytest.raises(ValueError):
+            sampler.sample([10.05], [20.05], "cubic")
+
+    def test_not_on_a_grid(self):
+        sampler = GridSampler(
+            np.array([1.0, 1.3, 2.0]), np.array([1.0, 5.0, 2.7]), [1, 2, 3]
+        )
+
+        with pytest.raises(ValueError):
+            sampler.sample([1.0], [1.0])
@@ -0,0 +1,134 @@
+import numpy as np
+import pytest
+
+from app.spatial_index import GridIndex, haversine_km, radius_bbox
+
+
+@pytest.fixture
+def points():
+    rng = np.random.default_rng(0)
+    lats = rng.uniform(-60, 60, 2000)
+    lons = rng.uniform(-180, 180, 2000)
+    return np.arange(2000), lats, lons
+
+
+def brute_bbox(lats, lons, min_lat, min_lon, max_lat, max_lon):
+    in_lat = (lats >= min_lat) & (lats <= max_lat)
+    if min_lon <= max_lon:
+        in_lon = (lons >= min_lon) & (lons <= max_lon)
+    else:
+        in_lon = (lons >= min_lon) | (lons <= max_lon)
+    return np.flatnonzero(in_lat & in_lon)
+
+
+class TestGridIndex:
+    def test_query_point(self, points):
+        ids, lats, lons = points
+        index = GridIndex(ids, lats, lons, cell_size=1.0)
+
+        assert 42 in index.query_point(lats[42], lons[42])
+
+    def test_query_bbox_superset(self, points):
+        ids, lats, lons = points
+        index = GridIndex(ids, lats, lons, cell_size=1.0)
+
+        for box in [(-10, -20, 10, 20), (0, 170, 30, -170), (-90, -180, 90, 180)]:
+            expected = brute_bbox(lats, lons, *box)
+            assert set(expected) <= set(index.query_bbox(*box))
+
+    def test_add_is_invisible_to_views(self, points):
+        ids, lats, lons = points
+        index = GridIndex(ids, lats, lons, cell_size=1.0)
+        view = index.view()
+
+        index.add(5000, 1.5, 1.5)
+        index.add_many(np.arange(6000, 8000), np.full(2000, 1.5), np.full(2000, 1.5))
+
+        assert {5000, 6000, 7999} <= set(index.query_point(1.5, 1.5))
+        assert 5000 not in view.query_point(1.5, 1.5)
+        assert len(index) == 4001
+        assert len(view) == 2000
+
+    def test_rebuild(self, points):
+        ids, lats, lons = points
+        index = GridIndex(ids, lats, lons, cell_size=1.0)
+        index.add(7, 1.5, 1.5)
+
+        index.rebuild(ids[:10], lats[:10], lons[:10])
+
+        assert len(index) == 10
+        assert 7 in index.query_point(lats[7], lons[7])
+        assert 7 not in index.query_point(1.5, 1.5)
+        assert not index.needs_rebuild()
+
+    def test_nearest_matches_brute_force(self, points):
+        ids, lats, lons = points
+        index = GridIndex(ids, lats, lons, cell_size=1.0)
+
+        def locate(members):
+            return members, lats[members], lons[members]
+
+        for lat, lon in [(0.0, 0.0), (59.0, 179.9), (-89.0, 10.0)]:
+            found, distances = index.nearest(lat, lon, 5, locate)
+            expected = np.sort(haversine_km(lat, lon, lats, lons))[:5]
+            np.testing.assert_allclose(distances, expected)
+            np.testing.assert_allclose(
+                haversine_km(lat, lon, lats[found], lons[found]), distances
+            )
+
+    def test_query_radius_superset(self, points):
+        ids, lats, lons = points
+        index = GridIndex(ids, lats, lons, cell_size=1.0)
+
+        for lat, lon, radius_km in [
+            (0.0, 0.0, 500.0),
+            (50.0, 179.5, 800.0),
+            (-59.0, -179.0, 2000.0),
+            (55.0, 10.0, 5000.0),
+        ]:
+            inside = np.flatnonzero(haversine_km(lat, lon, lats, lons) <= radius_km)
+            found = index.query_radius(lat, lon, radius_km)
+            assert set(inside) <= set(found)
+
+    def test_nearest_more_than_available(self):
+        index = GridIndex(np.array([0, 1]), np.array([1.0, 2.0]), np.array([1.0, 2.0]))
+
+        found, distances = index.nearest(
+            0.0, 0.0, 5, lambda m: (m, np.array([1.0, 2.0])[m], np.array([1.0, 2.0])[m])
+        )
+
+        assert list(found) == [0, 1]
+
+
+class TestRadiusBbox:
+    def test_box_holds_circle(self):
+        min_lat, min_lon, max_lat, max_lon = radius_bbox(60.0, 10.0, 100.0)
+        bearings = np.radians(np.arange(0, 360, 1.0))
+        # points on the circle, from the destination point formula
+        reach = 100.0 / 6371.0088
+        lat = np.radians(60.0)
+        lats = np.arcsin(
+            np.sin(lat) * np.cos(reach) + np.cos(lat) * np.sin(reach) * np.cos(bearings)
+        )
+        lons = 10.0 + np.degrees(
+            np.arctan2(
+                np.sin(bearings) * np.sin(reach) * np.cos(lat),
+                np.cos(reach) - np.sin(lat) * np.sin(lats),
+            )
+        )
+        lats = np.degrees(lats)
+
+        assert lats.min() >= min_lat and lats.max() <= max_lat
+        assert lons.min() >= min_lon and lons.max() <= max_lon
+        # tight to within a degree step of bearing
+        assert max_lon - lons.max() < 1e-3
+
+    def test_wraps_antimeridian(self):
+        min_lat, min_lon, max_lat, max_lon = radius_bbox(0.0, 179.9, 50.0)
+
+        assert min_lon > max_lon
+        assert min_lon < 179.9 and max_lon > -180.0
+
+    def test_holding_a_pole_spans_every_longitude(self):
+        assert radius_bbox(89.5, 20.0, 100.0)[1::2] == (-180.0, 180.0)
+        assert radius_bbox(89.5, 20.0, 100.0)[2] == 90.0
@@ -0,0 +1,177 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from app.storage import CHUNK_ROWS, ColumnStore
+
+
+@pytest.fixture
+def frame():
+    return pd.DataFrame(
+        {
+            "lat": [-44.355000, -44.355000, -44.345001],
+            "lon": [-176.255005, -176.244995, -176.274994],
+            "GWRPM25": np.array([6.2, 5.2, 6.1], dtype=np.float32),
+        }
+    )
+
+
+class TestColumnStore:
+    def test_append_allocates_monotonic_ids(self, frame):
+        store = ColumnStore(frame)
+
+        assert store.append(lat=1.0, lon=1.0, gwrpm25=1.0) == 3
+        store.delete(3)
+        assert store.append(lat=2.0, lon=2.0, gwrpm25=2.0) == 4
+        assert store.slot_of(3) is None
+        assert store.column("lat", [store.slot_of(4)])[0] == 2.0
+
+    def test_delete_does_not_cause_id_reuse(self, frame):
+        store = ColumnStore(frame)
+        store.delete(0)
+
+        new_id = store.append(lat=1.0, lon=1.0, gwrpm25=1.0)
+
+        assert new_id == 3
+        assert store.frame(store.live_slots()).index.tolist() == [1, 2, 3]
+
+    def test_growth_keeps_rows(self, frame):
+        store = ColumnStore(frame)
+        count = CHUNK_ROWS * 2
+
+        store.append_many(
+            lat=np.arange(count, dtype=float),
+            lon=np.arange(count, dtype=float),
+            gwrpm25=np.arange(count, dtype=float),
+        )
+        store.append(lat=-1.0, lon=-1.0, gwrpm25=-1.0)
+
+        assert store.capacity >= count + 4
+        assert len(store) == count + 4
+        assert store.column("GWRPM25", [0])[0] == np.float32(6.2)
+        assert store.column("lat", [store.slot_of(CHUNK_ROWS + 2)])[0] == (
+            CHUNK_ROWS - 1
+        )
+        assert store.column("lat", [store.slot_of(count + 3)])[0] == -1.0
+        assert store.column("GWRPM25", [0]).dtype == np.float32
+
+    def test_compaction_keeps_ids(self, frame):
+        store = ColumnStore(frame)
+        ids = [store.append(lat=0.0, lon=0.0, gwrpm25=float(i)) for i in range(3000)]
+
+        for id in ids[:2000]:
+            store.delete(id)
+
+        assert len(store) == 1003
+        assert store.frame(store.live_slots()).index.tolist() == [0, 1, 2] + ids[2000:]
+        assert store.append(lat=0.0, lon=0.0, gwrpm25=0.0) == ids[-1] + 1
+
+    def test_slots_of_skips_missing_and_deleted(self, frame):
+        store = ColumnStore(frame)
+        store.delete(1)
+
+        slots = store.slots_of(np.array([2, 1, 99, 0]))
+
+        assert store.ids(slots).tolist() == [0, 2]
+
+    def test_live_slots_limit(self, frame):
+        store = ColumnStore(frame)
+        store.delete(1)
+
+        assert store.ids(store.live_slots(0, 2)).tolist() == [0, 2]
+        assert store.ids(store.live_slots(store.slot_after(0), 1)).tolist() == [2]
+
+    def test_update_missing_id(self, frame):
+        store = ColumnStore(frame)
+
+        with pytest.raises(KeyError):
+            store.update(99, lat=0.0, lon=0.0, gwrpm25=0.0)
+
+    def test_append_many(self, frame):
+        store = ColumnStore(frame)
+        count = CHUNK_ROWS + 10
+
+        first_id = store.append_many(
+            lat=np.zeros(count), lon=np.ones(count), gwrpm25=np.arange(count)
+        )
+
+        assert first_id == 3
+        assert store.next_id == count + 3
+        assert len(store) == count + 3
+        assert store.column("GWRPM25", [store.slot_of(count + 2)])[0] == count - 1
+        assert store.ids(store.slots_of([2, 3, count + 2])).tolist() == [
+            2,
+            3,
+            count + 2,
+        ]
+
+    def test_snapshot_is_isolated_from_writes(self, frame):
+        store = ColumnStore(frame)
+        snapshot = store.snapshot()
+
+        store.update(0, lat=1.0, lon=1.0, gwrpm25=1.0)
+        store.delete(1)
+        store.append(lat=2.0, lon=2.0, gwrpm25=2.0)
+
+        assert snapshot.frame(snapshot.live_slots()).equals(frame)
+        assert store.ids(store.live_slots()).tolist() == [0, 2, 3]
+        assert store.column("lat", [0])[0] == 1.0
+
+    def test_snapshot_survives_compaction(self, frame):
+        store = ColumnStore(frame)
+        store.append_many(
+            lat=np.zeros(3000), lon=np.zeros(3000), gwrpm25=np.zeros(3000)
+        )
+        snapshot = store.snapshot()
+
+        for id in range(3, 3003):
+            store.delete(id)
+
+        assert len(store) == 3
+        assert len(snapshot) == 3003
+        assert snapshot.slot_of(3002) is not None
+
+    @pytest.mark.parametrize("dtypes", ["float32", "quantized"])
+    def test_compact_dtypes_round_trip(self, frame, dtypes):
+        store = ColumnStore(frame, dtypes=dtypes)
+
+        store.append(lat=-12.345678, lon=98.765432, gwrpm25=7.25)
+
+        lats = store.column("lat", store.live_slots())
+        assert store.column("GWRPM25", store.live_slots()).dtype.kind == "f"
+        assert np.allclose(lats, [-44.355, -44.355, -44.345001, -12.345678], atol=1e-5)
+        assert np.all(np.abs(lats[-1] - -12.345678) <= store.coordinate_tolerance)
+
+    def test_quantized_rejects_values_it_cannot_hold(self, frame):
+        store = ColumnStore(frame, dtypes="quantized")
+
+        with pytest.raises(ValueError):
+            store.append(lat=0.0, lon=0.0, gwrpm25=float("nan"))
+        with pytest.raises(ValueError):
+            store.update(0, lat=1e9, lon=0.0, gwrpm25=0.0)
+        assert len(store) == 3
+        assert store.column("lat", [0])[0] == -44.355
+
+    def test_unknown_dtypes(self, frame):
+        with pytest.raises(ValueError):
+            ColumnStore(frame, dtypes="float16")
+
+    def test_raster_round_trip_with_off_grid_overlay(self, frame):
+        store = ColumnStore(frame, dtypes="raster")
+        snapshot = store.snapshot()
+
+        store.append(lat=-12.345678, lon=98.765432, gwrpm25=7.25)
+        store.update(0, lat=1.5, lon=2.5, gwrpm25=1.0)
+
+        assert store.grid.dlat == 0.01
+        assert store.column("lat", store.live_slots()).tolist() == [
+            1.5,
+            -44.355,
+            -44.345,
+            -12.345678,
+        ]
+        assert store.column("lon", store.live_slots())[-1] == 98.765432
+        # on-grid points read back as their cell centre
+        before = snapshot.frame(snapshot.live_slots())
+        assert snapshot.column("lon", [1]).tolist() == [-176.245]
+        assert np.allclose(before, frame, rtol=0, atol=store.coordinate_tolerance)
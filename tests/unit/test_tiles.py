@@ -0,0 +1,111 @@
+import numpy as np
+import pytest
+
+from app.tiles import TILE_RECORD, TilePyramid, pack_tile
+
+
+@pytest.fixture
+def points():
+    rng = np.random.default_rng(0)
+    lats = rng.uniform(-60, 60, 2000)
+    lons = rng.uniform(-180, 180, 2000)
+    values = rng.gamma(2.0, 3.0, 2000)
+    return lats, lons, values
+
+
+def assert_same_tiles(pyramid, expected):
+    for z in range(pyramid.max_zoom + 1):
+        for x in range(1 << z):
+            for y in range(1 << z):
+                tile, other = pyramid.tile(z, x, y), expected.tile(z, x, y)
+                for name in ("index", "count", "min", "max"):
+                    assert np.array_equal(tile[name], other[name]), (z, x, y)
+                assert np.allclose(tile["mean"], other["mean"])
+
+
+class TestTilePyramid:
+    def test_zoom_zero_covers_everything(self, points):
+        lats, lons, values = points
+        pyramid = TilePyramid(lats, lons, values, max_zoom=4, size=1)
+
+        tile = pyramid.tile(0, 0, 0)
+
+        assert tile["count"].tolist() == [2000]
+        assert np.isclose(tile["mean"][0], values.mean())
+        assert tile["min"][0] == values.min()
+        assert tile["max"][0] == values.max()
+
+    def test_bins_sum_to_parent(self, points):
+        pyramid = TilePyramid(*points, max_zoom=4, size=8)
+
+        parent = pyramid.tile(1, 1, 0)
+        children = [pyramid.tile(2, x, y) for x in (2, 3) for y in (0, 1)]
+        children = [child for child in children if len(child["index"])]
+
+        assert parent["count"].sum() == sum(c["count"].sum() for c in children)
+        assert parent["max"].max() == max(c["max"].max() for c in children)
+
+    def test_tile_north_west_bin(self):
+        pyramid = TilePyramid([80.0, -80.0], [-179.0, 179.0], [1.0, 2.0], size=4)
+
+        tile = pyramid.tile(0, 0, 0)
+
+        assert tile["index"].tolist() == [0, 15]
+        assert tile["mean"].tolist() == [1.0, 2.0]
+
+    def test_outside_pyramid(self, points):
+        pyramid = TilePyramid(*points, max_zoom=2)
+
+        assert pyramid.tile(3, 0, 0) is None
+        assert pyramid.tile(1, 2, 0) is None
+
+    def test_changes_match_rebuild(self, points):
+        lats, lons, values = points
+        pyramid = TilePyramid(lats, lons, values, max_zoom=4, size=4)
+        live = np.ones(len(lats), dtype=bool)
+
+        def values_in(min_lat, min_lon, max_lat, max_lon):
+            return lats[live], lons[live], values[live]
+
+        # drop every extreme so bins have to be rescanned
+        for i in np.argsort(values)[::-1][:300]:
+            live[i] = False
+            pyramid.remove(lats[i], lons[i], values[i], values_in)
+        pyramid.add_many(lats[:50], lons[:50], values[:50] + 100.0)
+        view = pyramid.view()
+        pyramid.add(0.0, 0.0, 1000.0)
+
+        expected = TilePyramid(
+            np.concatenate([lats[live], lats[:50]]),
+            np.concatenate([lons[live], lons[:50]]),
+            np.concatenate([values[live], values[:50] + 100.0]),
+            max_zoom=4,
+            size=4,
+        )
+        assert_same_tiles(view, expected)
+        pyramid.compact()
+        assert pyramid.tile(0, 0, 0)["max"].max() == 1000.0
+
+    def test_views_between_single_writes(self, points):
+        lats, lons, values = points
+        pyramid = TilePyramid(lats[:1000], lons[:1000], values[:1000], max_zoom=3)
+        views = {}
+        for i in range(1000, 2000):
+            pyramid.add(lats[i], lons[i], values[i])
+            views[i + 1] = pyramid.view()
+
+        # views keep few layers and stay as they were when taken
+        assert all(len(level._layers) <= 12 for level in views[2000]._changed)
+        for n in (1001, 1500, 1777, 2000):
+            expected = TilePyramid(lats[:n], lons[:n], values[:n], max_zoom=3)
+            assert_same_tiles(views[n], expected)
+
+    def test_pack_tile(self, points):
+        tile = TilePyramid(*points, max_zoom=1, size=4).tile(1, 0, 1)
+
+        records = np.frombuffer(pack_tile(tile), dtype=TILE_RECORD)
+
+        assert TILE_RECORD.itemsize == 18
+        assert records["index"].tolist() == tile["index"].tolist()
+        assert records["count"].tolist() == tile["count"].tolist()
+        assert np.allclose(records["mean"], tile["mean"])
@@ -0,0 +1,271 @@
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from app import wal
+from app.changes import ChangesGoneError
+from app.wal import (
+    SNAPSHOT_FILE,
+    LogGapError,
+    LogTail,
+    LogWriteError,
+    MutationLog,
+    open_durable,
+    read_state,
+    write_snapshot,
+)
+
+
+@pytest.fixture
+def base_path(tmp_path):
+    path = str(tmp_path / "base.parquet")
+    pd.DataFrame(
+        {
+            "lat": [-44.355000, -44.355000, -44.345001],
+            "lon": [-176.255005, -176.244995, -176.274994],
+            "GWRPM25": np.array([6.2, 5.2, 6.1], dtype=np.float32),
+        }
+    ).to_parquet(path)
+    return path
+
+
+@pytest.fixture
+def wal_dir(tmp_path):
+    return str(tmp_path / "wal")
+
+
+def reopen(base_path, wal_dir):
+    data_set, log, compactor = open_durable(base_path, wal_dir, compact_interval=3600)
+    return data_set, log, compactor
+
+
+def shut(log, compactor):
+    compactor.stop()
+    log.close()
+
+
+class TestMutationLog:
+    def test_replay_after_restart(self, base_path, wal_dir):
+        data_set, log, compactor = reopen(base_path, wal_dir)
+        new_id = data_set.add_data_entry(lat=1.0, lon=2.0, gwrpm25=3.0)
+        first_id, last_id = data_set.add_data_entries(
+            np.array([4.0, 5.0]), np.array([4.0, 5.0]), np.array([4.0, 5.0])
+        )
+        data_set.update_data_entry(0, lat=9.0, lon=9.0, gwrpm25=9.0)
+        data_set.delete_data_entry(last_id)
+        expected = data_set.df
+        shut(log, compactor)
+
+        restarted, log, compactor = reopen(base_path, wal_dir)
+
+        pd.testing.assert_frame_equal(restarted.df, expected)
+        assert (new_id, first_id) == (3, 4)
+        assert restarted.version == data_set.version
+        assert restarted.get_stats() == data_set.get_stats()
+        # the deleted id is not handed out again
+        assert restarted.add_data_entry(lat=0.0, lon=0.0, gwrpm25=0.0) == 6
+        shut(log, compactor)
+
+    def test_writes_are_durable_when_acknowledged(self, base_path, wal_dir):
+        data_set, log, compactor = reopen(base_path, wal_dir)
+
+        data_set.add_data_entry(lat=1.0, lon=2.0, gwrpm25=3.0)
+
+        assert log.durable_lsn == data_set.version
+        assert [record["op"] for record in log.records()] == ["add"]
+        shut(log, compactor)
+
+    def test_concurrent_writers_share_fsyncs(self, base_path, wal_dir, monkeypatch):
+        data_set, log, compactor = reopen(base_path, wal_dir)
+        fsyncs = []
+        real_fsync = os.fsync
+        monkeypatch.setattr(os, "fsync", lambda fd: fsyncs.append(fd) or real_fsync(fd))
+
+        def write():
+            for _ in range(50):
+                data_set.add_data_entry(lat=1.0, lon=1.0, gwrpm25=1.0)
+
+        writers = [threading.Thread(target=write) for _ in range(8)]
+        for writer in writers:
+            writer.start()
+        for writer in writers:
+            writer.join()
+
+        assert log.durable_lsn == data_set.version == 400
+        assert 0 < len(fsyncs) <= 400
+        assert [record["lsn"] for record in log.records()] == list(range(1, 401))
+        shut(log, compactor)
+
+    def test_failed_write_is_not_published_and_retried(
+        self, base_path, wal_dir, monkeypatch
+    ):
+        monkeypatch.setattr(wal, "RETRY_SECONDS", 0.5)
+        data_set, log, compactor = reopen(base_path, wal_dir)
+        real_fsync = os.fsync
+        failures = [OSError("disk full")]
+
+        def fsync(fd):
+            if failures:
+                raise failures.pop()
+            real_fsync(fd)
+
+        monkeypatch.setattr(os, "fsync", fsync)
+
+        with pytest.raises(LogWriteError):
+            data_set.add_data_entry(lat=1.0, lon=2.0, gwrpm25=3.0)
+        # readers never saw it, and no more writes are taken while failing
+        assert data_set.snapshot().version == 0
+        assert len(data_set.df) == 3
+        with pytest.raises(LogWriteError):
+            data_set.delete_data_entry(0)
+
+        deadline = time.monotonic() + 10
+        while log.durable_lsn < 1 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        data_set.add_data_entry(lat=5.0, lon=5.0, gwrpm25=5.0)
+
+        assert data_set.snapshot().version == 2
+        assert len(data_set.df) == 5
+        assert [record["lsn"] for record in log.records()] == [1, 2]
+        shut(log, compactor)
+        restarted, log, compactor = reopen(base_path, wal_dir)
+        assert len(restarted.df) == 5
+        shut(log, compactor)
+
+    def test_torn_tail_is_dropped(self, base_path, wal_dir):
+        data_set, log, compactor = reopen(base_path, wal_dir)
+        data_set.add_data_entry(lat=1.0, lon=2.0, gwrpm25=3.0)
+        shut(log, compactor)
+        segment = MutationLog(wal_dir).segments()[-1]
+        with open(segment, "ab") as f:
+            f.write(b'{"lsn": 2, "op": "add", "id"')
+
+        restarted, log, compactor = reopen(base_path, wal_dir)
+        restarted.add_data_entry(lat=5.0, lon=5.0, gwrpm25=5.0)
+        shut(log, compactor)
+
+        assert [record["lsn"] for record in MutationLog(wal_dir).records()] == [1, 2]
+
+    def test_corrupt_record_raises(self, base_path, wal_dir):
+        os.makedirs(wal_dir)
+        with open(os.path.join(wal_dir, "mutations-1.log"), "wb") as f:
+            f.write(b"not json\n")
+
+        with pytest.raises(ValueError):
+            list(MutationLog(wal_dir).records())
+
+
+class TestLogTail:
+    def test_reads_only_new_complete_records(self, base_path, wal_dir):
+        data_set, log, compactor = reopen(base_path, wal_dir)
+        tail = LogTail(wal_dir, after=0)
+        data_set.add_data_entry(lat=1.0, lon=2.0, gwrpm25=3.0)
+
+        assert [record["lsn"] for record in tail.read()] == [1]
+        assert tail.read() == []
+
+        shut(log, compactor)
+        segment = MutationLog(wal_dir).segments()[-1]
+        with open(segment, "ab") as f:
+            f.write(b'{"lsn": 2, "op": "delete",')
+        assert tail.read() == []
+        with open(segment, "ab") as f:
+            f.write(b' "id": 0}\n')
+        assert [record["lsn"] for record in tail.read()] == [2]
+        tail.close()
+
+    def test_follows_into_new_segments(self, base_path, wal_dir):
+        data_set, log, compactor = reopen(base_path, wal_dir)
+        tail = LogTail(wal_dir, after=0)
+        data_set.add_data_entry(lat=1.0, lon=2.0, gwrpm25=3.0)
+        tail.read()
+        log.roll()
+        data_set.add_data_entry(lat=1.0, lon=2.0, gwrpm25=3.0)
+        log.roll()
+        data_set.add_data_entry(lat=1.0, lon=2.0, gwrpm25=3.0)
+
+        assert [record["lsn"] for record in tail.read()] == [2, 3]
+        tail.close()
+        shut(log, compactor)
+
+    def test_segments_discarded_between_reads_raise(self, base_path, wal_dir):
+        data_set, log, compactor = reopen(base_path, wal_dir)
+        tail = LogTail(wal_dir, after=0)
+        for _ in range(2):
+            data_set.add_data_entry(lat=1.0, lon=2.0, gwrpm25=3.0)
+        assert [record["lsn"] for record in tail.read()] == [1, 2]
+        for _ in range(2):
+            log.roll()
+            for _ in range(2):
+                data_set.add_data_entry(lat=1.0, lon=2.0, gwrpm25=3.0)
+            log.discard_before(log.roll())
+
+        with pytest.raises(LogGapError):
+            tail.read()
+        tail.close()
+        shut(log, compactor)
+
+    def test_compacted_records_raise(self, base_path, wal_dir):
+        data_set, log, compactor = reopen(base_path, wal_dir)
+        data_set.add_data_entry(lat=1.0, lon=2.0, gwrpm25=3.0)
+        compactor.compact()
+        data_set.add_data_entry(lat=1.0, lon=2.0, gwrpm25=3.0)
+
+        with pytest.raises(LogGapError):
+            LogTail(wal_dir, after=0).read()
+        assert [record["lsn"] for record in LogTail(wal_dir, after=1).read()] == [2]
+        shut(log, compactor)
+
+
+class TestCompaction:
+    def test_compaction_folds_log_into_snapshot(self, base_path, wal_dir):
+        data_set, log, compactor = reopen(base_path, wal_dir)
+        for i in range(5):
+            data_set.add_data_entry(lat=float(i), lon=0.0, gwrpm25=1.0)
+        data_set.delete_data_entry(7)
+
+        compactor.compact()
+        data_set.delete_data_entry(0)
+        expected = data_set.df
+        shut(log, compactor)
+
+        snapshot_path = os.path.join(wal_dir, SNAPSHOT_FILE)
+        assert read_state(snapshot_path) == (6, 8)
+        assert [record["lsn"] for record in MutationLog(wal_dir).records()] == [7]
+
+        restarted, log, compactor = reopen(base_path, wal_dir)
+        pd.testing.assert_frame_equal(restarted.df, expected)
+        assert restarted.add_data_entry(lat=0.0, lon=0.0, gwrpm25=0.0) == 8
+        shut(log, compactor)
+
+    def test_changes_after_the_snapshot_survive_restart(self, base_path, wal_dir):
+        data_set, log, compactor = reopen(base_path, wal_dir)
+        data_set.add_data_entry(lat=1.0, lon=0.0, gwrpm25=1.0)
+        compactor.compact()
+        data_set.delete_data_entry(0)
+        shut(log, compactor)
+
+        restarted, log, compactor = reopen(base_path, wal_dir)
+
+        assert restarted.changes(1) == ([{"seq": 2, "op": "delete", "id": 0}], 2, 2)
+        with pytest.raises(ChangesGoneError):
+            restarted.changes(0)
+        shut(log, compactor)
+
+    def test_snapshot_keeps_ids_and_dtypes(self, base_path, tmp_path):
+        data_set, log, compactor = reopen(base_path, str(tmp_path / "wal"))
+        data_set.delete_data_entry(1)
+        path = str(tmp_path / "snapshot.parquet")
+
+        write_snapshot(data_set.snapshot(), path)
+
+        written = pd.read_parquet(path)
+        assert written.index.tolist() == [0, 2]
+        assert written["GWRPM25"].dtype == np.float32
+        assert read_state(path) == (1, 3)
+        assert read_state(base_path) == (0, None)
+        shut(log, compactor)
@@ -0,0 +1,97 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import app.years as years
+from app.years import YearlyData, YearNotAvailableError, write_year
+
+
+def year_frame(year: int) -> pd.DataFrame:
+    rng = np.random.default_rng(year)
+    rows, cols = np.divmod(rng.permutation(2000), 50)
+    return pd.DataFrame(
+        {
+            "lat": -20.005 + rows * 0.01,
+            "lon": 100.005 + cols * 0.01,
+            "GWRPM25": rng.gamma(2.0, 3.0, 2000) + year,
+        }
+    )
+
+
+@pytest.fixture
+def root(tmp_path, monkeypatch):
+    monkeypatch.setattr(years, "ROW_GROUP_ROWS", 100)
+    for year in (2000, 2001, 2002):
+        write_year(year_frame(year), year, str(tmp_path))
+    (tmp_path / "notes").mkdir()
+    return str(tmp_path)
+
+
+class TestYearlyData:
+    def test_finds_years(self, root):
+        yearly = YearlyData(root)
+
+        assert yearly.years == [2000, 2001, 2002]
+        assert yearly.cached_years() == []
+
+    def test_loads_year_once(self, root):
+        yearly = YearlyData(root)
+        data_set = yearly.get(2001)
+
+        assert yearly.get(2001) is data_set
+        assert yearly.cached_years() == [2001]
+        assert data_set.get_stats()["count"] == 2000
+        assert data_set.get_stats()["min"] > 2001
+
+    def test_unknown_year(self, root):
+        with pytest.raises(YearNotAvailableError):
+            YearlyData(root).get(1999)
+
+    def test_evicts_least_recently_used(self, root):
+        size = YearlyData(root).get(2000).nbytes
+        yearly = YearlyData(root, memory_budget=int(2.5 * size))
+        yearly.get(2000)
+        yearly.get(2001)
+        yearly.get(2000)
+        yearly.get(2002)
+
+        assert yearly.cached_years() == [2000, 2002]
+        assert yearly.size <= yearly.memory_budget
+
+    def test_keeps_year_over_budget(self, root):
+        yearly = YearlyData(root, memory_budget=1)
+        yearly.get(2000)
+        yearly.get(2001)
+
+        assert yearly.cached_years() == [2001]
+
+    def test_timeseries(self, root, monkeypatch):
+        read = []
+        read_row_groups = years.pq.ParquetFile.read_row_groups
+        monkeypatch.setattr(
+            years.pq.ParquetFile,
+            "read_row_groups",
+            lambda self, groups, **kwargs: read.append(groups)
+            or read_row_groups(self, groups, **kwargs),
+        )
+        yearly = YearlyData(root)
+        lat, lon = -20.005 + 7 * 0.01, 100.005 + 31 * 0.01
+        result = yearly.timeseries(np.float32(lat), np.float32(lon))
+
+        assert result["year"].tolist() == [2000, 2001, 2002]
+        for year, value in zip(result["year"], result["GWRPM25"]):
+            frame = year_frame(year)
+            match = np.isclose(frame["lat"], lat) & np.isclose(frame["lon"], lon)
+            assert value == frame["GWRPM25"][match].item()
+        # 20 row groups per year, only the one holding the point is read
+        assert [len(groups) for groups in read] == [1, 1, 1]
+        assert yearly.cached_years() == []
+
+    def test_timeseries_outside(self, root):
+        result = YearlyData(root).timeseries(50.0, 50.0)
+
+        assert result.empty
+        assert list(result.columns) == ["year", "lat", "lon", "GWRPM25"]
+
+    def test_missing_root(self, tmp_path):
+        assert YearlyData(str(tmp_path / "missing")).years == []